@@ -0,0 +1,47 @@
+import argparse
+import importlib
+import sys
+
+# サブコマンド名と、サブコマンドを実装しているモジュール、ヘルプメッセージ
+# 起動時間を短くするため、モジュールは実行するサブコマンドのものだけをimportする
+SUBCOMMANDS: dict[str, tuple[str, str]] = {
+    "create_af_input_data": ("src.create_af_input_data", "COCOデータセットのimagesから、Annofabに入力データを作成します。"),
+    "create_af_task": ("src.create_af_task", "Annofabにタスクを作成します。"),
+    "convert_coco_instances_annotation_to_af": ("src.convert_coco_instances_annotation_to_af", "COCOデータセット（Instances）に含まれるアノテーションを、Annofab形式に変換します。"),
+    "convert_af_annotation_to_coco_instances": ("src.convert_af_annotation_to_coco_instances", "Annofab形式のアノテーションを、COCOデータセット（Instances）形式に変換します。"),
+    "merge": ("src.merge_coco_instances", "複数のCOCOデータセット（Instances）を1個にマージします。"),
+    "stats": ("src.dataset_stats", "COCOデータセット（Instances）またはAnnofab形式のアノテーションの統計情報を出力します。"),
+    "watch": ("src.watch_af_annotation", "ディレクトリに置かれたAnnofab形式のアノテーションを監視して、COCOデータセット（Instances）に変換し続けます。"),
+    "verify": ("src.verify_coco_instances_roundtrip", "COCOデータセット（Instances）をAnnofab形式に変換してから戻して、元のアノテーションと一致するかを検証します。"),
+}
+
+
+def create_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m src", description="Annofab形式のアノテーションとCOCOデータセット形式のアノテーションを相互に変換するツール群")
+    subparsers = parser.add_subparsers(dest="subcommand", metavar="subcommand", required=True)
+    for name, (_, help_message) in SUBCOMMANDS.items():
+        # サブコマンドの引数は、サブコマンドのモジュールで解釈する
+        subparsers.add_parser(name, help=help_message, add_help=False)
+    return parser
+
+
+def main(arguments: list[str] | None = None) -> None:
+    if arguments is None:
+        arguments = sys.argv[1:]
+
+    parser = create_parser()
+    if len(arguments) == 0 or arguments[0] not in SUBCOMMANDS:
+        # `--help`や、存在しないサブコマンドが指定された場合
+        parser.parse_args(arguments)
+        return
+
+    subcommand, *subcommand_arguments = arguments
+    module_name, _ = SUBCOMMANDS[subcommand]
+    # サブコマンドのヘルプやログに、実行したコマンドが表示されるようにする
+    sys.argv[0] = f"{parser.prog} {subcommand}"
+    module = importlib.import_module(module_name)
+    module.main(subcommand_arguments)
+
+
+if __name__ == "__main__":
+    main()
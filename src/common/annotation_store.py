@@ -0,0 +1,364 @@
+import array
+import bisect
+import itertools
+import operator
+from collections.abc import Iterable, Iterator
+from typing import TYPE_CHECKING, Any
+
+# bboxのみを変換する場合は、numpyをimportしないようにする
+if TYPE_CHECKING:
+    import numpy
+
+# `CocoAnnotationStore`が列として格納するCOCOのannotationのキー。dictに戻すときもこの順番で格納する
+COCO_ANNOTATION_KEYS = ("id", "image_id", "category_id", "bbox", "segmentation", "area", "iscrowd")
+_COCO_ANNOTATION_KEY_SET = frozenset(COCO_ANNOTATION_KEYS)
+# 列に格納するためにintでなければならない値を取り出す
+_get_int_values = operator.itemgetter("id", "image_id", "category_id", "iscrowd")
+
+# segmentationの種類
+_SEGMENTATION_POLYGON = 0
+_SEGMENTATION_UNCOMPRESSED_RLE = 1
+
+# `_flags`のビット。値がintかfloatかを記録して、dictに戻すときに元の型で復元する
+_FLAG_AREA_IS_INT = 1 << 0
+_FLAG_COORDINATES_ARE_INT = 1 << 1
+# bit2〜bit5: bboxの各要素がintかどうか
+_FLAG_BBOX_IS_INT_SHIFT = 2
+
+
+def _get_number_type(values: Iterable[Any]) -> type | None:
+    """
+    値がすべてintならint（値が空の場合を含む）、すべてfloatならfloatを返します。それ以外の場合はNoneを返します。
+    """
+    types = set(map(type, values))
+    if types <= {int}:
+        return int
+    if types == {float}:
+        return float
+    return None
+
+
+class CocoAnnotationStore:
+    """
+    COCOのannotationを列指向で格納します。
+    annotationをdictで保持すると1件あたり数百バイト以上のオーバーヘッドがあるので、数百万件のannotationを扱う場合にメモリ使用量を抑えるために利用します。
+
+    * `id`, `image_id`, `category_id`, `bbox`, `area`, `iscrowd`は、型付きの配列（`array.array`）に格納します。numpyのarrayとしても参照できます。
+    * ポリゴンの座標やRLEの`counts`のような可変長のデータは、1個の配列に連結して格納し、annotationごとの開始位置（オフセット）で参照します。
+    * dictは`__getitem__`や`__iter__`で取り出すときに生成します。キーの順番は追加したannotationと同じです。
+    * 上記以外のキーを持つannotationは、上記以外のキーのみをdictで格納します。
+    * 列に格納できないannotation（compressed RLE, intとfloatが混在しているポリゴンなど）は、dictのまま格納します。
+    """
+
+    def __init__(self, coco_annotations: Iterable[dict[str, Any]] = ()) -> None:
+        self._ids = array.array("q")
+        self._image_ids = array.array("q")
+        self._category_ids = array.array("q")
+        self._bboxes = array.array("d")
+        self._areas = array.array("d")
+        self._iscrowds = array.array("B")
+        self._flags = array.array("B")
+        self._segmentation_types = array.array("B")
+
+        # ポリゴンの座標。`_polygon_offsets[i]`〜`_polygon_offsets[i+1]`が、i番目のポリゴンの座標
+        self._coordinates = array.array("d")
+        self._polygon_offsets = array.array("q", [0])
+        # annotationごとのポリゴン。`_annotation_polygon_offsets[i]`〜`_annotation_polygon_offsets[i+1]`が、i番目のannotationのポリゴン
+        self._annotation_polygon_offsets = array.array("q", [0])
+
+        # RLEの`counts`。`_annotation_rle_offsets[i]`〜`_annotation_rle_offsets[i+1]`が、i番目のannotationの`counts`
+        self._rle_counts = array.array("q")
+        self._annotation_rle_offsets = array.array("q", [0])
+        # RLEの`size`（height, width）。RLEでないannotationは(0, 0)
+        self._rle_sizes = array.array("q")
+
+        # annotationのキーの順番。annotationごとに、`_key_orders`のインデックスを格納する。キーの順番の種類は少ないので、同じ順番は1個のtupleを共有する
+        self._key_orders: list[tuple[str, ...]] = []
+        self._key_order_indices_by_keys: dict[tuple[str, ...], int] = {}
+        self._key_order_indices = array.array("I")
+
+        # 列に格納しなかった値。keyはannotationのインデックス
+        self._extra_values: dict[int, dict[str, Any]] = {}
+        self._raw_annotations: dict[int, dict[str, Any]] = {}
+
+        # `image_id`でannotationを検索するためのインデックス（`image_id`の昇順に並べたannotationのインデックス）。annotationを追加したら破棄する
+        self._sorted_indices_by_image_id: array.array | None = None
+
+        for coco_annotation in coco_annotations:
+            self.append(coco_annotation)
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def _append_segmentation(self, segmentation: Any) -> int | None:  # noqa: ANN401
+        """
+        segmentationを列に格納します。
+
+        Returns:
+            格納できれば、segmentationに関する`_flags`のビット。`segmentation`が列に格納できない形式の場合はNone
+        """
+        if isinstance(segmentation, list):
+            if not all(isinstance(polygon, list) for polygon in segmentation):
+                return None
+            number_type = _get_number_type(itertools.chain.from_iterable(segmentation))
+            if number_type is None:
+                return None
+            for polygon in segmentation:
+                self._coordinates.extend(polygon)
+                self._polygon_offsets.append(len(self._coordinates))
+            self._segmentation_types.append(_SEGMENTATION_POLYGON)
+            self._rle_sizes.extend((0, 0))
+            return _FLAG_COORDINATES_ARE_INT if number_type is int else 0
+
+        if (
+            isinstance(segmentation, dict)
+            and segmentation.keys() == {"size", "counts"}
+            and isinstance(segmentation["counts"], list)
+            and _get_number_type(segmentation["counts"]) is int
+            and isinstance(segmentation["size"], list)
+            and len(segmentation["size"]) == 2
+            and _get_number_type(segmentation["size"]) is int
+        ):
+            self._rle_counts.extend(segmentation["counts"])
+            self._rle_sizes.extend(segmentation["size"])
+            self._segmentation_types.append(_SEGMENTATION_UNCOMPRESSED_RLE)
+            return 0
+
+        return None
+
+    @staticmethod
+    def _can_append_to_columns(coco_annotation: dict[str, Any]) -> bool:
+        # annotationの件数だけ呼ばれるので、ジェネレータ式を使わずにsetで判定する
+        if not coco_annotation.keys() >= _COCO_ANNOTATION_KEY_SET:
+            return False
+        if set(map(type, _get_int_values(coco_annotation))) != {int} or coco_annotation["iscrowd"] not in {0, 1}:
+            return False
+        bbox = coco_annotation["bbox"]
+        return isinstance(bbox, list) and len(bbox) == 4 and set(map(type, bbox)) <= {int, float} and type(coco_annotation["area"]) in {int, float}
+
+    def append(self, coco_annotation: dict[str, Any]) -> None:
+        """
+        COCOのannotationを1件追加します。
+        """
+        index = len(self._ids)
+        self._sorted_indices_by_image_id = None
+        if not self._can_append_to_columns(coco_annotation):
+            self._append_raw(index, coco_annotation)
+            return
+
+        flags = self._append_segmentation(coco_annotation["segmentation"])
+        if flags is None:
+            self._append_raw(index, coco_annotation)
+            return
+
+        bbox = coco_annotation["bbox"]
+        if type(coco_annotation["area"]) is int:
+            flags |= _FLAG_AREA_IS_INT
+        for i, value in enumerate(bbox):
+            if type(value) is int:
+                flags |= 1 << (_FLAG_BBOX_IS_INT_SHIFT + i)
+
+        self._ids.append(coco_annotation["id"])
+        self._image_ids.append(coco_annotation["image_id"])
+        self._category_ids.append(coco_annotation["category_id"])
+        self._bboxes.extend(bbox)
+        self._areas.append(coco_annotation["area"])
+        self._iscrowds.append(coco_annotation["iscrowd"])
+        self._flags.append(flags)
+        self._annotation_polygon_offsets.append(len(self._polygon_offsets) - 1)
+        self._annotation_rle_offsets.append(len(self._rle_counts))
+        self._append_key_order(tuple(coco_annotation))
+
+        # 列に格納するキーはすべて含んでいるので、キーの数が多ければ上記以外のキーがある
+        if len(coco_annotation) > len(COCO_ANNOTATION_KEYS):
+            extra_keys = coco_annotation.keys() - _COCO_ANNOTATION_KEY_SET
+            self._extra_values[index] = {key: value for key, value in coco_annotation.items() if key in extra_keys}
+
+    def _append_key_order(self, keys: tuple[str, ...]) -> None:
+        key_order_index = self._key_order_indices_by_keys.get(keys)
+        if key_order_index is None:
+            key_order_index = len(self._key_orders)
+            self._key_orders.append(keys)
+            self._key_order_indices_by_keys[keys] = key_order_index
+        self._key_order_indices.append(key_order_index)
+
+    def _append_raw(self, index: int, coco_annotation: dict[str, Any]) -> None:
+        """
+        列に格納できないannotationを、dictのまま格納します。列には`id`, `image_id`（intの場合のみ）以外はダミーの値を格納します。
+        """
+        self._raw_annotations[index] = coco_annotation
+        annotation_id = coco_annotation.get("id")
+        image_id = coco_annotation.get("image_id")
+        self._ids.append(annotation_id if type(annotation_id) is int else 0)
+        self._image_ids.append(image_id if type(image_id) is int else 0)
+        self._category_ids.append(0)
+        self._bboxes.extend((0, 0, 0, 0))
+        self._areas.append(0)
+        self._iscrowds.append(0)
+        self._flags.append(0)
+        self._segmentation_types.append(_SEGMENTATION_POLYGON)
+        self._rle_sizes.extend((0, 0))
+        self._annotation_polygon_offsets.append(len(self._polygon_offsets) - 1)
+        self._annotation_rle_offsets.append(len(self._rle_counts))
+        # dictのまま返すので、キーの順番は参照しない
+        self._key_order_indices.append(0)
+
+    def _get_segmentation(self, index: int, flags: int) -> list[list[int]] | list[list[float]] | dict[str, Any]:
+        if self._segmentation_types[index] == _SEGMENTATION_UNCOMPRESSED_RLE:
+            start, end = self._annotation_rle_offsets[index], self._annotation_rle_offsets[index + 1]
+            return {"size": self._rle_sizes[index * 2 : index * 2 + 2].tolist(), "counts": self._rle_counts[start:end].tolist()}
+
+        coordinates_are_int = bool(flags & _FLAG_COORDINATES_ARE_INT)
+        polygons: list[Any] = []
+        for polygon_index in range(self._annotation_polygon_offsets[index], self._annotation_polygon_offsets[index + 1]):
+            coordinates = self._coordinates[self._polygon_offsets[polygon_index] : self._polygon_offsets[polygon_index + 1]].tolist()
+            polygons.append([int(v) for v in coordinates] if coordinates_are_int else coordinates)
+        return polygons
+
+    def __getitem__(self, index: int) -> dict[str, Any]:
+        """
+        `index`番目のannotationをdictで返します。
+        """
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(f"index={index} is out of range")
+
+        raw_annotation = self._raw_annotations.get(index)
+        if raw_annotation is not None:
+            return raw_annotation
+
+        flags = self._flags[index]
+        bbox: list[int | float] = self._bboxes[index * 4 : index * 4 + 4].tolist()
+        for i in range(4):
+            if flags & (1 << (_FLAG_BBOX_IS_INT_SHIFT + i)):
+                bbox[i] = int(bbox[i])
+        area = self._areas[index]
+        result = {
+            "id": self._ids[index],
+            "image_id": self._image_ids[index],
+            "category_id": self._category_ids[index],
+            "bbox": bbox,
+            "segmentation": self._get_segmentation(index, flags),
+            "area": int(area) if flags & _FLAG_AREA_IS_INT else area,
+            "iscrowd": self._iscrowds[index],
+        }
+        extra_values = self._extra_values.get(index)
+        if extra_values is not None:
+            result.update(extra_values)
+        keys = self._key_orders[self._key_order_indices[index]]
+        if keys != COCO_ANNOTATION_KEYS:
+            # 追加したannotationとキーの順番をそろえる
+            result = {key: result[key] for key in keys}
+        return result
+
+    def __iter__(self) -> Iterator[dict[str, Any]]:
+        for index in range(len(self)):
+            yield self[index]
+
+    @property
+    def ids(self) -> "numpy.ndarray":
+        """
+        annotationの`id`のarray。dictのまま格納しているannotationの`id`がintでない場合、値は0です。
+        """
+        import numpy  # noqa: PLC0415
+
+        return numpy.frombuffer(self._ids, dtype=numpy.int64).copy()
+
+    @property
+    def image_ids(self) -> "numpy.ndarray":
+        """
+        annotationの`image_id`のarray
+        """
+        import numpy  # noqa: PLC0415
+
+        return numpy.frombuffer(self._image_ids, dtype=numpy.int64).copy()
+
+    @property
+    def category_ids(self) -> "numpy.ndarray":
+        """
+        annotationの`category_id`のarray。dictのまま格納しているannotationの値は0です。
+        """
+        import numpy  # noqa: PLC0415
+
+        return numpy.frombuffer(self._category_ids, dtype=numpy.int64).copy()
+
+    @property
+    def bboxes(self) -> "numpy.ndarray":
+        """
+        annotationの`bbox`のarray（shape=(N, 4)）。dictのまま格納しているannotationの値は0です。
+        """
+        import numpy  # noqa: PLC0415
+
+        return numpy.frombuffer(self._bboxes, dtype=numpy.float64).reshape(-1, 4).copy()
+
+    @property
+    def areas(self) -> "numpy.ndarray":
+        """
+        annotationの`area`のarray。dictのまま格納しているannotationの値は0です。
+        """
+        import numpy  # noqa: PLC0415
+
+        return numpy.frombuffer(self._areas, dtype=numpy.float64).copy()
+
+    @property
+    def rle_sizes(self) -> "numpy.ndarray":
+        """
+        annotationのRLEの`size`（height, width）のarray（shape=(N, 2)）。`is_uncompressed_rle`がFalseのannotationの値は0です。
+        """
+        import numpy  # noqa: PLC0415
+
+        return numpy.frombuffer(self._rle_sizes, dtype=numpy.int64).reshape(-1, 2).copy()
+
+    @property
+    def is_uncompressed_rle(self) -> "numpy.ndarray":
+        """
+        annotationの`segmentation`が列に格納したuncompressed RLEかどうかを表すboolのarray
+        """
+        import numpy  # noqa: PLC0415
+
+        return numpy.frombuffer(self._segmentation_types, dtype=numpy.uint8) == _SEGMENTATION_UNCOMPRESSED_RLE
+
+    @property
+    def raw_annotations(self) -> dict[int, dict[str, Any]]:
+        """
+        列に格納できずにdictのまま格納しているannotation。keyはannotationのインデックスです。
+        """
+        return self._raw_annotations
+
+    def get_polygons(self, start: int, end: int) -> tuple["numpy.ndarray", "numpy.ndarray", "numpy.ndarray"]:
+        """
+        `start`番目から`end - 1`番目までのannotationの、列に格納したポリゴンを返します。
+        ポリゴンの座標はdictやlistに戻さずに、連結した配列のまま返します。
+
+        Returns:
+            tuple[0]: ポリゴンの座標を連結したarray
+            tuple[1]: ポリゴンごとの座標の個数
+            tuple[2]: ポリゴンごとの、annotationのインデックス
+        """
+        import numpy  # noqa: PLC0415
+
+        polygon_counts = numpy.diff(numpy.frombuffer(self._annotation_polygon_offsets, dtype=numpy.int64)[start : end + 1])
+        polygon_start, polygon_end = self._annotation_polygon_offsets[start], self._annotation_polygon_offsets[end]
+        polygon_offsets = numpy.frombuffer(self._polygon_offsets, dtype=numpy.int64)[polygon_start : polygon_end + 1]
+        coordinates = numpy.frombuffer(self._coordinates, dtype=numpy.float64)[polygon_offsets[0] : polygon_offsets[-1]].copy()
+        return coordinates, numpy.diff(polygon_offsets), numpy.repeat(numpy.arange(start, end), polygon_counts)
+
+    def get_indices_by_image_id(self, image_id: int) -> list[int]:
+        """
+        `image_id`に紐づくannotationのインデックスを、追加した順に返します。
+        """
+        if self._sorted_indices_by_image_id is None:
+            # `sorted`は安定ソートなので、同じ`image_id`のannotationは追加した順に並ぶ
+            self._sorted_indices_by_image_id = array.array("q", sorted(range(len(self)), key=self._image_ids.__getitem__))
+
+        sorted_indices = self._sorted_indices_by_image_id
+        start = bisect.bisect_left(sorted_indices, image_id, key=self._image_ids.__getitem__)
+        end = bisect.bisect_right(sorted_indices, image_id, lo=start, key=self._image_ids.__getitem__)
+        return sorted_indices[start:end].tolist()
+
+    def get_annotations_by_image_id(self, image_id: int) -> list[dict[str, Any]]:
+        """
+        `image_id`に紐づくannotationを、追加した順にdictで返します。
+        """
+        return [self[index] for index in self.get_indices_by_image_id(image_id)]
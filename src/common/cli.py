@@ -1,11 +1,60 @@
-import jsonargparse
+import argparse
 
 
-def create_parent_parser() -> jsonargparse.ArgumentParser:
+def create_parent_parser() -> argparse.ArgumentParser:
     """
     共通の引数セットを生成する。
     """
-    parent_parser = jsonargparse.ArgumentParser(add_help=False)
+    parent_parser = argparse.ArgumentParser(add_help=False)
     parent_parser.add_argument("--verbose", action="store_true", help="詳細なログを出力します。")
+    parent_parser.add_argument(
+        "--enqueue_log",
+        action="store_true",
+        help="指定すると、ログの出力をバックグラウンドのスレッドで行います。ログの出力先が遅いファイルシステムの場合に、処理がログの書き込みを待たなくなります。",
+    )
 
     return parent_parser
+
+
+def add_shard_arguments(parser: argparse.ArgumentParser, *, key_name: str) -> None:
+    """
+    変換対象を複数のシャードに分割するための引数`--num_shards`, `--shard_index`を追加します。
+
+    Args:
+        parser: 引数を追加するparser
+        key_name: シャードを決めるキーの名前。ヘルプメッセージに利用します。
+    """
+    parser.add_argument(
+        "--num_shards",
+        type=int,
+        default=1,
+        help=f"シャード数。変換対象を{key_name}のハッシュ値で`--num_shards`個に分割して、`--shard_index`番目のシャードのみ変換します。複数のマシンで分散して変換する場合に利用します。",
+    )
+    parser.add_argument("--shard_index", type=int, default=0, help="変換対象のシャードのインデックス（0始まり）")
+
+
+def add_json_indent_argument(parser: argparse.ArgumentParser) -> None:
+    """
+    出力するCOCOデータセットのJSONをインデントするかどうかの引数`--indent`を追加します。
+    """
+    parser.add_argument(
+        "--indent",
+        action="store_true",
+        help="指定すると、出力するCOCOデータセットのJSONを2文字でインデントします。"
+        "デフォルトでは、ファイルサイズが小さく書き込みも速い、空白を含まないJSONを出力します。人がJSONを読む場合に指定してください。",
+    )
+
+
+def add_gzip_compression_level_argument(parser: argparse.ArgumentParser) -> None:
+    """
+    gzipで圧縮して出力するときの圧縮レベルの引数`--gzip_compression_level`を追加します。
+    """
+    from src.common.json_file import DEFAULT_GZIP_COMPRESSION_LEVEL  # noqa: PLC0415
+
+    parser.add_argument(
+        "--gzip_compression_level",
+        type=int,
+        choices=range(1, 10),
+        default=DEFAULT_GZIP_COMPRESSION_LEVEL,
+        help="JSONファイルをgzipで圧縮して出力するときの圧縮レベル（1〜9）。1が最も速く、9が最もファイルサイズが小さくなります。",
+    )
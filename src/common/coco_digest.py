@@ -0,0 +1,46 @@
+import collections
+import hashlib
+import json
+from typing import Any
+
+_DIGEST_SIZE = 16
+
+
+def _calculate_coco_annotation_digest(coco_annotation: dict[str, Any], category_name: str | None) -> bytes:
+    # category_idではなくcategory.nameを含める。Annofabのラベルはcategory.nameから決まるので、カテゴリ名の変更も検出できる
+    payload = json.dumps([category_name, coco_annotation], sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.blake2b(payload.encode("utf-8"), digest_size=_DIGEST_SIZE).digest()
+
+
+def calculate_coco_image_digests(coco_instances: dict[str, Any]) -> dict[str, str]:
+    """
+    COCOデータセット（Instances）のimageごとに、imageと紐づくannotationsのハッシュ値を計算します。
+    imageの`id`, `width`, `height`、または紐づくannotationsのどれかが変わると、ハッシュ値も変わります。annotationsの順番はハッシュ値に影響しません。
+
+    annotationごとのハッシュ値を`id`の順に並べて、imageの情報と一緒にもう一度ハッシュ値を計算します。
+    annotationsを`image_id`で並べ替えたり、imageごとにannotationのdictをまとめて保持したりはしません。
+
+    Returns:
+        keyがimageの`file_name`、valueがハッシュ値（16進数文字列）のdict
+    """
+    category_names_by_id = {category["id"]: category["name"] for category in coco_instances["categories"]}
+    annotation_digests_by_image_id: dict[int, list[tuple[int, bytes]]] = collections.defaultdict(list)
+    for coco_annotation in coco_instances["annotations"]:
+        annotation_digest = _calculate_coco_annotation_digest(coco_annotation, category_names_by_id.get(coco_annotation["category_id"]))
+        annotation_digests_by_image_id[coco_annotation["image_id"]].append((coco_annotation["id"], annotation_digest))
+
+    result = {}
+    for coco_image in coco_instances["images"]:
+        # imageの情報は、変換結果に影響するものだけを含める。`coco_url`などが変わっても変換結果は変わらない
+        image_hash = hashlib.blake2b(json.dumps([coco_image["id"], coco_image["width"], coco_image["height"]]).encode("utf-8"), digest_size=_DIGEST_SIZE)
+        for _, annotation_digest in sorted(annotation_digests_by_image_id.get(coco_image["id"], [])):
+            image_hash.update(annotation_digest)
+        result[coco_image["file_name"]] = image_hash.hexdigest()
+    return result
+
+
+def get_changed_file_names(previous_image_digests: dict[str, str], image_digests: dict[str, str]) -> set[str]:
+    """
+    前回から追加または変更されたimageの`file_name`を返します。前回から削除されたimageは含みません。
+    """
+    return {file_name for file_name, digest in image_digests.items() if previous_image_digests.get(file_name) != digest}
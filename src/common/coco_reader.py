@@ -0,0 +1,164 @@
+from collections.abc import Collection
+from pathlib import Path
+from typing import Any
+
+from src.common.annotation_store import CocoAnnotationStore
+from src.common.json_file import open_json_for_read, read_json
+from src.common.json_stream import iter_json_object_members
+from src.common.utils import ProgressLogger
+
+_COCO_ARRAY_KEYS = {"images", "annotations", "categories"}
+
+
+class _CocoInstancesFilter:
+    """
+    COCOデータセットのimagesとannotationsを、`file_name`とカテゴリ名で絞り込みます。
+    """
+
+    def __init__(self, target_image_file_names: Collection[str] | None, target_category_names: Collection[str] | None) -> None:
+        self.target_image_file_names = set(target_image_file_names) if target_image_file_names is not None else None
+        self.target_category_names = set(target_category_names) if target_category_names is not None else None
+        self.target_image_ids: set[int] = set()
+        self.target_category_ids: set[int] = set()
+
+    def add_image(self, coco_image: dict[str, Any]) -> bool:
+        """
+        imageが変換対象ならば、imageの`id`を記録してTrueを返します。
+        """
+        if self.target_image_file_names is not None and coco_image["file_name"] not in self.target_image_file_names:
+            return False
+        self.target_image_ids.add(coco_image["id"])
+        return True
+
+    def add_category(self, coco_category: dict[str, Any]) -> None:
+        if self.target_category_names is None or coco_category["name"] in self.target_category_names:
+            self.target_category_ids.add(coco_category["id"])
+
+    def can_filter_annotations(self, read_keys: Collection[str]) -> bool:
+        """
+        `read_keys`を読み込んだ時点で、annotationsを絞り込めるかどうかを返します。
+        """
+        return (self.target_image_file_names is None or "images" in read_keys) and (self.target_category_names is None or "categories" in read_keys)
+
+    def is_target_annotation(self, coco_annotation: dict[str, Any]) -> bool:
+        if self.target_image_file_names is not None and coco_annotation["image_id"] not in self.target_image_ids:
+            return False
+        return self.target_category_names is None or coco_annotation["category_id"] in self.target_category_ids
+
+
+def _read_all_coco_instances(path: Path, annotation_store: CocoAnnotationStore | None) -> dict[str, Any]:
+    """
+    COCOデータセットを`read_json`でまとめて読み込みます。`annotation_store`を指定した場合は、annotationsを`annotation_store`に移します。
+    """
+    coco_instances = read_json(path)
+    result: dict[str, Any] = {"images": [], "categories": [], **coco_instances}
+    annotations: list[dict[str, Any]] = result.get("annotations", [])
+    if annotation_store is not None:
+        # 追加したannotationのdictをすぐに解放できるように、末尾から取り出す
+        annotations.reverse()
+        while len(annotations) > 0:
+            annotation_store.append(annotations.pop())
+        result["annotations"] = annotation_store
+    else:
+        result["annotations"] = annotations
+    return result
+
+
+def read_coco_instances(
+    path: Path,
+    *,
+    target_image_file_names: Collection[str] | None = None,
+    target_category_names: Collection[str] | None = None,
+    should_read_annotations: bool = True,
+    annotation_store: CocoAnnotationStore | None = None,
+) -> dict[str, Any]:
+    """
+    COCOデータセット（Instances）のJSONファイルを少しずつ読み込んで、変換対象のimagesとannotationsだけを返します。
+    変換対象でないimagesやannotationsはメモリに保持しないので、一部だけを変換する場合に`read_json`で全体を読み込むよりメモリ使用量が小さくなります。
+
+    annotationsを絞り込むには、先にimagesとcategoriesを読み込んでおく必要があります。
+    COCOデータセットは`categories`が`annotations`の後ろにあることが多いので、`annotations`に達した時点で絞り込めない場合は、
+    `annotations`をデコードせずに読み飛ばして、ファイルをもう一度走査して`annotations`だけを読み込みます。
+
+    絞り込まずにすべてを読み込む場合は、読み飛ばすデータがないので、少しずつ読み込まずに`read_json`でまとめてパースします。
+    1件ずつパースするより数倍速いです。
+
+    Args:
+        path: COCOデータセットのJSONファイルのパス。gzipで圧縮されたファイルも読み込めます。
+        target_image_file_names: 指定した場合は、`file_name`が含まれるimageと、そのimageに紐づくannotationsだけを返します。
+        target_category_names: 指定した場合は、`name`が含まれるcategoryのannotationsだけを返します。categoriesとimagesは絞り込みません。
+        should_read_annotations: Falseならば`annotations`をデコードせずに読み飛ばします。imagesだけが必要な場合に指定します。
+        annotation_store: 指定した場合は、annotationsをdictのlistではなく`annotation_store`に1件ずつ追加して、`annotations`として返します。
+            annotationのdictは追加したら破棄するので、すべてのannotationsをdictで保持する場合よりメモリ使用量が小さくなります。
+
+    Returns:
+        COCOデータセット。`images`と`categories`のほか、`info`などのトップレベルの値もそのまま含みます。
+        `should_read_annotations`がFalseの場合は、`annotations`を含みません。
+    """
+    if target_image_file_names is None and target_category_names is None and should_read_annotations:
+        return _read_all_coco_instances(path, annotation_store)
+    return _read_filtered_coco_instances(
+        path,
+        target_image_file_names=target_image_file_names,
+        target_category_names=target_category_names,
+        should_read_annotations=should_read_annotations,
+        annotation_store=annotation_store,
+    )
+
+
+def _read_filtered_coco_instances(
+    path: Path,
+    *,
+    target_image_file_names: Collection[str] | None,
+    target_category_names: Collection[str] | None,
+    should_read_annotations: bool,
+    annotation_store: CocoAnnotationStore | None,
+) -> dict[str, Any]:
+    """
+    COCOデータセットを少しずつ読み込んで、変換対象のimagesとannotationsだけを返します。引数と戻り値は`read_coco_instances`と同じです。
+    """
+    coco_filter = _CocoInstancesFilter(target_image_file_names, target_category_names)
+    progress_logger = ProgressLogger("COCOデータセットのannotationsを読み込み中")
+    read_keys: set[str] = set()
+    skipped_keys: set[str] = set()
+
+    def should_skip(key: str) -> bool:
+        if key == "annotations" and not (should_read_annotations and coco_filter.can_filter_annotations(read_keys)):
+            skipped_keys.add(key)
+        read_keys.add(key)
+        return key in skipped_keys
+
+    result: dict[str, Any] = {"images": [], "categories": []}
+    annotations: list[dict[str, Any]] | CocoAnnotationStore = annotation_store if annotation_store is not None else []
+    with open_json_for_read(path) as f:
+        for key, value in iter_json_object_members(f, stream_keys=_COCO_ARRAY_KEYS, skip_keys=should_skip):
+            match key:
+                case "images":
+                    if coco_filter.add_image(value):
+                        result["images"].append(value)
+                case "categories":
+                    coco_filter.add_category(value)
+                    result["categories"].append(value)
+                case "annotations":
+                    progress_logger.update()
+                    if coco_filter.is_target_annotation(value):
+                        annotations.append(value)
+                case _:
+                    result[key] = value
+
+    if not should_read_annotations:
+        return result
+
+    if "annotations" in skipped_keys:
+        # 1回目の走査では`annotations`を読み飛ばしたので、`annotations`だけを読み込む
+        with open_json_for_read(path) as f:
+            for key, value in iter_json_object_members(f, stream_keys={"annotations"}, skip_keys=_COCO_ARRAY_KEYS - {"annotations"}):
+                if key != "annotations":
+                    # `info`などのトップレベルの値は、1回目の走査で読み込み済
+                    continue
+                progress_logger.update()
+                if coco_filter.is_target_annotation(value):
+                    annotations.append(value)
+
+    result["annotations"] = annotations
+    return result
@@ -0,0 +1,285 @@
+import collections
+import itertools
+from dataclasses import dataclass
+from enum import Enum
+from typing import TYPE_CHECKING, Any
+
+from loguru import logger
+
+from src.common.shard import get_shard_index
+
+# 起動時間を短くするため、numpyは検証する時点でimportする
+if TYPE_CHECKING:
+    import numpy
+
+    from src.common.annotation_store import CocoAnnotationStore
+
+
+class CocoValidationMode(Enum):
+    """
+    変換前の検証の動作
+    """
+
+    FAIL = "fail"
+    """エラーが見つかった場合は、何も出力せずに終了する"""
+    REPORT = "report"
+    """エラーが見つかってもログに出力するだけで、変換を続ける"""
+    SKIP = "skip"
+    """検証しない"""
+
+
+SEVERITY_ERROR = "error"
+"""変換結果が正しくならない問題"""
+SEVERITY_WARNING = "warning"
+"""変換はできるが、確認した方がよい問題"""
+
+
+@dataclass
+class CocoValidationIssue:
+    """
+    COCOデータセット（Instances）の不整合
+    """
+
+    kind: str
+    """不整合の種類。`dangling_category_id`など"""
+    severity: str
+    """`error`または`warning`"""
+    message: str
+    annotation_id: int | None = None
+    image_id: int | None = None
+
+
+_POLYGON_CHUNK_SIZE = 100_000
+"""ポリゴンを検証するときに、一度に処理するannotationの件数。座標ごとに作成する配列のメモリ使用量を抑えるため"""
+
+# annotationごとの不整合の種類と、重大度とメッセージ
+_ANNOTATION_ISSUE_TYPES = {
+    "dangling_image_id": (SEVERITY_ERROR, "存在しないimage_idを参照しています。"),
+    "dangling_category_id": (SEVERITY_ERROR, "存在しないcategory_idを参照しています。"),
+    "invalid_bbox": (SEVERITY_ERROR, "bboxの幅または高さが負です。"),
+    "bbox_out_of_image": (SEVERITY_WARNING, "bboxが画像からはみ出ています。"),
+    "odd_length_polygon": (SEVERITY_ERROR, "ポリゴンの座標の個数が奇数です。"),
+    "too_few_polygon_points": (SEVERITY_ERROR, "ポリゴンの頂点が3個未満です。"),
+    "polygon_out_of_image": (SEVERITY_WARNING, "ポリゴンが画像からはみ出ています。"),
+    "missing_rle_size": (SEVERITY_ERROR, "RLEにsizeがありません。"),
+    "rle_size_mismatch": (SEVERITY_ERROR, "RLEのsizeが画像のサイズ（height, width）と一致しません。"),
+}
+
+
+@dataclass
+class _AnnotationColumns:
+    """
+    検証に利用する、annotationsの列
+    """
+
+    ids: "numpy.ndarray"
+    image_ids: "numpy.ndarray"
+    category_ids: "numpy.ndarray"
+    bboxes: "numpy.ndarray"
+    has_bbox: "numpy.ndarray"
+    rle_sizes: "numpy.ndarray"
+    is_rle: "numpy.ndarray"
+    raw_polygons: list[tuple[int, list[Any]]]
+    """列に格納できなかったannotationのポリゴンと、annotationのインデックス"""
+
+    @classmethod
+    def from_store(cls, store: "CocoAnnotationStore", issue_masks: dict[str, "numpy.ndarray"]) -> "_AnnotationColumns":
+        """
+        `store`の列を読み込みます。列に格納できなかったannotation（compressed RLEなど）は件数が少ないので、dictから列に値を移します。
+        sizeがないRLEは、`issue_masks`に記録します。
+        """
+        import numpy  # noqa: PLC0415
+
+        columns = cls(
+            ids=store.ids,
+            image_ids=store.image_ids,
+            category_ids=store.category_ids,
+            bboxes=store.bboxes,
+            has_bbox=numpy.ones(len(store), dtype=bool),
+            rle_sizes=store.rle_sizes,
+            is_rle=store.is_uncompressed_rle,
+            raw_polygons=[],
+        )
+        for index, anno in store.raw_annotations.items():
+            columns.ids[index] = anno["id"]
+            columns.image_ids[index] = anno["image_id"]
+            columns.category_ids[index] = anno["category_id"]
+            bbox = anno.get("bbox")
+            columns.has_bbox[index] = bool(bbox)
+            if bbox:
+                columns.bboxes[index] = bbox
+            segmentation = anno.get("segmentation")
+            if isinstance(segmentation, list):
+                columns.raw_polygons.extend((index, polygon) for polygon in segmentation)
+            elif isinstance(segmentation, dict):
+                if isinstance(segmentation.get("size"), list) and len(segmentation["size"]) == 2:
+                    columns.rle_sizes[index] = segmentation["size"]
+                    columns.is_rle[index] = True
+                else:
+                    issue_masks["missing_rle_size"][index] = True
+        return columns
+
+    def get_raw_polygons(self) -> tuple["numpy.ndarray", "numpy.ndarray", "numpy.ndarray"]:
+        """
+        `raw_polygons`を、`CocoAnnotationStore.get_polygons`と同じ形式の配列で返します。
+        """
+        import numpy  # noqa: PLC0415
+
+        polygon_lengths = numpy.array([len(polygon) for _, polygon in self.raw_polygons], dtype=numpy.int64)
+        coordinates = numpy.fromiter(itertools.chain.from_iterable(polygon for _, polygon in self.raw_polygons), dtype=numpy.float64, count=int(polygon_lengths.sum()))
+        polygon_owners = numpy.array([index for index, _ in self.raw_polygons], dtype=numpy.int64)
+        return coordinates, polygon_lengths, polygon_owners
+
+
+def _create_duplicate_id_issues(name: str, ids: "numpy.ndarray") -> list[CocoValidationIssue]:
+    import numpy  # noqa: PLC0415
+
+    values, counts = numpy.unique(ids, return_counts=True)
+    return [CocoValidationIssue(kind=f"duplicate_{name}_id", severity=SEVERITY_ERROR, message=f"{name}のid={duplicated_id}が重複しています。") for duplicated_id in values[counts > 1].tolist()]
+
+
+def _lookup_image_sizes(coco_images: list[dict[str, Any]], annotation_image_ids: "numpy.ndarray") -> tuple["numpy.ndarray", "numpy.ndarray"]:
+    """
+    annotationごとに、参照している画像の幅と高さを返します。存在しない画像を参照している場合はNaNです。
+    """
+    import numpy  # noqa: PLC0415
+
+    widths = numpy.full(len(annotation_image_ids), numpy.nan)
+    heights = numpy.full(len(annotation_image_ids), numpy.nan)
+    if len(coco_images) == 0:
+        return widths, heights
+
+    image_ids = numpy.array([image["id"] for image in coco_images], dtype=numpy.int64)
+    image_sizes = numpy.array([(image["width"], image["height"]) for image in coco_images], dtype=numpy.float64)
+    order = numpy.argsort(image_ids, kind="stable")
+    positions = numpy.minimum(numpy.searchsorted(image_ids[order], annotation_image_ids), len(image_ids) - 1)
+    has_image = image_ids[order][positions] == annotation_image_ids
+    widths[has_image] = image_sizes[order[positions[has_image]], 0]
+    heights[has_image] = image_sizes[order[positions[has_image]], 1]
+    return widths, heights
+
+
+def _find_polygon_issues(
+    coordinates: "numpy.ndarray",
+    polygon_lengths: "numpy.ndarray",
+    polygon_owners: "numpy.ndarray",
+    annotation_widths: "numpy.ndarray",
+    annotation_heights: "numpy.ndarray",
+    issue_masks: dict[str, "numpy.ndarray"],
+) -> None:
+    """
+    連結したポリゴンの座標を配列の演算で一括して検証して、不整合のあるannotationを`issue_masks`に記録します。
+
+    Args:
+        coordinates: ポリゴンの座標を連結したarray
+        polygon_lengths: ポリゴンごとの座標の個数
+        polygon_owners: ポリゴンごとの、annotationのインデックス
+    """
+    import numpy  # noqa: PLC0415
+
+    is_odd_length = polygon_lengths % 2 == 1
+    issue_masks["odd_length_polygon"][polygon_owners[is_odd_length]] = True
+    issue_masks["too_few_polygon_points"][polygon_owners[polygon_lengths < 6]] = True
+
+    coordinate_owners = numpy.repeat(polygon_owners, polygon_lengths)
+    # ポリゴン内での座標の位置。偶数ならx座標、奇数ならy座標
+    polygon_starts = numpy.cumsum(polygon_lengths) - polygon_lengths
+    is_x = (numpy.arange(len(coordinates)) - numpy.repeat(polygon_starts, polygon_lengths)) % 2 == 0
+    coordinate_limits = numpy.where(is_x, annotation_widths[coordinate_owners], annotation_heights[coordinate_owners])
+    is_coordinate_out_of_image = (coordinates < 0) | (coordinates > coordinate_limits)
+    # 座標の個数が奇数のポリゴンはx座標とy座標を区別できないので、はみ出ているかは判定しない
+    is_coordinate_out_of_image &= ~numpy.repeat(is_odd_length, polygon_lengths)
+    issue_masks["polygon_out_of_image"][coordinate_owners[is_coordinate_out_of_image]] = True
+
+
+def validate_coco_instances(coco_instances: dict[str, Any], *, num_shards: int = 1, shard_index: int = 0) -> list[CocoValidationIssue]:
+    """
+    COCOデータセット（Instances）の整合性を検証します。
+    annotationsは`CocoAnnotationStore`の列（`id`, `image_id`, `category_id`, `bbox`、連結したポリゴンの座標、RLEの`size`）を
+    numpyの配列のまま参照して、配列の演算で一括して検証します。annotationのdictは生成しません。
+
+    以下をエラーとして検出します。
+
+    * images, categories, annotationsのidの重複
+    * 存在しないimage_id, category_idを参照しているannotation
+    * bboxの幅または高さが負
+    * 座標の個数が奇数、または頂点が3個未満のポリゴン
+    * RLEに`size`がない、またはRLEの`size`が画像のサイズと一致しない
+
+    以下を警告として検出します。
+
+    * 画像からはみ出ているbbox, ポリゴン
+
+    Args:
+        coco_instances: COCOデータセット。`annotations`はdictのlistでも`CocoAnnotationStore`でも構いません。
+        num_shards: 2以上を指定した場合は、`file_name`のハッシュ値で決まる`shard_index`のシャードのimagesと、それに紐づくannotationsだけを検証します。
+            存在しないimageを参照しているannotationはどのシャードにも属さないので、インデックスが0のシャードで検証します。
+        shard_index: 検証するシャードのインデックス
+
+    Returns:
+        検出した不整合のlist
+    """
+    import numpy  # noqa: PLC0415
+
+    from src.common.annotation_store import CocoAnnotationStore  # noqa: PLC0415
+
+    annotations = coco_instances["annotations"]
+    store = annotations if isinstance(annotations, CocoAnnotationStore) else CocoAnnotationStore(annotations)
+    annotation_count = len(store)
+    issue_masks = {kind: numpy.zeros(annotation_count, dtype=bool) for kind in _ANNOTATION_ISSUE_TYPES}
+    columns = _AnnotationColumns.from_store(store, issue_masks)
+    annotation_ids = columns.ids
+    annotation_image_ids = columns.image_ids
+
+    coco_images = coco_instances["images"]
+    annotation_widths, annotation_heights = _lookup_image_sizes(coco_images, annotation_image_ids)
+    has_image = ~numpy.isnan(annotation_widths)
+    issue_masks["dangling_image_id"] = ~has_image
+    category_ids = numpy.array([category["id"] for category in coco_instances["categories"]], dtype=numpy.int64)
+    issue_masks["dangling_category_id"] = ~numpy.isin(columns.category_ids, category_ids)
+
+    x, y, width, height = columns.bboxes.T
+    issue_masks["invalid_bbox"] = columns.has_bbox & ((width < 0) | (height < 0))
+    # 存在しない画像を参照している場合、幅と高さはNaNなので比較結果はFalseになる
+    issue_masks["bbox_out_of_image"] = columns.has_bbox & ((x < 0) | (y < 0) | (x + width > annotation_widths) | (y + height > annotation_heights))
+
+    for start in range(0, annotation_count, _POLYGON_CHUNK_SIZE):
+        _find_polygon_issues(*store.get_polygons(start, min(start + _POLYGON_CHUNK_SIZE, annotation_count)), annotation_widths, annotation_heights, issue_masks)
+    if len(columns.raw_polygons) > 0:
+        _find_polygon_issues(*columns.get_raw_polygons(), annotation_widths, annotation_heights, issue_masks)
+    issue_masks["too_few_polygon_points"] &= ~issue_masks["odd_length_polygon"]
+
+    issue_masks["rle_size_mismatch"] = columns.is_rle & has_image & ((columns.rle_sizes[:, 0] != annotation_heights) | (columns.rle_sizes[:, 1] != annotation_widths))
+
+    is_target_annotation = numpy.ones(annotation_count, dtype=bool)
+    if num_shards > 1:
+        coco_images = [image for image in coco_images if get_shard_index(image["file_name"], num_shards) == shard_index]
+        is_target_annotation = numpy.isin(annotation_image_ids, [image["id"] for image in coco_images])
+        if shard_index == 0:
+            is_target_annotation |= ~has_image
+
+    issues: list[CocoValidationIssue] = []
+    issues.extend(_create_duplicate_id_issues("image", numpy.array([image["id"] for image in coco_images], dtype=numpy.int64)))
+    issues.extend(_create_duplicate_id_issues("category", category_ids))
+    issues.extend(_create_duplicate_id_issues("annotation", annotation_ids[is_target_annotation]))
+    for kind, (severity, message) in _ANNOTATION_ISSUE_TYPES.items():
+        mask = issue_masks[kind] & is_target_annotation
+        issues.extend(
+            CocoValidationIssue(kind=kind, severity=severity, message=message, annotation_id=annotation_id, image_id=image_id)
+            for annotation_id, image_id in zip(annotation_ids[mask].tolist(), annotation_image_ids[mask].tolist(), strict=True)
+        )
+    return issues
+
+
+def log_coco_validation_issues(issues: list[CocoValidationIssue], *, max_examples: int = 10) -> None:
+    """
+    不整合の種類ごとに、件数と例をログに出力します。
+    """
+    issues_by_kind: dict[str, list[CocoValidationIssue]] = collections.defaultdict(list)
+    for issue in issues:
+        issues_by_kind[issue.kind].append(issue)
+
+    for kind, kind_issues in issues_by_kind.items():
+        examples = [f"annotation_id={issue.annotation_id}, image_id={issue.image_id}" if issue.annotation_id is not None else issue.message for issue in kind_issues[:max_examples]]
+        log = logger.error if kind_issues[0].severity == SEVERITY_ERROR else logger.warning
+        log(f"COCOデータセットの検証: {kind_issues[0].message} :: kind='{kind}', {len(kind_issues)}件 :: 例: {examples}")
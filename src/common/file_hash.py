@@ -0,0 +1,64 @@
+import hashlib
+import threading
+from pathlib import Path
+from typing import Any
+
+from loguru import logger
+
+from src.common.json_file import read_json, write_json
+
+
+def calculate_file_sha256(file: Path) -> str:
+    """
+    ファイルの中身のSHA-256ハッシュ値（16進数文字列）を計算します。
+    """
+    with file.open("rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+
+class FileHashCache:
+    """
+    ファイルのSHA-256ハッシュ値のキャッシュ。
+    ファイルのパス、サイズ、更新日時をキーにしているので、ファイルが変更されていなければハッシュ値を再計算しません。
+    スレッドセーフです。
+
+    Args:
+        cache_json: キャッシュを永続化するJSONファイルのパス。Noneの場合は永続化しません。
+    """
+
+    def __init__(self, cache_json: Path | None = None) -> None:
+        self.cache_json = cache_json
+        self._lock = threading.Lock()
+        self._entries: dict[str, dict[str, Any]] = {}
+        if cache_json is not None and cache_json.exists():
+            self._entries = read_json(cache_json)
+            logger.debug(f"ハッシュ値のキャッシュファイル'{cache_json}'を読み込みました。 :: {len(self._entries)}件")
+
+    def get_sha256(self, file: Path) -> str:
+        """
+        ファイルのSHA-256ハッシュ値を取得します。キャッシュに存在しない、またはファイルが変更されている場合は計算します。
+
+        Raises:
+            FileNotFoundError: ファイルが存在しない場合
+        """
+        key = str(file.resolve())
+        stat = file.stat()
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+            return entry["sha256"]
+
+        sha256 = calculate_file_sha256(file)
+        with self._lock:
+            self._entries[key] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": sha256}
+        return sha256
+
+    def save(self) -> None:
+        """
+        キャッシュをJSONファイルに書き出します。
+        """
+        if self.cache_json is None:
+            return
+        self.cache_json.parent.mkdir(exist_ok=True, parents=True)
+        with self._lock:
+            write_json(self.cache_json, self._entries)
@@ -0,0 +1,251 @@
+import os
+import struct
+import zlib
+from collections.abc import Iterator
+from enum import Enum
+from pathlib import Path
+from typing import TYPE_CHECKING, BinaryIO
+
+from src.common.mask import CroppedMask
+
+# 起動時間を短くするため、numpyは必要になった時点でimportする
+if TYPE_CHECKING:
+    import numpy
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# 画像サイズが格納されているJPEGのSOF(Start Of Frame)マーカー。DHT(0xC4), JPG(0xC8), DAC(0xCC)は除く
+_JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+# セグメント長を持たないJPEGのマーカー（TEM, RST0〜RST7, SOI, EOI）
+_JPEG_STANDALONE_MARKERS = {0x01, *range(0xD0, 0xDA)}
+
+
+def _read_png_size(f: BinaryIO) -> tuple[int, int] | None:
+    # シグネチャ(8byte)の直後は必ずIHDRチャンク: length(4byte), type(4byte), width(4byte), height(4byte)
+    header = f.read(16)
+    if len(header) < 16 or header[4:8] != b"IHDR":
+        return None
+    width, height = struct.unpack(">II", header[8:16])
+    return width, height
+
+
+def _read_jpeg_size(f: BinaryIO) -> tuple[int, int] | None:
+    f.read(2)  # SOI
+    while True:
+        # マーカーの前には0xFFが1個以上ある
+        byte = f.read(1)
+        while byte == b"\xff":
+            byte = f.read(1)
+        if len(byte) == 0:
+            return None
+
+        marker = byte[0]
+        if marker in _JPEG_STANDALONE_MARKERS:
+            continue
+
+        length_bytes = f.read(2)
+        if len(length_bytes) < 2:
+            return None
+        (segment_length,) = struct.unpack(">H", length_bytes)
+        # セグメント長は自身の2byteを含むので、2未満の場合はヘッダが壊れている
+        if segment_length < 2:
+            return None
+        if marker in _JPEG_SOF_MARKERS:
+            # precision(1byte), height(2byte), width(2byte)
+            sof = f.read(5)
+            if len(sof) < 5:
+                return None
+            height, width = struct.unpack(">HH", sof[1:5])
+            return width, height
+
+        f.seek(segment_length - 2, 1)
+
+
+def read_image_size_from_stream(f: BinaryIO) -> tuple[int, int] | None:
+    """
+    画像のファイルオブジェクトからヘッダのみを読み込んで、画像のサイズを取得します。
+    ZIPファイル内の画像のように、ファイルパスがない画像に利用します。
+
+    Args:
+        f: 先頭から読み込むファイルオブジェクト。JPEGの場合はシーク可能である必要があります。
+
+    Returns:
+        `read_image_size`と同じ
+    """
+    signature = f.read(8)
+    if signature == PNG_SIGNATURE:
+        return _read_png_size(f)
+    if signature[:2] == b"\xff\xd8":
+        f.seek(0)
+        return _read_jpeg_size(f)
+    return None
+
+
+def read_image_size(image_file: Path) -> tuple[int, int] | None:
+    """
+    画像ファイルのヘッダのみを読み込んで、画像のサイズを取得します。画像全体はデコードしません。
+
+    Args:
+        image_file: 画像ファイルのパス。JPEGとPNGに対応しています。
+
+    Returns:
+        tuple[0]: 画像の幅
+        tuple[1]: 画像の高さ
+        対応していない画像フォーマットの場合や、ヘッダが壊れている場合はNoneを返します。
+
+    Raises:
+        OSError: 画像ファイルを読み込めない場合（存在しない、権限がないなど）
+    """
+    with image_file.open("rb") as f:
+        return read_image_size_from_stream(f)
+
+
+class BinaryImageFormat(Enum):
+    """
+    塗りつぶし画像（PNG）の形式
+    """
+
+    RGBA = "rgba"
+    """8bitのRGBA。塗られている部分は[255,255,255,255]、塗られていない部分は[0,0,0,0]。`annofabapi.segmentation.write_binary_image`と同じ形式"""
+    PALETTE = "palette"
+    """1bitのパレット形式。パレットの色はRGBAと同じで、ファイルサイズが小さい"""
+
+
+def _write_png_chunk(fp: BinaryIO, chunk_type: bytes, data: bytes) -> None:
+    fp.write(struct.pack(">I", len(data)))
+    fp.write(chunk_type)
+    fp.write(data)
+    fp.write(struct.pack(">I", zlib.crc32(data, zlib.crc32(chunk_type))))
+
+
+def write_binary_png(
+    mask: "numpy.ndarray | CroppedMask",
+    fp: BinaryIO,
+    *,
+    compression_level: int = 6,
+    image_format: BinaryImageFormat = BinaryImageFormat.RGBA,
+    rows_per_chunk: int = 256,
+) -> None:
+    """
+    2値のマスクを、Annofabの塗りつぶし画像（PNG）として書き出します。
+
+    `rows_per_chunk`行ずつスキャンラインを作成して圧縮するので、RGBAの配列全体（マスクの4倍のサイズ）は作成しません。
+
+    Args:
+        mask: 2次元配列(shape=(height, width))。dtypeはboolまたはuint8（0以外が塗られている部分）。
+            `CroppedMask`の場合は、画像全体のサイズの配列を作成せずに書き出します。
+        fp: 書き込み先のバイナリのファイルオブジェクト
+        compression_level: zlibの圧縮レベル（0〜9）。1が最も速く、9が最もファイルサイズが小さい
+        image_format: 画像の形式
+        rows_per_chunk: 一度に圧縮する行数
+    """
+    import numpy  # noqa: PLC0415
+
+    if isinstance(mask, CroppedMask):
+        height, width = mask.image_height, mask.image_width
+    else:
+        height, width = mask.shape
+    if image_format == BinaryImageFormat.RGBA:
+        # bit depth=8, color type=6(RGBA)
+        ihdr = struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0)
+        row_byte_count = width * 4
+    else:
+        # bit depth=1, color type=3(パレット)
+        ihdr = struct.pack(">IIBBBBB", width, height, 1, 3, 0, 0, 0)
+        row_byte_count = (width + 7) // 8
+
+    fp.write(PNG_SIGNATURE)
+    _write_png_chunk(fp, b"IHDR", ihdr)
+    if image_format == BinaryImageFormat.PALETTE:
+        # パレット0は透明な黒、パレット1は不透明な白
+        _write_png_chunk(fp, b"PLTE", bytes([0, 0, 0, 255, 255, 255]))
+        _write_png_chunk(fp, b"tRNS", bytes([0, 255]))
+
+    def iter_raw_row_bands() -> Iterator["numpy.ndarray"]:
+        for start_row in range(0, height, rows_per_chunk):
+            if isinstance(mask, CroppedMask):
+                rows = mask.get_rows(start_row, start_row + rows_per_chunk)
+            else:
+                # pycocotools.mask.decodeの戻り値のようなF-orderの配列でも、行ごとに処理できるようにC-orderにする
+                rows = numpy.ascontiguousarray(mask[start_row : start_row + rows_per_chunk]) != 0
+            if image_format == BinaryImageFormat.RGBA:
+                # 1ピクセルを32bitの整数とみなして、塗られている部分を0xFFFFFFFF（[255,255,255,255]）にする
+                yield (rows.astype(numpy.uint32) * numpy.uint32(0xFFFFFFFF)).view(numpy.uint8)
+            else:
+                yield numpy.packbits(rows, axis=1)
+
+    _write_png_image_data(fp, iter_raw_row_bands(), row_byte_count, compression_level=compression_level)
+
+
+def write_label_map_png(label_map: "numpy.ndarray", fp: BinaryIO, *, compression_level: int = 6, rows_per_chunk: int = 256) -> None:
+    """
+    ピクセル値がカテゴリのIDであるラベルマップを、グレースケールのPNGとして書き出します。
+
+    Args:
+        label_map: 2次元配列(shape=(height, width))。dtypeはuint8（8bitのPNG）またはuint16（16bitのPNG）
+        fp: 書き込み先のバイナリのファイルオブジェクト
+        compression_level: zlibの圧縮レベル（0〜9）
+        rows_per_chunk: 一度に圧縮する行数
+    """
+    import numpy  # noqa: PLC0415
+
+    if label_map.dtype not in {numpy.dtype(numpy.uint8), numpy.dtype(numpy.uint16)}:
+        raise ValueError(f"ラベルマップのdtypeはuint8またはuint16である必要があります。 :: dtype={label_map.dtype}")
+
+    height, width = label_map.shape
+    bit_depth = label_map.dtype.itemsize * 8
+    # color type=0(グレースケール)
+    fp.write(PNG_SIGNATURE)
+    _write_png_chunk(fp, b"IHDR", struct.pack(">IIBBBBB", width, height, bit_depth, 0, 0, 0, 0))
+
+    def iter_raw_row_bands() -> Iterator["numpy.ndarray"]:
+        for start_row in range(0, height, rows_per_chunk):
+            # PNGの16bitの値はビッグエンディアン
+            rows = numpy.ascontiguousarray(label_map[start_row : start_row + rows_per_chunk], dtype=label_map.dtype.newbyteorder(">"))
+            yield rows.view(numpy.uint8)
+
+    _write_png_image_data(fp, iter_raw_row_bands(), width * label_map.dtype.itemsize, compression_level=compression_level)
+
+
+def _write_png_image_data(fp: BinaryIO, raw_row_bands: Iterator["numpy.ndarray"], row_byte_count: int, *, compression_level: int) -> None:
+    """
+    フィルタ前のスキャンラインを数行ずつ圧縮して、IDATチャンクとIENDチャンクを書き出します。
+
+    Args:
+        raw_row_bands: フィルタ前のスキャンライン（shape=(行数, row_byte_count), dtype=uint8）を、上の行から順に返すイテレータ
+        row_byte_count: 1行のバイト数
+    """
+    import numpy  # noqa: PLC0415
+
+    compressor = zlib.compressobj(compression_level)
+    # 上の行と同じ行が続くことが多いので、Upフィルタ（上の行との差分）を使う
+    previous_row = numpy.zeros(row_byte_count, dtype=numpy.uint8)
+    for raw_rows in raw_row_bands:
+        scanlines = numpy.empty((len(raw_rows), 1 + row_byte_count), dtype=numpy.uint8)
+        # 各スキャンラインの先頭1byteはフィルタの種類（2:Up）
+        scanlines[:, 0] = 2
+        scanlines[0, 1:] = raw_rows[0] - previous_row
+        numpy.subtract(raw_rows[1:], raw_rows[:-1], out=scanlines[1:, 1:])
+        previous_row = raw_rows[-1]
+
+        compressed = compressor.compress(scanlines.data)
+        if len(compressed) > 0:
+            _write_png_chunk(fp, b"IDAT", compressed)
+    _write_png_chunk(fp, b"IDAT", compressor.flush())
+    _write_png_chunk(fp, b"IEND", b"")
+
+
+def list_files_in_dir(root_dir: Path) -> set[str]:
+    """
+    ディレクトリ配下（サブディレクトリを含む）のファイルの一覧を取得します。
+
+    Returns:
+        `root_dir`からの相対パス（区切り文字は`/`）のset
+    """
+    result = set()
+    # `os.walk`は`os.scandir`を利用しているので、ファイルごとに`stat`を呼び出さない
+    for dirpath, _, filenames in os.walk(root_dir):
+        relative_dir = Path(dirpath).relative_to(root_dir)
+        for filename in filenames:
+            result.add((relative_dir / filename).as_posix())
+    return result
@@ -0,0 +1,133 @@
+import gzip
+import json
+from pathlib import Path
+from typing import Any, TextIO
+
+# orjsonはオプショナルな依存ライブラリ。インストールされている場合は、標準ライブラリのjsonの代わりに利用する
+try:
+    import orjson
+
+    JSON_BACKEND = "orjson"
+except ImportError:
+    JSON_BACKEND = "json"
+"""
+JSONの読み書きに利用するライブラリ。`orjson`または`json`
+"""
+
+GZIP_MAGIC_NUMBER = b"\x1f\x8b"
+
+DEFAULT_GZIP_COMPRESSION_LEVEL = 6
+"""
+gzipの圧縮レベルのデフォルト値。
+
+COCOのJSONでは、圧縮率はレベル6で約9倍、レベル9でもほぼ変わらず、圧縮速度はレベル9の数倍です。
+展開速度（数百MB/s）は圧縮レベルにほとんど依存しないので、帯域の狭いNFSなどでは、圧縮前のファイルを読み込むより速く読み込めます。
+"""
+
+
+def is_gzip_file(path: Path) -> bool:
+    """
+    ファイルの先頭のマジックナンバーから、gzipで圧縮されたファイルかどうかを判定します。
+    """
+    with path.open("rb") as f:
+        return f.read(len(GZIP_MAGIC_NUMBER)) == GZIP_MAGIC_NUMBER
+
+
+def open_json_for_read(path: Path) -> TextIO:
+    """
+    JSONファイルを読み込み用に開きます。gzipで圧縮されている場合は、展開しながら読み込みます。
+    圧縮されているかどうかは拡張子ではなくファイルの中身で判定するので、`.json.gz`以外のファイル名でも読み込めます。
+    """
+    if is_gzip_file(path):
+        return gzip.open(path, "rt", encoding="utf-8")
+    return path.open(encoding="utf-8")
+
+
+def open_json_for_write(path: Path, *, compression_level: int = DEFAULT_GZIP_COMPRESSION_LEVEL, is_gzip: bool | None = None) -> TextIO:
+    """
+    JSONファイルを書き込み用に開きます。拡張子が`.gz`の場合は、gzipで圧縮しながら書き込みます。
+
+    Args:
+        compression_level: gzipの圧縮レベル（1〜9）。gzipで圧縮する場合のみ利用します。
+        is_gzip: gzipで圧縮するかどうか。Noneの場合は拡張子で判定します。一時ファイルに書き込んでから名前を変更する場合などに指定します。
+    """
+    if is_gzip is None:
+        is_gzip = path.suffix == ".gz"
+    if is_gzip:
+        return gzip.open(path, "wt", encoding="utf-8", compresslevel=compression_level)
+    return path.open("w", encoding="utf-8")
+
+
+def loads_json(data: bytes | str) -> Any:  # noqa: ANN401
+    """
+    JSONをデシリアライズします。bytesはUTF-8としてデコードせずに、そのままパースします。
+    """
+    if JSON_BACKEND == "orjson":
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _convert_numpy_value(obj: Any) -> Any:  # noqa: ANN401
+    """
+    標準ライブラリの`json.dumps`の`default`に渡して、numpyのスカラーや配列をPythonのオブジェクトに変換します。
+    numpyをimportしないように、`tolist`メソッドの有無で判定します。
+    """
+    if hasattr(obj, "tolist"):
+        return obj.tolist()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps_json(obj: Any, *, indent: bool = False) -> bytes:  # noqa: ANN401
+    """
+    JSONにシリアライズして、UTF-8のbytesを返します。非ASCII文字はエスケープしません。
+    numpyのスカラー（`numpy.int64`など）や配列は、Pythonの数値やlistと同じようにシリアライズします。
+
+    Args:
+        indent: Trueならば2文字でインデントします。Falseならば空白を含まないコンパクトなJSONを返します。
+            人が読まずにプログラムが読み込むファイルは、コンパクトなJSONにしてください。
+    """
+    if JSON_BACKEND == "orjson":
+        # 標準ライブラリのjsonと同じように、dictのkeyに文字列以外（intなど）も指定できるようにする
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, option=option)
+    if indent:
+        return json.dumps(obj, indent=2, ensure_ascii=False, default=_convert_numpy_value).encode("utf-8")
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False, default=_convert_numpy_value).encode("utf-8")
+
+
+def read_json(path: Path) -> Any:  # noqa: ANN401
+    """
+    JSONファイルを読み込みます。gzipで圧縮されたファイルも読み込めます。
+    ファイルはbytesのまま読み込むので、`str`にデコードするコストはかかりません。
+    """
+    if is_gzip_file(path):
+        with gzip.open(path, "rb") as f:
+            return loads_json(f.read())
+    return loads_json(path.read_bytes())
+
+
+def dumps_json_file(path: Path, obj: Any, *, indent: bool = False, compression_level: int = DEFAULT_GZIP_COMPRESSION_LEVEL, is_gzip: bool | None = None) -> bytes:  # noqa: ANN401
+    """
+    `path`に書き込むJSONファイルの中身を返します。拡張子が`.gz`の場合は、gzipで圧縮したbytesを返します。
+    書き込みを別のスレッドで行う場合などに利用します。引数は`write_json`と同じです。
+    """
+    data = dumps_json(obj, indent=indent)
+    if is_gzip is None:
+        is_gzip = path.suffix == ".gz"
+    if is_gzip:
+        return gzip.compress(data, compresslevel=compression_level)
+    return data
+
+
+def write_json(path: Path, obj: Any, *, indent: bool = False, compression_level: int = DEFAULT_GZIP_COMPRESSION_LEVEL, is_gzip: bool | None = None) -> None:  # noqa: ANN401
+    """
+    JSONファイルを書き込みます。拡張子が`.gz`の場合は、gzipで圧縮して書き込みます。
+
+    Args:
+        indent: Trueならば2文字でインデントします。人が読むファイル（レポートなど）以外はFalseにしてください。
+        compression_level: gzipの圧縮レベル（1〜9）。gzipで圧縮する場合のみ利用します。
+        is_gzip: gzipで圧縮するかどうか。Noneの場合は拡張子で判定します。
+    """
+    path.write_bytes(dumps_json_file(path, obj, indent=indent, compression_level=compression_level, is_gzip=is_gzip))
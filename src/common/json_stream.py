@@ -0,0 +1,241 @@
+import itertools
+import json
+import re
+from collections.abc import Callable, Collection, Iterable, Iterator
+from types import TracebackType
+from typing import Any, Self, TextIO
+
+from src.common.json_file import dumps_json
+
+_WHITESPACE_PATTERN = re.compile(r"[ \t\n\r]*")
+# 読み飛ばすときに、括弧以外の文字と文字列をまとめて読み進めるためのパターン。文字列の中の括弧は数えない
+_SKIP_PATTERN = re.compile(r'(?:[^"\[\]{}]+|"[^"\\]*(?:\\.[^"\\]*)*")*', re.DOTALL)
+_DECODER = json.JSONDecoder()
+
+
+class StreamingJsonObjectWriter:
+    """
+    トップレベルがオブジェクトであるJSONを、キーごとに少しずつ書き出します。
+    配列は要素ごとに書き出すので、配列全体をメモリに載せる必要はありません。
+    値は`dumps_json`でシリアライズするので、orjsonがインストールされていればorjsonを利用します。
+    出力される文字列は、`dumps_json(obj, indent=indent)`をデコードした文字列と同じです。
+
+    Args:
+        fp: 書き込み先のファイルオブジェクト
+        indent: Trueならば2文字でインデントします。人が読まずにプログラムが読み込むファイルは、Falseにしてください。
+
+    Examples:
+        with open_json_for_write(output_json) as f, StreamingJsonObjectWriter(f) as writer:
+            writer.write("images", images)
+            writer.write_array("annotations", iter_annotations())
+    """
+
+    _ARRAY_BATCH_SIZE = 1000
+    """配列の要素をまとめてシリアライズする個数。要素ごとに`dumps_json`を呼ぶと、呼び出しのオーバーヘッドが大きいため"""
+
+    def __init__(self, fp: TextIO, *, indent: bool = False) -> None:
+        self._fp = fp
+        self._indent = indent
+        self._key_count = 0
+        self._fp.write("{")
+
+    def _dumps(self, value: Any) -> str:  # noqa: ANN401
+        """
+        トップレベルのオブジェクトのキーの値として、インデントを1段深くした文字列を返します。
+        """
+        text = dumps_json(value, indent=self._indent).decode("utf-8")
+        if not self._indent:
+            return text
+        return text.replace("\n", "\n  ")
+
+    def _write_key(self, key: str) -> None:
+        if self._key_count > 0:
+            self._fp.write(",")
+        if self._indent:
+            self._fp.write("\n  ")
+        self._fp.write(dumps_json(key).decode("utf-8") + (": " if self._indent else ":"))
+        self._key_count += 1
+
+    def write(self, key: str, value: Any) -> None:  # noqa: ANN401
+        """
+        キーと値を書き出します。
+        """
+        self._write_key(key)
+        self._fp.write(self._dumps(value))
+
+    def write_array(self, key: str, items: Iterable[Any]) -> int:
+        """
+        キーと、配列の要素を少しずつ書き出します。
+        要素は`_ARRAY_BATCH_SIZE`個ずつまとめてシリアライズするので、メモリに保持するのはその個数だけです。
+
+        Returns:
+            書き出した要素の個数
+        """
+        self._write_key(key)
+        self._fp.write("[")
+        count = 0
+        iterator = iter(items)
+        while batch := list(itertools.islice(iterator, self._ARRAY_BATCH_SIZE)):
+            # 配列としてシリアライズしてから、前後の括弧を取り除く
+            text = self._dumps(batch)
+            if count > 0:
+                self._fp.write(",")
+            # インデントする場合は、`"[\n    要素,\n    要素\n  ]"`の括弧の部分を取り除く
+            self._fp.write(text[1:-4] if self._indent else text[1:-1])
+            count += len(batch)
+
+        if count > 0 and self._indent:
+            self._fp.write("\n  ")
+        self._fp.write("]")
+        return count
+
+    def close(self) -> None:
+        if self._key_count > 0 and self._indent:
+            self._fp.write("\n")
+        self._fp.write("}")
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(self, exc_type: type[BaseException] | None, exc_value: BaseException | None, traceback: TracebackType | None) -> None:
+        self.close()
+
+
+class _BufferedJsonReader:
+    """
+    ファイルを少しずつ読み込みながら、JSONの値を1個ずつデコードします。
+    """
+
+    def __init__(self, fp: TextIO, *, chunk_size: int) -> None:
+        self._fp = fp
+        self._chunk_size = chunk_size
+        self._buffer = ""
+        self._pos = 0
+        self._eof = False
+
+    def _read_more(self, size: int) -> bool:
+        chunk = self._fp.read(size)
+        if chunk == "":
+            self._eof = True
+            return False
+        # デコード済の部分は捨てる
+        self._buffer = self._buffer[self._pos :] + chunk
+        self._pos = 0
+        return True
+
+    def peek_char(self) -> str:
+        """
+        空白を読み飛ばして、次の文字を返します。ファイルの終端に達した場合は空文字を返します。
+        """
+        while True:
+            match = _WHITESPACE_PATTERN.match(self._buffer, self._pos)
+            assert match is not None
+            self._pos = match.end()
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._read_more(self._chunk_size):
+                return ""
+
+    def consume_char(self, expected_chars: str) -> str:
+        """
+        空白を読み飛ばして、`expected_chars`のいずれかの文字を1文字読み込みます。
+        """
+        char = self.peek_char()
+        if char == "" or char not in expected_chars:
+            raise ValueError(f"JSONの形式が不正です。{list(expected_chars)}のいずれかを期待しましたが、{char!r}でした。")
+        self._pos += 1
+        return char
+
+    def decode_value(self) -> Any:  # noqa: ANN401
+        """
+        次のJSONの値を1個デコードします。
+        """
+        self.peek_char()
+        while True:
+            try:
+                value, end = _DECODER.raw_decode(self._buffer, self._pos)
+                # 数値はバッファの終端で途切れていてもデコードできてしまうので、後続の文字を読み込んでいることを確認する
+                if end < len(self._buffer) or self._eof:
+                    self._pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self._eof:
+                    raise
+            # 値が途中までしか読み込まれていないので、追加で読み込む。大きな値でデコードを何度もやり直さないように、読み込むサイズを倍々に増やす
+            self._read_more(max(self._chunk_size, len(self._buffer)))
+
+    def skip_value(self) -> None:
+        """
+        次のJSONの値を、デコードせずに読み飛ばします。
+        配列やオブジェクトは、文字列の中を除いて括弧の対応だけを数えるので、要素ごとのdictやlistは生成しません。
+        """
+        char = self.peek_char()
+        if char == "" or char not in "[{":
+            self.decode_value()
+            return
+
+        depth = 0
+        while True:
+            match = _SKIP_PATTERN.match(self._buffer, self._pos)
+            assert match is not None
+            self._pos = match.end()
+            if self._pos == len(self._buffer) or self._buffer[self._pos] == '"':
+                # バッファの終端に達したか、文字列が途中までしか読み込まれていない
+                if not self._read_more(max(self._chunk_size, len(self._buffer) - self._pos)):
+                    raise ValueError("JSONの形式が不正です。配列、オブジェクト、または文字列が閉じられていません。")
+                continue
+
+            depth += 1 if self._buffer[self._pos] in "[{" else -1
+            self._pos += 1
+            if depth == 0:
+                return
+
+
+def iter_json_object_members(fp: TextIO, *, stream_keys: Collection[str] = (), skip_keys: Collection[str] | Callable[[str], bool] = (), chunk_size: int = 2**16) -> Iterator[tuple[str, Any]]:
+    """
+    トップレベルがオブジェクトであるJSONを少しずつ読み込んで、キーと値を1個ずつ返します。
+    `stream_keys`に含まれるキーの値が配列の場合は、配列全体ではなく要素を1個ずつ返すので、配列全体をメモリに載せる必要はありません。
+
+    Args:
+        fp: 読み込むファイルオブジェクト
+        stream_keys: 配列の要素を1個ずつ返すキー
+        skip_keys: 値をデコードせずに読み飛ばすキー。このキーと値は返しません。
+            関数を指定した場合は、キーに達した時点でキーを引数に呼び出して、Trueを返したキーを読み飛ばします。
+            それまでに返したキーと値によって、読み飛ばすかどうかを決める場合に利用します。
+        chunk_size: 1回に読み込む文字数
+
+    Returns:
+        tuple[0]: キー
+        tuple[1]: 値。キーが`stream_keys`に含まれていて値が配列の場合は、配列の要素
+
+    Examples:
+        for key, value in iter_json_object_members(f, stream_keys={"annotations"}):
+            if key == "annotations":
+                # valueは1個のannotation
+                ...
+    """
+    should_skip = skip_keys if callable(skip_keys) else skip_keys.__contains__
+    reader = _BufferedJsonReader(fp, chunk_size=chunk_size)
+    reader.consume_char("{")
+    if reader.peek_char() == "}":
+        return
+
+    while True:
+        key = reader.decode_value()
+        reader.consume_char(":")
+        if should_skip(key):
+            reader.skip_value()
+        elif key in stream_keys and reader.peek_char() == "[":
+            reader.consume_char("[")
+            if reader.peek_char() == "]":
+                reader.consume_char("]")
+            else:
+                while True:
+                    yield key, reader.decode_value()
+                    if reader.consume_char(",]") == "]":
+                        break
+        else:
+            yield key, reader.decode_value()
+
+        if reader.consume_char(",}") == "}":
+            return
@@ -0,0 +1,269 @@
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, BinaryIO, Self
+
+if TYPE_CHECKING:
+    import numpy
+
+
+def decode_rle_counts_string(counts: str | bytes) -> "numpy.ndarray":
+    """
+    COCOのcompressed RLEの`counts`（文字列）を、uncompressed RLEの`counts`（整数の配列）に変換します。
+    pycocotoolsの`rleFrString`と同じ処理を、numpyでまとめて行います。
+    """
+    import numpy  # noqa: PLC0415
+
+    if isinstance(counts, str):
+        counts = counts.encode("ascii")
+    chars = numpy.frombuffer(counts, dtype=numpy.uint8).astype(numpy.int64) - 48
+    if len(chars) == 0:
+        return numpy.zeros(0, dtype=numpy.int64)
+    # 1個の値は、0x20のビットが立っていない文字で終わる、5ビットずつの文字の並び
+    is_last_char = (chars & 0x20) == 0
+    last_char_indices = numpy.flatnonzero(is_last_char)
+    first_char_indices = numpy.concatenate(([0], last_char_indices[:-1] + 1))
+    char_positions = numpy.arange(len(chars)) - numpy.repeat(first_char_indices, last_char_indices - first_char_indices + 1)
+    values = numpy.add.reduceat((chars & 0x1F) << (5 * char_positions), first_char_indices)
+    # 最後の文字の0x10のビットは符号
+    is_negative = (chars[last_char_indices] & 0x10) != 0
+    values[is_negative] -= numpy.left_shift(1, 5 * (char_positions[last_char_indices[is_negative]] + 1))
+    # 3個目以降は、2個前の値との差分が格納されている
+    values[2::2] = numpy.cumsum(values[2::2])
+    values[1::2] = numpy.cumsum(values[1::2])
+    return values
+
+
+@dataclass(frozen=True)
+class CroppedMask:
+    """
+    2値のマスクを、前景の外接矩形の範囲だけの配列と、その位置で表します。
+    大きな画像に含まれる小さな物体のマスクを、画像全体のサイズの配列を作成せずに扱うために利用します。
+    メモリ使用量と処理時間は、画像のサイズではなく物体のサイズに比例します。
+    """
+
+    x: int
+    """外接矩形の左上のx座標"""
+    y: int
+    """外接矩形の左上のy座標"""
+    array: "numpy.ndarray"
+    """外接矩形の範囲のマスク。2D boolean numpy array(shape=(height, width))。前景が存在しない場合はshape=(0, 0)"""
+    image_width: int
+    image_height: int
+
+    @classmethod
+    def from_array(cls, mask: "numpy.ndarray") -> Self:
+        """
+        画像全体のサイズのマスクから、前景の外接矩形の範囲を切り出します。
+        """
+        import numpy  # noqa: PLC0415
+
+        image_height, image_width = mask.shape
+        nonzero_ys = numpy.flatnonzero(mask.any(axis=1))
+        if len(nonzero_ys) == 0:
+            return cls(x=0, y=0, array=numpy.zeros((0, 0), dtype=bool), image_width=image_width, image_height=image_height)
+        nonzero_xs = numpy.flatnonzero(mask.any(axis=0))
+        y0, y1 = int(nonzero_ys[0]), int(nonzero_ys[-1]) + 1
+        x0, x1 = int(nonzero_xs[0]), int(nonzero_xs[-1]) + 1
+        return cls(x=x0, y=y0, array=numpy.ascontiguousarray(mask[y0:y1, x0:x1] != 0), image_width=image_width, image_height=image_height)
+
+    @classmethod
+    def from_rle(cls, segmentation: dict[str, Any], image_height: int, image_width: int) -> Self:
+        """
+        COCOのRLE形式の`segmentation`から、画像全体のサイズの配列を作成せずにマスクを作成します。
+
+        Args:
+            segmentation: RLE形式の`segmentation`。`counts`はcompressed（文字列）とuncompressed（整数のlist）のどちらでもよい
+            image_height: 画像の高さ
+            image_width: 画像の幅
+        """
+        import numpy  # noqa: PLC0415
+
+        counts = segmentation["counts"]
+        counts = decode_rle_counts_string(counts) if isinstance(counts, str | bytes) else numpy.asarray(counts, dtype=numpy.int64)
+        pixel_count = image_height * image_width
+        # RLEは列優先（Fortran order）で、0の個数から数える。奇数番目の区間が前景
+        boundaries = numpy.minimum(numpy.cumsum(counts), pixel_count)
+        run_starts = boundaries[0:-1:2]
+        run_ends = boundaries[1::2]
+        is_not_empty = run_ends > run_starts
+        run_starts = run_starts[is_not_empty]
+        run_ends = run_ends[is_not_empty]
+        if len(run_starts) == 0:
+            return cls(x=0, y=0, array=numpy.zeros((0, 0), dtype=bool), image_width=image_width, image_height=image_height)
+
+        # 区間を列ごとに分割する。複数の列にまたがる区間は、列の数だけ複製する
+        first_columns = run_starts // image_height
+        last_columns = (run_ends - 1) // image_height
+        column_counts = last_columns - first_columns + 1
+        segment_run_indices = numpy.repeat(numpy.arange(len(run_starts)), column_counts)
+        segment_columns = first_columns[segment_run_indices] + numpy.arange(len(segment_run_indices)) - numpy.repeat(numpy.cumsum(column_counts) - column_counts, column_counts)
+        column_offsets = segment_columns * image_height
+        segment_starts = numpy.maximum(run_starts[segment_run_indices], column_offsets) - column_offsets
+        segment_ends = numpy.minimum(run_ends[segment_run_indices], column_offsets + image_height) - column_offsets
+
+        x0, x1 = int(segment_columns[0]), int(segment_columns[-1]) + 1
+        y0, y1 = int(segment_starts.min()), int(segment_ends.max())
+        # 外接矩形の範囲を列優先で1次元に並べて、区間ごとにFalseとTrueを交互に並べる
+        crop_height, crop_width = y1 - y0, x1 - x0
+        crop_offsets = (segment_columns - x0) * crop_height - y0
+        boundaries = numpy.empty(len(segment_columns) * 2, dtype=numpy.int64)
+        boundaries[0::2] = segment_starts + crop_offsets
+        boundaries[1::2] = segment_ends + crop_offsets
+        run_lengths = numpy.diff(boundaries, prepend=0, append=crop_height * crop_width)
+        flatten_array = numpy.repeat(numpy.arange(len(run_lengths)) % 2 == 1, run_lengths)
+        return cls(x=x0, y=y0, array=flatten_array.reshape((crop_width, crop_height)).T, image_width=image_width, image_height=image_height)
+
+    @property
+    def width(self) -> int:
+        return self.array.shape[1]
+
+    @property
+    def height(self) -> int:
+        return self.array.shape[0]
+
+    def to_array(self) -> "numpy.ndarray":
+        """
+        画像全体のサイズのマスクを作成します。ファイル形式などで必要な場合のみ利用してください。
+        """
+        import numpy  # noqa: PLC0415
+
+        mask = numpy.zeros((self.image_height, self.image_width), dtype=bool)
+        mask[self.y : self.y + self.height, self.x : self.x + self.width] = self.array
+        return mask
+
+    def get_rows(self, start_row: int, stop_row: int) -> "numpy.ndarray":
+        """
+        画像全体の幅で、`start_row`行目から`stop_row`行目（含まない）までのマスクを返します。
+        """
+        import numpy  # noqa: PLC0415
+
+        stop_row = min(stop_row, self.image_height)
+        rows = numpy.zeros((stop_row - start_row, self.image_width), dtype=bool)
+        overlap_start, overlap_stop = max(start_row, self.y), min(stop_row, self.y + self.height)
+        if overlap_start < overlap_stop:
+            rows[overlap_start - start_row : overlap_stop - start_row, self.x : self.x + self.width] = self.array[overlap_start - self.y : overlap_stop - self.y]
+        return rows
+
+    def clip(self, image_width: int, image_height: int) -> "CroppedMask":
+        """
+        画像の範囲（`image_width`×`image_height`）に収まるように、マスクを切り取ります。
+        """
+        return self.crop(0, 0, image_width, image_height)
+
+    def crop(self, x: int, y: int, width: int, height: int) -> "CroppedMask":
+        """
+        画像内の矩形（左上が`(x, y)`、サイズが`width`×`height`）の範囲を切り出して、その矩形を画像とみなしたマスクを返します。
+        画像をタイルに分割する場合などに利用します。外接矩形の範囲だけをスライスするので、画像全体のサイズの配列は作成しません。
+        """
+        start_x, start_y = max(x - self.x, 0), max(y - self.y, 0)
+        array = self.array[start_y : max(y + height - self.y, 0), start_x : max(x + width - self.x, 0)]
+        cropped = CroppedMask.from_array(array)
+        if cropped.array.size == 0:
+            return CroppedMask(x=0, y=0, array=cropped.array, image_width=width, image_height=height)
+        return CroppedMask(x=self.x + start_x + cropped.x - x, y=self.y + start_y + cropped.y - y, array=cropped.array, image_width=width, image_height=height)
+
+    def get_area(self) -> int:
+        import numpy  # noqa: PLC0415
+
+        return int(numpy.count_nonzero(self.array))
+
+    def get_bbox(self) -> list[float]:
+        """
+        前景の外接矩形を、COCOの`bbox`（`[x, y, width, height]`）で返します。前景が存在しない場合は`[0, 0, 0, 0]`です。
+        `pycocotools.mask.toBbox`と同じ値です。
+        """
+        return [float(self.x), float(self.y), float(self.width), float(self.height)]
+
+    def to_uncompressed_rle(self) -> dict[str, Any]:
+        """
+        COCOのRLE形式(Uncompressed)の`segmentation`に変換します。画像全体のサイズの配列は作成しません。
+        """
+        import numpy  # noqa: PLC0415
+
+        pixel_count = self.image_height * self.image_width
+        if self.array.size == 0:
+            return {"size": [self.image_height, self.image_width], "counts": [pixel_count]}
+
+        # 外接矩形の範囲を列優先で1次元に並べて、値が変化する位置を求める
+        # 画像の高さより低い場合は、列の間に外接矩形の外（塗られていない部分）があるので、列の末尾に0を1個挟む
+        separator_count = 1 if self.height < self.image_height else 0
+        column_length = self.height + separator_count
+        flatten_array = numpy.zeros(self.width * column_length + 1, dtype=bool)
+        flatten_array[:-1].reshape((self.width, column_length))[:, : self.height] = self.array.T
+        change_indices = numpy.flatnonzero(flatten_array[1:] != flatten_array[:-1]) + 1
+        if flatten_array[0]:
+            change_indices = numpy.concatenate(([0], change_indices))
+        change_positions = (self.x + change_indices // column_length) * self.image_height + self.y + change_indices % column_length
+        # 最後のピクセルで終わる区間の終了位置は、長さ0の区間になるので取り除く
+        change_positions = change_positions[change_positions < pixel_count]
+        counts = numpy.diff(change_positions, prepend=0, append=pixel_count).tolist()
+        return {"size": [self.image_height, self.image_width], "counts": counts}
+
+
+def read_binary_image_as_cropped_mask(fp: BinaryIO) -> CroppedMask:
+    """
+    Annofabの塗りつぶし画像を読み込んで、前景の外接矩形の範囲だけのマスクを返します。
+    画素の値の解釈は`annofabapi.segmentation.read_binary_image`と同じです。
+    PNGのデコードでは画像全体を読み込みますが、numpy arrayに変換するのは外接矩形の範囲だけです。
+    """
+    import numpy  # noqa: PLC0415
+    from PIL import Image  # noqa: PLC0415
+
+    with Image.open(fp, formats=("PNG",)) as image:
+        binary_image = image.convert("1")
+    image_width, image_height = binary_image.size
+    bbox = binary_image.getbbox()
+    if bbox is None:
+        return CroppedMask(x=0, y=0, array=numpy.zeros((0, 0), dtype=bool), image_width=image_width, image_height=image_height)
+    x0, y0, _, _ = bbox
+    return CroppedMask(x=x0, y=y0, array=numpy.array(binary_image.crop(bbox), dtype=bool), image_width=image_width, image_height=image_height)
+
+
+def translate_polygon(polygon: list[int], dx: int, dy: int) -> list[int]:
+    """
+    COCO形式のポリゴン（`[x1, y1, x2, y2, ...]`）を平行移動します。
+    """
+    return [v + (dx if index % 2 == 0 else dy) for index, v in enumerate(polygon)]
+
+
+def convert_mask_to_polygons(mask: "numpy.ndarray", *, simplify_tolerance: float = 1.0) -> list[list[int]]:
+    """
+    2値のマスクの輪郭を、COCO形式のポリゴン（`[x1, y1, x2, y2, ...]`）に変換します。
+
+    行ごとの前景ピクセルの連続区間を矩形にして、それらを結合することで輪郭を求めます。
+    ピクセル単位のループを使わないので、4Kのような大きなマスクでも高速に処理できます。
+
+    Args:
+        mask: 2D boolean numpy array(shape=(height, width))
+        simplify_tolerance: ポリゴンを単純化するときの許容誤差（ピクセル単位）。0の場合は同一直線上の頂点のみを取り除きます。
+
+    Returns:
+        ポリゴンのlist。マスクが複数の領域に分かれている場合は、複数のポリゴンを返します。
+        COCOのポリゴンは穴を表現できないので、穴は無視します。
+    """
+    import numpy  # noqa: PLC0415
+    import shapely  # noqa: PLC0415
+
+    height, width = mask.shape
+    padded_mask = numpy.zeros((height, width + 2), dtype=numpy.int8)
+    padded_mask[:, 1:-1] = mask
+    # 行ごとに、前景の連続区間の開始位置と終了位置（終了位置は含まない）を求める
+    diff = numpy.diff(padded_mask, axis=1)
+    start_ys, start_xs = numpy.nonzero(diff == 1)
+    _, end_xs = numpy.nonzero(diff == -1)
+    if len(start_xs) == 0:
+        return []
+
+    geometry = shapely.union_all(shapely.box(start_xs, start_ys, end_xs, start_ys + 1)).simplify(simplify_tolerance)
+    # 頂点の順番を一意にするため、正規化する
+    geometry = shapely.normalize(geometry)
+
+    polygons = []
+    for part in shapely.get_parts(geometry):
+        if not isinstance(part, shapely.Polygon) or part.is_empty:
+            continue
+        # 最後の座標は始点と同じなので除く。単純化しても頂点は元の頂点の部分集合なので、座標は整数になる
+        coordinates = shapely.get_coordinates(part.exterior)[:-1]
+        if len(coordinates) < 3:
+            continue
+        polygons.append(coordinates.astype(numpy.int64).ravel().tolist())
+    return polygons
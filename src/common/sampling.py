@@ -0,0 +1,93 @@
+import hashlib
+import heapq
+from collections.abc import Collection
+from dataclasses import dataclass
+from enum import Enum
+
+
+class SampleStratification(Enum):
+    """
+    サンプリングするときに、どの単位（層）ごとに件数をそろえるか
+    """
+
+    NONE = "none"
+    """層に分けずに、全体から選ぶ"""
+    CATEGORY = "category"
+    """カテゴリ（Annofabのラベル）ごとに選ぶ。複数のカテゴリを含むタスクは、それぞれのカテゴリの候補になる"""
+    PHASE = "phase"
+    """タスクのフェーズごとに選ぶ"""
+
+
+def get_sample_priority(key: str, seed: int) -> int:
+    """
+    キーとシードから、サンプリングの優先度（0以上2**64未満の疑似乱数）を決めます。
+    同じキーとシードなら、実行ごとや走査の順番によらず同じ値になります。
+
+    Args:
+        key: サンプリングの対象を識別するキー。`task_id`と`input_data_id`を連結した文字列など
+        seed: 乱数のシード
+    """
+    return int.from_bytes(hashlib.blake2b(f"{seed}:{key}".encode(), digest_size=8).digest(), "big")
+
+
+class StratifiedReservoirSampler:
+    """
+    層ごとに`sample_size`個ずつ、キーを一様ランダムに選びます（層化リザーバーサンプリング）。
+
+    層ごとに優先度が小さい順に`sample_size`個のキーをヒープで保持するので、メモリ使用量は候補の件数ではなく`sample_size`と層の数に比例します。
+    優先度はキーとシードから決まるので、候補を追加する順番（ZIPファイル内のエントリー順など）によらず同じキーが選ばれます。
+
+    Args:
+        sample_size: 層ごとに選ぶキーの個数
+        seed: 乱数のシード
+
+    Examples:
+        sampler = StratifiedReservoirSampler(sample_size=100, seed=0)
+        sampler.add("task1/input_data1", strata=["car", "bus"])
+        print(sampler.get_sampled_keys())
+    """
+
+    def __init__(self, sample_size: int, seed: int) -> None:
+        if sample_size < 1:
+            raise ValueError(f"sample_size='{sample_size}'は1以上である必要があります。")
+        self.sample_size = sample_size
+        self.seed = seed
+        # 層ごとの、優先度の符号を反転した値とキーのヒープ。先頭が、保持しているキーのうち優先度が最も大きいキー
+        self._heaps_by_stratum: dict[str, list[tuple[int, str]]] = {}
+
+    def add(self, key: str, strata: Collection[str]) -> None:
+        """
+        キーを、`strata`に含まれる層の候補に追加します。
+        """
+        priority = get_sample_priority(key, self.seed)
+        for stratum in strata:
+            heap = self._heaps_by_stratum.setdefault(stratum, [])
+            if len(heap) < self.sample_size:
+                heapq.heappush(heap, (-priority, key))
+            elif priority < -heap[0][0]:
+                heapq.heapreplace(heap, (-priority, key))
+
+    def get_sampled_keys(self) -> set[str]:
+        """
+        いずれかの層で選ばれたキーを返します。
+        """
+        return {key for heap in self._heaps_by_stratum.values() for _, key in heap}
+
+    def get_sample_counts_by_stratum(self) -> dict[str, int]:
+        """
+        層ごとに選ばれたキーの個数を返します。
+        """
+        return {stratum: len(heap) for stratum, heap in sorted(self._heaps_by_stratum.items())}
+
+
+@dataclass(frozen=True)
+class SamplingOptions:
+    """
+    変換対象を一部だけ選んで変換するときの設定
+    """
+
+    sample_size: int
+    """層ごとに選ぶ件数"""
+    stratification: SampleStratification = SampleStratification.NONE
+    seed: int = 0
+    """乱数のシード。同じシードなら同じ変換対象が選ばれる"""
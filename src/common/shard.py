@@ -0,0 +1,29 @@
+import zlib
+
+
+def get_shard_index(key: str, num_shards: int) -> int:
+    """
+    キーから、キーが属するシャードのインデックスを決めます。
+    Pythonの`hash()`は実行ごとに値が変わるので、CRC32を利用しています。
+
+    Args:
+        key: シャードを決めるキー。`input_data_id`や`file_name`など
+        num_shards: シャード数
+
+    Returns:
+        0以上`num_shards`未満のシャードのインデックス
+    """
+    return zlib.crc32(key.encode("utf-8")) % num_shards
+
+
+def validate_shard(num_shards: int, shard_index: int) -> None:
+    """
+    シャード数とシャードのインデックスが正しいか確認します。
+
+    Raises:
+        ValueError: シャード数が1未満、またはシャードのインデックスが範囲外
+    """
+    if num_shards < 1:
+        raise ValueError(f"num_shards='{num_shards}'は1以上である必要があります。")
+    if not 0 <= shard_index < num_shards:
+        raise ValueError(f"shard_index='{shard_index}'は0以上{num_shards}未満である必要があります。")
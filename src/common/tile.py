@@ -0,0 +1,208 @@
+from dataclasses import dataclass
+from pathlib import PurePosixPath
+from typing import TYPE_CHECKING, Any
+
+# bboxのみを変換する場合は、numpyとshapelyをimportしないようにする
+if TYPE_CHECKING:
+    import numpy
+
+
+@dataclass(frozen=True)
+class TilingOptions:
+    """
+    画像をタイルに分割して変換するときの設定
+    """
+
+    tile_size: int
+    """タイルの幅と高さ（ピクセル）。画像がこれより小さい場合は、タイルのサイズは画像のサイズになります。"""
+    overlap: int = 0
+    """隣り合うタイルが重なる幅（ピクセル）"""
+    file_name_format: str = "{stem}_{x}_{y}{suffix}"
+    """
+    タイルのimageの`file_name`のフォーマット。元のimageの`file_name`のディレクトリの下に配置します。
+    `{stem}`（元の`file_name`の拡張子を除いたファイル名）、`{suffix}`（拡張子）、`{x}`, `{y}`（タイルの左上の座標）を指定できます。
+    """
+
+    def __post_init__(self) -> None:
+        if self.tile_size < 1:
+            raise ValueError(f"tile_size='{self.tile_size}'は1以上である必要があります。")
+        if not 0 <= self.overlap < self.tile_size:
+            raise ValueError(f"overlap='{self.overlap}'は0以上、tile_size='{self.tile_size}'未満である必要があります。")
+
+
+def get_tile_origins(length: int, tile_size: int, overlap: int) -> list[int]:
+    """
+    画像の幅または高さを、`tile_size`のタイルで`overlap`だけ重ねながら覆うときの、タイルの開始位置を返します。
+    最後のタイルは画像の端に揃えるので、最後のタイルとその前のタイルは`overlap`より大きく重なる場合があります。
+
+    Args:
+        length: 画像の幅または高さ
+        tile_size: タイルの幅または高さ
+        overlap: 隣り合うタイルが重なる幅
+    """
+    if length <= tile_size:
+        return [0]
+    origins = list(range(0, length - tile_size, tile_size - overlap))
+    origins.append(length - tile_size)
+    return origins
+
+
+@dataclass(frozen=True)
+class TileGrid:
+    """
+    1個の画像を格子状に分割したタイル。タイルのインデックスは、左上から行ごとに振ります。
+    """
+
+    x_origins: list[int]
+    y_origins: list[int]
+    tile_width: int
+    tile_height: int
+
+    @classmethod
+    def from_image_size(cls, image_width: int, image_height: int, options: TilingOptions) -> "TileGrid":
+        return cls(
+            x_origins=get_tile_origins(image_width, options.tile_size, options.overlap),
+            y_origins=get_tile_origins(image_height, options.tile_size, options.overlap),
+            tile_width=min(options.tile_size, image_width),
+            tile_height=min(options.tile_size, image_height),
+        )
+
+    def __len__(self) -> int:
+        return len(self.x_origins) * len(self.y_origins)
+
+    def get_origin(self, tile_index: int) -> tuple[int, int]:
+        """
+        タイルの左上の座標`(x, y)`を返します。
+        """
+        row, column = divmod(tile_index, len(self.x_origins))
+        return self.x_origins[column], self.y_origins[row]
+
+    def find_overlapping_tiles(self, boxes: "numpy.ndarray") -> tuple["numpy.ndarray", "numpy.ndarray"]:
+        """
+        矩形と重なっている（重なる部分の面積が正の）タイルを探します。
+        タイルの開始位置は昇順なので、矩形ごとに重なっているタイルの列と行の範囲を二分探索で求めます。矩形とすべてのタイルの組み合わせは調べません。
+
+        Args:
+            boxes: 矩形の左上と右下の座標`[x0, y0, x1, y1]`の配列（shape=(N, 4)）
+
+        Returns:
+            tuple[0]: 重なっている矩形のインデックス
+            tuple[1]: 重なっているタイルのインデックス。同じ矩形の中では昇順です。
+        """
+        import numpy  # noqa: PLC0415
+
+        x_origins = numpy.asarray(self.x_origins)
+        y_origins = numpy.asarray(self.y_origins)
+        # タイルの開始位置が矩形の右端より小さく、タイルの終了位置が矩形の左端より大きい範囲
+        first_columns = numpy.searchsorted(x_origins + self.tile_width, boxes[:, 0], side="right")
+        last_columns = numpy.searchsorted(x_origins, boxes[:, 2], side="left")
+        first_rows = numpy.searchsorted(y_origins + self.tile_height, boxes[:, 1], side="right")
+        last_rows = numpy.searchsorted(y_origins, boxes[:, 3], side="left")
+        # 幅または高さが0の矩形は、どのタイルとも重ならない
+        column_counts = numpy.where(boxes[:, 0] < boxes[:, 2], numpy.maximum(last_columns - first_columns, 0), 0)
+        row_counts = numpy.where(boxes[:, 1] < boxes[:, 3], numpy.maximum(last_rows - first_rows, 0), 0)
+
+        pair_counts = column_counts * row_counts
+        box_indices = numpy.repeat(numpy.arange(len(boxes)), pair_counts)
+        # 矩形ごとの、重なっているタイルの通し番号（0始まり）
+        pair_offsets = numpy.arange(len(box_indices)) - numpy.repeat(numpy.cumsum(pair_counts) - pair_counts, pair_counts)
+        rows = first_rows[box_indices] + pair_offsets // column_counts[box_indices]
+        columns = first_columns[box_indices] + pair_offsets % column_counts[box_indices]
+        return box_indices, rows * len(x_origins) + columns
+
+    def clip_boxes(self, boxes: "numpy.ndarray", tile_indices: "numpy.ndarray") -> "numpy.ndarray":
+        """
+        `clip_bounding_box_to_image`と同じように、矩形をタイルからはみ出ないように切り取ります。複数の矩形とタイルの組み合わせをまとめて処理します。
+
+        Args:
+            boxes: 矩形の左上と右下の座標`[x0, y0, x1, y1]`の配列（shape=(N, 4)）
+            tile_indices: `boxes`のそれぞれを切り取るタイルのインデックス（shape=(N,)）
+
+        Returns:
+            タイルの左上を原点にした、切り取った矩形の座標`[x0, y0, x1, y1]`の配列（shape=(N, 4)）
+        """
+        import numpy  # noqa: PLC0415
+
+        tile_xs = numpy.asarray(self.x_origins)[tile_indices % len(self.x_origins)]
+        tile_ys = numpy.asarray(self.y_origins)[tile_indices // len(self.x_origins)]
+        origins = numpy.stack([tile_xs, tile_ys, tile_xs, tile_ys], axis=1)
+        return numpy.clip(boxes - origins, 0, [self.tile_width, self.tile_height, self.tile_width, self.tile_height])
+
+
+def create_tile_images(coco_image: dict[str, Any], grid: TileGrid, options: TilingOptions, start_image_id: int) -> list[dict[str, Any]]:
+    """
+    COCOのimageを分割したタイルを、COCOのimagesとして返します。
+    タイルのimageの`tile`には、元のimageの`id`と`file_name`、元の画像でのタイルの左上の座標を格納します。学習時に元の画像からタイルを切り出すのに利用します。
+
+    Args:
+        coco_image: 元のCOCOのimage
+        grid: `coco_image`を分割したタイル
+        options: タイルに分割する設定
+        start_image_id: 最初のタイルのimageの`id`
+    """
+    file_name = PurePosixPath(coco_image["file_name"])
+    tile_images = []
+    for tile_index in range(len(grid)):
+        x, y = grid.get_origin(tile_index)
+        tile_file_name = file_name.with_name(options.file_name_format.format(stem=file_name.stem, suffix=file_name.suffix, x=x, y=y))
+        tile_images.append(
+            {
+                "id": start_image_id + tile_index,
+                "file_name": str(tile_file_name),
+                "width": grid.tile_width,
+                "height": grid.tile_height,
+                "tile": {"source_image_id": coco_image["id"], "source_file_name": coco_image["file_name"], "x": x, "y": y},
+            }
+        )
+    return tile_images
+
+
+def clip_polygon_to_tiles(points: list[dict[str, Any]], grid: TileGrid) -> list[tuple[int, list[list[float]], list[float], float]]:
+    """
+    Annofab形式のポリゴンを、重なっているタイルごとに切り取ります。
+    `clip_polygon_to_image`のように頂点を画像の範囲に寄せると、タイルの境界をまたぐポリゴンの形が変わってしまうので、ポリゴンとタイルの共通部分を求めます。
+    タイルに収まっているポリゴンは、座標を平行移動するだけです。タイルからはみ出ているポリゴンは、重なっているタイルとの共通部分をshapelyでまとめて求めます。
+
+    Returns:
+        重なっているタイルごとの、以下のtupleのlist
+            tuple[0]: タイルのインデックス
+            tuple[1]: タイルの左上を原点にした、COCOの`segmentation`（ポリゴンのlist）。共通部分が複数に分かれる場合は、複数のポリゴンになります。
+            tuple[2]: タイルの左上を原点にした、COCOの`bbox`
+            tuple[3]: 面積
+    """
+    import numpy  # noqa: PLC0415
+    import shapely  # noqa: PLC0415
+
+    coordinates = numpy.array([(point["x"], point["y"]) for point in points], dtype=numpy.float64)
+    bounds = numpy.concatenate([coordinates.min(axis=0), coordinates.max(axis=0)])
+    _, tile_indices = grid.find_overlapping_tiles(bounds[numpy.newaxis, :])
+    polygon = shapely.Polygon(coordinates)
+    if not polygon.is_valid:
+        # 自己交差しているポリゴンは共通部分を求められないので、修正してから切り取る
+        polygon = shapely.make_valid(polygon)
+
+    results = []
+    partial_tile_indices = []
+    for tile_index in tile_indices.tolist():
+        x, y = grid.get_origin(tile_index)
+        if x <= bounds[0] and y <= bounds[1] and bounds[2] <= x + grid.tile_width and bounds[3] <= y + grid.tile_height:
+            # 座標の型（int）を変えないように、元の頂点を平行移動する
+            segmentation = [[v for point in points for v in (point["x"] - x, point["y"] - y)]]
+            min_x, min_y, max_x, max_y = (bounds - (x, y, x, y)).tolist()
+            results.append((tile_index, segmentation, [min_x, min_y, max_x - min_x, max_y - min_y], polygon.area))
+        else:
+            partial_tile_indices.append(tile_index)
+
+    if len(partial_tile_indices) > 0:
+        origins = numpy.array([grid.get_origin(tile_index) for tile_index in partial_tile_indices], dtype=numpy.float64)
+        tile_boxes = shapely.box(origins[:, 0], origins[:, 1], origins[:, 0] + grid.tile_width, origins[:, 1] + grid.tile_height)
+        for tile_index, origin, clipped in zip(partial_tile_indices, origins, shapely.intersection(polygon, tile_boxes), strict=True):
+            clipped_polygons = [geometry for geometry in shapely.get_parts(clipped) if isinstance(geometry, shapely.Polygon) and geometry.area > 0]
+            if len(clipped_polygons) == 0:
+                continue
+            # 閉じたリングの最後の頂点（最初の頂点と同じ）は含めない
+            segmentation = [(numpy.asarray(geometry.exterior.coords)[:-1] - origin).flatten().tolist() for geometry in clipped_polygons]
+            min_x, min_y, max_x, max_y = (shapely.MultiPolygon(clipped_polygons).bounds - numpy.concatenate([origin, origin])).tolist()
+            results.append((tile_index, segmentation, [min_x, min_y, max_x - min_x, max_y - min_y], sum(geometry.area for geometry in clipped_polygons)))
+
+    return sorted(results, key=lambda result: result[0])
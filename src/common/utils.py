@@ -1,6 +1,7 @@
 import inspect
 import logging
 import sys
+import time
 from functools import wraps
 
 from loguru import logger
@@ -30,12 +31,13 @@ class InterceptHandler(logging.Handler):
         logger.opt(depth=depth, exception=record.exc_info).log(level, record.getMessage())
 
 
-def configure_loguru(*, is_verbose: bool) -> None:
+def configure_loguru(*, is_verbose: bool, enqueue: bool = False) -> None:
     """
     loguruの設定を行います。
 
     Args:
         is_verbose: 詳細なログを出力するか
+        enqueue: Trueならば、ログの出力（ファイルへの書き込みなど）をバックグラウンドのスレッドで行います。
     """
 
     logger.remove()
@@ -53,8 +55,50 @@ def configure_loguru(*, is_verbose: bool) -> None:
             "": "INFO",
         }
 
-    logger.add(sys.stderr, diagnose=False, filter=level_per_module)  # type: ignore[arg-type]
-    logger.add(".log/annofab-coco-tools.log", rotation="1 day", diagnose=False, filter=level_per_module)  # type: ignore[arg-type]
+    # loguruは、すべてのハンドラのレベルより低いレベルのログを、メッセージをフォーマットせずに破棄する。
+    # 詳細なログを出力しない場合はハンドラのレベルをINFOにして、DEBUGログのコストをほぼゼロにする。
+    level = "DEBUG" if is_verbose else "INFO"
+    logger.add(sys.stderr, level=level, diagnose=False, filter=level_per_module, enqueue=enqueue)  # type: ignore[arg-type]
+    logger.add(".log/annofab-coco-tools.log", level=level, rotation="1 day", diagnose=False, filter=level_per_module, enqueue=enqueue)  # type: ignore[arg-type]
+
+
+class ProgressLogger:
+    """
+    処理の進捗を、一定時間ごとにまとめてINFOレベルのログに出力します。
+    1件ごとにログを出力するとログ出力のコストが無視できなくなるので、件数が多いループではこのクラスを利用します。
+
+    Args:
+        message: 進捗ログの先頭に出力するメッセージ
+        total: 処理対象の件数。不明な場合はNone
+        interval_seconds: ログを出力する間隔[秒]
+    """
+
+    def __init__(self, message: str, *, total: int | None = None, interval_seconds: float = 10) -> None:
+        self.message = message
+        self.total = total
+        self.interval_seconds = interval_seconds
+        self.count = 0
+        self._start_time = time.monotonic()
+        self._last_logged_time = self._start_time
+
+    def update(self, count: int = 1) -> None:
+        """
+        処理した件数を加算します。前回ログを出力してから`interval_seconds`以上経過していれば、進捗をログに出力します。
+        """
+        self.count += count
+        now = time.monotonic()
+        if now - self._last_logged_time >= self.interval_seconds:
+            self._last_logged_time = now
+            self.log()
+
+    def log(self) -> None:
+        """
+        現在の進捗をログに出力します。
+        """
+        elapsed_seconds = time.monotonic() - self._start_time
+        throughput = self.count / elapsed_seconds if elapsed_seconds > 0 else 0
+        total_message = f"/{self.total}" if self.total is not None else ""
+        logger.info(f"{self.message} :: {self.count}{total_message}件 処理済（{throughput:.1f}件/秒、経過時間{elapsed_seconds:.1f}秒）")
 
 
 def log_exception():  # noqa: ANN201
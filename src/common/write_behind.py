@@ -0,0 +1,84 @@
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from types import TracebackType
+from typing import Self
+
+from loguru import logger
+
+DEFAULT_MAX_PENDING_BYTES = 256 * 1024**2
+"""書き込み待ちのデータの合計サイズの上限のデフォルト値（256MiB）"""
+
+
+class WriteBehindFileWriter:
+    """
+    ファイルの書き込みを、バックグラウンドのスレッドで行います。
+    ネットワークストレージなど書き込みの遅延が大きい場合に、書き込みを待たずに次の処理を始められるようにします。
+
+    書き込み待ちのデータの合計サイズが`max_pending_bytes`を超える場合は、書き込みが終わるまで`submit`がブロックします。
+    書き込みに失敗したファイルは、`submit`に渡した`key`（COCOのimageの`file_name`など）ごとに記録します。
+
+    Args:
+        max_workers: 書き込みに利用するスレッド数
+        max_pending_bytes: 書き込み待ちのデータの合計サイズの上限（バイト）
+
+    Examples:
+        with WriteBehindFileWriter() as writer:
+            writer.submit("a.jpg", [(png_file, png_data), (json_file, json_data)])
+        print(writer.failed_keys)
+    """
+
+    def __init__(self, *, max_workers: int = 4, max_pending_bytes: int = DEFAULT_MAX_PENDING_BYTES) -> None:
+        self.max_pending_bytes = max_pending_bytes
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="write_behind")
+        self._condition = threading.Condition()
+        self._pending_bytes = 0
+        self.succeeded_keys: list[str] = []
+        self.failed_keys: list[str] = []
+
+    def submit(self, key: str, files: list[tuple[Path, bytes]]) -> None:
+        """
+        ファイルの書き込みを予約します。`files`は指定した順番に書き込みます。
+        途中のファイルの書き込みに失敗した場合は、以降のファイルは書き込みません。
+
+        Args:
+            key: 書き込みに失敗したときに記録する値
+            files: 書き込むファイルのパスと中身のlist
+        """
+        size = sum(len(data) for _, data in files)
+        with self._condition:
+            # 1件だけで上限を超える場合も、ほかに書き込み待ちのデータがなければ受け付ける
+            self._condition.wait_for(lambda: self._pending_bytes == 0 or self._pending_bytes + size <= self.max_pending_bytes)
+            self._pending_bytes += size
+        future = self._executor.submit(self._write_files, files)
+        future.add_done_callback(lambda f: self._on_done(key, size, f))
+
+    @staticmethod
+    def _write_files(files: list[tuple[Path, bytes]]) -> None:
+        for path, data in files:
+            path.parent.mkdir(exist_ok=True, parents=True)
+            path.write_bytes(data)
+
+    def _on_done(self, key: str, size: int, future: Future[None]) -> None:
+        exception = future.exception()
+        with self._condition:
+            self._pending_bytes -= size
+            if exception is None:
+                self.succeeded_keys.append(key)
+            else:
+                self.failed_keys.append(key)
+            self._condition.notify_all()
+        if exception is not None:
+            logger.opt(exception=exception).warning(f"'{key}'のファイルの書き込みに失敗しました。")
+
+    def close(self) -> None:
+        """
+        予約したすべてのファイルの書き込みが終わるまで待ちます。
+        """
+        self._executor.shutdown(wait=True)
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(self, exc_type: type[BaseException] | None, exc_value: BaseException | None, traceback: TracebackType | None) -> None:
+        self.close()
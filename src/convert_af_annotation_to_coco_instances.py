@@ -1,25 +1,62 @@
 import collections
-import json
+import math
+import os
 import sys
+import tempfile
 import zipfile
-from collections.abc import Collection
+from argparse import ArgumentParser, Namespace
+from collections.abc import Collection, Iterator
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from enum import Enum
 from pathlib import Path
-from typing import Any
-
-import numpy
-import pycocotools
-import pycocotools.mask
-from annofabapi.parser import SimpleAnnotationParser, lazy_parse_simple_annotation_dir, lazy_parse_simple_annotation_zip
-from annofabapi.segmentation import read_binary_image
-from jsonargparse import ArgumentParser
+from typing import TYPE_CHECKING, Any
+
 from loguru import logger
-from shapely.geometry import Polygon
 
-from src.common.cli import create_parent_parser
-from src.common.utils import configure_loguru, log_exception
+from src.common.cli import add_gzip_compression_level_argument, add_json_indent_argument, add_shard_arguments, create_parent_parser
+from src.common.json_file import DEFAULT_GZIP_COMPRESSION_LEVEL, dumps_json, open_json_for_write, read_json
+from src.common.json_stream import StreamingJsonObjectWriter
+from src.common.mask import CroppedMask, read_binary_image_as_cropped_mask
+from src.common.sampling import SampleStratification, SamplingOptions, StratifiedReservoirSampler
+from src.common.shard import get_shard_index, validate_shard
+from src.common.tile import TileGrid, TilingOptions, clip_polygon_to_tiles, create_tile_images
+from src.common.utils import ProgressLogger, configure_loguru, log_exception
+from src.merge_coco_instances import CocoInstancesMerger, iter_annotations_from_temp_file
+
+# 起動時間を短くするため、numpy, pycocotools, shapely, annofabapiは必要になった時点でimportする
+if TYPE_CHECKING:
+    import numpy
+    from annofabapi.parser import SimpleAnnotationParser
+
+    from src.common.annotation_store import CocoAnnotationStore
+
+
+class CocoSegmentationFormat(Enum):
+    """
+    Annofabの塗りつぶしアノテーションを変換したときの、COCOの`segmentation`の形式
+    """
+
+    RLE = "rle"
+    """Uncompressed RLE（iscrowd=1）"""
+    POLYGON = "polygon"
+    """ポリゴン（iscrowd=0）。ポリゴンで十分に再現できない場合はRLEに変換します。"""
+
+
+class LabelMapOverlapOrder(Enum):
+    """
+    ラベルマップでアノテーションが重なっているときに、どのアノテーションを上に塗るか
+    """
+
+    AREA = "area"
+    """面積が大きい順に塗る。小さいアノテーションが大きいアノテーションに隠れない"""
+    DETAILS = "details"
+    """Annofabのアノテーション（details）の順に塗る。後のアノテーションが上になる"""
+    CATEGORY = "category"
+    """カテゴリのIDの昇順に塗る。IDが大きいカテゴリが上になる"""
 
 
-def get_rle_from_boolean_segmentation_array(boolean_segmentation_array: numpy.ndarray) -> dict[str, Any]:
+def get_rle_from_boolean_segmentation_array(boolean_segmentation_array: "numpy.ndarray") -> dict[str, Any]:
     """
     booleanのセグメンテーションのnumpy arrayから、RLE形式(Uncompressed)の辞書を取得します。
 
@@ -30,22 +67,20 @@ def get_rle_from_boolean_segmentation_array(boolean_segmentation_array: numpy.nd
         RLE形式の辞書
 
     """
+    import numpy  # noqa: PLC0415
+
     height, width = boolean_segmentation_array.shape
-    uint8_segmentation_array = boolean_segmentation_array.astype(numpy.uint8)
-
-    rle_uncompressed = {"size": [height, width], "counts": []}
-    # run-length counting
-    prev = 0
-    cnt = 0
-    for v in uint8_segmentation_array.flatten(order="F"):
-        if v == prev:
-            cnt += 1
-        else:
-            rle_uncompressed["counts"].append(cnt)
-            cnt = 1
-            prev = v  # type: ignore[assignment]
-    rle_uncompressed["counts"].append(cnt)
-    return rle_uncompressed
+    # COCOのRLEは列優先（Fortran order）で、0の個数から数える
+    flatten_array = boolean_segmentation_array.flatten(order="F")
+    if flatten_array.size == 0:
+        return {"size": [height, width], "counts": [0]}
+
+    # 値が変化する位置で区切って、区間の長さを求める
+    change_indices = numpy.flatnonzero(flatten_array[1:] != flatten_array[:-1]) + 1
+    counts = numpy.diff(numpy.concatenate(([0], change_indices, [flatten_array.size]))).tolist()
+    if flatten_array[0]:
+        counts.insert(0, 0)
+    return {"size": [height, width], "counts": counts}
 
 
 def clip_bounding_box_to_image(
@@ -130,6 +165,14 @@ def convert_af_input_data_list_to_coco_images(af_input_data_list: list[dict[str,
     return coco_images
 
 
+def get_af_annotation_key(af_parser: "SimpleAnnotationParser") -> str:
+    """
+    Annofab形式のアノテーションJSONファイルを識別するキー（`{task_id}/{input_data_id}`）を返します。
+    ZIPファイルでも展開したディレクトリでも同じ値になります。
+    """
+    return f"{af_parser.task_id}/{af_parser.input_data_id}"
+
+
 class AnnotationConverterFromAnnofabToCoco:
     """
     Annofabのアノテーション情報をCOCO形式に変換するクラスです。
@@ -146,13 +189,47 @@ class AnnotationConverterFromAnnofabToCoco:
         *,
         target_af_target_labels: Collection[str] | None = None,
         should_clip_annotation_to_image: bool = False,
+        segmentation_format: CocoSegmentationFormat = CocoSegmentationFormat.RLE,
+        polygon_simplify_tolerance: float = 1.0,
+        polygon_min_iou: float = 0.9,
+        label_map_overlap_order: LabelMapOverlapOrder = LabelMapOverlapOrder.AREA,
+        tiling: TilingOptions | None = None,
     ) -> None:
+        """
+        Args:
+            coco_categories: COCO形式のcategories
+            coco_images: COCO形式のimages
+            target_af_target_labels: 変換対象のAnnofabのラベル名（英語）
+            should_clip_annotation_to_image: Trueならば、アノテーションが画像からはみ出さないようにクリッピングします。
+            segmentation_format: 塗りつぶしアノテーションを変換したときの`segmentation`の形式
+            polygon_simplify_tolerance: 塗りつぶしアノテーションをポリゴンに変換するときの、単純化の許容誤差（ピクセル単位）
+            polygon_min_iou: 塗りつぶしアノテーションをポリゴンに変換するときの、元のマスクとのIoUの下限値。IoUがこの値未満の場合は、RLEに変換します。
+            label_map_overlap_order: ラベルマップでアノテーションが重なっているときに、どのアノテーションを上に塗るか
+            tiling: 指定した場合は、画像をタイルに分割して、タイルをCOCOのimageとするannotationsに変換します。
+                アノテーションはタイルからはみ出ないように切り取るので、`should_clip_annotation_to_image`は参照しません。
+        """
         self.category_ids_by_name: dict[str, int] = {category["name"]: category["id"] for category in coco_categories}
         self.images_by_file_name: dict[str, dict[str, Any]] = {image["file_name"]: image for image in coco_images}
         self.should_clip_annotation_to_image = should_clip_annotation_to_image
+        self.segmentation_format = segmentation_format
+        self.polygon_simplify_tolerance = polygon_simplify_tolerance
+        self.polygon_min_iou = polygon_min_iou
+        self.label_map_overlap_order = label_map_overlap_order
 
         self.target_af_target_labels = set(target_af_target_labels) if target_af_target_labels is not None else None
 
+        self.tiling = tiling
+        self.tile_images: list[dict[str, Any]] | None = None
+        """`tiling`を指定した場合の、`coco_images`を分割したタイルのimages。`id`は`coco_images`の順番に1から振ります。"""
+        self._tile_images_by_source_image_id: dict[int, list[dict[str, Any]]] = {}
+        if tiling is not None:
+            self.tile_images = []
+            for coco_image in coco_images:
+                grid = TileGrid.from_image_size(coco_image["width"], coco_image["height"], tiling)
+                tile_images = create_tile_images(coco_image, grid, tiling, start_image_id=len(self.tile_images) + 1)
+                self._tile_images_by_source_image_id[coco_image["id"]] = tile_images
+                self.tile_images.extend(tile_images)
+
     def convert_af_bounding_box_detail(
         self, af_detail: dict[str, Any], coco_image: dict[str, Any], coco_annotation_id: int, *, task_id: str | None = None, input_data_id: str | None = None
     ) -> dict[str, Any]:
@@ -179,12 +256,21 @@ class AnnotationConverterFromAnnofabToCoco:
                 image_height,
             )
             if new_left_top != left_top or new_right_bottom != right_bottom:
+                # 変換処理のホットパスなので、DEBUGログを出力しない場合はメッセージをフォーマットしないようにする
                 logger.debug(
-                    f"bboxが画像からはみ出ていたため修正しました。 :: "
-                    f"task_id='{task_id}', input_data_id='{input_data_id}', annotation_id='{annotation_id}', label='{label}', "
-                    f"coco_image_id='{coco_image_id}', coco_annotation_id='{coco_annotation_id}' :: "
-                    f"original_left_top={original_left_top}, original_right_bottom={original_right_bottom}, "
-                    f"new_left_top={new_left_top}, new_right_bottom={new_right_bottom}"
+                    "bboxが画像からはみ出ていたため修正しました。 :: "
+                    "task_id='{}', input_data_id='{}', annotation_id='{}', label='{}', coco_image_id='{}', coco_annotation_id='{}' :: "
+                    "original_left_top={}, original_right_bottom={}, new_left_top={}, new_right_bottom={}",
+                    task_id,
+                    input_data_id,
+                    annotation_id,
+                    label,
+                    coco_image_id,
+                    coco_annotation_id,
+                    original_left_top,
+                    original_right_bottom,
+                    new_left_top,
+                    new_right_bottom,
                 )
             left_top = new_left_top
             right_bottom = new_right_bottom
@@ -225,14 +311,24 @@ class AnnotationConverterFromAnnofabToCoco:
                 image_height,
             )
             if new_points != original_points:
+                # 変換処理のホットパスなので、DEBUGログを出力しない場合はメッセージをフォーマットしないようにする
                 logger.debug(
-                    f"polygonが画像からはみ出ていたため修正しました。 :: "
-                    f"task_id='{task_id}', input_data_id='{input_data_id}', annotation_id='{annotation_id}', label='{label}', "
-                    f"coco_image_id='{coco_image_id}', coco_annotation_id='{coco_annotation_id}' :: "
-                    f"original_points={original_points}, new_points={new_points}"
+                    "polygonが画像からはみ出ていたため修正しました。 :: "
+                    "task_id='{}', input_data_id='{}', annotation_id='{}', label='{}', coco_image_id='{}', coco_annotation_id='{}' :: "
+                    "original_points={}, new_points={}",
+                    task_id,
+                    input_data_id,
+                    annotation_id,
+                    label,
+                    coco_image_id,
+                    coco_annotation_id,
+                    original_points,
+                    new_points,
                 )
             points = new_points
 
+        from shapely.geometry import Polygon  # noqa: PLC0415
+
         segmentation = [[v for p in points for v in (p["x"], p["y"])]]
         polygon = Polygon([(p["x"], p["y"]) for p in points])
         min_x, min_y, max_x, max_y = polygon.bounds
@@ -247,32 +343,144 @@ class AnnotationConverterFromAnnofabToCoco:
             "iscrowd": 0,
         }
 
-    def convert_af_segmentation_detail(self, af_detail: dict[str, Any], coco_image: dict[str, Any], coco_annotation_id: int, af_parser: SimpleAnnotationParser) -> dict[str, Any]:
+    def convert_mask_to_polygon_annotation(self, mask: CroppedMask, coco_image: dict[str, Any], coco_annotation_id: int, category_id: int) -> tuple[dict[str, Any] | None, float]:
         """
-        Annofabの塗りつぶしアノテーションのdetail情報をCOCO形式（Uncompressed RLE）に変換します。
+        塗りつぶしアノテーションのマスクを、COCO形式のポリゴン（iscrowd=0）のannotationに変換します。
+        IoUなどは、マスクの外接矩形の周囲1ピクセルを含む範囲だけで計算します。
+
+        Returns:
+            tuple[0]: COCO形式のannotation。ポリゴンで元のマスクを十分に再現できない場合（IoUが`polygon_min_iou`未満の場合）はNone
+            tuple[1]: ポリゴンと元のマスクとのIoU
         """
-        assert af_detail["data"]["_type"] == "Segmentation"
-        annotation_id = af_detail["annotation_id"]
-        label = af_detail["label"]
+        import numpy  # noqa: PLC0415
+        import pycocotools.mask  # noqa: PLC0415
+
+        from src.common.mask import convert_mask_to_polygons, translate_polygon  # noqa: PLC0415
+
+        mask = mask.clip(coco_image["width"], coco_image["height"])
+        local_polygons = convert_mask_to_polygons(mask.array, simplify_tolerance=self.polygon_simplify_tolerance)
+        if len(local_polygons) == 0:
+            return None, 0.0
+
+        # ポリゴンをラスタライズすると外接矩形の境界のピクセルも塗られることがあるので、周囲1ピクセルを含めた範囲で比較する
+        x0, y0 = max(mask.x - 1, 0), max(mask.y - 1, 0)
+        x1, y1 = min(mask.x + mask.width + 1, coco_image["width"]), min(mask.y + mask.height + 1, coco_image["height"])
+        window = numpy.zeros((y1 - y0, x1 - x0), dtype=numpy.uint8, order="F")
+        window[mask.y - y0 : mask.y - y0 + mask.height, mask.x - x0 : mask.x - x0 + mask.width] = mask.array
+        window_polygons = [translate_polygon(polygon, mask.x - x0, mask.y - y0) for polygon in local_polygons]
+
+        polygon_rle = pycocotools.mask.merge(pycocotools.mask.frPyObjects(window_polygons, y1 - y0, x1 - x0))
+        mask_rle = pycocotools.mask.encode(window)
+        iou = float(pycocotools.mask.iou([polygon_rle], [mask_rle], [0])[0][0])
+        if iou < self.polygon_min_iou:
+            return None, iou
+
+        bbox_x, bbox_y, bbox_width, bbox_height = pycocotools.mask.toBbox(polygon_rle).tolist()
+        return {
+            "id": coco_annotation_id,
+            "image_id": coco_image["id"],
+            "category_id": category_id,
+            "bbox": [bbox_x + x0, bbox_y + y0, bbox_width, bbox_height],
+            "segmentation": [translate_polygon(polygon, mask.x, mask.y) for polygon in local_polygons],
+            "area": float(pycocotools.mask.area(polygon_rle)),
+            "iscrowd": 0,
+        }, iou
 
+    def convert_af_segmentation_detail(self, af_detail: dict[str, Any], coco_image: dict[str, Any], coco_annotation_id: int, af_parser: "SimpleAnnotationParser") -> dict[str, Any]:
+        """
+        Annofabの塗りつぶしアノテーションのdetail情報をCOCO形式に変換します。
+        `segmentation_format`がRLEの場合、またはポリゴンで十分に再現できない場合は、Uncompressed RLEに変換します。
+        """
+        return self.convert_af_segmentation_details([af_detail], coco_image, [coco_annotation_id], af_parser)[0]
+
+    def convert_af_segmentation_details(
+        self,
+        af_details: list[dict[str, Any]],
+        coco_image: dict[str, Any],
+        coco_annotation_ids: list[int],
+        af_parser: "SimpleAnnotationParser",
+        *,
+        segmentation_masks: dict[str, CroppedMask] | None = None,
+    ) -> list[dict[str, Any]]:
+        """
+        1個の入力データに含まれる、Annofabの塗りつぶしアノテーションのdetail情報をまとめてCOCO形式に変換します。
+        塗りつぶし画像は外接矩形の範囲だけのマスクとして読み込むので、処理時間は画像のサイズではなく物体のサイズに比例します。
+
+        Args:
+            af_details: Annofabの塗りつぶしアノテーションのdetail情報のlist
+            coco_image: COCO形式のimage
+            coco_annotation_ids: `af_details`のそれぞれに割り当てるCOCOのannotation_id
+            af_parser: Annofab形式のアノテーションのパーサー。塗りつぶし画像を読み込むのに利用します。
+            segmentation_masks: 読み込んだ塗りつぶし画像のマスクを、annotation_idをキーにして格納するdict。`_read_segmentation_mask`を参照してください。
+
+        Returns:
+            `af_details`と同じ順番の、COCO形式のannotationのlist
+        """
+        coco_annotations = []
+        for af_detail, coco_annotation_id in zip(af_details, coco_annotation_ids, strict=True):
+            assert af_detail["data"]["_type"] == "Segmentation"
+            mask = self._read_segmentation_mask(af_detail, af_parser, segmentation_masks)
+            coco_annotations.append(self._convert_mask_to_coco_annotation(mask, af_detail, coco_image, coco_annotation_id, af_parser))
+        return coco_annotations
+
+    @staticmethod
+    def _read_segmentation_mask(af_detail: dict[str, Any], af_parser: "SimpleAnnotationParser", segmentation_masks: dict[str, CroppedMask] | None) -> CroppedMask:
+        """
+        塗りつぶしアノテーションの画像を、外接矩形の範囲だけのマスクとして読み込みます。
+
+        Args:
+            segmentation_masks: 指定した場合は、読み込んだマスクをannotation_idをキーにして格納します。
+                すでに格納されているマスクは、画像をデコードせずにそのまま返します。
+                COCO形式への変換とラベルマップの作成で、同じ塗りつぶし画像を2回デコードしないために利用します。
+        """
+        annotation_id = af_detail["annotation_id"]
+        if segmentation_masks is not None and annotation_id in segmentation_masks:
+            return segmentation_masks[annotation_id]
         with af_parser.open_outer_file(annotation_id) as f:
-            boolean_segmentation_array = read_binary_image(f)
+            mask = read_binary_image_as_cropped_mask(f)
+        if segmentation_masks is not None:
+            segmentation_masks[annotation_id] = mask
+        return mask
 
-        uncompressed_rle = get_rle_from_boolean_segmentation_array(boolean_segmentation_array)
-        compressed_rle = pycocotools.mask.frPyObjects(uncompressed_rle, coco_image["height"], coco_image["width"])
+    def _convert_mask_to_coco_annotation(
+        self, mask: CroppedMask, af_detail: dict[str, Any], coco_image: dict[str, Any], coco_annotation_id: int, af_parser: "SimpleAnnotationParser"
+    ) -> dict[str, Any]:
+        """
+        塗りつぶしアノテーションのマスクを、`segmentation_format`に従ってCOCO形式のannotationに変換します。
+        """
+        category_id = self.category_ids_by_name[af_detail["label"]]
+        if self.segmentation_format == CocoSegmentationFormat.POLYGON:
+            coco_annotation, iou = self.convert_mask_to_polygon_annotation(mask, coco_image, coco_annotation_id, category_id)
+            if coco_annotation is not None:
+                return coco_annotation
+            logger.debug(
+                "塗りつぶしアノテーションをポリゴンで十分に再現できないので、RLEに変換します。 :: task_id='{}', input_data_id='{}', annotation_id='{}', iou={:.3f}",
+                af_parser.task_id,
+                af_parser.input_data_id,
+                af_detail["annotation_id"],
+                iou,
+            )
 
         return {
             "id": coco_annotation_id,
             "image_id": coco_image["id"],
-            "category_id": self.category_ids_by_name[label],
-            "bbox": pycocotools.mask.toBbox(compressed_rle).tolist(),
-            "segmentation": uncompressed_rle,
-            "area": float(pycocotools.mask.area(compressed_rle)),
+            "category_id": category_id,
+            "bbox": mask.get_bbox(),
+            "segmentation": mask.to_uncompressed_rle(),
+            "area": float(mask.get_area()),
             # COCOのフォーマットに従い、RLE形式のときはiscrowdは1にする
             "iscrowd": 1,
         }
 
-    def convert_af_annotation(self, af_annotation: dict[str, Any], af_parser: SimpleAnnotationParser, coco_image: dict[str, Any], coco_start_annotation_id: int) -> tuple[list[dict[str, Any]], int]:
+    def convert_af_annotation(
+        self,
+        af_annotation: dict[str, Any],
+        af_parser: "SimpleAnnotationParser",
+        coco_image: dict[str, Any],
+        coco_start_annotation_id: int,
+        *,
+        segmentation_masks: dict[str, CroppedMask] | None = None,
+    ) -> tuple[list[dict[str, Any]], int]:
         """
         Annofab形式の1個のJSONファイルに格納されているアノテーション情報を、COCO形式の複数個のアノテーションに変換します。
 
@@ -281,6 +489,7 @@ class AnnotationConverterFromAnnofabToCoco:
             af_parser: Annofab形式のアノテーションのパーサー。塗りつぶしアノテーションを読み込むのに利用する。
             coco_image: COCO形式のimage
             coco_start_annotation_id: COCO形式のannotation_idの開始番号
+            segmentation_masks: 読み込んだ塗りつぶし画像のマスクを、annotation_idをキーにして格納するdict。`_read_segmentation_mask`を参照してください。
 
         Returns:
             tuple[0]: COCO形式のアノテーションのリスト
@@ -291,48 +500,319 @@ class AnnotationConverterFromAnnofabToCoco:
         af_details = af_annotation["details"]
         task_id = af_annotation["task_id"]
         input_data_id = af_annotation["input_data_id"]
-        coco_annotations = []
+        coco_annotations: list[dict[str, Any] | None] = []
+        # 塗りつぶしアノテーションは、最後にまとめて変換する
+        segmentation_indices: list[int] = []
+        segmentation_af_details: list[dict[str, Any]] = []
+        segmentation_coco_annotation_ids: list[int] = []
         coco_annotation_id = coco_start_annotation_id
         for af_detail in af_details:
             if self.target_af_target_labels is not None and af_detail["label"] not in self.target_af_target_labels:
                 continue
 
+            coco_annotation: dict[str, Any] | None
             match af_detail["data"]["_type"]:
                 case "BoundingBox":
                     coco_annotation = self.convert_af_bounding_box_detail(af_detail, coco_image, coco_annotation_id, task_id=task_id, input_data_id=input_data_id)
                 case "Points":
                     coco_annotation = self.convert_af_polygon_detail(af_detail, coco_image, coco_annotation_id, task_id=task_id, input_data_id=input_data_id)
                 case "Segmentation":
-                    coco_annotation = self.convert_af_segmentation_detail(af_detail, coco_image, coco_annotation_id, af_parser)
+                    coco_annotation = None
+                    segmentation_indices.append(len(coco_annotations))
+                    segmentation_af_details.append(af_detail)
+                    segmentation_coco_annotation_ids.append(coco_annotation_id)
                 case _:
                     continue
 
             coco_annotations.append(coco_annotation)
             coco_annotation_id += 1
-        return coco_annotations, coco_annotation_id
 
-    def convert_af_annotation_path(
+        if len(segmentation_af_details) > 0:
+            segmentation_coco_annotations = self.convert_af_segmentation_details(
+                segmentation_af_details, coco_image, segmentation_coco_annotation_ids, af_parser, segmentation_masks=segmentation_masks
+            )
+            for index, segmentation_coco_annotation in zip(segmentation_indices, segmentation_coco_annotations, strict=True):
+                coco_annotations[index] = segmentation_coco_annotation
+
+        return coco_annotations, coco_annotation_id  # type: ignore[return-value]
+
+    def _clip_bounding_boxes_to_tiles(
+        self, bounding_boxes: list[list[int]], grid: TileGrid, tile_images: list[dict[str, Any]], af_details: list[dict[str, Any]], detail_indices: list[int]
+    ) -> Iterator[tuple[int, int, dict[str, Any]]]:
+        """
+        Annofabの矩形（`[x0, y0, x1, y1]`）をまとめて、重なっているタイルごとに切り取ります。
+
+        Yields:
+            tuple[0]: タイルのインデックス
+            tuple[1]: `bounding_boxes`でのインデックス
+            tuple[2]: タイルに含まれる部分のCOCO形式のannotation。`id`は0です。
+        """
+        import numpy  # noqa: PLC0415
+
+        if len(bounding_boxes) == 0:
+            return
+        boxes = numpy.array(bounding_boxes)
+        box_indices, tile_indices = grid.find_overlapping_tiles(boxes)
+        clipped_boxes = grid.clip_boxes(boxes[box_indices], tile_indices)
+        for box_index, tile_index, (x0, y0, x1, y1) in zip(box_indices.tolist(), tile_indices.tolist(), clipped_boxes.tolist(), strict=True):
+            yield (
+                tile_index,
+                box_index,
+                {
+                    "id": 0,
+                    "image_id": tile_images[tile_index]["id"],
+                    "category_id": self.category_ids_by_name[af_details[detail_indices[box_index]]["label"]],
+                    "bbox": [x0, y0, x1 - x0, y1 - y0],
+                    "segmentation": [[x0, y0, x1, y0, x1, y1, x0, y1]],
+                    "area": (x1 - x0) * (y1 - y0),
+                    "iscrowd": 0,
+                },
+            )
+
+    def _slice_mask_to_tiles(
+        self, af_detail: dict[str, Any], af_parser: "SimpleAnnotationParser", coco_image: dict[str, Any], grid: TileGrid, tile_images: list[dict[str, Any]]
+    ) -> Iterator[tuple[int, dict[str, Any]]]:
+        """
+        塗りつぶしアノテーションのマスクを、重なっているタイルごとにスライスします。
+
+        Yields:
+            tuple[0]: タイルのインデックス
+            tuple[1]: タイルに含まれる部分のCOCO形式のannotation。`id`は0です。
+        """
+        import numpy  # noqa: PLC0415
+
+        with af_parser.open_outer_file(af_detail["annotation_id"]) as f:
+            mask = read_binary_image_as_cropped_mask(f).clip(coco_image["width"], coco_image["height"])
+        if mask.array.size == 0:
+            return
+        _, tile_indices = grid.find_overlapping_tiles(numpy.array([[mask.x, mask.y, mask.x + mask.width, mask.y + mask.height]]))
+        for tile_index in tile_indices.tolist():
+            x, y = grid.get_origin(tile_index)
+            tile_mask = mask.crop(x, y, grid.tile_width, grid.tile_height)
+            if tile_mask.array.size == 0:
+                continue
+            yield tile_index, self._convert_mask_to_coco_annotation(tile_mask, af_detail, tile_images[tile_index], 0, af_parser)
+
+    def convert_af_annotation_to_tiles(
+        self, af_annotation: dict[str, Any], af_parser: "SimpleAnnotationParser", coco_image: dict[str, Any], coco_start_annotation_id: int
+    ) -> tuple[list[tuple[dict[str, Any], list[dict[str, Any]]]], int]:
+        """
+        Annofab形式の1個のJSONファイルに格納されているアノテーションを、画像を`tiling`で分割したタイルごとに、COCO形式のannotationsに変換します。
+        矩形はまとめてタイルの範囲に切り取り、ポリゴンはタイルとの共通部分を求めます。
+        塗りつぶしアノテーションは外接矩形の範囲のマスクをタイルごとにスライスするので、画像全体のサイズの配列は作成しません。
+
+        Args:
+            af_annotation: Annofab形式のアノテーション情報
+            af_parser: Annofab形式のアノテーションのパーサー。塗りつぶしアノテーションを読み込むのに利用する。
+            coco_image: 分割する前のCOCO形式のimage
+            coco_start_annotation_id: COCO形式のannotation_idの開始番号
+
+        Returns:
+            tuple[0]: タイルのimageと、タイルに含まれるCOCO形式のannotationsのtupleのlist。アノテーションを含まないタイルも含みます。
+                annotationsは、タイルの順番、Annofabのアノテーション（details）の順番に並んでいます。
+            tuple[1]: 次のアノテーションID
+        """
+        assert self.tiling is not None
+        grid = TileGrid.from_image_size(coco_image["width"], coco_image["height"], self.tiling)
+        tile_images = self._tile_images_by_source_image_id[coco_image["id"]]
+        # タイルごとの、(detailsでの順番, COCO形式のannotation)のlist。annotationの`id`は最後に振る
+        annotations_by_tile: list[list[tuple[int, dict[str, Any]]]] = [[] for _ in range(len(grid))]
+        bounding_box_detail_indices: list[int] = []
+        bounding_boxes: list[list[int]] = []
+        for detail_index, af_detail in enumerate(af_annotation["details"]):
+            if self.target_af_target_labels is not None and af_detail["label"] not in self.target_af_target_labels:
+                continue
+
+            data = af_detail["data"]
+            match data["_type"]:
+                case "BoundingBox":
+                    # 矩形は、最後にまとめて切り取る
+                    bounding_box_detail_indices.append(detail_index)
+                    bounding_boxes.append([data["left_top"]["x"], data["left_top"]["y"], data["right_bottom"]["x"], data["right_bottom"]["y"]])
+                case "Points":
+                    for tile_index, segmentation, bbox, area in clip_polygon_to_tiles(data["points"], grid):
+                        coco_annotation = {
+                            "id": 0,
+                            "image_id": tile_images[tile_index]["id"],
+                            "category_id": self.category_ids_by_name[af_detail["label"]],
+                            "bbox": bbox,
+                            "segmentation": segmentation,
+                            "area": area,
+                            "iscrowd": 0,
+                        }
+                        annotations_by_tile[tile_index].append((detail_index, coco_annotation))
+                case "Segmentation":
+                    for tile_index, coco_annotation in self._slice_mask_to_tiles(af_detail, af_parser, coco_image, grid, tile_images):
+                        annotations_by_tile[tile_index].append((detail_index, coco_annotation))
+
+        for tile_index, box_index, coco_annotation in self._clip_bounding_boxes_to_tiles(bounding_boxes, grid, tile_images, af_annotation["details"], bounding_box_detail_indices):
+            annotations_by_tile[tile_index].append((bounding_box_detail_indices[box_index], coco_annotation))
+
+        result = []
+        coco_annotation_id = coco_start_annotation_id
+        for tile_image, tile_annotations in zip(tile_images, annotations_by_tile, strict=True):
+            coco_annotations = []
+            for _, coco_annotation in sorted(tile_annotations, key=lambda item: item[0]):
+                coco_annotation["id"] = coco_annotation_id
+                coco_annotation_id += 1
+                coco_annotations.append(coco_annotation)
+            result.append((tile_image, coco_annotations))
+        return result, coco_annotation_id
+
+    def _get_label_map_dtype(self) -> str:
+        """
+        ラベルマップのdtypeを返します。カテゴリのIDがラベルマップのピクセル値として表現できない場合はValueErrorを発生させます。
+        """
+        category_ids = self.category_ids_by_name.values()
+        if 0 in category_ids:
+            raise ValueError("ラベルマップではピクセル値0はアノテーションが存在しないことを表すので、IDが0のカテゴリは利用できません。")
+        max_category_id = max(category_ids, default=0)
+        if max_category_id > 65535:
+            raise ValueError(f"カテゴリのIDが大きすぎるため、ラベルマップ（uint16）で表現できません。 :: max_category_id={max_category_id}")
+        return "uint8" if max_category_id <= 255 else "uint16"
+
+    def _create_label_map_layer(  # noqa: PLR0911
+        self, af_detail: dict[str, Any], af_parser: "SimpleAnnotationParser", image_width: int, image_height: int, segmentation_masks: dict[str, CroppedMask] | None
+    ) -> tuple[int, int, "numpy.ndarray"] | None:
+        """
+        Annofabの1個のアノテーションについて、画像内の外接矩形の範囲だけのマスクを作成します。
+
+        Returns:
+            tuple[0]: 外接矩形の左上のy座標
+            tuple[1]: 外接矩形の左上のx座標
+            tuple[2]: 外接矩形の範囲のマスク
+            画像内に塗る部分がない場合、または対応していない種類のアノテーションの場合はNone
+        """
+        import numpy  # noqa: PLC0415
+        import pycocotools.mask  # noqa: PLC0415
+
+        data = af_detail["data"]
+        match data["_type"]:
+            case "BoundingBox":
+                x0, y0 = max(math.floor(data["left_top"]["x"]), 0), max(math.floor(data["left_top"]["y"]), 0)
+                x1, y1 = min(math.ceil(data["right_bottom"]["x"]), image_width), min(math.ceil(data["right_bottom"]["y"]), image_height)
+                if x1 <= x0 or y1 <= y0:
+                    return None
+                return y0, x0, numpy.ones((y1 - y0, x1 - x0), dtype=bool)
+
+            case "Points":
+                points = data["points"]
+                # 頂点が2個以下のポリゴンは、pycocotoolsがbboxとみなしてしまうので除く
+                if len(points) < 3:
+                    return None
+                xs = [point["x"] for point in points]
+                ys = [point["y"] for point in points]
+                x0, y0 = max(math.floor(min(xs)), 0), max(math.floor(min(ys)), 0)
+                x1, y1 = min(math.ceil(max(xs)) + 1, image_width), min(math.ceil(max(ys)) + 1, image_height)
+                if x1 <= x0 or y1 <= y0:
+                    return None
+                # 外接矩形の左上を原点にしてラスタライズする
+                polygon = [v for x, y in zip(xs, ys, strict=True) for v in (x - x0, y - y0)]
+                return y0, x0, pycocotools.mask.decode(pycocotools.mask.frPyObjects([polygon], y1 - y0, x1 - x0))[:, :, 0].view(bool)
+
+            case "Segmentation":
+                mask = self._read_segmentation_mask(af_detail, af_parser, segmentation_masks).clip(image_width, image_height)
+                if mask.array.size == 0:
+                    return None
+                return mask.y, mask.x, mask.array
+
+            case _:
+                return None
+
+    def create_label_map(
+        self, af_annotation: dict[str, Any], af_parser: "SimpleAnnotationParser", coco_image: dict[str, Any], *, segmentation_masks: dict[str, CroppedMask] | None = None
+    ) -> "numpy.ndarray":
+        """
+        Annofab形式の1個のJSONファイルに格納されているアノテーションを、ピクセル値がCOCOのカテゴリのIDであるラベルマップに合成します。
+        アノテーションごとに外接矩形の範囲だけのマスクを作成して、配列のスライスへの代入で塗り重ねます。
+        重なっている部分は、`label_map_overlap_order`に従って後に塗ったアノテーションのカテゴリになります。
+
+        Args:
+            af_annotation: Annofab形式のアノテーション情報
+            af_parser: Annofab形式のアノテーションのパーサー。塗りつぶし画像を読み込むのに利用します。
+            coco_image: COCO形式のimage。ラベルマップのサイズに利用します。
+            segmentation_masks: 読み込んだ塗りつぶし画像のマスクを、annotation_idをキーにして格納するdict。`_read_segmentation_mask`を参照してください。
+
+        Returns:
+            2次元配列(shape=(height, width))。アノテーションが存在しないピクセルは0です。
+            dtypeは、カテゴリのIDの最大値が255以下ならuint8、それ以外はuint16です。
+        """
+        import numpy  # noqa: PLC0415
+
+        height = coco_image["height"]
+        width = coco_image["width"]
+        # (塗る順番, category_id, 外接矩形の左上のy座標, 外接矩形の左上のx座標, 外接矩形の範囲のマスク)
+        layers: list[tuple[tuple[int, int], int, int, int, numpy.ndarray]] = []
+        for index, af_detail in enumerate(af_annotation["details"]):
+            if self.target_af_target_labels is not None and af_detail["label"] not in self.target_af_target_labels:
+                continue
+            layer = self._create_label_map_layer(af_detail, af_parser, width, height, segmentation_masks)
+            if layer is None:
+                continue
+
+            y0, x0, mask = layer
+            category_id = self.category_ids_by_name[af_detail["label"]]
+            match self.label_map_overlap_order:
+                case LabelMapOverlapOrder.AREA:
+                    order = (-int(numpy.count_nonzero(mask)), index)
+                case LabelMapOverlapOrder.CATEGORY:
+                    order = (category_id, index)
+                case _:
+                    order = (index, index)
+            layers.append((order, category_id, y0, x0, mask))
+
+        label_map = numpy.zeros((height, width), dtype=self._get_label_map_dtype())
+        for _, category_id, y0, x0, mask in sorted(layers, key=lambda layer: layer[0]):
+            label_map[y0 : y0 + mask.shape[0], x0 : x0 + mask.shape[1]][mask] = category_id
+        return label_map
+
+    def write_label_map(self, label_map: "numpy.ndarray", coco_image: dict[str, Any], label_map_dir: Path) -> Path:
+        """
+        ラベルマップを`{label_map_dir}/{file_nameの拡張子をpngにしたパス}`に書き出します。
+
+        Returns:
+            書き出したPNGファイルのパス
+        """
+        from src.common.image import write_label_map_png  # noqa: PLC0415
+
+        output_file = label_map_dir / Path(coco_image["file_name"]).with_suffix(".png")
+        output_file.parent.mkdir(exist_ok=True, parents=True)
+        with output_file.open("wb") as f:
+            write_label_map_png(label_map, f)
+        return output_file
+
+    def _iter_target_af_annotations(
         self,
         af_annotation_zip_or_dir: Path,
         *,
-        target_task_ids: Collection[str] | None = None,
-        target_input_data_ids: Collection[str] | None = None,
+        target_task_ids: Collection[str] | None,
+        target_input_data_ids: Collection[str] | None,
         target_task_phase: str | None,
         target_task_status: str | None,
-    ) -> list[dict[str, Any]]:
+        num_shards: int,
+        shard_index: int,
+        sampling: SamplingOptions | None = None,
+        progress_message: str = "Annofab形式のアノテーションJSONファイルを、COCO形式に変換中",
+    ) -> Iterator[tuple[dict[str, Any], "SimpleAnnotationParser"]]:
         """
-        AnnofabからダウンロードしたアノテーションZIPまたは展開したディレクトリを、COCO形式のアノテーションに変換します。
-
-        Args:
-            af_annotation_zip_or_dir: Annofab形式のアノテーションZIPファイルまたはそれを展開したディレクトリのパス
-            target_task_ids: 変換対象のタスクのID
-            target_input_data_ids: 変換対象の入力データのID
-            target_task_phase: 変換対象のタスクのフェーズ
-            target_task_status: 変換対象のタスクのステータス
-
-
+        変換対象のアノテーションJSONファイルを読み込んで、アノテーション情報とパーサーを返します。
+        `sampling`を指定した場合は、先にアノテーションJSONファイルだけを走査して変換対象を選んでから、選んだタスクのみを返します。
         """
-        coco_start_annotation_id = 1
+        validate_shard(num_shards, shard_index)
+        from annofabapi.parser import lazy_parse_simple_annotation_dir, lazy_parse_simple_annotation_zip  # noqa: PLC0415
+
+        sampled_keys: set[str] | None = None
+        if sampling is not None:
+            sampled_keys = self._sample_af_annotation_keys(
+                af_annotation_zip_or_dir,
+                sampling,
+                target_task_ids=target_task_ids,
+                target_input_data_ids=target_input_data_ids,
+                target_task_phase=target_task_phase,
+                target_task_status=target_task_status,
+                num_shards=num_shards,
+                shard_index=shard_index,
+            )
 
         if zipfile.is_zipfile(af_annotation_zip_or_dir):
             iter_af_annotation_parser = lazy_parse_simple_annotation_zip(af_annotation_zip_or_dir)
@@ -341,14 +821,18 @@ class AnnotationConverterFromAnnofabToCoco:
         else:
             raise ValueError(f"'{af_annotation_zip_or_dir}'はZIPファイルでもディレクトリでもありません。")
 
-        coco_annotations = []
-
-        success_count = 0
+        progress_logger = ProgressLogger(progress_message)
         for af_parser in iter_af_annotation_parser:
+            progress_logger.update()
             if target_task_ids is not None and af_parser.task_id not in target_task_ids:
                 continue
             if target_input_data_ids is not None and af_parser.input_data_id not in target_input_data_ids:
                 continue
+            if num_shards > 1 and get_shard_index(af_parser.input_data_id, num_shards) != shard_index:
+                continue
+            # 選ばれなかったタスクは、アノテーションJSONファイルも読み込まない
+            if sampled_keys is not None and get_af_annotation_key(af_parser) not in sampled_keys:
+                continue
 
             af_annotation = af_parser.load_json()
             if target_task_phase is not None and af_annotation["task_phase"] != target_task_phase:
@@ -356,21 +840,472 @@ class AnnotationConverterFromAnnofabToCoco:
             if target_task_status is not None and af_annotation["task_status"] != target_task_status:
                 continue
 
+            yield af_annotation, af_parser
+
+    def _sample_af_annotation_keys(
+        self,
+        af_annotation_zip_or_dir: Path,
+        sampling: SamplingOptions,
+        *,
+        target_task_ids: Collection[str] | None,
+        target_input_data_ids: Collection[str] | None,
+        target_task_phase: str | None,
+        target_task_status: str | None,
+        num_shards: int,
+        shard_index: int,
+    ) -> set[str]:
+        """
+        アノテーションJSONファイルのタスクの情報とラベル名だけを参照して、変換対象のタスクを層ごとに`sampling.sample_size`件ずつ選びます。
+        塗りつぶし画像は読み込まないので、すべてのタスクを変換するより大幅に速く終わります。
+
+        Returns:
+            選んだタスクのキー（`get_af_annotation_key`の戻り値）
+        """
+        sampler = StratifiedReservoirSampler(sampling.sample_size, sampling.seed)
+        candidate_count = 0
+        for af_annotation, af_parser in self._iter_target_af_annotations(
+            af_annotation_zip_or_dir,
+            target_task_ids=target_task_ids,
+            target_input_data_ids=target_input_data_ids,
+            target_task_phase=target_task_phase,
+            target_task_status=target_task_status,
+            num_shards=num_shards,
+            shard_index=shard_index,
+            progress_message="変換対象のタスクを選ぶために、Annofab形式のアノテーションJSONファイルを走査中",
+        ):
+            # COCOのimageが存在しないタスクは変換できないので、候補にしない
+            if af_annotation["input_data_name"] not in self.images_by_file_name:
+                continue
+
+            match sampling.stratification:
+                case SampleStratification.NONE:
+                    strata = [""]
+                case SampleStratification.PHASE:
+                    strata = [af_annotation["task_phase"]]
+                case SampleStratification.CATEGORY:
+                    strata = [
+                        label
+                        for label in {af_detail["label"] for af_detail in af_annotation["details"]}
+                        if label in self.category_ids_by_name and (self.target_af_target_labels is None or label in self.target_af_target_labels)
+                    ]
+            candidate_count += 1
+            sampler.add(get_af_annotation_key(af_parser), strata)
+
+        sampled_keys = sampler.get_sampled_keys()
+        logger.info(
+            f"Annofab形式のアノテーション'{af_annotation_zip_or_dir}'に含まれる{candidate_count}件のタスクから、{len(sampled_keys)}件を選びました。 :: "
+            f"stratification='{sampling.stratification.value}', seed={sampling.seed}, 層ごとの件数={sampler.get_sample_counts_by_stratum()}"
+        )
+        return sampled_keys
+
+    def iter_converted_af_annotation_path(
+        self,
+        af_annotation_zip_or_dir: Path,
+        *,
+        target_task_ids: Collection[str] | None = None,
+        target_input_data_ids: Collection[str] | None = None,
+        target_task_phase: str | None = None,
+        target_task_status: str | None = None,
+        num_shards: int = 1,
+        shard_index: int = 0,
+        sampling: SamplingOptions | None = None,
+        label_map_dir: Path | None = None,
+    ) -> Iterator[tuple[dict[str, Any], list[dict[str, Any]]]]:
+        """
+        AnnofabからダウンロードしたアノテーションZIPまたは展開したディレクトリを、タスク（アノテーションJSONファイル）ごとにCOCO形式のアノテーションに変換して返します。
+        変換しながら1件ずつ返すので、すべてのアノテーションをメモリに保持しません。
+
+        `label_map_dir`以外の引数は`convert_af_annotation_path`と同じです。
+
+        Args:
+            label_map_dir: 指定した場合は、変換と同時にimageごとのラベルマップ（PNG）をこのディレクトリに書き出します。
+                ラベルマップの書き出しに失敗したタスクも、COCO形式のannotationsは返します。
+
+        Yields:
+            tuple[0]: COCO形式のimage。`tiling`を指定した場合は、タイルのimage
+            tuple[1]: imageに紐づくCOCO形式のannotations。`id`は1始まりの連番です。
+        """
+        if label_map_dir is not None and self.tiling is not None:
+            raise ValueError("画像をタイルに分割する場合は、ラベルマップは出力できません。")
+        if label_map_dir is not None:
+            # カテゴリのIDがラベルマップで表現できない場合は、変換を始める前にエラーにする
+            self._get_label_map_dtype()
+
+        coco_start_annotation_id = 1
+        success_count = 0
+        annotation_count = 0
+        label_map_failure_count = 0
+        for af_annotation, af_parser in self._iter_target_af_annotations(
+            af_annotation_zip_or_dir,
+            target_task_ids=target_task_ids,
+            target_input_data_ids=target_input_data_ids,
+            target_task_phase=target_task_phase,
+            target_task_status=target_task_status,
+            num_shards=num_shards,
+            shard_index=shard_index,
+            sampling=sampling,
+        ):
             try:
                 # Annofabのinput_data_nameをCOCOのfile_nameとして変換する
                 coco_image = self.images_by_file_name[af_annotation["input_data_name"]]
-                sub_coco_annotations, coco_start_annotation_id = self.convert_af_annotation(af_annotation, af_parser, coco_image, coco_start_annotation_id)
-                logger.debug(f"AnnofabのアノテーションJSONファイル'{af_parser.json_file_path}'をCOCO形式のannotations（{len(sub_coco_annotations)}個）に変換しました。 ")
-                coco_annotations.extend(sub_coco_annotations)
-                success_count += 1
+                # ラベルマップも出力する場合は、COCO形式への変換でデコードした塗りつぶし画像のマスクを、ラベルマップの作成でも利用する
+                segmentation_masks: dict[str, CroppedMask] | None = {} if label_map_dir is not None else None
+                if self.tiling is not None:
+                    converted_tiles, coco_start_annotation_id = self.convert_af_annotation_to_tiles(af_annotation, af_parser, coco_image, coco_start_annotation_id)
+                else:
+                    sub_coco_annotations, coco_start_annotation_id = self.convert_af_annotation(af_annotation, af_parser, coco_image, coco_start_annotation_id, segmentation_masks=segmentation_masks)
+                    converted_tiles = [(coco_image, sub_coco_annotations)]
+                converted_annotation_count = sum(len(sub_coco_annotations) for _, sub_coco_annotations in converted_tiles)
+                logger.debug("AnnofabのアノテーションJSONファイル'{}'をCOCO形式のannotations（{}個）に変換しました。 ", af_parser.json_file_path, converted_annotation_count)
             except Exception:
                 logger.opt(exception=True).warning(f"AnnofabのアノテーションJSONファイル'{af_parser.json_file_path}'の変換に失敗しました。")
                 continue
 
-        logger.info(f"Annofab形式のアノテーション'{af_annotation_zip_or_dir}'に含まれる{success_count}個のJSONファイルを、COCO形式のannotations（{len(coco_annotations)}個）に変換しました。")
+            if label_map_dir is not None:
+                # annotationの`id`は採番済なので、ラベルマップの書き出しに失敗しても、COCO形式のannotationsは返す
+                try:
+                    self.write_label_map(self.create_label_map(af_annotation, af_parser, coco_image, segmentation_masks=segmentation_masks), coco_image, label_map_dir)
+                except Exception:
+                    logger.opt(exception=True).warning(f"AnnofabのアノテーションJSONファイル'{af_parser.json_file_path}'からラベルマップを作成できませんでした。")
+                    label_map_failure_count += 1
+
+            success_count += 1
+            annotation_count += converted_annotation_count
+            # タイルに分割する場合は、タイルごとに返す
+            yield from converted_tiles
+
+        logger.info(f"Annofab形式のアノテーション'{af_annotation_zip_or_dir}'に含まれる{success_count}個のJSONファイルを、COCO形式のannotations（{annotation_count}個）に変換しました。")
+        if label_map_failure_count > 0:
+            logger.warning(f"{label_map_failure_count}個のJSONファイルは、COCO形式には変換しましたが、ラベルマップの書き出しに失敗しました。")
+
+    def write_label_maps_from_af_annotation_path(
+        self,
+        af_annotation_zip_or_dir: Path,
+        label_map_dir: Path,
+        *,
+        target_task_ids: Collection[str] | None = None,
+        target_input_data_ids: Collection[str] | None = None,
+        target_task_phase: str | None = None,
+        target_task_status: str | None = None,
+        num_shards: int = 1,
+        shard_index: int = 0,
+        sampling: SamplingOptions | None = None,
+    ) -> int:
+        """
+        AnnofabからダウンロードしたアノテーションZIPまたは展開したディレクトリから、COCO形式のannotationsを作成せずに、imageごとのラベルマップ（PNG）のみを書き出します。
+
+        `label_map_dir`以外の引数は`convert_af_annotation_path`と同じです。
+
+        Returns:
+            書き出したラベルマップの個数
+        """
+        self._get_label_map_dtype()
+        success_count = 0
+        for af_annotation, af_parser in self._iter_target_af_annotations(
+            af_annotation_zip_or_dir,
+            target_task_ids=target_task_ids,
+            target_input_data_ids=target_input_data_ids,
+            target_task_phase=target_task_phase,
+            target_task_status=target_task_status,
+            num_shards=num_shards,
+            shard_index=shard_index,
+            sampling=sampling,
+        ):
+            try:
+                coco_image = self.images_by_file_name[af_annotation["input_data_name"]]
+                self.write_label_map(self.create_label_map(af_annotation, af_parser, coco_image), coco_image, label_map_dir)
+            except Exception:
+                logger.opt(exception=True).warning(f"AnnofabのアノテーションJSONファイル'{af_parser.json_file_path}'からラベルマップを作成できませんでした。")
+                continue
+            success_count += 1
+
+        logger.info(f"Annofab形式のアノテーション'{af_annotation_zip_or_dir}'に含まれる{success_count}個のJSONファイルから、ラベルマップを'{label_map_dir}'に書き出しました。")
+        return success_count
+
+    def convert_af_annotation_path(
+        self,
+        af_annotation_zip_or_dir: Path,
+        *,
+        target_task_ids: Collection[str] | None = None,
+        target_input_data_ids: Collection[str] | None = None,
+        target_task_phase: str | None,
+        target_task_status: str | None,
+        num_shards: int = 1,
+        shard_index: int = 0,
+        sampling: SamplingOptions | None = None,
+    ) -> list[dict[str, Any]]:
+        """
+        AnnofabからダウンロードしたアノテーションZIPまたは展開したディレクトリを、COCO形式のアノテーションに変換します。
+
+        Args:
+            af_annotation_zip_or_dir: Annofab形式のアノテーションZIPファイルまたはそれを展開したディレクトリのパス
+            target_task_ids: 変換対象のタスクのID
+            target_input_data_ids: 変換対象の入力データのID
+            target_task_phase: 変換対象のタスクのフェーズ
+            target_task_status: 変換対象のタスクのステータス
+            num_shards: シャード数。変換対象を`input_data_id`のハッシュ値で`num_shards`個に分割します。
+            shard_index: 変換対象のシャードのインデックス（0始まり）
+            sampling: 指定した場合は、変換対象のタスクから一部だけを選んで変換します。ほかの引数で絞り込んだタスクから選びます。
+
+        Returns:
+            COCO形式のannotations
+        """
+        return [
+            coco_annotation
+            for _, sub_coco_annotations in self.iter_converted_af_annotation_path(
+                af_annotation_zip_or_dir,
+                target_task_ids=target_task_ids,
+                target_input_data_ids=target_input_data_ids,
+                target_task_phase=target_task_phase,
+                target_task_status=target_task_status,
+                num_shards=num_shards,
+                shard_index=shard_index,
+                sampling=sampling,
+            )
+            for coco_annotation in sub_coco_annotations
+        ]
+
+    def convert_af_annotation_path_to_annotation_store(
+        self,
+        af_annotation_zip_or_dir: Path,
+        *,
+        target_task_ids: Collection[str] | None = None,
+        target_input_data_ids: Collection[str] | None = None,
+        target_task_phase: str | None,
+        target_task_status: str | None,
+        num_shards: int = 1,
+        shard_index: int = 0,
+        sampling: SamplingOptions | None = None,
+    ) -> "CocoAnnotationStore":
+        """
+        `convert_af_annotation_path`と同じように変換して、COCO形式のannotationsをdictのlistではなく`CocoAnnotationStore`で返します。
+        annotationを列指向で格納するので、annotationが多い場合にメモリ使用量を抑えられます。
+        引数は`convert_af_annotation_path`と同じです。
+        """
+        from src.common.annotation_store import CocoAnnotationStore  # noqa: PLC0415
+
+        coco_annotations = CocoAnnotationStore()
+        for _, sub_coco_annotations in self.iter_converted_af_annotation_path(
+            af_annotation_zip_or_dir,
+            target_task_ids=target_task_ids,
+            target_input_data_ids=target_input_data_ids,
+            target_task_phase=target_task_phase,
+            target_task_status=target_task_status,
+            num_shards=num_shards,
+            shard_index=shard_index,
+            sampling=sampling,
+        ):
+            for coco_annotation in sub_coco_annotations:
+                coco_annotations.append(coco_annotation)
         return coco_annotations
 
 
+def iter_coco_annotations_from_af_annotation(  # noqa: PLR0913
+    af_annotation_zip_or_dir: Path,
+    coco_categories: list[dict[str, Any]],
+    *,
+    coco_images: list[dict[str, Any]] | None = None,
+    af_input_data_list: list[dict[str, Any]] | None = None,
+    target_af_target_labels: Collection[str] | None = None,
+    should_clip_annotation_to_image: bool = False,
+    segmentation_format: CocoSegmentationFormat = CocoSegmentationFormat.RLE,
+    polygon_simplify_tolerance: float = 1.0,
+    polygon_min_iou: float = 0.9,
+    tiling: TilingOptions | None = None,
+    target_task_ids: Collection[str] | None = None,
+    target_input_data_ids: Collection[str] | None = None,
+    target_task_phase: str | None = None,
+    target_task_status: str | None = None,
+    num_shards: int = 1,
+    shard_index: int = 0,
+    sampling: SamplingOptions | None = None,
+) -> Iterator[tuple[dict[str, Any], list[dict[str, Any]]]]:
+    """
+    Annofab形式のアノテーションを、タスクごとにCOCO形式に変換して返します。
+    学習データのパイプラインなどで、COCO形式のJSONファイルを経由せずに変換結果を利用するためのAPIです。
+    フィルタやannotationの`id`の採番は、`convert_af_annotation_to_coco_instances`コマンドと同じです。
+
+    Args:
+        af_annotation_zip_or_dir: Annofab形式のアノテーションZIPファイルまたはそれを展開したディレクトリのパス
+        coco_categories: COCO形式のcategories
+        coco_images: COCO形式のimages。`af_input_data_list`とどちらか一方を指定してください。
+        af_input_data_list: Annofabの入力データ全件ファイルの中身。COCO形式のimagesに変換して利用します。
+
+    その他の引数は、`AnnotationConverterFromAnnofabToCoco`のコンストラクタおよび`convert_af_annotation_path`と同じです。
+
+    Yields:
+        tuple[0]: COCO形式のimage。`tiling`を指定した場合は、タイルのimage
+        tuple[1]: imageに紐づくCOCO形式のannotations
+    """
+    if (coco_images is None) == (af_input_data_list is None):
+        raise ValueError("`coco_images`と`af_input_data_list`のどちらか一方を指定してください。")
+    if af_input_data_list is not None:
+        coco_images = convert_af_input_data_list_to_coco_images(af_input_data_list)
+    assert coco_images is not None
+
+    converter = AnnotationConverterFromAnnofabToCoco(
+        coco_categories=coco_categories,
+        coco_images=coco_images,
+        target_af_target_labels=target_af_target_labels,
+        should_clip_annotation_to_image=should_clip_annotation_to_image,
+        segmentation_format=segmentation_format,
+        polygon_simplify_tolerance=polygon_simplify_tolerance,
+        polygon_min_iou=polygon_min_iou,
+        tiling=tiling,
+    )
+    yield from converter.iter_converted_af_annotation_path(
+        af_annotation_zip_or_dir,
+        target_task_ids=target_task_ids,
+        target_input_data_ids=target_input_data_ids,
+        target_task_phase=target_task_phase,
+        target_task_status=target_task_status,
+        num_shards=num_shards,
+        shard_index=shard_index,
+        sampling=sampling,
+    )
+
+
+class FileNamePrefixScheme(Enum):
+    """
+    複数のAnnofab形式のアノテーションを変換するときに、COCOのimageの`file_name`に接頭辞を付ける方法
+    """
+
+    NONE = "none"
+    """接頭辞を付けない。`file_name`が同じimageは、同じimageとみなす"""
+    COLLISION = "collision"
+    """複数のAnnofab形式のアノテーションに存在する`file_name`にのみ、接頭辞を付ける"""
+    ALL = "all"
+    """すべての`file_name`に接頭辞を付ける"""
+
+
+@dataclass(frozen=True)
+class AfAnnotationSource:
+    """
+    変換対象のAnnofab形式のアノテーションと、それに対応するCOCO形式のimages
+    """
+
+    af_annotation_zip_or_dir: Path
+    coco_images: list[dict[str, Any]]
+
+    @property
+    def name(self) -> str:
+        """`file_name`の接頭辞に使う名前。ZIPファイルの場合は拡張子を除いたファイル名"""
+        return self.af_annotation_zip_or_dir.stem if self.af_annotation_zip_or_dir.is_file() else self.af_annotation_zip_or_dir.name
+
+
+def _get_file_name_prefixes(sources: list[AfAnnotationSource], file_name_prefix_scheme: FileNamePrefixScheme, file_name_prefix_format: str) -> list[dict[str, str]]:
+    """
+    Returns:
+        sourceごとの、元の`file_name`から接頭辞を付けた`file_name`への対応。接頭辞を付けない`file_name`は含みません。
+    """
+    source_counts_by_file_name = collections.Counter(file_name for source in sources for file_name in {image["file_name"] for image in source.coco_images})
+    result = []
+    for source_index, source in enumerate(sources):
+        prefix = file_name_prefix_format.format(source_name=source.name, source_index=source_index)
+        renamed_file_names = {}
+        for coco_image in source.coco_images:
+            file_name = coco_image["file_name"]
+            if file_name_prefix_scheme == FileNamePrefixScheme.ALL or (file_name_prefix_scheme == FileNamePrefixScheme.COLLISION and source_counts_by_file_name[file_name] > 1):
+                renamed_file_names[file_name] = prefix + file_name
+        result.append(renamed_file_names)
+    return result
+
+
+def _convert_af_annotation_source_to_temp_file(
+    source: AfAnnotationSource, coco_categories: list[dict[str, Any]], converter_options: dict[str, Any], filter_options: dict[str, Any], temp_file: Path
+) -> int:
+    """
+    1個のAnnofab形式のアノテーションをCOCO形式に変換して、annotationsを1行1件のJSONで一時ファイルに書き出します。
+    別プロセスで実行するので、トップレベルの関数にしています。
+
+    Returns:
+        書き出したannotationsの件数
+    """
+    converter = AnnotationConverterFromAnnofabToCoco(coco_categories=coco_categories, coco_images=source.coco_images, **converter_options)
+    annotation_count = 0
+    with temp_file.open("wb") as f:
+        for _, coco_annotations in converter.iter_converted_af_annotation_path(source.af_annotation_zip_or_dir, **filter_options):
+            for coco_annotation in coco_annotations:
+                f.write(dumps_json(coco_annotation) + b"\n")
+            annotation_count += len(coco_annotations)
+    return annotation_count
+
+
+def convert_af_annotation_sources_to_coco_instances_file(
+    sources: list[AfAnnotationSource],
+    coco_categories: list[dict[str, Any]],
+    output_coco_instances_json: Path,
+    *,
+    file_name_prefix_scheme: FileNamePrefixScheme = FileNamePrefixScheme.COLLISION,
+    file_name_prefix_format: str = "{source_name}/",
+    parallelism: int = 1,
+    converter_options: dict[str, Any] | None = None,
+    filter_options: dict[str, Any] | None = None,
+    gzip_compression_level: int = DEFAULT_GZIP_COMPRESSION_LEVEL,
+    indent: bool = False,
+) -> None:
+    """
+    複数のAnnofab形式のアノテーション（例：Annofabプロジェクトごとのアノテーション）を、1個のCOCOデータセット（Instances）に変換します。
+
+    Annofab形式のアノテーションごとに`parallelism`個のプロセスで並列に変換して、annotationsを一時ファイルに書き出します。
+    すべての変換が終わったら、imagesをマージして、`sources`の順番でannotationsのIDを1から振り直しながら出力ファイルに書き出します。
+    したがって、出力結果は変換が終わった順番に依存しません。
+
+    Args:
+        sources: 変換対象のAnnofab形式のアノテーション
+        coco_categories: COCO形式のcategories
+        output_coco_instances_json: 出力先のJSONファイルのパス
+        file_name_prefix_scheme: imageの`file_name`に接頭辞を付ける方法
+        file_name_prefix_format: 接頭辞のフォーマット。`{source_name}`（ZIPファイルまたはディレクトリの名前）と`{source_index}`（0始まり）を指定できます。
+        parallelism: 変換に利用するプロセス数
+        converter_options: `AnnotationConverterFromAnnofabToCoco`のコンストラクタのキーワード引数
+        filter_options: `AnnotationConverterFromAnnofabToCoco.iter_converted_af_annotation_path`のキーワード引数
+        gzip_compression_level: 出力先の拡張子が`.gz`の場合の、gzipの圧縮レベル
+        indent: Trueならば、出力するJSONを2文字でインデントします。
+    """
+    converter_options = converter_options or {}
+    filter_options = filter_options or {}
+    output_coco_instances_json.parent.mkdir(exist_ok=True, parents=True)
+
+    with tempfile.TemporaryDirectory(dir=output_coco_instances_json.parent) as temp_dir:
+        temp_files = [Path(temp_dir) / f"{source_index}.jsonl" for source_index in range(len(sources))]
+        if parallelism == 1 or len(sources) == 1:
+            annotation_counts = [
+                _convert_af_annotation_source_to_temp_file(source, coco_categories, converter_options, filter_options, temp_file) for source, temp_file in zip(sources, temp_files, strict=True)
+            ]
+        else:
+            with ProcessPoolExecutor(max_workers=min(parallelism, len(sources))) as executor:
+                futures = [
+                    executor.submit(_convert_af_annotation_source_to_temp_file, source, coco_categories, converter_options, filter_options, temp_file)
+                    for source, temp_file in zip(sources, temp_files, strict=True)
+                ]
+                annotation_counts = [future.result() for future in futures]
+
+        merger = CocoInstancesMerger()
+        file_name_prefixes = _get_file_name_prefixes(sources, file_name_prefix_scheme, file_name_prefix_format)
+        renamed_sources_images = [
+            [{**coco_image, "file_name": prefixes.get(coco_image["file_name"], coco_image["file_name"])} for coco_image in source.coco_images]
+            for source, prefixes in zip(sources, file_name_prefixes, strict=True)
+        ]
+        # annotationsより先にimagesを書き出すため、先にすべてのimagesをマージする
+        for coco_images in renamed_sources_images:
+            merger.merge_images_and_categories({"images": coco_images, "categories": coco_categories})
+
+        def iter_merged_annotations() -> Iterator[dict[str, Any]]:
+            for coco_images, temp_file in zip(renamed_sources_images, temp_files, strict=True):
+                with temp_file.open("rb") as f:
+                    yield from merger.merge({"images": coco_images, "categories": coco_categories, "annotations": iter_annotations_from_temp_file(f)})
+
+        with open_json_for_write(output_coco_instances_json, compression_level=gzip_compression_level) as f, StreamingJsonObjectWriter(f, indent=indent) as writer:
+            writer.write("images", list(merger.images_by_file_name.values()))
+            writer.write_array("annotations", iter_merged_annotations())
+            writer.write("categories", list(merger.categories_by_name.values()))
+
+    logger.info(
+        f"{len(sources)}個のAnnofab形式のアノテーションを変換して、'{output_coco_instances_json}'に出力しました。 :: images={len(merger.images_by_file_name)}件, annotations={sum(annotation_counts)}件"
+    )
+
+
 def create_parser() -> ArgumentParser:
     parser = ArgumentParser(
         description="Annofab形式のアノテーションを、COCOデータセット（Instances）形式に変換します。"
@@ -381,23 +1316,48 @@ def create_parser() -> ArgumentParser:
     parser.add_argument(
         "--af_annotation_zip_or_dir",
         type=Path,
+        nargs="+",
         required=True,
-        help="Annofab形式のアノテーションZIPファイルのパス。またはZIPファイルを展開したディレクトリのパス。`annofabcli annotation download`コマンドでアノテーションZIPファイルをダウンロードできます。",
+        help="Annofab形式のアノテーションZIPファイルのパス。またはZIPファイルを展開したディレクトリのパス。`annofabcli annotation download`コマンドでアノテーションZIPファイルをダウンロードできます。"
+        "複数指定した場合は（例：Annofabプロジェクトごとのアノテーション）、並列に変換して1個のCOCOデータセットに出力します。",
     )
 
     parser.add_argument(
         "--af_input_data_json",
         type=Path,
+        nargs="+",
         required=False,
         help="Annofabの入力データ全件ファイルのパス。COCO形式のimagesを生成するのに利用します。`annofabcli input_data download`コマンドでダウンロードできます。"
-        "未指定の場合は、'--coco_instances_json'に指定したJSONファイルの'images'を利用します。",
+        "未指定の場合は、'--coco_instances_json'に指定したJSONファイルの'images'を利用します。"
+        "`--af_annotation_zip_or_dir`を複数指定した場合は必須です。同じ個数を同じ順番で指定してください。",
     )
 
     parser.add_argument(
         "--coco_instances_json", type=Path, required=True, help="入力情報であるCOCOデータセット（Instances）形式アノテーションのJSONファイルのパス。`categories`と`images`(オプショナル)を参照します。"
     )
 
-    parser.add_argument("-o", "--output_coco_instances_json", type=Path, required=True, help="変換後のCOCOデータセット（Instances）形式アノテーションの出力先JSONファイルのパス")
+    parser.add_argument(
+        "-o",
+        "--output_coco_instances_json",
+        type=Path,
+        help="変換後のCOCOデータセット（Instances）形式アノテーションの出力先JSONファイルのパス。拡張子が`.gz`の場合はgzipで圧縮して出力します。`--output_label_map_dir`を指定した場合は省略できます。",
+    )
+    add_gzip_compression_level_argument(parser)
+    add_json_indent_argument(parser)
+    parser.add_argument(
+        "--output_label_map_dir",
+        type=Path,
+        help="指定すると、セマンティックセグメンテーション用のラベルマップ（ピクセル値がCOCOのcategory.idであるグレースケールのPNG）をimageごとに出力します。"
+        "ファイル名はimage.file_nameの拡張子を`.png`にしたものです。カテゴリのIDの最大値が255以下なら8bit、それ以外は16bitのPNGです。",
+    )
+    parser.add_argument(
+        "--label_map_overlap_order",
+        type=str,
+        choices=[e.value for e in LabelMapOverlapOrder],
+        default=LabelMapOverlapOrder.AREA.value,
+        help="ラベルマップでアノテーションが重なっているときに、どのアノテーションを上に塗るか。"
+        "`area`:面積が小さいアノテーションを上に塗ります, `details`:Annofabのアノテーションの順番が後のアノテーションを上に塗ります, `category`:IDが大きいカテゴリを上に塗ります。",
+    )
 
     parser.add_argument(
         "--clip_annotation_to_image",
@@ -405,51 +1365,186 @@ def create_parser() -> ArgumentParser:
         help="指定すると、アノテーションが画像からはみ出さないようにクリッピングします。Annofabは矩形やポリゴンは画像外に作図できます。ただし、塗りつぶしアノテーションは画像外に作図できません。",
     )
 
+    parser.add_argument(
+        "--segmentation_format",
+        type=str,
+        choices=[e.value for e in CocoSegmentationFormat],
+        default=CocoSegmentationFormat.RLE.value,
+        help="塗りつぶしアノテーションを変換したときの`segmentation`の形式。"
+        "`rle`:Uncompressed RLE（iscrowd=1）, `polygon`:ポリゴン（iscrowd=0）。"
+        "`polygon`の場合、ポリゴンと元のマスクのIoUが`--polygon_min_iou`未満ならばRLEに変換します。",
+    )
+    parser.add_argument(
+        "--polygon_simplify_tolerance",
+        type=float,
+        default=1.0,
+        help="塗りつぶしアノテーションをポリゴンに変換するときの、単純化の許容誤差（ピクセル単位）。大きくするほど頂点数が少なくなります。",
+    )
+    parser.add_argument("--polygon_min_iou", type=float, default=0.9, help="塗りつぶしアノテーションをポリゴンに変換するときの、ポリゴンと元のマスクのIoUの下限値。")
+
+    parser.add_argument(
+        "--tile_size",
+        type=int,
+        help="指定すると、画像を指定したサイズ（ピクセル）の正方形のタイルに分割して、タイルをCOCOのimageとして出力します。巨大な画像を学習に利用する場合に指定します。"
+        "アノテーションはタイルごとに切り取ります。画像ファイルは分割しないので、タイルのimageの`tile`に格納した元の画像での位置を利用して切り出してください。",
+    )
+    parser.add_argument("--tile_overlap", type=int, default=0, help="`--tile_size`を指定したときに、隣り合うタイルが重なる幅（ピクセル）")
+    parser.add_argument(
+        "--tile_file_name_format",
+        type=str,
+        default="{stem}_{x}_{y}{suffix}",
+        help="タイルのimageの`file_name`のフォーマット。元の`file_name`のディレクトリの下に配置します。"
+        "`{stem}`（元のファイル名の拡張子を除いた部分）、`{suffix}`（拡張子）、`{x}`, `{y}`（元の画像でのタイルの左上の座標）を指定できます。",
+    )
+
     parser.add_argument("--af_task_id", type=str, nargs="+", help="変換対象のAnnofabのタスクのID")
     parser.add_argument("--af_input_data_id", type=str, nargs="+", help="変換対象のAnnofabの入力データのID")
     parser.add_argument("--af_label_name", type=str, nargs="+", help="変換対象のAnnofabのラベル名（英語）")
     parser.add_argument("--af_task_phase", type=str, help="変換対象のAnnofabのタスクのフェーズ")
     parser.add_argument("--af_task_status", type=str, help="変換対象のAnnofabのタスクのステータス")
 
+    add_shard_arguments(parser, key_name="input_data_id")
+
+    parser.add_argument(
+        "--sample",
+        type=int,
+        help="指定すると、変換対象のタスクから層ごとに指定した件数だけを選んで変換します。プレビュー用に、一部だけを素早く変換する場合に利用します。"
+        "先にアノテーションJSONファイルだけを走査して変換対象を選ぶので、塗りつぶし画像は選んだタスクの分だけ読み込みます。"
+        "COCOのimagesには、選んだタスクのimageのみを出力します。",
+    )
+    parser.add_argument(
+        "--sample_stratification",
+        type=str,
+        choices=[e.value for e in SampleStratification],
+        default=SampleStratification.NONE.value,
+        help="`--sample`の件数をそろえる単位。`none`:全体から選びます, `category`:カテゴリ（ラベル）ごとに選びます, `phase`:タスクのフェーズごとに選びます。",
+    )
+    parser.add_argument("--sample_seed", type=int, default=0, help="`--sample`で変換対象を選ぶときの乱数のシード。同じシードなら同じタスクが選ばれます。")
+
+    parser.add_argument(
+        "--file_name_prefix_scheme",
+        type=str,
+        choices=[e.value for e in FileNamePrefixScheme],
+        default=FileNamePrefixScheme.COLLISION.value,
+        help="`--af_annotation_zip_or_dir`を複数指定したときに、COCOのimageの`file_name`に接頭辞を付ける方法。"
+        "`none`:接頭辞を付けず、`file_name`が同じimageは同じimageとみなします, `collision`:複数のアノテーションに存在する`file_name`にのみ付けます, `all`:すべての`file_name`に付けます。",
+    )
+    parser.add_argument(
+        "--file_name_prefix_format",
+        type=str,
+        default="{source_name}/",
+        help="`file_name`に付ける接頭辞のフォーマット。`{source_name}`（ZIPファイルの拡張子を除いた名前またはディレクトリの名前）と`{source_index}`（0始まり）を指定できます。",
+    )
+    parser.add_argument("--parallelism", type=int, default=os.cpu_count() or 1, help="`--af_annotation_zip_or_dir`を複数指定したときに、変換に利用するプロセス数")
+
     return parser
 
 
+def _validate_arguments(args: Namespace) -> None:
+    """
+    同時に指定できないコマンドライン引数の組み合わせを検証します。
+    """
+    if args.output_coco_instances_json is None and args.output_label_map_dir is None:
+        raise ValueError("'--output_coco_instances_json'と'--output_label_map_dir'のどちらかは指定してください。")
+
+    source_count = len(args.af_annotation_zip_or_dir)
+    if source_count > 1 and args.output_label_map_dir is not None:
+        raise ValueError("'--af_annotation_zip_or_dir'を複数指定した場合は、'--output_label_map_dir'は指定できません。")
+    if source_count > 1 and args.af_input_data_json is None:
+        # '--coco_instances_json'のimagesを全sourceで共有すると、すべてのimageが衝突して接頭辞付きで重複して出力されるため
+        raise ValueError("'--af_annotation_zip_or_dir'を複数指定した場合は、'--af_input_data_json'も同じ個数だけ指定してください。")
+    if source_count > 1 and args.sample is not None:
+        raise ValueError("'--af_annotation_zip_or_dir'を複数指定した場合は、'--sample'は指定できません。")
+    if args.tile_size is not None and (source_count > 1 or args.output_label_map_dir is not None):
+        raise ValueError("'--tile_size'を指定した場合は、'--af_annotation_zip_or_dir'の複数指定と'--output_label_map_dir'は指定できません。")
+    if args.af_input_data_json is not None and len(args.af_input_data_json) != source_count:
+        raise ValueError(f"'--af_input_data_json'の個数（{len(args.af_input_data_json)}）が、'--af_annotation_zip_or_dir'の個数（{source_count}）と一致しません。")
+
+
 @log_exception()
-def main() -> None:
-    args = create_parser().parse_args()
-    configure_loguru(is_verbose=args.verbose)
+def main(arguments: list[str] | None = None) -> None:
+    args = create_parser().parse_args(arguments)
+    configure_loguru(is_verbose=args.verbose, enqueue=args.enqueue_log)
     logger.info(f"argv={sys.argv}")
 
-    coco_instances = json.loads(args.coco_instances_json.read_text())
-
+    _validate_arguments(args)
+    output_coco_instances_json: Path | None = args.output_coco_instances_json
+    output_label_map_dir: Path | None = args.output_label_map_dir
+    coco_instances = read_json(args.coco_instances_json)
+    af_annotation_zip_or_dirs: list[Path] = args.af_annotation_zip_or_dir
     if args.af_input_data_json is not None:
-        af_input_data_list = json.loads(args.af_input_data_json.read_text())
-        coco_images = convert_af_input_data_list_to_coco_images(af_input_data_list)
-        logger.info(f"'{args.af_input_data_json}'に格納されているAnnofabの入力データ {len(af_input_data_list)} 件を、COCO形式のimagesに変換しました。")
+        coco_images_list = []
+        for af_input_data_json in args.af_input_data_json:
+            af_input_data_list = read_json(af_input_data_json)
+            coco_images_list.append(convert_af_input_data_list_to_coco_images(af_input_data_list))
+            logger.info(f"'{af_input_data_json}'に格納されているAnnofabの入力データ {len(af_input_data_list)} 件を、COCO形式のimagesに変換しました。")
     else:
-        coco_images = coco_instances["images"]
-        logger.info(f"'{args.coco_instances_json}'に格納されているCOCO形式のimages（{len(coco_images)} 件）をそのまま利用します。")
+        coco_images_list = [coco_instances["images"]]
+        logger.info(f"'{args.coco_instances_json}'に格納されているCOCO形式のimages（{len(coco_instances['images'])} 件）をそのまま利用します。")
 
     coco_categories = coco_instances["categories"]
-    converter = AnnotationConverterFromAnnofabToCoco(
-        coco_categories=coco_categories,
-        coco_images=coco_images,
-        target_af_target_labels=args.af_label_name,
-        should_clip_annotation_to_image=args.clip_annotation_to_image,
-    )
+    converter_options = {
+        "target_af_target_labels": args.af_label_name,
+        "should_clip_annotation_to_image": args.clip_annotation_to_image,
+        "segmentation_format": CocoSegmentationFormat(args.segmentation_format),
+        "polygon_simplify_tolerance": args.polygon_simplify_tolerance,
+        "polygon_min_iou": args.polygon_min_iou,
+        "label_map_overlap_order": LabelMapOverlapOrder(args.label_map_overlap_order),
+        "tiling": TilingOptions(args.tile_size, args.tile_overlap, args.tile_file_name_format) if args.tile_size is not None else None,
+    }
+    filter_options = {
+        "target_input_data_ids": args.af_input_data_id,
+        "target_task_ids": args.af_task_id,
+        "target_task_phase": args.af_task_phase,
+        "target_task_status": args.af_task_status,
+        "num_shards": args.num_shards,
+        "shard_index": args.shard_index,
+        "sampling": SamplingOptions(args.sample, SampleStratification(args.sample_stratification), args.sample_seed) if args.sample is not None else None,
+    }
 
-    coco_annotations = converter.convert_af_annotation_path(
-        args.af_annotation_zip_or_dir, target_input_data_ids=args.af_input_data_id, target_task_ids=args.af_task_id, target_task_phase=args.af_task_phase, target_task_status=args.af_task_status
-    )
+    if len(af_annotation_zip_or_dirs) > 1:
+        assert output_coco_instances_json is not None
+        convert_af_annotation_sources_to_coco_instances_file(
+            [AfAnnotationSource(path, coco_images) for path, coco_images in zip(af_annotation_zip_or_dirs, coco_images_list, strict=True)],
+            coco_categories,
+            output_coco_instances_json,
+            file_name_prefix_scheme=FileNamePrefixScheme(args.file_name_prefix_scheme),
+            file_name_prefix_format=args.file_name_prefix_format,
+            parallelism=args.parallelism,
+            converter_options=converter_options,
+            filter_options=filter_options,
+            gzip_compression_level=args.gzip_compression_level,
+            indent=args.indent,
+        )
+        return
+
+    coco_images = coco_images_list[0]
+    converter = AnnotationConverterFromAnnofabToCoco(coco_categories=coco_categories, coco_images=coco_images, **converter_options)
+    if output_coco_instances_json is None:
+        assert output_label_map_dir is not None
+        # COCO形式のannotationsは作成せずに、ラベルマップだけを書き出す
+        converter.write_label_maps_from_af_annotation_path(af_annotation_zip_or_dirs[0], output_label_map_dir, **filter_options)
+        return
+
+    # ラベルマップは、COCO形式に変換するのと同じ走査で書き出す
+    iter_converted_annotations = converter.iter_converted_af_annotation_path(af_annotation_zip_or_dirs[0], label_map_dir=output_label_map_dir, **filter_options)
+    if converter.tile_images is not None:
+        # imagesには、画像ではなくタイルを出力する
+        coco_images = converter.tile_images
+
+    if args.sample is not None:
+        # imagesには選んだタスクのimageだけを出力したいので、変換が終わってから書き出す。選んだタスクだけなのでメモリに保持できる
+        converted_annotations = list(iter_converted_annotations)
+        sampled_image_ids = {coco_image["id"] for coco_image, _ in converted_annotations}
+        coco_images = [coco_image for coco_image in coco_images if coco_image["id"] in sampled_image_ids]
+        iter_converted_annotations = iter(converted_annotations)
 
-    result_coco_instances = {
-        "images": coco_images,
-        "annotations": coco_annotations,
-        "categories": coco_categories,
-    }
-    output_coco_instances_json = args.output_coco_instances_json
     output_coco_instances_json.parent.mkdir(exist_ok=True, parents=True)
-    output_coco_instances_json.write_text(json.dumps(result_coco_instances, indent=2, ensure_ascii=False))
+    # annotationsは変換しながら1タスクずつ書き出すので、すべてのannotationsをメモリに保持しない
+    with open_json_for_write(output_coco_instances_json, compression_level=args.gzip_compression_level) as f, StreamingJsonObjectWriter(f, indent=args.indent) as writer:
+        writer.write("images", coco_images)
+        writer.write_array("annotations", (coco_annotation for _, coco_annotations in iter_converted_annotations for coco_annotation in coco_annotations))
+        writer.write("categories", coco_categories)
 
 
 if __name__ == "__main__":
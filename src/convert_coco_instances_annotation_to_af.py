@@ -1,21 +1,26 @@
-import collections
-import json
+import dataclasses
+import io
 import sys
 import uuid
+from argparse import ArgumentParser
 from collections.abc import Collection, Sequence
 from enum import Enum
 from pathlib import Path
 from typing import Any, assert_never
 
-import numpy
-import pycocotools
-import pycocotools.mask
-from annofabapi.segmentation import write_binary_image
-from jsonargparse import ArgumentParser
 from loguru import logger
 
-from src.common.cli import create_parent_parser
-from src.common.utils import configure_loguru, log_exception
+from src.common.annotation_store import CocoAnnotationStore
+from src.common.cli import add_gzip_compression_level_argument, add_shard_arguments, create_parent_parser
+from src.common.coco_digest import calculate_coco_image_digests, get_changed_file_names
+from src.common.coco_reader import read_coco_instances
+from src.common.coco_validation import SEVERITY_ERROR, CocoValidationMode, log_coco_validation_issues, validate_coco_instances
+from src.common.image import BinaryImageFormat, write_binary_png
+from src.common.json_file import DEFAULT_GZIP_COMPRESSION_LEVEL, dumps_json_file, read_json, write_json
+from src.common.mask import CroppedMask
+from src.common.shard import get_shard_index, validate_shard
+from src.common.utils import ProgressLogger, configure_loguru, log_exception
+from src.common.write_behind import DEFAULT_MAX_PENDING_BYTES, WriteBehindFileWriter
 
 
 class CocoAnnotationType(Enum):
@@ -24,6 +29,26 @@ class CocoAnnotationType(Enum):
     RLE_SEGMENTATION = "rle_segmentation"
 
 
+AF_ANNOTATION_ID_NAMESPACE = uuid.UUID("6f1c2f0e-8d3a-4c1b-9a57-3e0b7d2c4f18")
+"""Annofabのannotation_idを生成するときの、UUID version 5の名前空間"""
+
+
+def create_af_annotation_id(coco_annotation_type: CocoAnnotationType, coco_annotation_id: int, part_index: int | None = None) -> str:
+    """
+    COCOのannotationの`id`から、Annofabのannotation_idを決定的に生成します。
+    同じCOCOのannotationからは常に同じannotation_idを生成するので、変換し直したアノテーションをインポートしても、annotation_idは変わりません。
+
+    Args:
+        coco_annotation_type: 変換対象のアノテーションの種類。同じCOCOのannotationを、矩形とポリゴンの両方に変換した場合にannotation_idが重複しないようにします。
+        coco_annotation_id: COCOのannotationの`id`
+        part_index: マルチポリゴンを複数のAnnofabのアノテーションに分割する場合の、ポリゴンのインデックス
+    """
+    name = f"{coco_annotation_type.value}/{coco_annotation_id}"
+    if part_index is not None:
+        name = f"{name}/{part_index}"
+    return str(uuid.uuid5(AF_ANNOTATION_ID_NAMESPACE, name))
+
+
 def convert_coco_one_segmentation_to_af_format(polygon_segmentation: Sequence[float]) -> dict[str, Any]:
     """
     COCO形式の1個のアノテーションの`segmentation`をAnnofab形式のポリゴンに変換します。
@@ -40,17 +65,45 @@ class AnnotationConverterFromCocoToAnnofab:
         *,
         target_coco_category_names: Collection[str] | None = None,
         target_coco_image_file_names: Collection[str] | None = None,
+        num_shards: int = 1,
+        shard_index: int = 0,
+        png_compression_level: int = 6,
+        binary_image_format: BinaryImageFormat = BinaryImageFormat.RGBA,
+        should_output_empty_details: bool = False,
+        af_annotation_json_gzip_compression_level: int | None = None,
     ) -> None:
+        """
+        Args:
+            coco_instances: COCOデータセット（Instances）形式のアノテーション。`annotations`は`CocoAnnotationStore`でも構いません。
+            coco_annotation_type: 変換対象のアノテーションの種類
+            target_coco_category_names: 変換対象のCOCOのcategory_name
+            target_coco_image_file_names: 変換対象のCOCOのimageのfile_name
+            num_shards: シャード数。変換対象のimagesを`file_name`のハッシュ値で`num_shards`個に分割します。
+            shard_index: 変換対象のシャードのインデックス（0始まり）
+            png_compression_level: 塗りつぶし画像（PNG）のzlibの圧縮レベル（0〜9）。1が最も速い
+            binary_image_format: 塗りつぶし画像（PNG）の形式
+            should_output_empty_details: Trueならば、変換対象のアノテーションが存在しないimageも、`details`が空のAnnofab形式のアノテーションを出力します。
+                差分だけを変換するときに、すべてのアノテーションが削除されたimageのアノテーションを、インポートで削除できるようにします。
+            af_annotation_json_gzip_compression_level: 指定した場合は、Annofab形式のアノテーションJSONをこの圧縮レベルのgzipで圧縮して、`{input_data_id}.json.gz`に出力します。
+        """
+        validate_shard(num_shards, shard_index)
+
         self.coco_annotation_type = coco_annotation_type
+        self.png_compression_level = png_compression_level
+        self.binary_image_format = binary_image_format
+        self.should_output_empty_details = should_output_empty_details
+        self.af_annotation_json_gzip_compression_level = af_annotation_json_gzip_compression_level
         coco_images = coco_instances["images"]
         if target_coco_image_file_names is not None:
-            coco_images = [img for img in coco_images if img["file_name"] in set(target_coco_image_file_names)]
+            target_coco_image_file_names = set(target_coco_image_file_names)
+            coco_images = [img for img in coco_images if img["file_name"] in target_coco_image_file_names]
+        if num_shards > 1:
+            coco_images = [img for img in coco_images if get_shard_index(img["file_name"], num_shards) == shard_index]
         self.coco_images = coco_images
 
-        annotations_by_image_id = collections.defaultdict(list)
-        for coco_anno in coco_instances["annotations"]:
-            annotations_by_image_id[coco_anno["image_id"]].append(coco_anno)
-        self.annotations_by_image_id: dict[int, list[dict[str, Any]]] = annotations_by_image_id
+        # annotationの件数が多いとdictのlistではメモリ使用量が大きいので、列指向で格納する
+        coco_annotations = coco_instances["annotations"]
+        self.annotation_store = coco_annotations if isinstance(coco_annotations, CocoAnnotationStore) else CocoAnnotationStore(coco_annotations)
 
         self.target_coco_category_names = set(target_coco_category_names) if target_coco_category_names is not None else None
 
@@ -74,7 +127,7 @@ class AnnotationConverterFromCocoToAnnofab:
         left_top_x, left_top_y, width, height = coco_annotation["bbox"]
         # Annofabは座標値は整数で格納しているので、round()で整数に変換する。
         data = {"left_top": {"x": round(left_top_x), "y": round(left_top_y)}, "right_bottom": {"x": round(left_top_x + width), "y": round(left_top_y + height)}, "_type": "BoundingBox"}
-        return {"annotation_id": str(uuid.uuid4()), "label": coco_category_name, "attributes": attributes, "data": data}
+        return {"annotation_id": create_af_annotation_id(CocoAnnotationType.BBOX, coco_annotation["id"]), "label": coco_category_name, "attributes": attributes, "data": data}
 
     def convert_polygon_segmentation_annotation_to_af_detail(self, coco_annotation: dict[str, Any]) -> list[dict[str, Any]]:
         """
@@ -97,20 +150,20 @@ class AnnotationConverterFromCocoToAnnofab:
         return [
             {
                 "label": coco_category_name,
-                "annotation_id": str(uuid.uuid4()),
+                "annotation_id": create_af_annotation_id(CocoAnnotationType.POLYGON_SEGMENTATION, coco_annotation["id"], polygon_index),
                 "attributes": attributes,
                 "data": convert_coco_one_segmentation_to_af_format(polygon),
             }
-            for polygon in segmentation
+            for polygon_index, polygon in enumerate(segmentation)
         ]
 
-    def convert_rle_segmentation_annotation_to_af_detail(self, coco_annotation: dict[str, Any], coco_image: dict[str, Any]) -> tuple[dict[str, Any] | None, numpy.ndarray | None]:
+    def convert_rle_segmentation_annotation_to_af_detail(self, coco_annotation: dict[str, Any], coco_image: dict[str, Any]) -> tuple[dict[str, Any] | None, CroppedMask | None]:
         """
         COCO形式のRLE形式の`segmentation`（iscrowd=1）をAnnofabの塗りつぶしv1アノテーションに変換します。
 
         Returns:
             tuple[0]: Annofabの`detail`. iscrowd=0の場合はNone
-            tuple[1]: segmentationをboolean arrayに変換したもの。iscrowd=0の場合はNone
+            tuple[1]: segmentationを、外接矩形の範囲だけのマスクに変換したもの。iscrowd=0の場合はNone
         """
         if coco_annotation["iscrowd"] != 1:
             return None, None
@@ -125,17 +178,18 @@ class AnnotationConverterFromCocoToAnnofab:
         }
         segmentation = coco_annotation["segmentation"]
 
-        # 以下のコードと同じように、rleを取得した
+        # 以下のコードと同じように、uncompressed RLEは画像のサイズ、compressed RLEは`size`のサイズのマスクとみなす
         # https://github.com/ppwwyyxx/cocoapi/blob/8cbc887b3da6cb76c7cc5b10f8e082dd29d565cb/PythonAPI/pycocotools/coco.py#L266C1-L269C56
+        # 画像全体のサイズの配列は作成せずに、外接矩形の範囲だけをデコードする
         if isinstance(segmentation["counts"], list):
-            rle = pycocotools.mask.frPyObjects(segmentation, coco_image["height"], coco_image["width"])
+            mask = CroppedMask.from_rle(segmentation, coco_image["height"], coco_image["width"])
         else:
-            rle = segmentation
+            height, width = segmentation["size"]
+            mask = CroppedMask.from_rle(segmentation, height, width)
 
-        segmentation_bool_array = pycocotools.mask.decode(rle).astype(bool)
-        annotation_id = str(uuid.uuid4())
+        annotation_id = create_af_annotation_id(CocoAnnotationType.RLE_SEGMENTATION, coco_annotation["id"])
         af_detail = {"label": coco_category_name, "annotation_id": annotation_id, "attributes": attributes, "data": {"data_uri": annotation_id, "_type": "Segmentation"}}
-        return af_detail, segmentation_bool_array
+        return af_detail, mask
 
     def convert_annotations_to_af_details(self, coco_image: dict[str, Any], af_input_data_dir: Path) -> tuple[list[dict[str, Any]], int]:
         """
@@ -149,7 +203,24 @@ class AnnotationConverterFromCocoToAnnofab:
             tuple[0]: 変換したAnnofab形式のdetails
             tuple[1]: 変換したCOCOのアノテーションの個数。マルチポリゴンが存在する場合、この値と`len(tuple[0])`の結果は異なります。
         """
-        coco_annotations = self.annotations_by_image_id[coco_image["id"]]
+        af_details, target_coco_annotation_count, outer_files = self.convert_annotations_to_af_details_and_outer_files(coco_image)
+        if len(outer_files) > 0:
+            af_input_data_dir.mkdir(exist_ok=True, parents=True)
+        for file_name, data in outer_files:
+            (af_input_data_dir / file_name).write_bytes(data)
+        return af_details, target_coco_annotation_count
+
+    def convert_annotations_to_af_details_and_outer_files(self, coco_image: dict[str, Any]) -> tuple[list[dict[str, Any]], int, list[tuple[str, bytes]]]:
+        """
+        COCO形式の`images -> file_name`に対応するアノテーションをAnnofab形式の`details`に変換します。
+        塗りつぶし画像はファイルに書き込まずに、PNGのbytesを返します。
+
+        Returns:
+            tuple[0]: 変換したAnnofab形式のdetails
+            tuple[1]: 変換したCOCOのアノテーションの個数。マルチポリゴンが存在する場合、この値と`len(tuple[0])`の結果は異なります。
+            tuple[2]: 塗りつぶし画像のファイル名（`annotation_id`）とPNGのbytesのlist
+        """
+        coco_annotations = self.annotation_store.get_annotations_by_image_id(coco_image["id"])
         af_details = []
         match self.coco_annotation_type:
             case CocoAnnotationType.BBOX:
@@ -157,7 +228,7 @@ class AnnotationConverterFromCocoToAnnofab:
                     af_detail = self.convert_bbox_annotation_to_af_detail(anno)
                     if af_detail is not None:
                         af_details.append(af_detail)
-                return af_details, len(af_details)
+                return af_details, len(af_details), []
 
             case CocoAnnotationType.POLYGON_SEGMENTATION:
                 target_coco_annotation_count = 0
@@ -167,83 +238,112 @@ class AnnotationConverterFromCocoToAnnofab:
                         target_coco_annotation_count += 1
                     af_details.extend(sub_details)
 
-                return af_details, target_coco_annotation_count
+                return af_details, target_coco_annotation_count, []
 
             case CocoAnnotationType.RLE_SEGMENTATION:
+                outer_files = []
                 for anno in coco_annotations:
-                    af_detail, segmentation_bool_array = self.convert_rle_segmentation_annotation_to_af_detail(anno, coco_image)
+                    af_detail, mask = self.convert_rle_segmentation_annotation_to_af_detail(anno, coco_image)
                     if af_detail is None:
                         continue
 
-                    assert segmentation_bool_array is not None
-                    af_input_data_dir.mkdir(exist_ok=True, parents=True)
-                    with (af_input_data_dir / af_detail["annotation_id"]).open("wb") as f:
-                        write_binary_image(segmentation_bool_array, f)
+                    assert mask is not None
+                    with io.BytesIO() as f:
+                        write_binary_png(mask, f, compression_level=self.png_compression_level, image_format=self.binary_image_format)
+                        outer_files.append((af_detail["annotation_id"], f.getvalue()))
                     af_details.append(af_detail)
-                return af_details, len(af_details)
+                return af_details, len(af_details), outer_files
             case _ as unreachable:
                 assert_never(unreachable)
 
-    def convert(self, output_dir: Path, input_data_id_to_task_id: dict[str, str] | None, input_data_name_to_input_data_id: dict[str, str] | None) -> None:
+    def convert(
+        self,
+        output_dir: Path,
+        input_data_id_to_task_id: dict[str, str] | None,
+        input_data_name_to_input_data_id: dict[str, str] | None,
+        *,
+        write_parallelism: int = 4,
+        max_pending_write_bytes: int = DEFAULT_MAX_PENDING_BYTES,
+    ) -> list[str]:
         """
         COCO形式のアノテーション全体をAnnofab形式に変換します。
+        ファイルの書き込みはバックグラウンドのスレッドで行うので、書き込みを待たずに次のimageを変換します。
 
         Args:
             output_dir: 変換したAnnofab形式のアノテーションを出力するディレクトリ
             input_data_id_to_task_id: keyが`input_data_id`、valueが`task_id`のdict。Noneの場合、`task_id`は`input_data_id`と同じ値だとみなして変換します。
             input_data_name_to_input_data_id: keyが`input_data_name`、valueが`input_data_id`のdict。Noneの場合、`input_data_name`は`input_data_id`と同じ値だとみなして変換します。
+            write_parallelism: ファイルの書き込みに利用するスレッド数
+            max_pending_write_bytes: 書き込み待ちのデータの合計サイズの上限（バイト）。超える場合は、書き込みが終わるまで変換を待ちます。
 
+        Returns:
+            変換または書き込みに失敗した、またはAnnofabの入力データやタスクが見つからなかったimageの`file_name`のlist（昇順）
         """
         output_dir.mkdir(exist_ok=True, parents=True)
-        success_image_count = 0
         skipped_image_count = 0
-        total_target_coco_annotation_count = 0
+        target_coco_annotation_counts: dict[str, int] = {}
+        failed_file_names: set[str] = set()
         logger.info(f"COCOデータセットの{len(self.coco_images)}件のimagesに紐づくアノテーションを、Annofab形式に変換します。")
 
-        for image_index, coco_image in enumerate(self.coco_images):
-            if (image_index + 1) % 1000 == 0:
-                logger.info(f"{image_index + 1}件目のCOCO imagesに紐づくアノテーションを、Annofabフォーマットに変換中...")
-
-            image_file_name = coco_image["file_name"]
-            af_input_data_id = input_data_name_to_input_data_id.get(image_file_name) if input_data_name_to_input_data_id is not None else image_file_name
-            if af_input_data_id is None:
-                logger.warning(f"Annofabのinput_data_name='{image_file_name}'に対応するinput_data_idが見つかりません。スキップします。")
-                continue
-
-            af_task_id = input_data_id_to_task_id.get(af_input_data_id) if input_data_id_to_task_id is not None else af_input_data_id
-            if af_task_id is None:
-                logger.warning(f"Annofabのinput_data_id='{af_input_data_id}'に対応するtask_idが見つかりません。スキップします。")
-                continue
-
-            af_annotation_json = output_dir / af_task_id / f"{af_input_data_id}.json"
-            try:
-                af_details, target_coco_annotation_count = self.convert_annotations_to_af_details(coco_image, af_input_data_dir=output_dir / af_task_id / af_input_data_id)
-                if target_coco_annotation_count == 0:
-                    skipped_image_count += 1
-                    logger.debug(f"COCOのimage.file_name='{image_file_name}'に紐づく変換対象のアノテーションは存在しません。")
+        progress_logger = ProgressLogger("COCO imagesに紐づくアノテーションを、Annofabフォーマットに変換中", total=len(self.coco_images))
+        with WriteBehindFileWriter(max_workers=write_parallelism, max_pending_bytes=max_pending_write_bytes) as writer:
+            for coco_image in self.coco_images:
+                progress_logger.update()
+
+                image_file_name = coco_image["file_name"]
+                af_input_data_id = input_data_name_to_input_data_id.get(image_file_name) if input_data_name_to_input_data_id is not None else image_file_name
+                if af_input_data_id is None:
+                    logger.warning(f"Annofabのinput_data_name='{image_file_name}'に対応するinput_data_idが見つかりません。スキップします。")
+                    failed_file_names.add(image_file_name)
                     continue
 
-                af_annotation_json.parent.mkdir(exist_ok=True, parents=True)
-                af_annotation_json.write_text(json.dumps({"details": af_details}, ensure_ascii=False, indent=2))
-                success_image_count += 1
-                total_target_coco_annotation_count += target_coco_annotation_count
-                message = (
-                    f"COCOのimage.file_name='{image_file_name}'に紐づくアノテーション{target_coco_annotation_count}件を、Annofab形式に変換して、"
-                    f"'{af_annotation_json}'に出力しました。 :: "
-                    f"変換後のAnnofab形式のアノテーションは{len(af_details)}件です。"
-                )
-                if len(af_details) != target_coco_annotation_count:
-                    message += "（マルチポリゴンが存在するので、COCOのアノテーション数と異なります）。"
-                logger.debug(message)
-            except Exception:
-                logger.opt(exception=True).warning(f"COCOのimage.file_name='{image_file_name}'に紐づくアノテーションを、Annofabフォーマットへ変換するのに失敗しました。")
-                continue
+                af_task_id = input_data_id_to_task_id.get(af_input_data_id) if input_data_id_to_task_id is not None else af_input_data_id
+                if af_task_id is None:
+                    logger.warning(f"Annofabのinput_data_id='{af_input_data_id}'に対応するtask_idが見つかりません。スキップします。")
+                    failed_file_names.add(image_file_name)
+                    continue
+
+                af_annotation_json = output_dir / af_task_id / (f"{af_input_data_id}.json" if self.af_annotation_json_gzip_compression_level is None else f"{af_input_data_id}.json.gz")
+                try:
+                    af_details, target_coco_annotation_count, outer_files = self.convert_annotations_to_af_details_and_outer_files(coco_image)
+                    if target_coco_annotation_count == 0 and not self.should_output_empty_details:
+                        skipped_image_count += 1
+                        logger.debug("COCOのimage.file_name='{}'に紐づく変換対象のアノテーションは存在しません。", image_file_name)
+                        continue
+
+                    af_input_data_dir = output_dir / af_task_id / af_input_data_id
+                    # 塗りつぶし画像を書き込んでから、それを参照するアノテーションJSONを書き込む
+                    # `annofabcli annotation import`が読み込むだけなので、インデントしない
+                    files = [(af_input_data_dir / file_name, data) for file_name, data in outer_files]
+                    af_annotation_json_data = dumps_json_file(
+                        af_annotation_json, {"details": af_details}, compression_level=self.af_annotation_json_gzip_compression_level or DEFAULT_GZIP_COMPRESSION_LEVEL
+                    )
+                    files.append((af_annotation_json, af_annotation_json_data))
+                    target_coco_annotation_counts[image_file_name] = target_coco_annotation_count
+                    writer.submit(image_file_name, files)
+                    # 変換処理のホットパスなので、DEBUGログを出力しない場合はメッセージをフォーマットしないようにする
+                    logger.debug(
+                        "COCOのimage.file_name='{}'に紐づくアノテーション{}件を、Annofab形式に変換しました。 :: 出力先='{}', 変換後のAnnofab形式のアノテーションは{}件です。{}",
+                        image_file_name,
+                        target_coco_annotation_count,
+                        af_annotation_json,
+                        len(af_details),
+                        "（マルチポリゴンが存在するので、COCOのアノテーション数と異なります）。" if len(af_details) != target_coco_annotation_count else "",
+                    )
+                except Exception:
+                    logger.opt(exception=True).warning(f"COCOのimage.file_name='{image_file_name}'に紐づくアノテーションを、Annofabフォーマットへ変換するのに失敗しました。")
+                    failed_file_names.add(image_file_name)
+                    continue
 
+        failed_file_names.update(writer.failed_keys)
+        total_target_coco_annotation_count = sum(target_coco_annotation_counts[file_name] for file_name in writer.succeeded_keys)
         logger.info(
-            f"{success_image_count}/{len(self.coco_images)}件のCOCOデータセットimagesに紐づくアノテーション{total_target_coco_annotation_count}件を、Annofabフォーマットに変換しました。"
+            f"{len(writer.succeeded_keys)}/{len(self.coco_images)}件のCOCOデータセットimagesに紐づくアノテーション{total_target_coco_annotation_count}件を、Annofabフォーマットに変換しました。"
             f"{skipped_image_count}件のCOCOデータセットのimagesは、アノテーションが存在しなかったためスキップしました。"
-            f" :: output_dir='{output_dir}'"
+            + (f"{len(writer.failed_keys)}件のCOCOデータセットのimagesは、ファイルの書き込みに失敗しました。" if len(writer.failed_keys) > 0 else "")
+            + f" :: output_dir='{output_dir}'"
         )
+        return sorted(failed_file_names)
 
 
 def create_input_data_id_to_task_id_mapping(task_list: list[dict[str, Any]]) -> dict[str, str]:
@@ -288,6 +388,37 @@ def create_input_data_name_to_input_data_id_mapping(input_data_list: list[dict[s
     return result
 
 
+def create_conversion_manifest(image_digests: dict[str, str], settings: dict[str, Any]) -> dict[str, Any]:
+    """
+    差分だけを変換するためのマニフェストを作成します。
+
+    Args:
+        image_digests: 変換済のimageの`file_name`と、imageに紐づくannotationsのハッシュ値のdict
+        settings: 変換結果に影響する設定。設定が異なるマニフェストは、差分の変換に利用しません。
+    """
+    return {"settings": settings, "image_digests": image_digests}
+
+
+def get_previous_image_digests(previous_coco_instances_json: Path | None, previous_manifest_json: Path | None, settings: dict[str, Any]) -> dict[str, str] | None:
+    """
+    前回変換したCOCOデータセットまたはマニフェストから、imageごとのハッシュ値を取得します。
+
+    Returns:
+        keyがimageの`file_name`、valueがハッシュ値のdict。どちらも指定されていない場合、またはマニフェストの設定が`settings`と異なる場合はNone
+    """
+    if previous_coco_instances_json is not None:
+        return calculate_coco_image_digests(read_json(previous_coco_instances_json))
+
+    if previous_manifest_json is not None:
+        previous_manifest = read_json(previous_manifest_json)
+        if previous_manifest["settings"] != settings:
+            logger.warning(f"マニフェスト'{previous_manifest_json}'は変換の設定が異なるので、すべてのimageを変換します。 :: マニフェストの設定={previous_manifest['settings']}, 今回の設定={settings}")
+            return None
+        return previous_manifest["image_digests"]
+
+    return None
+
+
 def create_parser() -> ArgumentParser:
     parser = ArgumentParser(
         description="COCOデータセット（Instances）に含まれるアノテーションを、Annofab形式に変換します。"
@@ -333,24 +464,150 @@ def create_parser() -> ArgumentParser:
     parser.add_argument("--coco_category_name", type=str, nargs="+", help="変換対象のCOCOのcategory_name")
 
     parser.add_argument("-o", "--output_dir", type=Path, required=True, help="Annofab形式のアノテーションの出力先ディレクトリのパス")
+    parser.add_argument(
+        "--gzip_af_annotation_json",
+        action="store_true",
+        help="指定すると、Annofab形式のアノテーションJSONをgzipで圧縮して`{input_data_id}.json.gz`に出力します。`annofabcli annotation import`でインポートする前に展開してください。",
+    )
+    add_gzip_compression_level_argument(parser)
+
+    parser.add_argument(
+        "--png_compression_level",
+        type=int,
+        choices=range(10),
+        default=6,
+        help="`--coco_annotation_type rle_segmentation`のときに出力する塗りつぶし画像（PNG）の圧縮レベル（0〜9）。1が最も速く、9が最もファイルサイズが小さくなります。",
+    )
+    parser.add_argument(
+        "--binary_image_format",
+        type=str,
+        choices=[e.value for e in BinaryImageFormat],
+        default=BinaryImageFormat.RGBA.value,
+        help="`--coco_annotation_type rle_segmentation`のときに出力する塗りつぶし画像（PNG）の形式。"
+        "`rgba`:8bitのRGBA, `palette`:1bitのパレット形式。`palette`の方が書き込みが速く、ファイルサイズも小さくなります。",
+    )
+
+    parser.add_argument(
+        "--write_parallelism",
+        type=int,
+        default=4,
+        help="ファイルの書き込みに利用するスレッド数。変換とは別のスレッドで書き込むので、ネットワークストレージなど書き込みの遅延が大きい場合は増やしてください。",
+    )
+
+    add_shard_arguments(parser, key_name="COCOのimageのfile_name")
+
+    parser.add_argument(
+        "--validation",
+        type=str,
+        choices=[e.value for e in CocoValidationMode],
+        default=CocoValidationMode.SKIP.value,
+        help="変換前に、COCOデータセットの整合性（IDの重複や参照先の存在、座標の範囲など）を検証します。"
+        "`fail`:エラーが見つかった場合は何も出力せずに終了します, `report`:見つかった問題をログに出力して変換を続けます, `skip`:検証しません（デフォルト）。"
+        "`--coco_image_file_name`または`--coco_category_name`を指定した場合は、変換対象のimagesとannotationsだけを読み込んで検証します。"
+        "`--num_shards`を指定した場合は、`--shard_index`のシャードのimagesとannotationsだけを検証します。",
+    )
+    parser.add_argument("--validation_report_json", type=Path, help="検証で見つかった問題の一覧を出力するJSONファイルのパス")
+
+    previous_group = parser.add_mutually_exclusive_group()
+    previous_group.add_argument(
+        "--previous_coco_instances_json",
+        type=Path,
+        help="前回変換したCOCOデータセット（Instances）のJSONファイルのパス。"
+        "指定すると、imageごとに紐づくannotationsのハッシュ値を比較して、追加または変更されたimageのアノテーションのみを出力します。",
+    )
+    previous_group.add_argument(
+        "--previous_manifest_json",
+        type=Path,
+        help="前回の変換で`--output_manifest_json`に出力したマニフェストのパス。`--previous_coco_instances_json`と同じく、追加または変更されたimageのアノテーションのみを出力します。",
+    )
+    parser.add_argument(
+        "--output_manifest_json",
+        type=Path,
+        help="imageごとに紐づくannotationsのハッシュ値を記録したマニフェストの出力先のパス。次回の変換で`--previous_manifest_json`に指定できます。",
+    )
 
     return parser
 
 
 @log_exception()
-def main() -> None:
-    args = create_parser().parse_args()
-    configure_loguru(is_verbose=args.verbose)
+def main(arguments: list[str] | None = None) -> None:
+    args = create_parser().parse_args(arguments)
+    configure_loguru(is_verbose=args.verbose, enqueue=args.enqueue_log)
     logger.info(f"argv={sys.argv}")
 
-    coco_instances = json.loads(args.coco_instances_json.read_text())
+    is_differential = args.previous_coco_instances_json is not None or args.previous_manifest_json is not None or args.output_manifest_json is not None
+    # 変換対象のimagesとannotationsだけを読み込む。差分だけを変換する場合は、すべてのannotationsからハッシュ値を計算するので全体を読み込む
+    target_options = {} if is_differential else {"target_image_file_names": args.coco_image_file_name, "target_category_names": args.coco_category_name}
+    # annotationsは1件ずつ列指向で格納するので、すべてのannotationsをdictで保持しない
+    coco_instances = read_coco_instances(args.coco_instances_json, annotation_store=CocoAnnotationStore(), **target_options)
+    logger.info(f"COCOデータセットから、変換対象のimage{len(coco_instances['images'])}件とannotation{len(coco_instances['annotations'])}件を読み込みました。")
+
+    validation_mode = CocoValidationMode(args.validation)
+    if validation_mode != CocoValidationMode.SKIP:
+        validate_shard(args.num_shards, args.shard_index)
+        issues = validate_coco_instances(coco_instances, num_shards=args.num_shards, shard_index=args.shard_index)
+        log_coco_validation_issues(issues)
+        if args.validation_report_json is not None:
+            args.validation_report_json.parent.mkdir(exist_ok=True, parents=True)
+            write_json(args.validation_report_json, [dataclasses.asdict(issue) for issue in issues], indent=True)
+        error_count = sum(1 for issue in issues if issue.severity == SEVERITY_ERROR)
+        if error_count > 0 and validation_mode == CocoValidationMode.FAIL:
+            raise ValueError(f"COCOデータセットの検証で{error_count}件のエラーが見つかったので、変換を中止します。エラーを無視して変換する場合は`--validation report`を指定してください。")
+        logger.info(f"COCOデータセットを検証しました。 :: エラー={error_count}件, 警告={len(issues) - error_count}件")
+
+    settings = {
+        "coco_annotation_type": args.coco_annotation_type,
+        "coco_category_names": sorted(args.coco_category_name) if args.coco_category_name is not None else None,
+        "binary_image_format": args.binary_image_format,
+    }
+    image_digests = None
+    if is_differential:
+        image_digests = calculate_coco_image_digests(coco_instances)
+
+    target_coco_image_file_names = args.coco_image_file_name
+    previous_image_digests = get_previous_image_digests(args.previous_coco_instances_json, args.previous_manifest_json, settings)
+    if previous_image_digests is not None:
+        assert image_digests is not None
+        changed_file_names = get_changed_file_names(previous_image_digests, image_digests)
+        removed_file_names = previous_image_digests.keys() - image_digests.keys()
+        logger.info(
+            f"前回の変換と比較しました。 :: 追加または変更されたimage={len(changed_file_names)}件, 変更されていないimage={len(image_digests) - len(changed_file_names)}件, "
+            f"削除されたimage={len(removed_file_names)}件（削除されたimageのアノテーションは出力しません）"
+        )
+        target_coco_image_file_names = changed_file_names if target_coco_image_file_names is None else changed_file_names & set(target_coco_image_file_names)
 
-    input_data_id_to_task_id = create_input_data_id_to_task_id_mapping(json.loads(args.af_task_json.read_text())) if args.af_task_json is not None else None
-    input_data_name_to_input_data_id = create_input_data_name_to_input_data_id_mapping(json.loads(args.af_input_data_json.read_text())) if args.af_input_data_json is not None else None
+    input_data_id_to_task_id = create_input_data_id_to_task_id_mapping(read_json(args.af_task_json)) if args.af_task_json is not None else None
+    input_data_name_to_input_data_id = create_input_data_name_to_input_data_id_mapping(read_json(args.af_input_data_json)) if args.af_input_data_json is not None else None
     converter = AnnotationConverterFromCocoToAnnofab(
-        coco_instances, CocoAnnotationType(args.coco_annotation_type), target_coco_category_names=args.coco_category_name, target_coco_image_file_names=args.coco_image_file_name
+        coco_instances,
+        CocoAnnotationType(args.coco_annotation_type),
+        target_coco_category_names=args.coco_category_name,
+        target_coco_image_file_names=target_coco_image_file_names,
+        num_shards=args.num_shards,
+        shard_index=args.shard_index,
+        png_compression_level=args.png_compression_level,
+        binary_image_format=BinaryImageFormat(args.binary_image_format),
+        # アノテーションがすべて削除されたimageも、インポートでアノテーションを削除できるように出力する
+        should_output_empty_details=previous_image_digests is not None,
+        af_annotation_json_gzip_compression_level=args.gzip_compression_level if args.gzip_af_annotation_json else None,
+    )
+    # annotationsはconverterが列指向で保持しているので、読み込んだJSONは解放する
+    del coco_instances
+    failed_file_names = set(
+        converter.convert(
+            args.output_dir, input_data_id_to_task_id=input_data_id_to_task_id, input_data_name_to_input_data_id=input_data_name_to_input_data_id, write_parallelism=args.write_parallelism
+        )
     )
-    converter.convert(args.output_dir, input_data_id_to_task_id=input_data_id_to_task_id, input_data_name_to_input_data_id=input_data_name_to_input_data_id)
+
+    if args.output_manifest_json is not None:
+        assert image_digests is not None
+        # 今回変換しなかったimageは前回のハッシュ値を引き継ぐ。変換に失敗したimageは、次回も変換対象になるようにハッシュ値を更新しない
+        converted_file_names = {coco_image["file_name"] for coco_image in converter.coco_images} - failed_file_names
+        manifest_image_digests = {file_name: digest for file_name, digest in (previous_image_digests or {}).items() if file_name in image_digests and file_name not in failed_file_names}
+        manifest_image_digests.update({file_name: image_digests[file_name] for file_name in converted_file_names})
+        args.output_manifest_json.parent.mkdir(exist_ok=True, parents=True)
+        write_json(args.output_manifest_json, create_conversion_manifest(manifest_image_digests, settings))
+        logger.info(f"{len(manifest_image_digests)}件のimageのハッシュ値を、マニフェスト'{args.output_manifest_json}'に出力しました。")
 
 
 if __name__ == "__main__":
@@ -1,23 +1,43 @@
-import json
+import collections
 import subprocess
 import sys
 import tempfile
 import time
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
 from pathlib import Path
 from typing import Any
 
-from jsonargparse import ArgumentParser
 from loguru import logger
 
 from src.common.cli import create_parent_parser
+from src.common.coco_reader import read_coco_instances
+from src.common.file_hash import FileHashCache
+from src.common.image import list_files_in_dir, read_image_size
+from src.common.json_file import read_json, write_json
 from src.common.utils import configure_loguru, log_exception
 
+SHA256_METADATA_KEY = "sha256"
+"""画像ファイルのSHA-256ハッシュ値を格納する、入力データのメタデータのキー"""
 
-def execute_annofabcli_input_data_put(project_id: str, json_info: list[dict[str, Any]], temp_dir: Path) -> None:
+
+def execute_annofabcli_input_data_put(project_id: str, json_info: list[dict[str, Any]], temp_dir: Path, *, overwrite: bool = False) -> None:
     json_file = temp_dir / f"{time.time()}--input_data_info.json"
-    json_file.write_text(json.dumps(json_info, ensure_ascii=False, indent=2), encoding="utf-8")
+    write_json(json_file, json_info)
 
     command = ["annofabcli", "input_data", "put", "--yes", "--project_id", project_id, "--json", f"file://{json_file!s}", "--parallelism", "4"]
+    if overwrite:
+        command.append("--overwrite")
+
+    subprocess.run(command, check=True)
+
+
+def execute_annofabcli_input_data_update_metadata(project_id: str, json_info: list[dict[str, Any]], temp_dir: Path) -> None:
+    json_file = temp_dir / f"{time.time()}--input_data_metadata.json"
+    write_json(json_file, json_info)
+
+    command = ["annofabcli", "input_data", "update_metadata_per_input_data", "--yes", "--project_id", project_id, "--json", f"file://{json_file!s}", "--parallelism", "4"]
 
     subprocess.run(command, check=True)
 
@@ -39,6 +59,176 @@ def create_target_input_data_info(coco_images: list[dict[str, Any]], image_dir:
     return af_results
 
 
+@dataclass
+class CocoImageFileCheckResult:
+    """
+    COCOデータセットのimagesと画像ファイルの整合性をチェックした結果
+    """
+
+    missing_file_names: list[str] = field(default_factory=list)
+    """画像ファイルが存在しない`file_name`のlist"""
+    unreadable_file_names: list[str] = field(default_factory=list)
+    """画像ファイルを読み込めなかった（権限がない、I/Oエラーなど）`file_name`のlist"""
+    unknown_size_file_names: list[str] = field(default_factory=list)
+    """画像サイズを取得できなかった（JPEGでもPNGでもない、ヘッダが壊れているなど）`file_name`のlist"""
+    size_mismatched_images: list[dict[str, Any]] = field(default_factory=list)
+    """画像ファイルのサイズと`width`,`height`が一致しないimageのlist。要素の`width`,`height`は画像ファイルのサイズに修正されています。"""
+    corrected_coco_images: list[dict[str, Any]] = field(default_factory=list)
+    """`width`,`height`を画像ファイルのサイズに修正したimagesのlist。画像ファイルが存在しない、または読み込めなかったimageは含みません。"""
+
+
+def check_coco_image_files(coco_images: list[dict[str, Any]], image_dir: Path, *, parallelism: int = 8) -> CocoImageFileCheckResult:
+    """
+    COCOデータセットのimagesに対応する画像ファイルが存在するか、画像のサイズが`width`,`height`と一致するかをチェックします。
+    画像ファイルはヘッダのみを読み込むので、画像全体はデコードしません。
+
+    Args:
+        coco_images: COCOデータセットのimages
+        image_dir: 画像ファイルが存在するディレクトリ
+        parallelism: 画像ファイルのヘッダを読み込むスレッド数
+    """
+    # ファイルの存在確認のたびに`stat`を呼ばないように、ディレクトリは1回だけ走査する
+    existing_file_names = list_files_in_dir(image_dir)
+
+    result = CocoImageFileCheckResult()
+    target_coco_images = []
+    for coco_image in coco_images:
+        if coco_image["file_name"] in existing_file_names:
+            target_coco_images.append(coco_image)
+        else:
+            result.missing_file_names.append(coco_image["file_name"])
+
+    def read_image_size_or_error(coco_image: dict[str, Any]) -> tuple[int, int] | OSError | None:
+        try:
+            return read_image_size(image_dir / coco_image["file_name"])
+        except OSError as e:
+            return e
+
+    with ThreadPoolExecutor(max_workers=parallelism) as executor:
+        image_sizes = executor.map(read_image_size_or_error, target_coco_images)
+
+        for coco_image, image_size in zip(target_coco_images, image_sizes, strict=True):
+            if isinstance(image_size, OSError):
+                logger.debug(f"画像ファイル'{image_dir / coco_image['file_name']}'を読み込めませんでした。 :: {image_size!r}")
+                result.unreadable_file_names.append(coco_image["file_name"])
+                continue
+            if image_size is None:
+                result.unknown_size_file_names.append(coco_image["file_name"])
+                result.corrected_coco_images.append(coco_image)
+                continue
+
+            width, height = image_size
+            if coco_image["width"] == width and coco_image["height"] == height:
+                result.corrected_coco_images.append(coco_image)
+                continue
+
+            corrected_coco_image = {**coco_image, "width": width, "height": height}
+            logger.debug(
+                f"COCOのimage.file_name='{coco_image['file_name']}'の画像サイズが画像ファイルと一致しません。 :: "
+                f"image.width={coco_image['width']}, image.height={coco_image['height']}, 画像ファイルのwidth={width}, 画像ファイルのheight={height}"
+            )
+            result.size_mismatched_images.append(corrected_coco_image)
+            result.corrected_coco_images.append(corrected_coco_image)
+
+    return result
+
+
+def filter_coco_images_by_image_file_check(coco_images: list[dict[str, Any]], image_dir: Path, *, parallelism: int, output_corrected_coco_images_json: Path | None) -> list[dict[str, Any]]:
+    """
+    画像ファイルをチェックして結果をログに出力し、画像ファイルが存在して読み込めたimagesのみを返します。
+    """
+    check_result = check_coco_image_files(coco_images, image_dir, parallelism=parallelism)
+    if len(check_result.missing_file_names) > 0:
+        logger.warning(f"{len(check_result.missing_file_names)}件のCOCOのimageは、画像ファイルが'{image_dir}'に存在しないので登録しません。 :: {check_result.missing_file_names}")
+    if len(check_result.unreadable_file_names) > 0:
+        logger.warning(f"{len(check_result.unreadable_file_names)}件のCOCOのimageは、画像ファイルを読み込めなかったので登録しません。 :: {check_result.unreadable_file_names}")
+    if len(check_result.unknown_size_file_names) > 0:
+        logger.warning(f"{len(check_result.unknown_size_file_names)}件の画像ファイルは、画像サイズを取得できませんでした。 :: {check_result.unknown_size_file_names}")
+    if len(check_result.size_mismatched_images) > 0:
+        logger.warning(
+            f"{len(check_result.size_mismatched_images)}件のCOCOのimageは、`width`,`height`が画像ファイルのサイズと一致しません。 :: "
+            f"{[img['file_name'] for img in check_result.size_mismatched_images]}"
+        )
+
+    if output_corrected_coco_images_json is not None:
+        output_corrected_coco_images_json.parent.mkdir(exist_ok=True, parents=True)
+        write_json(output_corrected_coco_images_json, check_result.corrected_coco_images, indent=True)
+        logger.info(f"`width`,`height`を画像ファイルのサイズに修正したCOCOのimages（{len(check_result.corrected_coco_images)}件）を、'{output_corrected_coco_images_json}'に出力しました。")
+
+    invalid_file_names = {*check_result.missing_file_names, *check_result.unreadable_file_names}
+    return [img for img in coco_images if img["file_name"] not in invalid_file_names]
+
+
+def calculate_coco_image_sha256s(coco_images: list[dict[str, Any]], image_dir: Path, hash_cache: FileHashCache, *, parallelism: int = 8) -> dict[str, str]:
+    """
+    COCOデータセットのimagesに対応する画像ファイルのSHA-256ハッシュ値を、並列に計算します。
+
+    Returns:
+        keyが`file_name`、valueがSHA-256ハッシュ値のdict。画像ファイルが存在しないimageは含みません。
+    """
+
+    def get_sha256(coco_image: dict[str, Any]) -> str | None:
+        try:
+            return hash_cache.get_sha256(image_dir / coco_image["file_name"])
+        except FileNotFoundError:
+            return None
+
+    with ThreadPoolExecutor(max_workers=parallelism) as executor:
+        sha256s = executor.map(get_sha256, coco_images)
+        return {coco_image["file_name"]: sha256 for coco_image, sha256 in zip(coco_images, sha256s, strict=True) if sha256 is not None}
+
+
+def find_duplicated_images(sha256_by_file_name: dict[str, str]) -> list[list[str]]:
+    """
+    中身が同じ画像ファイルを探します。
+
+    Returns:
+        中身が同じ画像ファイルの`file_name`のlistのlist
+    """
+    file_names_by_sha256 = collections.defaultdict(list)
+    for file_name, sha256 in sha256_by_file_name.items():
+        file_names_by_sha256[sha256].append(file_name)
+    return [file_names for file_names in file_names_by_sha256.values() if len(file_names) > 1]
+
+
+def exclude_registered_images(coco_images: list[dict[str, Any]], sha256_by_file_name: dict[str, str], af_input_data_list: list[dict[str, Any]]) -> list[dict[str, Any]]:
+    """
+    すでにAnnofabに登録されている画像を除外します。
+    `input_data_name`が`file_name`と一致し、かつメタデータに格納されているハッシュ値が画像ファイルのハッシュ値と一致する入力データは、登録済とみなします。
+    メタデータにハッシュ値が格納されていない入力データ（ハッシュ値を格納する前に登録した入力データ）は、中身が変更されたか分からないので登録済とみなします。
+
+    Args:
+        coco_images: COCOデータセットのimages
+        sha256_by_file_name: keyが`file_name`、valueがSHA-256ハッシュ値のdict
+        af_input_data_list: Annofabの入力データ全件ファイルの中身
+
+    Returns:
+        まだ登録されていない（または中身が変更された）画像に対応するimages
+    """
+    registered_sha256_by_name = {input_data["input_data_name"]: input_data["metadata"].get(SHA256_METADATA_KEY) for input_data in af_input_data_list}
+    target_coco_images = []
+    for coco_image in coco_images:
+        file_name = coco_image["file_name"]
+        if file_name in registered_sha256_by_name and registered_sha256_by_name[file_name] in {None, sha256_by_file_name[file_name]}:
+            continue
+        target_coco_images.append(coco_image)
+    return target_coco_images
+
+
+def create_missing_sha256_metadata_info(coco_images: list[dict[str, Any]], sha256_by_file_name: dict[str, str], af_input_data_list: list[dict[str, Any]]) -> list[dict[str, Any]]:
+    """
+    メタデータにハッシュ値が格納されていない登録済の入力データに、画像ファイルのハッシュ値を格納するための情報を生成します。
+    `annofabcli input_data update_metadata_per_input_data`コマンドの`--json`オプションに渡します。
+    画像ファイルは登録し直さないので、次回以降はハッシュ値で登録済かどうかを判定できます。
+    """
+    target_file_names = {coco_image["file_name"] for coco_image in coco_images}
+    return [
+        {"input_data_id": input_data["input_data_id"], "metadata": {SHA256_METADATA_KEY: sha256_by_file_name[input_data["input_data_name"]]}}
+        for input_data in af_input_data_list
+        if input_data["input_data_name"] in target_file_names and input_data["metadata"].get(SHA256_METADATA_KEY) is None
+    ]
+
+
 def create_parser() -> ArgumentParser:
     parser = ArgumentParser(
         description="COCOデータセットのimagesから、Annofabに入力データを作成します。"
@@ -61,34 +251,111 @@ def create_parser() -> ArgumentParser:
     parser.add_argument("--coco_image_file_name", type=str, nargs="+", help="作成対象のCOCOのimageのfile_name")
     parser.add_argument("--temp_dir", type=Path, required=False, help="一時ディレクトリのパス")
 
+    parser.add_argument(
+        "--check_image_file",
+        action="store_true",
+        help="指定すると、入力データを登録する前に、画像ファイルが存在するかと、画像のサイズがCOCOのimageの`width`,`height`と一致するかをチェックします。"
+        "画像ファイルが存在しない、または読み込めないimageは登録しません。画像ファイルはヘッダのみ読み込みます（JPEGとPNGに対応）。",
+    )
+    parser.add_argument(
+        "--output_corrected_coco_images_json",
+        type=Path,
+        required=False,
+        help="`width`,`height`を画像ファイルのサイズに修正したCOCOのimagesを出力するJSONファイルのパス。`--check_image_file`と一緒に指定してください。",
+    )
+
+    parser.add_argument(
+        "--af_input_data_json",
+        type=Path,
+        required=False,
+        help="Annofabの入力データ全件ファイルのパス。指定すると、画像ファイルのSHA-256ハッシュ値を計算して、`input_data_name`とハッシュ値が一致する入力データは登録しません。"
+        "ハッシュ値は入力データのメタデータ`sha256`に格納されます。"
+        "`input_data_name`のみ一致する入力データは、画像ファイルを上書きして登録します。"
+        "メタデータにハッシュ値が格納されていない入力データは、画像ファイルは登録し直さずに、ハッシュ値のみ格納します。"
+        "`annofabcli input_data download`コマンドでダウンロードできます。",
+    )
+    parser.add_argument(
+        "--hash_cache_json",
+        type=Path,
+        required=False,
+        help="画像ファイルのハッシュ値のキャッシュファイルのパス。ファイルのパス、サイズ、更新日時が変わっていない画像ファイルは、ハッシュ値を再計算しません。"
+        "指定すると、`--af_input_data_json`を指定しなくても画像ファイルのハッシュ値を計算して、中身が同じ画像ファイルを出力します。",
+    )
+
+    parser.add_argument("--parallelism", type=int, default=8, help="画像ファイルを読み込むスレッド数")
+
     return parser
 
 
 @log_exception()
-def main() -> None:
-    args = create_parser().parse_args()
-    configure_loguru(is_verbose=args.verbose)
+def main(arguments: list[str] | None = None) -> None:
+    args = create_parser().parse_args(arguments)
+    configure_loguru(is_verbose=args.verbose, enqueue=args.enqueue_log)
     logger.info(f"argv={sys.argv}")
 
+    if args.output_corrected_coco_images_json is not None and not args.check_image_file:
+        raise ValueError("'--output_corrected_coco_images_json'を指定した場合は、'--check_image_file'も指定してください。")
+
     image_dir = args.image_dir
     af_project_id = args.af_project_id
 
-    coco_instances = json.loads(args.coco_instances_json.read_text())
-    coco_images = coco_instances["images"]
-    if args.coco_image_file_name is not None:
-        coco_images = [img for img in coco_images if img["file_name"] in args.coco_image_file_name]
+    # imagesだけを参照するので、annotationsは読み込まない
+    coco_images = read_coco_instances(args.coco_instances_json, target_image_file_names=args.coco_image_file_name, should_read_annotations=False)["images"]
+
+    if args.check_image_file:
+        coco_images = filter_coco_images_by_image_file_check(coco_images, image_dir, parallelism=args.parallelism, output_corrected_coco_images_json=args.output_corrected_coco_images_json)
+
+    sha256_by_file_name: dict[str, str] | None = None
+    missing_sha256_metadata_info: list[dict[str, Any]] = []
+    if args.af_input_data_json is not None or args.hash_cache_json is not None:
+        hash_cache = FileHashCache(args.hash_cache_json)
+        sha256_by_file_name = calculate_coco_image_sha256s(coco_images, image_dir, hash_cache, parallelism=args.parallelism)
+        hash_cache.save()
+        logger.info(f"{len(sha256_by_file_name)}件の画像ファイルのハッシュ値を計算しました。")
+
+        missing_file_names = [img["file_name"] for img in coco_images if img["file_name"] not in sha256_by_file_name]
+        if len(missing_file_names) > 0:
+            logger.warning(f"{len(missing_file_names)}件のCOCOのimageは、画像ファイルが'{image_dir}'に存在しないので登録しません。 :: {missing_file_names}")
+            coco_images = [img for img in coco_images if img["file_name"] in sha256_by_file_name]
+
+        duplicated_images = find_duplicated_images(sha256_by_file_name)
+        if len(duplicated_images) > 0:
+            logger.warning(f"中身が同じ画像ファイルが{len(duplicated_images)}組存在します。 :: {duplicated_images}")
+
+        if args.af_input_data_json is not None:
+            af_input_data_list = read_json(args.af_input_data_json)
+            target_coco_images = exclude_registered_images(coco_images, sha256_by_file_name, af_input_data_list)
+            logger.info(f"{len(coco_images) - len(target_coco_images)}件の画像は、すでにAnnofabに登録されているので登録しません。")
+            missing_sha256_metadata_info = create_missing_sha256_metadata_info(coco_images, sha256_by_file_name, af_input_data_list)
+            if len(missing_sha256_metadata_info) > 0:
+                logger.info(f"{len(missing_sha256_metadata_info)}件の入力データは、メタデータにハッシュ値が格納されていないので、画像ファイルは登録し直さずにハッシュ値のみ格納します。")
+            coco_images = target_coco_images
+
     json_info = create_target_input_data_info(coco_images, image_dir)
+    if len(json_info) == 0 and len(missing_sha256_metadata_info) == 0:
+        logger.info("Annofabへ登録する入力データはありません。")
+        return
 
-    logger.info(f"COCOデータセットのimage{len(json_info)}件を、Annofabへ入力データとして登録します。 :: af_project_id='{af_project_id}'")
+    def put_input_data(temp_dir: Path) -> None:
+        if len(json_info) > 0:
+            logger.info(f"COCOデータセットのimage{len(json_info)}件を、Annofabへ入力データとして登録します。 :: af_project_id='{af_project_id}'")
+            # 登録済の入力データと中身が異なる画像は、上書きして登録する
+            execute_annofabcli_input_data_put(af_project_id, json_info, temp_dir, overwrite=args.af_input_data_json is not None)
+        if sha256_by_file_name is not None:
+            metadata_json_info = [
+                *missing_sha256_metadata_info,
+                *({"input_data_id": info["input_data_id"], "metadata": {SHA256_METADATA_KEY: sha256_by_file_name[info["input_data_name"]]}} for info in json_info),
+            ]
+            execute_annofabcli_input_data_update_metadata(af_project_id, metadata_json_info, temp_dir)
 
     if args.temp_dir is not None:
         temp_dir = args.temp_dir
         temp_dir.mkdir(exist_ok=True, parents=True)
-        execute_annofabcli_input_data_put(af_project_id, json_info, temp_dir)
+        put_input_data(temp_dir)
     else:
         with tempfile.TemporaryDirectory() as temp_dir:
             temp_dir_path = Path(temp_dir)
-            execute_annofabcli_input_data_put(af_project_id, json_info, temp_dir_path)
+            put_input_data(temp_dir_path)
 
 
 if __name__ == "__main__":
@@ -1,5 +1,4 @@
 import argparse
-import json
 import subprocess
 import sys
 import tempfile
@@ -10,12 +9,13 @@ from pathlib import Path
 from loguru import logger
 
 from src.common.cli import create_parent_parser
+from src.common.json_file import read_json, write_json
 from src.common.utils import configure_loguru, log_exception
 
 
 def execute_annofabcli_task_put(project_id: str, json_info: dict[str, list[str]], temp_dir: Path) -> None:
     json_file = temp_dir / f"{time.time()}--task_info.json"
-    json_file.write_text(json.dumps(json_info, ensure_ascii=False, indent=2), encoding="utf-8")
+    write_json(json_file, json_info)
 
     logger.info(f"{len(json_info)}件のタスクをAnnofabに登録します。 :: project_id='{project_id}'")
 
@@ -36,7 +36,7 @@ def create_input_data_id_list_from_input_data_json(input_data_json: Path) -> lis
     入力データ全件ファイルに記載されている`input_data_id`のリストを生成します。
 
     """
-    input_data_list = json.loads(input_data_json.read_text())
+    input_data_list = read_json(input_data_json)
     return [item["input_data_id"] for item in input_data_list]
 
 
@@ -71,9 +71,9 @@ def create_parser() -> argparse.ArgumentParser:
 
 
 @log_exception()
-def main() -> None:
-    args = create_parser().parse_args()
-    configure_loguru(is_verbose=args.verbose)
+def main(arguments: list[str] | None = None) -> None:
+    args = create_parser().parse_args(arguments)
+    configure_loguru(is_verbose=args.verbose, enqueue=args.enqueue_log)
     logger.info(f"argv={sys.argv}")
 
     af_project_id = args.af_project_id
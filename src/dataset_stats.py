@@ -0,0 +1,318 @@
+import collections
+import math
+import sys
+import zipfile
+from argparse import ArgumentParser
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, TextIO
+
+from loguru import logger
+
+from src.common.cli import create_parent_parser
+from src.common.image import read_image_size_from_stream
+from src.common.json_file import dumps_json, open_json_for_read
+from src.common.json_stream import iter_json_object_members
+from src.common.mask import read_binary_image_as_cropped_mask
+from src.common.utils import ProgressLogger, configure_loguru, log_exception
+
+if TYPE_CHECKING:
+    from annofabapi.parser import SimpleAnnotationParser
+
+
+def get_area_histogram_bin(area: float) -> int:
+    """
+    面積のヒストグラムのビンを返します。ビンは面積の平方根（一辺の長さ）を2の累乗で区切ります。
+
+    Returns:
+        ビンの下限値（一辺の長さ）。`sqrt(area)`が1未満の場合は0
+    """
+    side_length = math.sqrt(area) if area > 0 else 0
+    if side_length < 1:
+        return 0
+    return 2 ** math.floor(math.log2(side_length))
+
+
+class AnnotationStatsAccumulator:
+    """
+    アノテーションの件数、種類ごとの件数、面積のヒストグラムを集計します。
+    集計結果のみを保持するので、アノテーションの件数に関わらずメモリ使用量は一定です。
+    """
+
+    def __init__(self) -> None:
+        self.annotation_count = 0
+        self.type_counts: collections.Counter[str] = collections.Counter()
+        self.area_histogram: collections.Counter[int] = collections.Counter()
+
+    def add(self, annotation_type: str, area: float | None) -> None:
+        """
+        Args:
+            annotation_type: アノテーションの種類
+            area: アノテーションの面積。不明な場合はNone（ヒストグラムには含めません）
+        """
+        self.annotation_count += 1
+        self.type_counts[annotation_type] += 1
+        if area is not None:
+            self.area_histogram[get_area_histogram_bin(area)] += 1
+
+    def to_dict(self) -> dict[str, Any]:
+        area_histogram = {}
+        for lower in sorted(self.area_histogram):
+            upper = max(lower * 2, 1)
+            area_histogram[f"{lower}-{upper}"] = self.area_histogram[lower]
+        return {
+            "annotation_count": self.annotation_count,
+            "type_counts": dict(self.type_counts.most_common()),
+            # keyは面積の平方根（一辺の長さ）の範囲
+            "area_histogram": area_histogram,
+        }
+
+
+def get_coco_annotation_type(coco_annotation: dict[str, Any]) -> str:
+    """
+    COCOのannotationの`segmentation`の種類を返します。
+    """
+    segmentation = coco_annotation.get("segmentation")
+    if isinstance(segmentation, list):
+        if len(segmentation) == 0:
+            return "no_segmentation"
+        return "polygon" if len(segmentation) == 1 else "multi_polygon"
+    if isinstance(segmentation, dict):
+        return "uncompressed_rle" if isinstance(segmentation.get("counts"), list) else "compressed_rle"
+    return "no_segmentation"
+
+
+def calculate_coco_instances_stats(fp: TextIO) -> dict[str, Any]:
+    """
+    COCOデータセット（Instances）のJSONを1回だけ読み込んで、統計情報を算出します。
+    annotationsは1件ずつ読み込むので、annotationsの件数に関わらずメモリ使用量は一定です（imagesのIDは保持します）。
+
+    Args:
+        fp: COCOデータセット（Instances）のJSONファイルのファイルオブジェクト
+
+    Returns:
+        統計情報。`projected_conversion`は、Annofab形式に変換したときの処理量の見積もりです。
+    """
+    total_stats = AnnotationStatsAccumulator()
+    stats_by_category_id: dict[int, AnnotationStatsAccumulator] = collections.defaultdict(AnnotationStatsAccumulator)
+    category_names_by_id: dict[int, str] = {}
+    image_ids: set[int] = set()
+    annotated_image_ids: set[int] = set()
+    polygon_count = 0
+    segmentation_image_count = 0
+    segmentation_canvas_pixel_count = 0
+
+    progress_logger = ProgressLogger("COCOデータセットを読み込み中")
+    for key, value in iter_json_object_members(fp, stream_keys={"images", "annotations", "categories"}):
+        match key:
+            case "images":
+                image_ids.add(value["id"])
+            case "categories":
+                category_names_by_id[value["id"]] = value["name"]
+            case "annotations":
+                progress_logger.update()
+                annotation_type = get_coco_annotation_type(value)
+                area = value.get("area")
+                if area is None and "bbox" in value:
+                    area = value["bbox"][2] * value["bbox"][3]
+                total_stats.add(annotation_type, area)
+                stats_by_category_id[value["category_id"]].add(annotation_type, area)
+                annotated_image_ids.add(value["image_id"])
+
+                if annotation_type in {"polygon", "multi_polygon"}:
+                    # Annofabはマルチポリゴンに対応していないので、ポリゴンごとにアノテーションを作成する
+                    polygon_count += len(value["segmentation"])
+                elif annotation_type in {"uncompressed_rle", "compressed_rle"}:
+                    height, width = value["segmentation"]["size"]
+                    segmentation_image_count += 1
+                    segmentation_canvas_pixel_count += height * width
+
+    return {
+        "format": "coco",
+        "image_count": len(image_ids),
+        "images_without_annotations_count": len(image_ids - annotated_image_ids),
+        **total_stats.to_dict(),
+        "categories": {category_names_by_id.get(category_id, str(category_id)): stats.to_dict() for category_id, stats in sorted(stats_by_category_id.items())},
+        "projected_conversion": {
+            "af_annotation_json_count": len(annotated_image_ids),
+            "af_detail_count": {
+                "bbox": total_stats.annotation_count,
+                "polygon_segmentation": polygon_count,
+                "rle_segmentation": segmentation_image_count,
+            },
+            # 塗りつぶし画像のキャンバス（画像全体）のピクセル数の合計。塗りつぶし画像に変換（エンコード）する量なので、変換時間とアップロード量の目安
+            "segmentation_image_count": segmentation_image_count,
+            "segmentation_canvas_pixel_count": segmentation_canvas_pixel_count,
+        },
+    }
+
+
+def _calculate_polygon_area(points: list[dict[str, int]]) -> float:
+    """
+    Annofab形式のポリゴンの面積を、座標の公式（shoelace formula）で計算します。
+    """
+    doubled_area = 0
+    for index, point in enumerate(points):
+        next_point = points[(index + 1) % len(points)]
+        doubled_area += point["x"] * next_point["y"] - next_point["x"] * point["y"]
+    return abs(doubled_area) / 2
+
+
+def _read_af_annotation_details(af_parser: "SimpleAnnotationParser", *, should_count_segmentation_area: bool) -> tuple[list[tuple[str, str, float | None]], int]:
+    """
+    Annofab形式のアノテーションJSONファイルを1個読み込んで、アノテーションごとの統計情報を返します。
+
+    Returns:
+        tuple[0]: アノテーションごとの、ラベル名と種類と面積（不明な場合はNone）
+        tuple[1]: 塗りつぶし画像のキャンバスのピクセル数の合計
+    """
+    af_annotation = af_parser.load_json()
+    detail_stats: list[tuple[str, str, float | None]] = []
+    canvas_pixel_count = 0
+    for af_detail in af_annotation["details"]:
+        data = af_detail["data"]
+        annotation_type = data["_type"]
+        area: float | None = None
+        match annotation_type:
+            case "BoundingBox":
+                area = (data["right_bottom"]["x"] - data["left_top"]["x"]) * (data["right_bottom"]["y"] - data["left_top"]["y"])
+            case "Points":
+                area = _calculate_polygon_area(data["points"])
+            case "Segmentation":
+                with af_parser.open_outer_file(af_detail["annotation_id"]) as f:
+                    if should_count_segmentation_area:
+                        cropped_mask = read_binary_image_as_cropped_mask(f)
+                        area = cropped_mask.get_area()
+                        canvas_pixel_count += cropped_mask.image_width * cropped_mask.image_height
+                    else:
+                        image_size = read_image_size_from_stream(f)
+                        if image_size is None:
+                            raise ValueError(f"塗りつぶし画像'{af_detail['annotation_id']}'のサイズを読み込めませんでした。")
+                        canvas_pixel_count += image_size[0] * image_size[1]
+        detail_stats.append((af_detail["label"], annotation_type, area))
+    return detail_stats, canvas_pixel_count
+
+
+def calculate_af_annotation_stats(af_annotation_zip_or_dir: Path, *, should_count_segmentation_area: bool = False) -> dict[str, Any]:
+    """
+    Annofab形式のアノテーションZIPまたはディレクトリを1回だけ走査して、統計情報を算出します。
+    JSONファイルを1個ずつ読み込むので、JSONファイルの個数に関わらずメモリ使用量は一定です。
+    読み込めなかったJSONファイルは警告を出力してスキップし、`failed_json_count`として数えます。
+
+    Args:
+        af_annotation_zip_or_dir: Annofab形式のアノテーションZIPファイルまたはそれを展開したディレクトリのパス
+        should_count_segmentation_area: Trueならば、塗りつぶし画像をデコードして、塗られているピクセル数を面積とします。
+            Falseならば塗りつぶし画像のヘッダだけを読み込んで画像のサイズを取得するので、塗りつぶしアノテーションは面積のヒストグラムに含めません。
+
+    Returns:
+        統計情報。`projected_conversion`は、COCO形式に変換したときの処理量の見積もりです。
+    """
+    from annofabapi.parser import lazy_parse_simple_annotation_dir, lazy_parse_simple_annotation_zip  # noqa: PLC0415
+
+    if zipfile.is_zipfile(af_annotation_zip_or_dir):
+        iter_af_annotation_parser = lazy_parse_simple_annotation_zip(af_annotation_zip_or_dir)
+    elif af_annotation_zip_or_dir.is_dir():
+        iter_af_annotation_parser = lazy_parse_simple_annotation_dir(af_annotation_zip_or_dir)
+    else:
+        raise ValueError(f"'{af_annotation_zip_or_dir}'はZIPファイルでもディレクトリでもありません。")
+
+    total_stats = AnnotationStatsAccumulator()
+    stats_by_label: dict[str, AnnotationStatsAccumulator] = collections.defaultdict(AnnotationStatsAccumulator)
+    json_count = 0
+    json_without_annotations_count = 0
+    failed_json_count = 0
+    coco_annotation_count = 0
+    segmentation_image_count = 0
+    segmentation_canvas_pixel_count = 0
+
+    progress_logger = ProgressLogger("Annofab形式のアノテーションJSONファイルを読み込み中")
+    for af_parser in iter_af_annotation_parser:
+        progress_logger.update()
+        try:
+            detail_stats, canvas_pixel_count = _read_af_annotation_details(af_parser, should_count_segmentation_area=should_count_segmentation_area)
+        except Exception:
+            logger.opt(exception=True).warning(f"AnnofabのアノテーションJSONファイル'{af_parser.json_file_path}'の読み込みに失敗しました。")
+            failed_json_count += 1
+            continue
+
+        # 途中で失敗したJSONファイルを統計情報に含めないように、JSONファイルを読み込み終えてから加算する
+        json_count += 1
+        if len(detail_stats) == 0:
+            json_without_annotations_count += 1
+        for label, annotation_type, area in detail_stats:
+            total_stats.add(annotation_type, area)
+            stats_by_label[label].add(annotation_type, area)
+            if annotation_type in {"BoundingBox", "Points", "Segmentation"}:
+                coco_annotation_count += 1
+            if annotation_type == "Segmentation":
+                segmentation_image_count += 1
+        segmentation_canvas_pixel_count += canvas_pixel_count
+
+    if failed_json_count > 0:
+        logger.warning(f"{failed_json_count}個のAnnofabのアノテーションJSONファイルは、読み込みに失敗したので統計情報に含めていません。")
+
+    return {
+        "format": "annofab",
+        "image_count": json_count,
+        "images_without_annotations_count": json_without_annotations_count,
+        "failed_json_count": failed_json_count,
+        **total_stats.to_dict(),
+        "categories": {label: stats.to_dict() for label, stats in sorted(stats_by_label.items())},
+        "projected_conversion": {
+            "coco_annotation_count": coco_annotation_count,
+            # 塗りつぶし画像のキャンバス（画像全体）のピクセル数の合計。Uncompressed RLEに変換（デコード）する量なので、変換時間の目安
+            "segmentation_image_count": segmentation_image_count,
+            "segmentation_canvas_pixel_count": segmentation_canvas_pixel_count,
+        },
+    }
+
+
+def create_parser() -> ArgumentParser:
+    parser = ArgumentParser(
+        description="COCOデータセット（Instances）またはAnnofab形式のアノテーションを1回だけ走査して、統計情報を出力します。"
+        "カテゴリ（ラベル）ごと・種類ごとのアノテーション数、面積のヒストグラム、変換したときの処理量の見積もりを出力します。",
+        parents=[create_parent_parser()],
+    )
+
+    input_group = parser.add_mutually_exclusive_group(required=True)
+    input_group.add_argument("--coco_instances_json", type=Path, help="COCOデータセット（Instances）形式アノテーションのJSONファイルのパス")
+    input_group.add_argument("--af_annotation_zip_or_dir", type=Path, help="Annofab形式のアノテーションZIPファイルのパス。またはZIPファイルを展開したディレクトリのパス。")
+
+    parser.add_argument(
+        "--count_segmentation_area",
+        action="store_true",
+        help="Annofab形式のアノテーションの場合、塗りつぶし画像をデコードして、塗られているピクセル数を面積として数えます。"
+        "未指定の場合は塗りつぶし画像のヘッダだけを読み込むので高速ですが、塗りつぶしアノテーションは面積のヒストグラムに含めません。",
+    )
+
+    parser.add_argument("-o", "--output_json", type=Path, help="統計情報の出力先JSONファイルのパス。未指定の場合は標準出力に出力します。")
+
+    return parser
+
+
+@log_exception()
+def main(arguments: list[str] | None = None) -> None:
+    args = create_parser().parse_args(arguments)
+    configure_loguru(is_verbose=args.verbose, enqueue=args.enqueue_log)
+    logger.info(f"argv={sys.argv}")
+
+    if args.coco_instances_json is not None and args.count_segmentation_area:
+        raise ValueError("'--coco_instances_json'を指定した場合は、'--count_segmentation_area'は指定できません。")
+
+    if args.coco_instances_json is not None:
+        # gzipで圧縮されている場合も、展開しながら読み込むので一時ファイルは作成しない
+        with open_json_for_read(args.coco_instances_json) as f:
+            stats = calculate_coco_instances_stats(f)
+    else:
+        stats = calculate_af_annotation_stats(args.af_annotation_zip_or_dir, should_count_segmentation_area=args.count_segmentation_area)
+
+    logger.info(f"{stats['image_count']}件の画像に含まれる{stats['annotation_count']}件のアノテーションの統計情報を算出しました。")
+    stats_json = dumps_json(stats, indent=True).decode("utf-8")
+    if args.output_json is not None:
+        args.output_json.parent.mkdir(exist_ok=True, parents=True)
+        args.output_json.write_text(stats_json)
+    else:
+        print(stats_json)  # noqa: T201
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+import sys
+import tempfile
+from argparse import ArgumentParser
+from collections.abc import Iterator
+from pathlib import Path
+from typing import IO, Any
+
+from loguru import logger
+
+from src.common.cli import add_gzip_compression_level_argument, add_json_indent_argument, create_parent_parser
+from src.common.json_file import DEFAULT_GZIP_COMPRESSION_LEVEL, dumps_json, loads_json, open_json_for_write, read_json
+from src.common.json_stream import StreamingJsonObjectWriter
+from src.common.utils import configure_loguru, log_exception
+
+
+class _IdAllocator:
+    """
+    重複しないIDを割り当てます。
+    """
+
+    def __init__(self) -> None:
+        self._used_ids: set[int] = set()
+        self._max_id = 0
+
+    def allocate(self, preferred_id: int) -> int:
+        """
+        `preferred_id`が未使用ならば`preferred_id`を、使用済ならば使用済のIDの最大値+1を割り当てます。
+        """
+        new_id = preferred_id if preferred_id not in self._used_ids else self._max_id + 1
+        self._used_ids.add(new_id)
+        self._max_id = max(self._max_id, new_id)
+        return new_id
+
+
+class CocoInstancesMerger:
+    """
+    複数のCOCOデータセット（Instances）を1個にマージします。
+
+    * imagesは`file_name`で、categoriesは`name`で重複を除きます。
+    * image, categoryのIDは、最初に出現したものを引き継ぎます。ただし、別のimage, categoryがすでに同じIDを使っている場合は、新しいIDを割り当てます。
+    * annotationのIDは、1から振り直します。
+    """
+
+    def __init__(self) -> None:
+        self.images_by_file_name: dict[str, dict[str, Any]] = {}
+        self.categories_by_name: dict[str, dict[str, Any]] = {}
+        self._image_id_allocator = _IdAllocator()
+        self._category_id_allocator = _IdAllocator()
+        self._next_annotation_id = 1
+
+    def _merge_images(self, coco_images: list[dict[str, Any]]) -> dict[int, int]:
+        """
+        imagesをマージして、マージ前のimage_idからマージ後のimage_idへの対応を返します。
+        """
+        image_id_mapping = {}
+        for coco_image in coco_images:
+            merged_image = self.images_by_file_name.get(coco_image["file_name"])
+            if merged_image is None:
+                merged_image = {**coco_image, "id": self._image_id_allocator.allocate(coco_image["id"])}
+                self.images_by_file_name[coco_image["file_name"]] = merged_image
+            image_id_mapping[coco_image["id"]] = merged_image["id"]
+        return image_id_mapping
+
+    def _merge_categories(self, coco_categories: list[dict[str, Any]]) -> dict[int, int]:
+        """
+        categoriesをマージして、マージ前のcategory_idからマージ後のcategory_idへの対応を返します。
+        """
+        category_id_mapping = {}
+        for coco_category in coco_categories:
+            merged_category = self.categories_by_name.get(coco_category["name"])
+            if merged_category is None:
+                merged_category = {**coco_category, "id": self._category_id_allocator.allocate(coco_category["id"])}
+                self.categories_by_name[coco_category["name"]] = merged_category
+            category_id_mapping[coco_category["id"]] = merged_category["id"]
+        return category_id_mapping
+
+    def merge_images_and_categories(self, coco_instances: dict[str, Any]) -> tuple[dict[int, int], dict[int, int]]:
+        """
+        1個のCOCOデータセットのimagesとcategoriesをマージします。
+        マージ済のimages, categoriesを再度マージしても、IDは変わりません。
+        annotationsより先にimagesを出力する場合は、すべてのCOCOデータセットについてこのメソッドを呼び出してから`merge`を呼び出してください。
+
+        Returns:
+            tuple[0]: マージ前のimage_idからマージ後のimage_idへの対応
+            tuple[1]: マージ前のcategory_idからマージ後のcategory_idへの対応
+        """
+        return self._merge_images(coco_instances["images"]), self._merge_categories(coco_instances["categories"])
+
+    def merge(self, coco_instances: dict[str, Any]) -> Iterator[dict[str, Any]]:
+        """
+        1個のCOCOデータセットのimagesとcategoriesをマージして、IDを振り直したannotationsを返します。
+        """
+        image_id_mapping, category_id_mapping = self.merge_images_and_categories(coco_instances)
+        for coco_annotation in coco_instances["annotations"]:
+            yield {
+                **coco_annotation,
+                "id": self._next_annotation_id,
+                "image_id": image_id_mapping[coco_annotation["image_id"]],
+                "category_id": category_id_mapping[coco_annotation["category_id"]],
+            }
+            self._next_annotation_id += 1
+
+
+def iter_annotations_from_temp_file(fp: IO[bytes]) -> Iterator[dict[str, Any]]:
+    fp.seek(0)
+    for line in fp:
+        yield loads_json(line)
+
+
+def merge_coco_instances_files(input_coco_instances_jsons: list[Path], output_coco_instances_json: Path, *, gzip_compression_level: int = DEFAULT_GZIP_COMPRESSION_LEVEL, indent: bool = False) -> None:
+    """
+    複数のCOCOデータセット（Instances）のJSONファイルを、1個のJSONファイルにマージします。
+    メモリ使用量を抑えるため、入力ファイルは1個ずつ読み込みます。
+    annotationsは一時ファイルに書き出して、最後に出力ファイルへ書き出します。
+
+    Args:
+        input_coco_instances_jsons: マージするCOCOデータセット（Instances）のJSONファイルのlist
+        output_coco_instances_json: マージしたCOCOデータセット（Instances）の出力先。拡張子が`.gz`の場合はgzipで圧縮して出力します。
+        gzip_compression_level: gzipの圧縮レベル
+        indent: Trueならば、出力するJSONを2文字でインデントします。
+    """
+    merger = CocoInstancesMerger()
+    output_coco_instances_json.parent.mkdir(exist_ok=True, parents=True)
+    with tempfile.TemporaryFile(mode="w+b", dir=output_coco_instances_json.parent) as temp_file:
+        annotation_count = 0
+        for input_json in input_coco_instances_jsons:
+            coco_instances = read_json(input_json)
+            for coco_annotation in merger.merge(coco_instances):
+                temp_file.write(dumps_json(coco_annotation) + b"\n")
+                annotation_count += 1
+            logger.debug(f"'{input_json}'をマージしました。")
+            # 次のファイルを読み込む前に、メモリを解放する
+            del coco_instances
+
+        with open_json_for_write(output_coco_instances_json, compression_level=gzip_compression_level) as f, StreamingJsonObjectWriter(f, indent=indent) as writer:
+            writer.write("images", list(merger.images_by_file_name.values()))
+            writer.write_array("annotations", iter_annotations_from_temp_file(temp_file))
+            writer.write("categories", list(merger.categories_by_name.values()))
+
+    logger.info(
+        f"{len(input_coco_instances_jsons)}個のCOCOデータセットをマージして、'{output_coco_instances_json}'に出力しました。 :: "
+        f"images={len(merger.images_by_file_name)}件, annotations={annotation_count}件, categories={len(merger.categories_by_name)}件"
+    )
+
+
+def create_parser() -> ArgumentParser:
+    parser = ArgumentParser(
+        description="複数のCOCOデータセット（Instances）を1個にマージします。`--num_shards`を指定して分割して変換した結果をマージするのに利用します。"
+        "imagesは`file_name`で、categoriesは`name`で重複を除きます。annotationのIDは1から振り直します。",
+        parents=[create_parent_parser()],
+    )
+
+    parser.add_argument("--coco_instances_json", type=Path, nargs="+", required=True, help="マージするCOCOデータセット（Instances）形式アノテーションのJSONファイルのパス")
+    parser.add_argument(
+        "-o",
+        "--output_coco_instances_json",
+        type=Path,
+        required=True,
+        help="マージしたCOCOデータセット（Instances）形式アノテーションの出力先JSONファイルのパス。拡張子が`.gz`の場合はgzipで圧縮して出力します。",
+    )
+    add_gzip_compression_level_argument(parser)
+    add_json_indent_argument(parser)
+
+    return parser
+
+
+@log_exception()
+def main(arguments: list[str] | None = None) -> None:
+    args = create_parser().parse_args(arguments)
+    configure_loguru(is_verbose=args.verbose, enqueue=args.enqueue_log)
+    logger.info(f"argv={sys.argv}")
+
+    merge_coco_instances_files(args.coco_instances_json, args.output_coco_instances_json, gzip_compression_level=args.gzip_compression_level, indent=args.indent)
+
+
+if __name__ == "__main__":
+    main()
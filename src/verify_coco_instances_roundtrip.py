@@ -0,0 +1,359 @@
+import collections
+import os
+import sys
+import tempfile
+from argparse import ArgumentParser
+from collections.abc import Iterator
+from concurrent.futures import Future, ProcessPoolExecutor
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import IO, TYPE_CHECKING, Any, assert_never
+
+from loguru import logger
+
+from src.common.cli import create_parent_parser
+from src.common.json_file import read_json, write_json
+from src.common.utils import ProgressLogger, configure_loguru, log_exception
+from src.convert_coco_instances_annotation_to_af import CocoAnnotationType
+
+# 起動時間を短くするため、numpy, pycocotoolsは必要になった時点でimportする
+if TYPE_CHECKING:
+    import numpy
+
+IMAGE_CHUNK_SIZE = 500
+"""1個のプロセスでまとめて検証するimagesの件数"""
+
+MAX_PENDING_CHUNKS_PER_PROCESS = 2
+"""プロセスごとに、結果を受け取る前に投入しておくチャンクの最大数"""
+
+
+@dataclass
+class RoundtripMismatch:
+    """
+    往復変換（COCO → Annofab → COCO）で一致しなかったannotation
+    """
+
+    image_id: int
+    file_name: str
+    annotation_id: int
+    reason: str
+    """一致しなかった理由。`missing`:変換後のannotationが存在しない, `category_mismatch`:category_idが異なる, `low_iou`:IoUが閾値未満"""
+    bbox_iou: float | None = None
+    mask_iou: float | None = None
+
+
+@dataclass
+class RoundtripVerificationResult:
+    image_count: int = 0
+    annotation_count: int = 0
+    mismatches: list[RoundtripMismatch] = field(default_factory=list)
+
+    def add(self, other: "RoundtripVerificationResult") -> None:
+        self.image_count += other.image_count
+        self.annotation_count += other.annotation_count
+        self.mismatches.extend(other.mismatches)
+
+
+class _AnnofabOuterFileDirParser:
+    """
+    Annofab形式に変換した塗りつぶし画像を読み込むためのパーサー。`SimpleAnnotationParser`の`open_outer_file`のみを実装しています。
+    """
+
+    def __init__(self, task_id: str, input_data_id: str, af_input_data_dir: Path) -> None:
+        self.task_id = task_id
+        self.input_data_id = input_data_id
+        self.af_input_data_dir = af_input_data_dir
+
+    @contextmanager
+    def open_outer_file(self, data_uri: str) -> Iterator[IO[bytes]]:
+        with (self.af_input_data_dir / data_uri).open("rb") as f:
+            yield f
+
+
+def _is_target_annotation(coco_annotation: dict[str, Any], coco_annotation_type: CocoAnnotationType) -> bool:
+    match coco_annotation_type:
+        case CocoAnnotationType.BBOX:
+            return True
+        case CocoAnnotationType.POLYGON_SEGMENTATION:
+            return coco_annotation["iscrowd"] == 0
+        case CocoAnnotationType.RLE_SEGMENTATION:
+            return coco_annotation["iscrowd"] == 1
+        case _ as unreachable:
+            assert_never(unreachable)
+
+
+def _get_union_bbox(coco_annotations: list[dict[str, Any]]) -> list[float]:
+    """
+    複数のannotationの`bbox`を囲む`bbox`を返します。マルチポリゴンは複数のannotationに分割されるので、比較するときに1個にまとめます。
+    """
+    min_x = min(anno["bbox"][0] for anno in coco_annotations)
+    min_y = min(anno["bbox"][1] for anno in coco_annotations)
+    max_x = max(anno["bbox"][0] + anno["bbox"][2] for anno in coco_annotations)
+    max_y = max(anno["bbox"][1] + anno["bbox"][3] for anno in coco_annotations)
+    return [min_x, min_y, max_x - min_x, max_y - min_y]
+
+
+def _get_rles(segmentations_list: list[list[Any]], image_height: int, image_width: int) -> list[dict[str, Any]]:
+    """
+    COCOの`segmentation`（ポリゴンまたはRLE）のlistのlistを、compressed RLEのlistに変換します。
+    `segmentations_list[i]`に含まれる`segmentation`は、1個のRLEにまとめます。
+    1個のimageに含まれるポリゴンは、`pycocotools.mask.frPyObjects`でまとめて変換します。
+    """
+    import numpy  # noqa: PLC0415
+    import pycocotools.mask  # noqa: PLC0415
+
+    rle_parts: list[list[Any]] = [[] for _ in segmentations_list]
+    polygons = []
+    polygon_owner_indices = []
+    for index, segmentations in enumerate(segmentations_list):
+        for segmentation in segmentations:
+            if isinstance(segmentation, list):
+                polygons.extend(segmentation)
+                polygon_owner_indices.extend([index] * len(segmentation))
+            elif isinstance(segmentation["counts"], list):
+                rle_parts[index].append(pycocotools.mask.frPyObjects(segmentation, image_height, image_width))
+            else:
+                rle_parts[index].append(segmentation)
+
+    if len(polygons) > 0:
+        for owner_index, polygon_rle in zip(polygon_owner_indices, pycocotools.mask.frPyObjects(polygons, image_height, image_width), strict=True):
+            rle_parts[owner_index].append(polygon_rle)
+
+    rles = []
+    for parts in rle_parts:
+        if len(parts) == 0:
+            rles.append(pycocotools.mask.encode(numpy.zeros((image_height, image_width, 1), dtype=numpy.uint8, order="F"))[0])
+        elif len(parts) == 1:
+            rles.append(parts[0])
+        else:
+            rles.append(pycocotools.mask.merge(parts))
+    return rles
+
+
+def _calculate_ious(dt: "list[Any] | numpy.ndarray", gt: "list[Any] | numpy.ndarray") -> "numpy.ndarray":
+    """
+    `dt[i]`と`gt[i]`のIoUを、`pycocotools.mask.iou`でまとめて計算します。
+    """
+    import numpy  # noqa: PLC0415
+    import pycocotools.mask  # noqa: PLC0415
+
+    if len(gt) == 0:
+        return numpy.empty(0)
+    return numpy.diagonal(pycocotools.mask.iou(dt, gt, [0] * len(gt)))
+
+
+def compare_roundtrip_annotations(
+    coco_image: dict[str, Any],
+    original_annotations: list[dict[str, Any]],
+    roundtrip_annotations_by_original_id: dict[int, list[dict[str, Any]]],
+    *,
+    should_compare_mask: bool,
+    min_iou: float,
+) -> list[RoundtripMismatch]:
+    """
+    1個のimageについて、元のannotationと往復変換したannotationを比較します。
+
+    Args:
+        coco_image: COCOのimage
+        original_annotations: 元のannotation
+        roundtrip_annotations_by_original_id: keyが元のannotationのid、valueが往復変換したannotationのlist（マルチポリゴンは複数になる）
+        should_compare_mask: Trueならば`bbox`に加えて`segmentation`のIoUも比較します。
+        min_iou: IoUの下限値。IoUがこの値未満のannotationは一致しなかったとみなします。
+
+    Returns:
+        一致しなかったannotationのlist
+    """
+    import numpy  # noqa: PLC0415
+
+    image_id = coco_image["id"]
+    file_name = coco_image["file_name"]
+    mismatches = []
+    pairs = []
+    for original in original_annotations:
+        roundtrip_annotations = roundtrip_annotations_by_original_id.get(original["id"], [])
+        if len(roundtrip_annotations) == 0:
+            mismatches.append(RoundtripMismatch(image_id=image_id, file_name=file_name, annotation_id=original["id"], reason="missing"))
+        elif any(anno["category_id"] != original["category_id"] for anno in roundtrip_annotations):
+            mismatches.append(RoundtripMismatch(image_id=image_id, file_name=file_name, annotation_id=original["id"], reason="category_mismatch"))
+        else:
+            pairs.append((original, roundtrip_annotations))
+
+    bbox_ious = _calculate_ious(
+        numpy.array([_get_union_bbox(roundtrip_annotations) for _, roundtrip_annotations in pairs], dtype=numpy.float64).reshape(-1, 4),
+        numpy.array([original["bbox"] for original, _ in pairs], dtype=numpy.float64).reshape(-1, 4),
+    )
+    if should_compare_mask:
+        height, width = coco_image["height"], coco_image["width"]
+        mask_ious = _calculate_ious(
+            _get_rles([[anno["segmentation"] for anno in roundtrip_annotations] for _, roundtrip_annotations in pairs], height, width),
+            _get_rles([[original["segmentation"]] for original, _ in pairs], height, width),
+        )
+    else:
+        mask_ious = None
+
+    for index, (original, _) in enumerate(pairs):
+        bbox_iou = float(bbox_ious[index])
+        mask_iou = float(mask_ious[index]) if mask_ious is not None else None
+        if bbox_iou < min_iou or (mask_iou is not None and mask_iou < min_iou):
+            mismatches.append(RoundtripMismatch(image_id=image_id, file_name=file_name, annotation_id=original["id"], reason="low_iou", bbox_iou=bbox_iou, mask_iou=mask_iou))
+    return mismatches
+
+
+def verify_roundtrip_of_images(
+    coco_images: list[dict[str, Any]],
+    coco_annotations: list[dict[str, Any]],
+    coco_categories: list[dict[str, Any]],
+    coco_annotation_type: CocoAnnotationType,
+    *,
+    min_iou: float,
+) -> RoundtripVerificationResult:
+    """
+    COCOのannotationを、Annofab形式に変換してからCOCO形式に戻して、元のannotationと一致するかを検証します。
+    プロセスプールで実行できるように、必要なデータはすべて引数で受け取ります。
+
+    Args:
+        coco_images: 検証対象のimages
+        coco_annotations: `coco_images`に紐づくannotations
+        coco_categories: categories
+        coco_annotation_type: 検証対象のアノテーションの種類
+        min_iou: IoUの下限値
+    """
+    from src.convert_af_annotation_to_coco_instances import AnnotationConverterFromAnnofabToCoco  # noqa: PLC0415
+    from src.convert_coco_instances_annotation_to_af import AnnotationConverterFromCocoToAnnofab  # noqa: PLC0415
+
+    coco_to_af_converter = AnnotationConverterFromCocoToAnnofab({"images": coco_images, "annotations": coco_annotations, "categories": coco_categories}, coco_annotation_type)
+    af_to_coco_converter = AnnotationConverterFromAnnofabToCoco(coco_categories, coco_images)
+    annotations_by_image_id = collections.defaultdict(list)
+    for coco_annotation in coco_annotations:
+        if _is_target_annotation(coco_annotation, coco_annotation_type):
+            annotations_by_image_id[coco_annotation["image_id"]].append(coco_annotation)
+
+    result = RoundtripVerificationResult()
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for coco_image in coco_images:
+            file_name = coco_image["file_name"]
+            original_annotations = annotations_by_image_id[coco_image["id"]]
+
+            af_input_data_dir = Path(temp_dir) / str(coco_image["id"])
+            af_details, _ = coco_to_af_converter.convert_annotations_to_af_details(coco_image, af_input_data_dir)
+            af_annotation = {"task_id": file_name, "input_data_id": file_name, "input_data_name": file_name, "details": af_details}
+            af_parser = _AnnofabOuterFileDirParser(file_name, file_name, af_input_data_dir)
+            roundtrip_annotations, _ = af_to_coco_converter.convert_af_annotation(af_annotation, af_parser, coco_image, coco_start_annotation_id=1)  # type: ignore[arg-type]
+
+            # Annofabのdetailの順番で変換されるので、detailの属性から元のannotationのidが分かる
+            roundtrip_annotations_by_original_id = collections.defaultdict(list)
+            for af_detail, roundtrip_annotation in zip(af_details, roundtrip_annotations, strict=True):
+                roundtrip_annotations_by_original_id[af_detail["attributes"]["coco.annotation_id"]].append(roundtrip_annotation)
+
+            result.image_count += 1
+            result.annotation_count += len(original_annotations)
+            result.mismatches.extend(
+                compare_roundtrip_annotations(
+                    coco_image,
+                    original_annotations,
+                    roundtrip_annotations_by_original_id,
+                    should_compare_mask=coco_annotation_type != CocoAnnotationType.BBOX,
+                    min_iou=min_iou,
+                )
+            )
+    return result
+
+
+def verify_roundtrip(coco_instances: dict[str, Any], coco_annotation_type: CocoAnnotationType, *, min_iou: float, parallelism: int) -> RoundtripVerificationResult:
+    """
+    COCOデータセット（Instances）の往復変換（COCO → Annofab → COCO）を検証します。
+    imagesを`IMAGE_CHUNK_SIZE`件ずつに分割して、`parallelism`個のプロセスで並列に検証します。
+    投入したチャンクの引数はpickleされて結果を受け取るまで保持されるので、投入するチャンクは`parallelism * MAX_PENDING_CHUNKS_PER_PROCESS`個までにします。
+    """
+    annotations_by_image_id = collections.defaultdict(list)
+    for coco_annotation in coco_instances["annotations"]:
+        annotations_by_image_id[coco_annotation["image_id"]].append(coco_annotation)
+
+    coco_images = coco_instances["images"]
+    coco_categories = coco_instances["categories"]
+    image_chunks = [coco_images[i : i + IMAGE_CHUNK_SIZE] for i in range(0, len(coco_images), IMAGE_CHUNK_SIZE)]
+
+    def get_chunk_arguments(image_chunk: list[dict[str, Any]]) -> tuple[Any, ...]:
+        chunk_annotations = [anno for image in image_chunk for anno in annotations_by_image_id[image["id"]]]
+        return (image_chunk, chunk_annotations, coco_categories, coco_annotation_type)
+
+    result = RoundtripVerificationResult()
+    progress_logger = ProgressLogger("往復変換を検証中", total=len(coco_images))
+    if parallelism == 1:
+        for image_chunk in image_chunks:
+            result.add(verify_roundtrip_of_images(*get_chunk_arguments(image_chunk), min_iou=min_iou))
+            progress_logger.update(len(image_chunk))
+        return result
+
+    # 投入した順に結果を受け取るので、検証結果の順番は`parallelism`に依存しない
+    pending_futures: collections.deque[tuple[int, Future[RoundtripVerificationResult]]] = collections.deque()
+
+    def add_oldest_result() -> None:
+        image_count, future = pending_futures.popleft()
+        result.add(future.result())
+        progress_logger.update(image_count)
+
+    with ProcessPoolExecutor(max_workers=parallelism) as executor:
+        for image_chunk in image_chunks:
+            if len(pending_futures) >= parallelism * MAX_PENDING_CHUNKS_PER_PROCESS:
+                add_oldest_result()
+            pending_futures.append((len(image_chunk), executor.submit(verify_roundtrip_of_images, *get_chunk_arguments(image_chunk), min_iou=min_iou)))
+        while len(pending_futures) > 0:
+            add_oldest_result()
+    return result
+
+
+def create_parser() -> ArgumentParser:
+    parser = ArgumentParser(
+        description="COCOデータセット（Instances）のアノテーションをAnnofab形式に変換してからCOCO形式に戻して、元のアノテーションと一致するかを検証します。"
+        "imageごとにannotationを対応付けて、bboxのIoUと（segmentationの場合は）マスクのIoUを比較します。"
+        "一致しないannotationが存在する場合は、終了コード1で終了します。",
+        parents=[create_parent_parser()],
+    )
+
+    parser.add_argument("--coco_instances_json", type=Path, required=True, help="検証対象のCOCOデータセット（Instances）形式アノテーションのJSONファイルのパス")
+    parser.add_argument(
+        "--coco_annotation_type",
+        type=str,
+        required=True,
+        choices=[e.value for e in CocoAnnotationType],
+        help="検証対象のアノテーションの種類。`bbox`:バウンディングボックス, `polygon_segmentation`:`iscrowd=0`のポリゴン形式のsegmentation, `rle_segmentation`:`iscrowd=1`のRLE形式のsegmentation",
+    )
+    parser.add_argument(
+        "--min_iou",
+        type=float,
+        default=0.95,
+        help="IoUの下限値。IoUがこの値未満のannotationは一致しなかったとみなします。Annofabは座標を整数で格納するので、座標が小数の場合は1にはなりません。",
+    )
+    parser.add_argument("--parallelism", type=int, default=os.cpu_count() or 1, help="検証に利用するプロセス数")
+    parser.add_argument("-o", "--output_json", type=Path, help="検証結果（一致しなかったannotationの一覧）の出力先JSONファイルのパス")
+
+    return parser
+
+
+@log_exception()
+def main(arguments: list[str] | None = None) -> None:
+    args = create_parser().parse_args(arguments)
+    configure_loguru(is_verbose=args.verbose, enqueue=args.enqueue_log)
+    logger.info(f"argv={sys.argv}")
+
+    coco_instances = read_json(args.coco_instances_json)
+    result = verify_roundtrip(coco_instances, CocoAnnotationType(args.coco_annotation_type), min_iou=args.min_iou, parallelism=args.parallelism)
+
+    if args.output_json is not None:
+        args.output_json.parent.mkdir(exist_ok=True, parents=True)
+        write_json(args.output_json, {**asdict(result), "mismatch_count": len(result.mismatches)}, indent=True)
+
+    reason_counter = collections.Counter(mismatch.reason for mismatch in result.mismatches)
+    message = (
+        f"{result.image_count}件のimagesに紐づく{result.annotation_count}件のannotationの往復変換を検証しました。一致しなかったannotationは{len(result.mismatches)}件です。 :: {dict(reason_counter)}"
+    )
+    if len(result.mismatches) > 0:
+        logger.warning(message)
+        sys.exit(1)
+    logger.info(message)
+
+
+if __name__ == "__main__":
+    main()
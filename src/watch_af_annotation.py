@@ -0,0 +1,486 @@
+import dataclasses
+import datetime
+import sys
+import time
+import zipfile
+from argparse import ArgumentParser
+from collections.abc import Iterator
+from dataclasses import dataclass
+from pathlib import Path
+from typing import TYPE_CHECKING, Any
+
+from loguru import logger
+
+from src.common.cli import add_gzip_compression_level_argument, add_json_indent_argument, create_parent_parser
+from src.common.json_file import DEFAULT_GZIP_COMPRESSION_LEVEL, dumps_json, open_json_for_write, read_json
+from src.common.json_stream import StreamingJsonObjectWriter
+from src.common.utils import configure_loguru, log_exception
+from src.convert_af_annotation_to_coco_instances import AnnotationConverterFromAnnofabToCoco, CocoSegmentationFormat, convert_af_input_data_list_to_coco_images
+
+# 起動時間を短くするため、annofabapiは必要になった時点でimportする
+if TYPE_CHECKING:
+    from annofabapi.parser import SimpleAnnotationParser
+
+TaskKey = tuple[str, str]
+"""`(task_id, input_data_id)`"""
+
+
+@dataclass
+class _ConvertedTask:
+    """
+    変換済のタスク
+    """
+
+    source: Path
+    """タスクが含まれていたファイル（ZIPファイルまたはJSONファイル）"""
+    source_fingerprint: tuple[int, int]
+    """`source`の`(更新日時[ナノ秒], ファイルサイズ)`。複数のファイルに含まれるタスクは、この値が大きいファイルを優先します。"""
+    fingerprint: tuple[int, int]
+    """タスクのJSONが変更されたかを判定するための値"""
+    coco_annotations: list[dict[str, Any]]
+    """COCO形式のannotations。`id`は出力するときに振り直します。"""
+
+
+@dataclass
+class WatchStatus:
+    """
+    監視の状態。`--status_json`に出力します。
+    """
+
+    started_at: str
+    last_polled_at: str | None = None
+    last_published_at: str | None = None
+    poll_count: int = 0
+    publish_count: int = 0
+    task_count: int = 0
+    """出力結果に含まれるタスクの件数"""
+    annotation_count: int = 0
+    """出力結果に含まれるannotationsの件数"""
+    converted_task_count: int = 0
+    """起動してから変換したタスクの件数"""
+    failed_task_count: int = 0
+    """起動してから変換に失敗したタスクの件数"""
+    last_converted_task_count: int = 0
+    """最後に出力したときに、変換したタスクの件数"""
+    last_conversion_seconds: float = 0
+    """最後に出力したときの、変換にかかった時間[秒]"""
+    throughput_tasks_per_second: float | None = None
+    """最後に出力したときの、1秒あたりに変換したタスクの件数"""
+    lag_seconds: float | None = None
+    """最後に出力したときの、変更されたファイルのうち最も古い更新日時から出力が完了するまでの時間[秒]"""
+
+
+def _now() -> str:
+    return datetime.datetime.now().astimezone().isoformat()
+
+
+def _write_text_atomically(path: Path, text: str) -> None:
+    temp_path = path.with_name(f".{path.name}.tmp")
+    temp_path.write_text(text, encoding="utf-8")
+    temp_path.replace(path)
+
+
+class AfAnnotationWatcher:
+    """
+    ディレクトリに置かれたAnnofab形式のアノテーション（ZIPファイル、またはタスクごとのJSONファイル）を監視して、COCOデータセット（Instances）に変換し続けます。
+
+    変換済のタスクとcategories, imagesはメモリに保持するので、新規または変更されたタスクのみを変換します。
+    出力ファイルは一時ファイルに書き込んでから置き換えるので、読み込む側が書き込み途中のファイルを読むことはありません。
+
+    同じタスクが複数のファイルに含まれている場合は、更新日時が新しいファイルのタスクを優先します。
+    ファイルが削除された場合は、そのファイルに含まれていたタスクを出力結果から除きます。
+    ただし、ほかのファイルにも同じタスクが含まれている場合は、残っているファイルのうち更新日時が最も新しいファイルのタスクを出力します。
+
+    Args:
+        converter: Annofab形式のアノテーションをCOCO形式に変換するオブジェクト
+        coco_categories: 出力するCOCO形式のcategories
+        coco_images: 出力するCOCO形式のimages
+        drop_dir: 監視するディレクトリ
+        output_coco_instances_json: 出力先のJSONファイルのパス。拡張子が`.gz`の場合はgzipで圧縮して出力します。
+        status_json: 監視の状態の出力先のJSONファイルのパス
+        target_task_phase: 変換対象のタスクのフェーズ
+        target_task_status: 変換対象のタスクのステータス
+        gzip_compression_level: gzipの圧縮レベル
+        indent: Trueならば、出力するCOCOデータセットのJSONを2文字でインデントします。
+    """
+
+    def __init__(
+        self,
+        converter: AnnotationConverterFromAnnofabToCoco,
+        coco_categories: list[dict[str, Any]],
+        coco_images: list[dict[str, Any]],
+        drop_dir: Path,
+        output_coco_instances_json: Path,
+        *,
+        status_json: Path | None = None,
+        target_task_phase: str | None = None,
+        target_task_status: str | None = None,
+        gzip_compression_level: int = DEFAULT_GZIP_COMPRESSION_LEVEL,
+        indent: bool = False,
+    ) -> None:
+        self.converter = converter
+        self.coco_categories = coco_categories
+        self.coco_images = coco_images
+        self.drop_dir = drop_dir
+        self.output_coco_instances_json = output_coco_instances_json
+        self.status_json = status_json
+        self.target_task_phase = target_task_phase
+        self.target_task_status = target_task_status
+        self.gzip_compression_level = gzip_compression_level
+        self.indent = indent
+
+        self.status = WatchStatus(started_at=_now())
+        self._source_fingerprints: dict[Path, tuple[int, int]] = {}
+        """読み込んだファイルと、その`(更新日時[ナノ秒], ファイルサイズ)`"""
+        self._task_sources: dict[TaskKey, set[Path]] = {}
+        """タスクごとの、タスクが含まれているファイル"""
+        self._tasks: dict[TaskKey, _ConvertedTask] = {}
+
+    def _list_sources(self) -> dict[Path, tuple[int, int]]:
+        """
+        Returns:
+            監視対象のファイルと、その`(更新日時[ナノ秒], ファイルサイズ)`
+        """
+        excluded_paths = {self.output_coco_instances_json.resolve()}
+        if self.status_json is not None:
+            excluded_paths.add(self.status_json.resolve())
+
+        result = {}
+        for path in self.drop_dir.rglob("*"):
+            # `.`で始まるファイルは、書き込み途中の一時ファイルとみなして無視する
+            if path.suffix not in {".zip", ".json"} or path.name.startswith(".") or path.resolve() in excluded_paths or not path.is_file():
+                continue
+            stat = path.stat()
+            result[path] = (stat.st_mtime_ns, stat.st_size)
+        return result
+
+    @staticmethod
+    def _iter_task_parsers(source: Path) -> Iterator[tuple[TaskKey, tuple[int, int], "SimpleAnnotationParser"]]:
+        """
+        Yields:
+            tuple[0]: タスクのkey
+            tuple[1]: タスクのJSONが変更されたかを判定するための値。ZIPファイルの場合は`(CRC32, ファイルサイズ)`
+            tuple[2]: タスクのparser
+        """
+        from annofabapi.parser import SimpleAnnotationDirParser, SimpleAnnotationZipParser  # noqa: PLC0415
+
+        if source.suffix == ".zip":
+            with zipfile.ZipFile(source) as zip_file:
+                for info in zip_file.infolist():
+                    # `{task_id}/{input_data_id}.json`のみ対象にする
+                    if info.is_dir() or not info.filename.endswith(".json") or info.filename.count("/") != 1:
+                        continue
+                    zip_parser = SimpleAnnotationZipParser(zip_file, info.filename)
+                    yield (zip_parser.task_id, zip_parser.input_data_id), (info.CRC, info.file_size), zip_parser
+        else:
+            dir_parser = SimpleAnnotationDirParser(source)
+            stat = source.stat()
+            yield (dir_parser.task_id, dir_parser.input_data_id), (stat.st_mtime_ns, stat.st_size), dir_parser
+
+    def _convert_task(self, af_parser: "SimpleAnnotationParser") -> list[dict[str, Any]] | None:
+        """
+        Returns:
+            COCO形式のannotations。変換対象外のタスクの場合はNone
+        """
+        af_annotation = af_parser.load_json()
+        if self.target_task_phase is not None and af_annotation["task_phase"] != self.target_task_phase:
+            return None
+        if self.target_task_status is not None and af_annotation["task_status"] != self.target_task_status:
+            return None
+
+        # Annofabのinput_data_nameをCOCOのfile_nameとして変換する
+        coco_image = self.converter.images_by_file_name[af_annotation["input_data_name"]]
+        coco_annotations, _ = self.converter.convert_af_annotation(af_annotation, af_parser, coco_image, coco_start_annotation_id=1)
+        return coco_annotations
+
+    def _update_tasks_from_source(self, source: Path, source_fingerprint: tuple[int, int], target_task_keys: set[TaskKey] | None = None) -> tuple[int, set[TaskKey]]:
+        """
+        ファイルに含まれる新規または変更されたタスクを変換します。
+        より新しいファイルのタスクを出力しているタスクは変換しません。
+
+        Args:
+            source: タスクを読み込むファイル
+            source_fingerprint: `source`の`(更新日時[ナノ秒], ファイルサイズ)`
+            target_task_keys: 指定した場合は、このタスクだけを変換します。削除されたファイルのタスクを、ほかのファイルから読み込み直すときに指定します。
+
+        Returns:
+            tuple[0]: 変換したタスクの件数
+            tuple[1]: ファイルから削除されたので、出力結果から除いたタスク
+        """
+        converted_task_count = 0
+        task_keys = set()
+        for task_key, fingerprint, af_parser in self._iter_task_parsers(source):
+            if target_task_keys is not None and task_key not in target_task_keys:
+                continue
+            task_keys.add(task_key)
+            self._task_sources.setdefault(task_key, set()).add(source)
+            task = self._tasks.get(task_key)
+            if task is not None:
+                if task.source == source and task.fingerprint == fingerprint:
+                    continue
+                if task.source != source and task.source_fingerprint > source_fingerprint:
+                    # より新しいファイルのタスクを出力している
+                    continue
+
+            try:
+                coco_annotations = self._convert_task(af_parser)
+            except Exception:
+                logger.opt(exception=True).warning(f"AnnofabのアノテーションJSONファイル'{af_parser.json_file_path}'の変換に失敗しました。 :: source='{source}'")
+                self.status.failed_task_count += 1
+                coco_annotations = None
+
+            if coco_annotations is None:
+                # ほかのファイルのタスクを出力している場合は、そのまま残す
+                if task is not None and task.source == source:
+                    del self._tasks[task_key]
+                continue
+            self._tasks[task_key] = _ConvertedTask(source=source, source_fingerprint=source_fingerprint, fingerprint=fingerprint, coco_annotations=coco_annotations)
+            converted_task_count += 1
+
+        removed_task_keys = set()
+        if target_task_keys is None:
+            # ファイルから削除されたタスクを除く
+            removed_task_keys = {task_key for task_key, sources in self._task_sources.items() if source in sources and task_key not in task_keys}
+            self._remove_source_from_tasks(source, removed_task_keys)
+        return converted_task_count, removed_task_keys
+
+    def _remove_source_from_tasks(self, source: Path, task_keys: set[TaskKey]) -> None:
+        """
+        タスクが`source`に含まれていないことを記録して、`source`のタスクを出力しているタスクを出力結果から除きます。
+        """
+        for task_key in task_keys:
+            sources = self._task_sources[task_key]
+            sources.discard(source)
+            if len(sources) == 0:
+                del self._task_sources[task_key]
+            task = self._tasks.get(task_key)
+            if task is not None and task.source == source:
+                del self._tasks[task_key]
+
+    def _restore_tasks_from_remaining_sources(self, task_keys: set[TaskKey]) -> int:
+        """
+        出力結果から除いたタスクを、そのタスクが含まれている残りのファイルのうち、更新日時が最も新しいファイルから読み込み直します。
+
+        Returns:
+            変換したタスクの件数
+        """
+        task_keys_by_source: dict[Path, set[TaskKey]] = {}
+        for task_key in task_keys:
+            sources = [source for source in self._task_sources.get(task_key, set()) if source in self._source_fingerprints]
+            if task_key in self._tasks or len(sources) == 0:
+                continue
+            newest_source = max(sources, key=lambda source: self._source_fingerprints[source])
+            task_keys_by_source.setdefault(newest_source, set()).add(task_key)
+
+        converted_task_count = 0
+        for source, source_task_keys in task_keys_by_source.items():
+            logger.info(f"{len(source_task_keys)}件のタスクを、'{source}'から読み込み直します。")
+            try:
+                converted_task_count += self._update_tasks_from_source(source, self._source_fingerprints[source], target_task_keys=source_task_keys)[0]
+            except (OSError, ValueError, zipfile.BadZipFile):
+                # 次回の確認時に再度読み込むように、読み込み済のファイルから除く
+                logger.opt(exception=True).warning(f"'{source}'を読み込めませんでした。次回の確認時に再度読み込みます。")
+                del self._source_fingerprints[source]
+        return converted_task_count
+
+    def poll(self) -> bool:
+        """
+        監視しているディレクトリを1回確認して、変更があれば変換して出力します。
+        変更されたファイルをすべて読み込めなかった場合は、出力しません。
+
+        Returns:
+            出力した場合はTrue
+        """
+        self.status.poll_count += 1
+        self.status.last_polled_at = _now()
+        current_sources = self._list_sources()
+        changed_sources = [path for path, fingerprint in current_sources.items() if self._source_fingerprints.get(path) != fingerprint]
+        removed_sources = [path for path in self._source_fingerprints if path not in current_sources]
+
+        # 出力結果から除いたので、ほかのファイルから読み込み直すタスク
+        lost_task_keys: set[TaskKey] = set()
+        for source in removed_sources:
+            logger.info(f"'{source}'が削除されたので、含まれていたタスクを出力結果から除きます。")
+            del self._source_fingerprints[source]
+            source_task_keys = {task_key for task_key, sources in self._task_sources.items() if source in sources}
+            self._remove_source_from_tasks(source, source_task_keys)
+            lost_task_keys |= source_task_keys
+
+        start_time = time.perf_counter()
+        converted_task_count = 0
+        processed_sources = []
+        # 更新日時が新しいファイルのタスクを優先するため、古い順に処理する
+        for source in sorted(changed_sources, key=lambda path: current_sources[path]):
+            try:
+                source_converted_task_count, removed_task_keys = self._update_tasks_from_source(source, current_sources[source])
+            except (OSError, ValueError, zipfile.BadZipFile):
+                # ファイルを書き込み途中の可能性があるので、次回に再度処理する
+                logger.opt(exception=True).warning(f"'{source}'を読み込めませんでした。次回の確認時に再度読み込みます。")
+                continue
+            converted_task_count += source_converted_task_count
+            lost_task_keys |= removed_task_keys
+            self._source_fingerprints[source] = current_sources[source]
+            processed_sources.append(source)
+        converted_task_count += self._restore_tasks_from_remaining_sources(lost_task_keys)
+        conversion_seconds = time.perf_counter() - start_time
+
+        if len(processed_sources) == 0 and len(removed_sources) == 0:
+            self._write_status()
+            return False
+
+        self._publish()
+        oldest_changed_mtime_ns = min(current_sources[path][0] for path in processed_sources) if len(processed_sources) > 0 else None
+        self.status.publish_count += 1
+        self.status.last_published_at = _now()
+        self.status.converted_task_count += converted_task_count
+        self.status.last_converted_task_count = converted_task_count
+        self.status.last_conversion_seconds = conversion_seconds
+        self.status.throughput_tasks_per_second = converted_task_count / conversion_seconds if conversion_seconds > 0 else None
+        self.status.lag_seconds = time.time() - oldest_changed_mtime_ns / 1e9 if oldest_changed_mtime_ns is not None else None
+        self._write_status()
+        logger.info(
+            f"{converted_task_count}件のタスクを変換して、'{self.output_coco_instances_json}'に出力しました。 :: "
+            f"タスク={self.status.task_count}件, annotations={self.status.annotation_count}件, 変換時間={conversion_seconds:.3f}秒"
+        )
+        return True
+
+    def _publish(self) -> None:
+        """
+        変換済のタスクを、COCOデータセットとして出力します。annotationsの`id`は`(task_id, input_data_id)`の順に1から振ります。
+        """
+        annotation_count = 0
+
+        def iter_coco_annotations() -> Iterator[dict[str, Any]]:
+            nonlocal annotation_count
+            for task_key in sorted(self._tasks):
+                for coco_annotation in self._tasks[task_key].coco_annotations:
+                    annotation_count += 1
+                    yield {**coco_annotation, "id": annotation_count}
+
+        output_json = self.output_coco_instances_json
+        output_json.parent.mkdir(exist_ok=True, parents=True)
+        temp_json = output_json.with_name(f".{output_json.name}.tmp")
+        # 一時ファイルの拡張子は`.tmp`なので、圧縮するかどうかは出力先の拡張子で判定する
+        with open_json_for_write(temp_json, compression_level=self.gzip_compression_level, is_gzip=output_json.suffix == ".gz") as f, StreamingJsonObjectWriter(f, indent=self.indent) as writer:
+            writer.write("images", self.coco_images)
+            writer.write_array("annotations", iter_coco_annotations())
+            writer.write("categories", self.coco_categories)
+        temp_json.replace(output_json)
+
+        self.status.task_count = len(self._tasks)
+        self.status.annotation_count = annotation_count
+
+    def _write_status(self) -> None:
+        if self.status_json is None:
+            return
+        self.status_json.parent.mkdir(exist_ok=True, parents=True)
+        _write_text_atomically(self.status_json, dumps_json(dataclasses.asdict(self.status), indent=True).decode("utf-8"))
+
+    def run(self, interval_seconds: float, *, max_poll_count: int | None = None) -> None:
+        """
+        `interval_seconds`秒ごとに`poll`を呼び出します。
+
+        Args:
+            interval_seconds: ディレクトリを確認する間隔[秒]
+            max_poll_count: ディレクトリを確認する回数の上限。Noneの場合は終了しません。
+        """
+        poll_count = 0
+        while True:
+            self.poll()
+            poll_count += 1
+            if max_poll_count is not None and poll_count >= max_poll_count:
+                return
+            time.sleep(interval_seconds)
+
+
+def create_parser() -> ArgumentParser:
+    parser = ArgumentParser(
+        description="ディレクトリに置かれたAnnofab形式のアノテーション（ZIPファイル、またはタスクごとのJSONファイル）を監視して、COCOデータセット（Instances）に変換し続けます。"
+        "新規または変更されたタスクのみを変換します。",
+        parents=[create_parent_parser()],
+    )
+
+    parser.add_argument(
+        "--drop_dir",
+        type=Path,
+        required=True,
+        help="監視するディレクトリ。Annofab形式のアノテーションZIPファイル、または`{task_id}/{input_data_id}.json`の形式のJSONファイルを置いてください。"
+        "書き込み途中のファイルを読み込まないように、`.`で始まるファイル名で書き込んでから名前を変更してください。",
+    )
+    parser.add_argument(
+        "--coco_instances_json", type=Path, required=True, help="COCOデータセット（Instances）形式アノテーションのJSONファイルのパス。`categories`と`images`(オプショナル)を参照します。"
+    )
+    parser.add_argument(
+        "--af_input_data_json",
+        type=Path,
+        help="Annofabの入力データ全件ファイルのパス。COCO形式のimagesを生成するのに利用します。未指定の場合は、'--coco_instances_json'に指定したJSONファイルの'images'を利用します。",
+    )
+    parser.add_argument(
+        "-o",
+        "--output_coco_instances_json",
+        type=Path,
+        required=True,
+        help="変換後のCOCOデータセット（Instances）形式アノテーションの出力先JSONファイルのパス。拡張子が`.gz`の場合はgzipで圧縮して出力します。",
+    )
+    add_gzip_compression_level_argument(parser)
+    add_json_indent_argument(parser)
+    parser.add_argument("--status_json", type=Path, help="監視の状態（出力の遅延や変換のスループットなど）の出力先JSONファイルのパス")
+    parser.add_argument("--interval", type=float, default=60, help="ディレクトリを確認する間隔[秒]")
+    parser.add_argument("--max_poll_count", type=int, help="ディレクトリを確認する回数の上限。未指定の場合は終了しません。")
+
+    parser.add_argument("--clip_annotation_to_image", action="store_true", help="指定すると、アノテーションが画像からはみ出さないようにクリッピングします。")
+    parser.add_argument(
+        "--segmentation_format",
+        type=str,
+        choices=[e.value for e in CocoSegmentationFormat],
+        default=CocoSegmentationFormat.RLE.value,
+        help="塗りつぶしアノテーションを変換したときの`segmentation`の形式。",
+    )
+    parser.add_argument("--af_label_name", type=str, nargs="+", help="変換対象のAnnofabのラベル名（英語）")
+    parser.add_argument("--af_task_phase", type=str, help="変換対象のAnnofabのタスクのフェーズ")
+    parser.add_argument("--af_task_status", type=str, help="変換対象のAnnofabのタスクのステータス")
+
+    return parser
+
+
+@log_exception()
+def main(arguments: list[str] | None = None) -> None:
+    args = create_parser().parse_args(arguments)
+    configure_loguru(is_verbose=args.verbose, enqueue=args.enqueue_log)
+    logger.info(f"argv={sys.argv}")
+
+    coco_instances = read_json(args.coco_instances_json)
+    if args.af_input_data_json is not None:
+        coco_images = convert_af_input_data_list_to_coco_images(read_json(args.af_input_data_json))
+    else:
+        coco_images = coco_instances["images"]
+    coco_categories = coco_instances["categories"]
+
+    converter = AnnotationConverterFromAnnofabToCoco(
+        coco_categories=coco_categories,
+        coco_images=coco_images,
+        target_af_target_labels=args.af_label_name,
+        should_clip_annotation_to_image=args.clip_annotation_to_image,
+        segmentation_format=CocoSegmentationFormat(args.segmentation_format),
+    )
+    watcher = AfAnnotationWatcher(
+        converter,
+        coco_categories,
+        coco_images,
+        args.drop_dir,
+        args.output_coco_instances_json,
+        status_json=args.status_json,
+        target_task_phase=args.af_task_phase,
+        target_task_status=args.af_task_status,
+        gzip_compression_level=args.gzip_compression_level,
+        indent=args.indent,
+    )
+    logger.info(f"'{args.drop_dir}'の監視を開始します。 :: interval={args.interval}秒")
+    try:
+        watcher.run(args.interval, max_poll_count=args.max_poll_count)
+    except KeyboardInterrupt:
+        logger.info("監視を終了します。")
+
+
+if __name__ == "__main__":
+    main()
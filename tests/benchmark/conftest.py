@@ -0,0 +1,23 @@
+import math
+from collections.abc import Iterator
+
+import pytest
+
+from tests.benchmark.microbenchmark import MicrobenchmarkRecorder
+
+
+@pytest.fixture(scope="session")
+def microbenchmark(request: pytest.FixtureRequest) -> Iterator[MicrobenchmarkRecorder]:
+    """
+    すべてのマイクロベンチマークが終わった後に、計測結果をJSONに出力します。
+    `--microbenchmark_update_baseline`を指定した場合は、ベースラインも更新します。
+    """
+    should_update_baseline = request.config.getoption("microbenchmark_update_baseline")
+    # ベースラインを更新する場合は、劣化を判定しない
+    threshold = math.inf if should_update_baseline else request.config.getoption("microbenchmark_threshold")
+    recorder = MicrobenchmarkRecorder(request.config.getoption("microbenchmark_baseline_json"), threshold=threshold)
+    yield recorder
+
+    recorder.write_result(request.config.getoption("microbenchmark_result_json"))
+    if should_update_baseline:
+        recorder.write_baseline()
@@ -0,0 +1,85 @@
+"""
+マイクロベンチマーク（`-m microbenchmark`）の計測と、ベースラインとの比較を行います。
+"""
+
+import json
+import platform
+import sys
+import timeit
+from collections.abc import Callable
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any
+
+DEFAULT_MICROBENCHMARK_RESULT_JSON = Path("out/microbenchmark_result.json")
+DEFAULT_MICROBENCHMARK_BASELINE_JSON = Path(__file__).parent / "microbenchmark_baseline.json"
+DEFAULT_MICROBENCHMARK_THRESHOLD = 1.5
+"""
+処理時間がベースラインの何倍を超えたら性能の劣化とみなすか。
+最短の時間で比較するので計測誤差は小さいですが、別のマシンで計測したベースラインと比較することもあるので、緩めにしています。
+"""
+
+REPEAT_COUNT = 7
+
+
+@dataclass
+class MicrobenchmarkResult:
+    name: str
+    seconds: float
+    """1回あたりの処理時間（秒）。`REPEAT_COUNT`回のうち最短の時間"""
+    baseline_seconds: float | None
+    """ベースラインの1回あたりの処理時間（秒）。ベースラインに存在しない場合はNone"""
+    ratio: float | None
+    """ベースラインに対する処理時間の比"""
+    is_regression: bool
+
+
+class MicrobenchmarkRecorder:
+    """
+    関数の処理時間を計測して、ベースラインと比較します。
+
+    Args:
+        baseline_json: ベースラインのJSONファイルのパス。存在しない場合は比較しません。
+        threshold: 処理時間がベースラインの何倍を超えたら性能の劣化とみなすか
+    """
+
+    def __init__(self, baseline_json: Path, threshold: float) -> None:
+        self.baseline_json = baseline_json
+        self.threshold = threshold
+        self.baseline: dict[str, float] = json.loads(baseline_json.read_text())["results"] if baseline_json.exists() else {}
+        self.results: dict[str, MicrobenchmarkResult] = {}
+
+    def measure(self, name: str, func: Callable[[], Any]) -> MicrobenchmarkResult:
+        """
+        `func`の処理時間を`REPEAT_COUNT`回計測して、1回あたりの最短の時間をベースラインと比較します。
+        1回の計測で`func`を実行する回数は、`timeit.Timer.autorange`で計測時間が0.2秒以上になるように決めます。
+        1回の計測が短すぎると、タイマーの精度やほかのプロセスの影響を受けやすいためです。
+        """
+        timer = timeit.Timer(func)
+        number, _ = timer.autorange()
+        seconds = min(timer.repeat(number=number, repeat=REPEAT_COUNT)) / number
+        baseline_seconds = self.baseline.get(name)
+        ratio = seconds / baseline_seconds if baseline_seconds is not None else None
+        result = MicrobenchmarkResult(name=name, seconds=seconds, baseline_seconds=baseline_seconds, ratio=ratio, is_regression=ratio is not None and ratio > self.threshold)
+        self.results[name] = result
+        comparison = f"ベースラインの{ratio:.2f}倍" if ratio is not None else "ベースラインなし"
+        print(f"{name}: {seconds * 1000:.3f}ミリ秒（{comparison}）")  # noqa: T201
+        return result
+
+    def write_result(self, result_json: Path) -> None:
+        result_json.parent.mkdir(exist_ok=True, parents=True)
+        result = {
+            "python_version": platform.python_version(),
+            "platform": platform.platform(),
+            "threshold": self.threshold,
+            "results": {name: asdict(result) for name, result in sorted(self.results.items())},
+        }
+        result_json.write_text(json.dumps(result, indent=2, ensure_ascii=False) + "\n")
+
+    def write_baseline(self) -> None:
+        """
+        今回の計測結果で、ベースラインを上書きします。今回計測しなかった関数のベースラインは残します。
+        """
+        baseline = {**self.baseline, **{name: result.seconds for name, result in self.results.items()}}
+        content = {"python_version": platform.python_version(), "platform": sys.platform, "results": dict(sorted(baseline.items()))}
+        self.baseline_json.write_text(json.dumps(content, indent=2, ensure_ascii=False) + "\n")
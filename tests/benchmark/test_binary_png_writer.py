@@ -0,0 +1,73 @@
+"""
+塗りつぶし画像（PNG）の書き込みの速度とファイルサイズを、`annofabapi.segmentation.write_binary_image`と比較するベンチマーク。
+`pytest -m benchmark tests/benchmark/test_binary_png_writer.py`で実行します。
+"""
+
+import io
+import time
+from collections.abc import Callable
+from typing import BinaryIO
+
+import numpy
+import pytest
+from annofabapi.segmentation import read_binary_image, write_binary_image
+
+from src.common.image import BinaryImageFormat, write_binary_png
+
+pytestmark = pytest.mark.benchmark
+
+# 4K
+IMAGE_WIDTH = 3840
+IMAGE_HEIGHT = 2160
+REPEAT_COUNT = 5
+
+
+def create_mask() -> numpy.ndarray:
+    """
+    矩形と円を組み合わせたマスクを、`pycocotools.mask.decode`の戻り値と同じF-orderで生成します。
+    """
+    rng = numpy.random.default_rng(0)
+    ys, xs = numpy.ogrid[:IMAGE_HEIGHT, :IMAGE_WIDTH]
+    mask = numpy.zeros((IMAGE_HEIGHT, IMAGE_WIDTH), dtype=bool)
+    for _ in range(20):
+        x, y = rng.integers(0, IMAGE_WIDTH), rng.integers(0, IMAGE_HEIGHT)
+        mask[y : y + rng.integers(10, 600), x : x + rng.integers(10, 1200)] = True
+        radius = rng.integers(10, 400)
+        mask |= (xs - x) ** 2 + (ys - y) ** 2 < radius**2
+    return numpy.asfortranarray(mask)
+
+
+def measure(write: Callable[[numpy.ndarray, BinaryIO], None], mask: numpy.ndarray) -> tuple[float, bytes]:
+    """
+    Returns:
+        tuple[0]: 1回あたりの書き込み時間（秒）。`REPEAT_COUNT`回のうち最短の時間
+        tuple[1]: 書き込んだPNG
+    """
+    elapsed_seconds = []
+    for _ in range(REPEAT_COUNT):
+        f = io.BytesIO()
+        start = time.perf_counter()
+        write(mask, f)
+        elapsed_seconds.append(time.perf_counter() - start)
+    return min(elapsed_seconds), f.getvalue()
+
+
+def test_binary_png_writer():
+    """圧縮レベル1の`write_binary_png`は、`write_binary_image`より速い"""
+    mask = create_mask()
+    baseline_seconds, baseline_png = measure(write_binary_image, mask)
+    print(f"write_binary_image: {baseline_seconds * 1000:.1f}ミリ秒, {len(baseline_png):,}バイト")  # noqa: T201
+
+    results = {}
+    for image_format in BinaryImageFormat:
+        for compression_level in [1, 6, 9]:
+            seconds, png = measure(lambda mask, f: write_binary_png(mask, f, compression_level=compression_level, image_format=image_format), mask)  # noqa: B023
+            assert numpy.array_equal(read_binary_image(io.BytesIO(png)), mask)
+            results[(image_format, compression_level)] = seconds
+            print(  # noqa: T201
+                f"write_binary_png(image_format={image_format.value}, compression_level={compression_level}): "
+                f"{seconds * 1000:.1f}ミリ秒（{baseline_seconds / seconds:.1f}倍速）, {len(png):,}バイト（{len(png) / len(baseline_png):.0%}）"
+            )
+
+    assert results[(BinaryImageFormat.RGBA, 1)] < baseline_seconds
+    assert results[(BinaryImageFormat.PALETTE, 1)] < baseline_seconds
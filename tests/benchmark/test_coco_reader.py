@@ -0,0 +1,96 @@
+"""
+COCOデータセットの一部のimagesだけを変換する場合に、JSONファイル全体を読み込む場合と、変換対象だけを読み込む場合（`read_coco_instances`）の
+処理時間とメモリ使用量を比較するベンチマーク。
+`pytest -m benchmark tests/benchmark/test_coco_reader.py`で実行します。
+"""
+
+import json
+import time
+import tracemalloc
+from collections.abc import Callable
+from pathlib import Path
+from typing import Any
+
+import numpy
+import pytest
+
+from src.common.coco_reader import read_coco_instances
+from src.common.json_file import read_json
+from src.convert_coco_instances_annotation_to_af import AnnotationConverterFromCocoToAnnofab, CocoAnnotationType
+
+pytestmark = pytest.mark.benchmark
+
+IMAGE_COUNT = 1000
+ANNOTATION_COUNT = 100_000
+TARGET_IMAGE_FILE_NAMES = ["1.jpg", "2.jpg"]
+TARGET_CATEGORY_NAMES = ["category1"]
+
+
+def create_coco_instances_json(path: Path) -> None:
+    """
+    ポリゴンのsegmentationを含むannotationを`ANNOTATION_COUNT`件含むCOCOデータセットを生成します。
+    一般的なCOCOデータセットと同じように、categoriesはannotationsの後ろに置きます。
+    """
+    rng = numpy.random.default_rng(0)
+    images = [{"id": image_id, "file_name": f"{image_id}.jpg", "width": 1920, "height": 1080} for image_id in range(1, IMAGE_COUNT + 1)]
+    annotations = [
+        {
+            "id": annotation_id,
+            "image_id": int(rng.integers(1, IMAGE_COUNT + 1)),
+            "category_id": int(rng.integers(1, 11)),
+            "bbox": [10.5, 20.5, 30.0, 40.0],
+            "area": 1200.0,
+            "iscrowd": 0,
+            "segmentation": [rng.uniform(0, 1000, 24).round(2).tolist()],
+        }
+        for annotation_id in range(1, ANNOTATION_COUNT + 1)
+    ]
+    categories = [{"id": category_id, "name": f"category{category_id}"} for category_id in range(1, 11)]
+    path.write_text(json.dumps({"images": images, "annotations": annotations, "categories": categories}))
+
+
+def measure(func: Callable[[], Any]) -> tuple[float, int]:
+    """
+    処理時間とメモリ使用量は別々に計測します。`tracemalloc`はPythonのオブジェクトを生成するたびに処理が遅くなるためです。
+
+    Returns:
+        tuple[0]: 処理時間（秒）
+        tuple[1]: 処理中に確保したメモリのピーク（バイト）
+    """
+    start = time.perf_counter()
+    func()
+    elapsed_seconds = time.perf_counter() - start
+
+    tracemalloc.start()
+    func()
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed_seconds, peak_bytes
+
+
+def test_read_coco_instances(tmp_path: Path):
+    """変換対象だけを読み込むと、メモリ使用量はCOCOデータセット全体ではなく変換対象の大きさに比例する"""
+    coco_instances_json = tmp_path / "coco.json"
+    create_coco_instances_json(coco_instances_json)
+
+    def create_converter_from_whole_json() -> None:
+        AnnotationConverterFromCocoToAnnofab(
+            read_json(coco_instances_json), CocoAnnotationType.BBOX, target_coco_image_file_names=TARGET_IMAGE_FILE_NAMES, target_coco_category_names=TARGET_CATEGORY_NAMES
+        )
+
+    def create_converter_from_filtered_json() -> None:
+        coco_instances = read_coco_instances(coco_instances_json, target_image_file_names=TARGET_IMAGE_FILE_NAMES, target_category_names=TARGET_CATEGORY_NAMES)
+        AnnotationConverterFromCocoToAnnofab(coco_instances, CocoAnnotationType.BBOX, target_coco_image_file_names=TARGET_IMAGE_FILE_NAMES, target_coco_category_names=TARGET_CATEGORY_NAMES)
+
+    whole_seconds, whole_peak_bytes = measure(create_converter_from_whole_json)
+    filtered_seconds, filtered_peak_bytes = measure(create_converter_from_filtered_json)
+    images_only_seconds, images_only_peak_bytes = measure(lambda: read_coco_instances(coco_instances_json, should_read_annotations=False))
+
+    print(  # noqa: T201
+        f"ファイルサイズ={coco_instances_json.stat().st_size / 1024**2:.0f}MiB, annotations={ANNOTATION_COUNT}件 :: "
+        f"全体を読み込む={whole_seconds:.2f}秒（メモリのピーク={whole_peak_bytes / 1024**2:.0f}MiB）, "
+        f"変換対象だけを読み込む={filtered_seconds:.2f}秒（メモリのピーク={filtered_peak_bytes / 1024**2:.1f}MiB）, "
+        f"imagesだけを読み込む={images_only_seconds:.2f}秒（メモリのピーク={images_only_peak_bytes / 1024**2:.1f}MiB）"
+    )
+    assert filtered_peak_bytes * 10 < whole_peak_bytes
+    assert images_only_peak_bytes * 10 < whole_peak_bytes
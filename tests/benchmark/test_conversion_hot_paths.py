@@ -0,0 +1,120 @@
+"""
+アノテーション1個あたりの変換処理（ホットパス）のマイクロベンチマーク。
+処理時間をベースライン（`microbenchmark_baseline.json`）と比較して、閾値を超えて遅くなっていればテストを失敗させます。
+
+`pytest -m microbenchmark tests/benchmark/test_conversion_hot_paths.py`で実行します。
+ベースラインを更新する場合は、`--microbenchmark_update_baseline`を指定してください。
+"""
+
+import sys
+from collections.abc import Iterator
+from typing import Any
+
+import numpy
+import pycocotools.mask
+import pytest
+from loguru import logger
+
+from src.convert_af_annotation_to_coco_instances import AnnotationConverterFromAnnofabToCoco, clip_bounding_box_to_image, clip_polygon_to_image, get_rle_from_boolean_segmentation_array
+from src.convert_coco_instances_annotation_to_af import AnnotationConverterFromCocoToAnnofab, CocoAnnotationType, convert_coco_one_segmentation_to_af_format
+from tests.benchmark.microbenchmark import MicrobenchmarkRecorder, MicrobenchmarkResult
+from tests.benchmark.test_binary_png_writer import IMAGE_HEIGHT, IMAGE_WIDTH, create_mask
+
+pytestmark = pytest.mark.microbenchmark
+
+BOX_COUNT = 10_000
+POLYGON_POINT_COUNT = 500
+
+
+def assert_no_regression(result: MicrobenchmarkResult) -> None:
+    assert not result.is_regression, f"{result.name}の処理時間がベースラインの{result.ratio:.2f}倍になりました。"
+
+
+def create_af_boxes() -> list[tuple[dict[str, int], dict[str, int]]]:
+    """
+    一部が画像からはみ出ているAnnofab形式のバウンディングボックスを生成します。
+    """
+    rng = numpy.random.default_rng(0)
+    boxes = []
+    for x, y, width, height in rng.integers([-100, -100, 1, 1], [IMAGE_WIDTH, IMAGE_HEIGHT, 500, 500], size=(BOX_COUNT, 4)).tolist():
+        boxes.append(({"x": x, "y": y}, {"x": x + width, "y": y + height}))
+    return boxes
+
+
+def create_af_polygon_points() -> list[dict[str, int]]:
+    """
+    一部が画像からはみ出ている、`POLYGON_POINT_COUNT`個の頂点を持つ星形のポリゴンを生成します。
+    """
+    angles = numpy.linspace(0, 2 * numpy.pi, POLYGON_POINT_COUNT, endpoint=False)
+    radii = numpy.where(numpy.arange(POLYGON_POINT_COUNT) % 2 == 0, 1200, 600)
+    xs = numpy.round(IMAGE_WIDTH / 2 + radii * numpy.cos(angles)).astype(int)
+    ys = numpy.round(IMAGE_HEIGHT / 2 + radii * numpy.sin(angles)).astype(int)
+    return [{"x": x, "y": y} for x, y in zip(xs.tolist(), ys.tolist(), strict=True)]
+
+
+@pytest.fixture(scope="module", autouse=True)
+def _disable_debug_log() -> Iterator[None]:
+    """`--verbose`を指定しないときと同じように、DEBUGログを出力しない状態で計測する"""
+    logger.remove()
+    logger.add(sys.stderr, level="INFO")
+    yield
+    logger.remove()
+    logger.add(sys.stderr)
+
+
+@pytest.fixture(scope="module")
+def mask() -> numpy.ndarray:
+    """4Kのマスク。`annofabapi.segmentation.read_binary_image`の戻り値と同じC-order"""
+    return numpy.ascontiguousarray(create_mask())
+
+
+def test_clip_bounding_box_to_image(microbenchmark: MicrobenchmarkRecorder):
+    boxes = create_af_boxes()
+
+    def clip_boxes() -> None:
+        for left_top, right_bottom in boxes:
+            clip_bounding_box_to_image(left_top, right_bottom, IMAGE_WIDTH, IMAGE_HEIGHT)
+
+    assert_no_regression(microbenchmark.measure(f"clip_bounding_box_to_image[{BOX_COUNT}boxes]", clip_boxes))
+
+
+def test_clip_polygon_to_image(microbenchmark: MicrobenchmarkRecorder):
+    points = create_af_polygon_points()
+    assert_no_regression(microbenchmark.measure(f"clip_polygon_to_image[{POLYGON_POINT_COUNT}points]", lambda: clip_polygon_to_image(points, IMAGE_WIDTH, IMAGE_HEIGHT)))
+
+
+def test_convert_af_polygon_detail(microbenchmark: MicrobenchmarkRecorder):
+    coco_image = {"id": 1, "file_name": "a.jpg", "width": IMAGE_WIDTH, "height": IMAGE_HEIGHT}
+    converter = AnnotationConverterFromAnnofabToCoco(coco_categories=[{"id": 1, "name": "car"}], coco_images=[coco_image], should_clip_annotation_to_image=True)
+    af_detail = {"annotation_id": "a", "label": "car", "data": {"_type": "Points", "points": create_af_polygon_points()}}
+    assert_no_regression(microbenchmark.measure(f"convert_af_polygon_detail[{POLYGON_POINT_COUNT}points]", lambda: converter.convert_af_polygon_detail(af_detail, coco_image, 1)))
+
+
+def test_get_rle_from_boolean_segmentation_array(microbenchmark: MicrobenchmarkRecorder, mask: numpy.ndarray):
+    assert_no_regression(microbenchmark.measure("get_rle_from_boolean_segmentation_array[4K]", lambda: get_rle_from_boolean_segmentation_array(mask)))
+
+
+def test_convert_coco_one_segmentation_to_af_format(microbenchmark: MicrobenchmarkRecorder):
+    polygon = [float(v) + 0.5 for point in create_af_polygon_points() for v in (point["x"], point["y"])]
+    assert_no_regression(microbenchmark.measure(f"convert_coco_one_segmentation_to_af_format[{POLYGON_POINT_COUNT}points]", lambda: convert_coco_one_segmentation_to_af_format(polygon)))
+
+
+@pytest.mark.parametrize("rle_format", ["compressed", "uncompressed"])
+def test_convert_rle_segmentation_annotation_to_af_detail(microbenchmark: MicrobenchmarkRecorder, mask: numpy.ndarray, rle_format: str):
+    if rle_format == "compressed":
+        rle = pycocotools.mask.encode(numpy.asfortranarray(mask.view(numpy.uint8)))
+        segmentation: dict[str, Any] = {"size": rle["size"], "counts": rle["counts"].decode("ascii")}
+    else:
+        segmentation = get_rle_from_boolean_segmentation_array(mask)
+    coco_image = {"id": 1, "file_name": "a.jpg", "width": IMAGE_WIDTH, "height": IMAGE_HEIGHT}
+    coco_annotation = {"id": 1, "image_id": 1, "category_id": 1, "segmentation": segmentation, "iscrowd": 1}
+    converter = AnnotationConverterFromCocoToAnnofab(
+        {"images": [coco_image], "annotations": [coco_annotation], "categories": [{"id": 1, "name": "car"}]}, coco_annotation_type=CocoAnnotationType.RLE_SEGMENTATION
+    )
+    _, cropped_mask = converter.convert_rle_segmentation_annotation_to_af_detail(coco_annotation, coco_image)
+    assert cropped_mask is not None
+    assert numpy.array_equal(cropped_mask.to_array(), mask)
+
+    assert_no_regression(
+        microbenchmark.measure(f"convert_rle_segmentation_annotation_to_af_detail[4K,{rle_format}]", lambda: converter.convert_rle_segmentation_annotation_to_af_detail(coco_annotation, coco_image))
+    )
@@ -0,0 +1,85 @@
+"""
+大きな画像に含まれる小さな物体のマスクについて、画像全体のサイズの配列を作成する場合と、外接矩形の範囲だけを扱う場合（`CroppedMask`）の
+処理時間とメモリ使用量を比較するベンチマーク。
+`pytest -m benchmark tests/benchmark/test_cropped_mask.py`で実行します。
+"""
+
+import time
+import tracemalloc
+from collections.abc import Callable
+from typing import Any
+
+import numpy
+import pycocotools.mask
+import pytest
+
+from src.common.mask import CroppedMask
+from src.convert_af_annotation_to_coco_instances import get_rle_from_boolean_segmentation_array
+
+pytestmark = pytest.mark.benchmark
+
+# 8K
+IMAGE_WIDTH = 7680
+IMAGE_HEIGHT = 4320
+OBJECT_COUNT = 20
+OBJECT_SIZE = 64
+
+
+def create_segmentations() -> list[dict[str, Any]]:
+    """
+    `OBJECT_SIZE`四方の円のマスクを、compressed RLEの`segmentation`として生成します。
+    """
+    rng = numpy.random.default_rng(0)
+    ys, xs = numpy.ogrid[:OBJECT_SIZE, :OBJECT_SIZE]
+    circle = (ys - OBJECT_SIZE / 2) ** 2 + (xs - OBJECT_SIZE / 2) ** 2 < (OBJECT_SIZE / 2) ** 2
+    segmentations = []
+    for _ in range(OBJECT_COUNT):
+        mask = numpy.zeros((IMAGE_HEIGHT, IMAGE_WIDTH), dtype=numpy.uint8, order="F")
+        x, y = rng.integers(0, IMAGE_WIDTH - OBJECT_SIZE), rng.integers(0, IMAGE_HEIGHT - OBJECT_SIZE)
+        mask[y : y + OBJECT_SIZE, x : x + OBJECT_SIZE] = circle
+        rle = pycocotools.mask.encode(mask)
+        segmentations.append({"size": rle["size"], "counts": rle["counts"].decode("ascii")})
+    return segmentations
+
+
+def measure(func: Callable[[], Any]) -> tuple[float, int]:
+    """
+    Returns:
+        tuple[0]: 処理時間（秒）
+        tuple[1]: 処理中に確保したメモリのピーク（バイト）
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    func()
+    elapsed_seconds = time.perf_counter() - start
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed_seconds, peak_bytes
+
+
+def test_cropped_mask():
+    """外接矩形の範囲だけを扱うと、処理時間とメモリ使用量は画像のサイズではなく物体のサイズに比例する"""
+    segmentations = create_segmentations()
+
+    def convert_full_masks() -> None:
+        for segmentation in segmentations:
+            mask = pycocotools.mask.decode(segmentation).view(bool)
+            pycocotools.mask.toBbox(segmentation)
+            get_rle_from_boolean_segmentation_array(mask)
+
+    def convert_cropped_masks() -> None:
+        for segmentation in segmentations:
+            mask = CroppedMask.from_rle(segmentation, IMAGE_HEIGHT, IMAGE_WIDTH)
+            mask.get_bbox()
+            mask.to_uncompressed_rle()
+
+    full_seconds, full_peak_bytes = measure(convert_full_masks)
+    cropped_seconds, cropped_peak_bytes = measure(convert_cropped_masks)
+
+    print(  # noqa: T201
+        f"画像サイズ={IMAGE_WIDTH}x{IMAGE_HEIGHT}, 物体のサイズ={OBJECT_SIZE}x{OBJECT_SIZE}, 物体数={OBJECT_COUNT} :: "
+        f"画像全体のサイズの配列={full_seconds:.3f}秒（メモリのピーク={full_peak_bytes / 1024:.0f}KiB）, "
+        f"外接矩形の範囲だけの配列={cropped_seconds:.3f}秒（メモリのピーク={cropped_peak_bytes / 1024:.0f}KiB）"
+    )
+    assert cropped_seconds < full_seconds
+    assert cropped_peak_bytes * 10 < full_peak_bytes
@@ -0,0 +1,91 @@
+"""
+JSONの読み書きの速度を、`orjson`と標準ライブラリの`json`で比較するベンチマーク。
+`pytest -m benchmark tests/benchmark/test_json_backend.py`で実行します。
+"""
+
+import json
+import time
+from collections.abc import Callable
+from pathlib import Path
+from typing import Any
+
+import numpy
+import pytest
+
+import src.common.json_file
+from src.common.json_file import dumps_json, read_json
+
+pytestmark = pytest.mark.benchmark
+
+IMAGE_COUNT = 1000
+ANNOTATION_COUNT_PER_IMAGE = 20
+POINT_COUNT_PER_POLYGON = 50
+REPEAT_COUNT = 3
+
+
+def create_coco_instances() -> dict[str, Any]:
+    """
+    ポリゴンのannotationを含む大きなCOCOデータセット（Instances）を生成します。
+    """
+    rng = numpy.random.default_rng(0)
+    images = [{"id": image_id, "file_name": f"画像{image_id:06d}.jpg", "width": 1920, "height": 1080} for image_id in range(1, IMAGE_COUNT + 1)]
+    annotations = []
+    for annotation_id in range(1, IMAGE_COUNT * ANNOTATION_COUNT_PER_IMAGE + 1):
+        polygon = rng.uniform(0, 1000, POINT_COUNT_PER_POLYGON * 2).round(2).tolist()
+        annotations.append(
+            {
+                "id": annotation_id,
+                "image_id": (annotation_id - 1) // ANNOTATION_COUNT_PER_IMAGE + 1,
+                "category_id": annotation_id % 10 + 1,
+                "segmentation": [polygon],
+                "area": 1234.5,
+                "bbox": [10.0, 20.0, 300.5, 400.25],
+                "iscrowd": 0,
+            }
+        )
+    categories = [{"id": category_id, "name": f"category{category_id}", "supercategory": ""} for category_id in range(1, 11)]
+    return {"images": images, "annotations": annotations, "categories": categories}
+
+
+def measure(func: Callable[[], Any]) -> float:
+    """
+    Returns:
+        1回あたりの時間（秒）。`REPEAT_COUNT`回のうち最短の時間
+    """
+    elapsed_seconds = []
+    for _ in range(REPEAT_COUNT):
+        start = time.perf_counter()
+        func()
+        elapsed_seconds.append(time.perf_counter() - start)
+    return min(elapsed_seconds)
+
+
+def test_json_backend(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    """`orjson`を利用すると、標準ライブラリの`json`より速く読み書きできる"""
+    pytest.importorskip("orjson")
+    coco_instances = create_coco_instances()
+    coco_instances_json = tmp_path / "coco_instances.json"
+    coco_instances_json.write_text(json.dumps(coco_instances, indent=2, ensure_ascii=False), encoding="utf-8")
+    file_size = coco_instances_json.stat().st_size
+    print(f"COCOデータセット: annotations={len(coco_instances['annotations']):,}件, {file_size / 1024**2:.1f}MB")  # noqa: T201
+
+    # 変更前の実装
+    baseline_read_seconds = measure(lambda: json.loads(coco_instances_json.read_text()))
+    baseline_write_seconds = measure(lambda: json.dumps(coco_instances, indent=2, ensure_ascii=False).encode("utf-8"))
+    print(f"json.loads(path.read_text()): {baseline_read_seconds:.2f}秒, json.dumps(indent=2): {baseline_write_seconds:.2f}秒")  # noqa: T201
+
+    results = {}
+    for backend in ["json", "orjson"]:
+        monkeypatch.setattr(src.common.json_file, "JSON_BACKEND", backend)
+        assert read_json(coco_instances_json) == coco_instances
+        read_seconds = measure(lambda: read_json(coco_instances_json))
+        write_seconds = measure(lambda: dumps_json(coco_instances))
+        results[backend] = (read_seconds, write_seconds)
+        print(  # noqa: T201
+            f"JSON_BACKEND={backend}: read_json {read_seconds:.2f}秒（{baseline_read_seconds / read_seconds:.1f}倍速, {file_size / 1024**2 / read_seconds:.0f}MB/s）, "
+            f"dumps_json {write_seconds:.2f}秒（{baseline_write_seconds / write_seconds:.1f}倍速）"
+        )
+
+    orjson_read_seconds, orjson_write_seconds = results["orjson"]
+    assert orjson_read_seconds < baseline_read_seconds
+    assert orjson_write_seconds < baseline_write_seconds
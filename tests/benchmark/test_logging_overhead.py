@@ -0,0 +1,114 @@
+"""
+ログ出力のオーバーヘッドを計測するベンチマーク。
+`pytest -m benchmark tests/benchmark/test_logging_overhead.py`で実行します。
+
+変換処理全体の時間の差はログ出力のコストより計測誤差の方が大きいので、変換中に呼ばれたログ出力処理の時間を直接計測します。
+"""
+
+import json
+import time
+from collections.abc import Callable
+from pathlib import Path
+from typing import Any
+
+import pytest
+from loguru import logger
+
+import src.common.utils
+import src.convert_af_annotation_to_coco_instances
+from src.common.utils import ProgressLogger, configure_loguru
+from src.convert_af_annotation_to_coco_instances import AnnotationConverterFromAnnofabToCoco
+
+pytestmark = pytest.mark.benchmark
+
+IMAGE_WIDTH = 1000
+IMAGE_HEIGHT = 1000
+TASK_COUNT = 200
+DETAIL_COUNT_PER_TASK = 20
+POINT_COUNT_PER_POLYGON = 100
+
+
+class TimedLogger:
+    """
+    loguruのloggerをラップして、ログ出力にかかった時間を計測します。
+    """
+
+    def __init__(self, wrapped_logger: Any) -> None:  # noqa: ANN401
+        self._wrapped_logger = wrapped_logger
+        self.elapsed_seconds = 0.0
+        self.call_count = 0
+
+    def timed(self, func: Callable) -> Callable:
+        def wrapper(*args, **kwargs):  # noqa: ANN202, ANN002, ANN003
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.elapsed_seconds += time.perf_counter() - start
+                self.call_count += 1
+
+        return wrapper
+
+    def __getattr__(self, name: str) -> Any:  # noqa: ANN401
+        attr = getattr(self._wrapped_logger, name)
+        if name in {"debug", "info", "warning"}:
+            return self.timed(attr)
+        return attr
+
+
+def create_af_annotation_dir(output_dir: Path) -> None:
+    """
+    画像からはみ出たポリゴンを含むAnnofab形式のアノテーションを生成します。
+    はみ出たポリゴンはクリッピングされ、DEBUGログの出力対象になります。
+    """
+    for task_index in range(TASK_COUNT):
+        details = []
+        for detail_index in range(DETAIL_COUNT_PER_TASK):
+            points = [{"x": -10 + (i * 37) % (IMAGE_WIDTH + 20), "y": -10 + (i * 53) % (IMAGE_HEIGHT + 20)} for i in range(POINT_COUNT_PER_POLYGON)]
+            details.append({"annotation_id": f"{task_index}-{detail_index}", "label": "car", "data": {"_type": "Points", "points": points}})
+        af_annotation = {
+            "task_id": f"task{task_index}",
+            "task_phase": "acceptance",
+            "task_status": "complete",
+            "input_data_id": f"input{task_index}",
+            "input_data_name": "image.jpg",
+            "details": details,
+        }
+        json_file = output_dir / f"task{task_index}/input{task_index}.json"
+        json_file.parent.mkdir(parents=True, exist_ok=True)
+        json_file.write_text(json.dumps(af_annotation))
+
+
+@pytest.mark.parametrize("enqueue", [False, True])
+def test_logging_overhead(tmp_path: Path, monkeypatch: pytest.MonkeyPatch, enqueue: bool):  # noqa: FBT001
+    """DEBUGログを出力しない設定では、ログ出力のオーバーヘッドは変換時間の1%未満である"""
+    monkeypatch.chdir(tmp_path)
+    af_annotation_dir = tmp_path / "af_annotation"
+    create_af_annotation_dir(af_annotation_dir)
+
+    timed_logger = TimedLogger(logger)
+    monkeypatch.setattr(src.convert_af_annotation_to_coco_instances, "logger", timed_logger)
+    monkeypatch.setattr(src.common.utils, "logger", timed_logger)
+    monkeypatch.setattr(ProgressLogger, "update", timed_logger.timed(ProgressLogger.update))
+
+    converter = AnnotationConverterFromAnnofabToCoco(
+        coco_categories=[{"id": 1, "name": "car"}],
+        coco_images=[{"id": 1, "file_name": "image.jpg", "width": IMAGE_WIDTH, "height": IMAGE_HEIGHT}],
+        should_clip_annotation_to_image=True,
+    )
+    configure_loguru(is_verbose=False, enqueue=enqueue)
+    try:
+        start = time.perf_counter()
+        converter.convert_af_annotation_path(af_annotation_dir, target_task_phase=None, target_task_status=None)
+        conversion_seconds = time.perf_counter() - start
+    finally:
+        logger.complete()
+        logger.remove()
+
+    overhead_ratio = timed_logger.elapsed_seconds / conversion_seconds
+    print(  # noqa: T201
+        f"enqueue={enqueue}: 変換時間={conversion_seconds:.3f}秒, ログ出力の呼び出し回数={timed_logger.call_count}, "
+        f"ログ出力の時間={timed_logger.elapsed_seconds * 1000:.1f}ミリ秒, オーバーヘッド={overhead_ratio:.3%}"
+    )
+    assert timed_logger.call_count >= TASK_COUNT * DETAIL_COUNT_PER_TASK
+    assert overhead_ratio < 0.01
@@ -0,0 +1,76 @@
+"""
+書き込みの遅延が大きいファイルシステムで、COCO形式からAnnofab形式への変換時間を計測するベンチマーク。
+ファイルの書き込みごとに一定時間待つことで、ネットワークストレージの書き込みの遅延を再現します。
+`pytest -m benchmark tests/benchmark/test_write_behind.py`で実行します。
+"""
+
+import time
+from pathlib import Path
+from typing import Any
+
+import numpy
+import pycocotools.mask
+import pytest
+
+from src.common.write_behind import WriteBehindFileWriter
+from src.convert_coco_instances_annotation_to_af import AnnotationConverterFromCocoToAnnofab, CocoAnnotationType
+
+pytestmark = pytest.mark.benchmark
+
+IMAGE_COUNT = 50
+ANNOTATION_COUNT_PER_IMAGE = 2
+IMAGE_WIDTH = 1920
+IMAGE_HEIGHT = 1080
+WRITE_LATENCY_SECONDS = 0.05
+
+
+def create_coco_instances() -> dict[str, Any]:
+    """
+    imageごとに、RLE形式のsegmentation（iscrowd=1）のannotationを含むCOCOデータセットを生成します。
+    """
+    rng = numpy.random.default_rng(0)
+    annotations: list[dict[str, Any]] = []
+    for image_id in range(1, IMAGE_COUNT + 1):
+        for _ in range(ANNOTATION_COUNT_PER_IMAGE):
+            mask = numpy.zeros((IMAGE_HEIGHT, IMAGE_WIDTH), dtype=numpy.uint8, order="F")
+            x, y = rng.integers(0, IMAGE_WIDTH - 500), rng.integers(0, IMAGE_HEIGHT - 500)
+            mask[y : y + rng.integers(50, 500), x : x + rng.integers(50, 500)] = 1
+            rle = pycocotools.mask.encode(mask)
+            segmentation = {"size": rle["size"], "counts": rle["counts"].decode("ascii")}
+            annotations.append({"id": len(annotations) + 1, "image_id": image_id, "category_id": 1, "segmentation": segmentation, "iscrowd": 1})
+    images = [{"id": image_id, "file_name": f"{image_id}.jpg", "width": IMAGE_WIDTH, "height": IMAGE_HEIGHT} for image_id in range(1, IMAGE_COUNT + 1)]
+    return {"images": images, "annotations": annotations, "categories": [{"id": 1, "name": "car"}]}
+
+
+def measure(converter: AnnotationConverterFromCocoToAnnofab, output_dir: Path, **kwargs: Any) -> float:  # noqa: ANN401
+    start = time.perf_counter()
+    failed_file_names = converter.convert(output_dir, input_data_id_to_task_id=None, input_data_name_to_input_data_id=None, **kwargs)
+    elapsed_seconds = time.perf_counter() - start
+    assert failed_file_names == []
+    return elapsed_seconds
+
+
+def test_write_behind(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    """書き込みの遅延が大きくても、変換時間は書き込みをしない場合（変換処理のみ）の時間に近い"""
+    converter = AnnotationConverterFromCocoToAnnofab(create_coco_instances(), CocoAnnotationType.RLE_SEGMENTATION, png_compression_level=1)
+    original_write_files = WriteBehindFileWriter._write_files
+
+    monkeypatch.setattr(WriteBehindFileWriter, "_write_files", staticmethod(lambda _files: None))
+    compute_seconds = measure(converter, tmp_path / "compute")
+
+    def slow_write_files(files: list[tuple[Path, bytes]]) -> None:
+        for file in files:
+            time.sleep(WRITE_LATENCY_SECONDS)
+            original_write_files([file])
+
+    monkeypatch.setattr(WriteBehindFileWriter, "_write_files", staticmethod(slow_write_files))
+    # 書き込み待ちのデータを持てないので、1件ずつ書き込みが終わるのを待ってから次のimageを変換する（変更前の動作と同じ）
+    sync_seconds = measure(converter, tmp_path / "sync", write_parallelism=1, max_pending_write_bytes=0)
+    write_behind_seconds = measure(converter, tmp_path / "write_behind", write_parallelism=8)
+
+    print(  # noqa: T201
+        f"書き込みの遅延={WRITE_LATENCY_SECONDS * 1000:.0f}ミリ秒/ファイル, images={IMAGE_COUNT}件, ファイル数={IMAGE_COUNT * (ANNOTATION_COUNT_PER_IMAGE + 1)}件 :: "
+        f"変換処理のみ={compute_seconds:.2f}秒, 同期的に書き込み={sync_seconds:.2f}秒, 書き込みを別スレッドで実行={write_behind_seconds:.2f}秒"
+    )
+    assert write_behind_seconds < sync_seconds
+    assert write_behind_seconds < compute_seconds * 1.5
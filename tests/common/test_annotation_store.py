@@ -0,0 +1,75 @@
+import json
+
+import pytest
+
+from src.common.annotation_store import CocoAnnotationStore
+
+
+class TestCocoAnnotationStore:
+    def test_roundtrip(self):
+        """列に格納したannotationを取り出すと、元のannotationと同じJSONになる"""
+        coco_annotations = [
+            # Annofabの矩形から変換したannotation（値はすべてint）
+            {"id": 1, "image_id": 1, "category_id": 1, "bbox": [1, 2, 3, 4], "segmentation": [[1, 2, 4, 2, 4, 6, 1, 6]], "area": 12, "iscrowd": 0},
+            # マルチポリゴン
+            {
+                "id": 2,
+                "image_id": 2,
+                "category_id": 2,
+                "bbox": [1.5, 2.0, 3.25, 4.0],
+                "segmentation": [[1.5, 2.0, 4.75, 2.0, 4.75, 6.0], [10.0, 10.0, 11.0, 11.0, 12.0, 10.0]],
+                "area": 7.5,
+                "iscrowd": 0,
+            },
+            # Uncompressed RLE
+            {"id": 3, "image_id": 1, "category_id": 1, "bbox": [0.0, 0.0, 2.0, 2.0], "segmentation": {"size": [3, 4], "counts": [0, 2, 1, 2, 7]}, "area": 4.0, "iscrowd": 1},
+            # bboxにintとfloatが混在している
+            {"id": 4, "image_id": 2, "category_id": 1, "bbox": [1, 2.5, 3, 4.5], "segmentation": [], "area": 0, "iscrowd": 0},
+        ]
+        store = CocoAnnotationStore(coco_annotations)
+
+        assert len(store) == 4
+        assert json.dumps(list(store)) == json.dumps(coco_annotations)
+        assert json.dumps(store[-1]) == json.dumps(coco_annotations[-1])
+        assert store.bboxes.shape == (4, 4)
+        assert store.image_ids.tolist() == [1, 2, 1, 2]
+
+    def test_extra_keys_and_raw_annotation(self):
+        """列に格納できない値も、元と同じ値で取り出せる"""
+        coco_annotations = [
+            {"id": 1, "image_id": 1, "category_id": 1, "bbox": [1, 2, 3, 4], "segmentation": [[1, 2, 4, 2, 4, 6]], "area": 12, "iscrowd": 0, "attributes": {"occluded": True}},
+            # compressed RLE
+            {"id": 2, "image_id": 1, "category_id": 1, "bbox": [1, 2, 3, 4], "segmentation": {"size": [3, 4], "counts": "abc"}, "area": 12, "iscrowd": 1},
+            # 座標にintとfloatが混在している
+            {"id": 3, "image_id": 2, "category_id": 1, "bbox": [1, 2, 3, 4], "segmentation": [[1, 2.5, 4, 2]], "area": 12, "iscrowd": 0},
+        ]
+        store = CocoAnnotationStore(coco_annotations)
+        assert list(store) == coco_annotations
+
+    def test_key_order(self):
+        """キーの順番も元のannotationと同じになるので、JSONに出力すると元と同じ文字列になる"""
+        coco_annotations = [
+            # pycocotoolsなどが出力するCOCOデータセットのキーの順番
+            {"segmentation": [[1, 2, 4, 2, 4, 6]], "area": 12, "iscrowd": 0, "image_id": 1, "bbox": [1, 2, 3, 4], "category_id": 1, "id": 1},
+            {"attributes": {"occluded": True}, "id": 2, "image_id": 1, "category_id": 1, "bbox": [1, 2, 3, 4], "segmentation": [], "area": 12, "iscrowd": 0},
+            {"id": 3, "image_id": 1, "category_id": 1, "bbox": [1, 2, 3, 4], "segmentation": [], "area": 12, "iscrowd": 0},
+        ]
+        store = CocoAnnotationStore(coco_annotations)
+        assert [json.dumps(anno) for anno in store] == [json.dumps(anno) for anno in coco_annotations]
+
+    def test_get_annotations_by_image_id(self):
+        store = CocoAnnotationStore()
+        for annotation_id, image_id in enumerate([3, 1, 3, 2, 3], start=1):
+            store.append({"id": annotation_id, "image_id": image_id, "category_id": 1, "bbox": [0, 0, 1, 1], "segmentation": [], "area": 1, "iscrowd": 0})
+
+        assert [anno["id"] for anno in store.get_annotations_by_image_id(3)] == [1, 3, 5]
+        assert store.get_annotations_by_image_id(4) == []
+
+        # 追加した後も検索できる
+        store.append({"id": 6, "image_id": 4, "category_id": 1, "bbox": [0, 0, 1, 1], "segmentation": [], "area": 1, "iscrowd": 0})
+        assert [anno["id"] for anno in store.get_annotations_by_image_id(4)] == [6]
+
+    def test_index_error(self):
+        store = CocoAnnotationStore()
+        with pytest.raises(IndexError):
+            store[0]
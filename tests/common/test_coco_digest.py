@@ -0,0 +1,40 @@
+import copy
+
+from src.common.coco_digest import calculate_coco_image_digests, get_changed_file_names
+
+COCO_INSTANCES = {
+    "images": [{"id": 1, "file_name": "a.jpg", "width": 10, "height": 10}, {"id": 2, "file_name": "b.jpg", "width": 10, "height": 10}],
+    "categories": [{"id": 1, "name": "car"}, {"id": 2, "name": "person"}],
+    "annotations": [
+        {"id": 1, "image_id": 1, "category_id": 1, "bbox": [0, 0, 1, 1]},
+        {"id": 2, "image_id": 1, "category_id": 2, "bbox": [1, 1, 2, 2]},
+        {"id": 3, "image_id": 2, "category_id": 1, "bbox": [0, 0, 3, 3]},
+    ],
+}
+
+
+def test_calculate_coco_image_digests__order_independent():
+    coco_instances = copy.deepcopy(COCO_INSTANCES)
+    coco_instances["annotations"].reverse()
+    coco_instances["images"][0]["coco_url"] = "http://example.com/a.jpg"
+
+    assert calculate_coco_image_digests(coco_instances) == calculate_coco_image_digests(COCO_INSTANCES)
+
+
+def test_get_changed_file_names():
+    previous_digests = calculate_coco_image_digests(COCO_INSTANCES)
+
+    # annotationの変更
+    coco_instances = copy.deepcopy(COCO_INSTANCES)
+    coco_instances["annotations"][2]["bbox"] = [0, 0, 4, 4]
+    assert get_changed_file_names(previous_digests, calculate_coco_image_digests(coco_instances)) == {"b.jpg"}
+
+    # カテゴリ名の変更は、そのカテゴリのannotationを含むimageのみ変更とみなす
+    coco_instances = copy.deepcopy(COCO_INSTANCES)
+    coco_instances["categories"][1]["name"] = "pedestrian"
+    assert get_changed_file_names(previous_digests, calculate_coco_image_digests(coco_instances)) == {"a.jpg"}
+
+    # imageの追加と削除。削除されたimageは含まない
+    coco_instances = copy.deepcopy(COCO_INSTANCES)
+    coco_instances["images"] = [coco_instances["images"][0], {"id": 3, "file_name": "c.jpg", "width": 10, "height": 10}]
+    assert get_changed_file_names(previous_digests, calculate_coco_image_digests(coco_instances)) == {"c.jpg"}
@@ -0,0 +1,91 @@
+import gzip
+import json
+from pathlib import Path
+from typing import TextIO
+
+import pytest
+
+from src.common import coco_reader
+from src.common.annotation_store import CocoAnnotationStore
+from src.common.coco_reader import read_coco_instances
+
+COCO_INSTANCES = {
+    "info": {"description": "test"},
+    "images": [{"id": 1, "file_name": "a.jpg"}, {"id": 2, "file_name": "b.jpg"}, {"id": 3, "file_name": "c.jpg"}],
+    "annotations": [
+        {"id": 1, "image_id": 1, "category_id": 1, "bbox": [0, 0, 1, 1]},
+        {"id": 2, "image_id": 1, "category_id": 2, "bbox": [0, 0, 1, 1]},
+        {"id": 3, "image_id": 2, "category_id": 1, "bbox": [0, 0, 1, 1]},
+        {"id": 4, "image_id": 3, "category_id": 2, "bbox": [0, 0, 1, 1]},
+    ],
+    # 一般的なCOCOデータセットと同じように、categoriesをannotationsの後ろに置く
+    "categories": [{"id": 1, "name": "car"}, {"id": 2, "name": "bus"}],
+}
+
+
+@pytest.fixture
+def coco_instances_json(tmp_path: Path) -> Path:
+    path = tmp_path / "coco.json"
+    path.write_text(json.dumps(COCO_INSTANCES, indent=2))
+    return path
+
+
+def test_read_coco_instances(coco_instances_json: Path):
+    """絞り込まない場合は、`json.load`と同じ内容を返す"""
+    assert read_coco_instances(coco_instances_json) == COCO_INSTANCES
+
+
+def test_read_coco_instances__filters(coco_instances_json: Path):
+    actual = read_coco_instances(coco_instances_json, target_image_file_names=["a.jpg", "b.jpg"], target_category_names=["car"])
+
+    assert [image["id"] for image in actual["images"]] == [1, 2]
+    assert [annotation["id"] for annotation in actual["annotations"]] == [1, 3]
+    assert actual["categories"] == COCO_INSTANCES["categories"]
+    assert actual["info"] == COCO_INSTANCES["info"]
+
+
+def test_read_coco_instances__without_annotations(tmp_path: Path):
+    """annotationsを読み込まない場合は、gzipで圧縮されたファイルでもannotationsを含まない"""
+    path = tmp_path / "coco.json.gz"
+    path.write_bytes(gzip.compress(json.dumps(COCO_INSTANCES).encode()))
+
+    actual = read_coco_instances(path, target_image_file_names=["c.jpg"], should_read_annotations=False)
+
+    assert actual["images"] == [{"id": 3, "file_name": "c.jpg"}]
+    assert "annotations" not in actual
+
+
+@pytest.mark.parametrize("target_category_names", [None, ["bus"]])
+def test_read_coco_instances__single_pass(tmp_path: Path, monkeypatch: pytest.MonkeyPatch, target_category_names: list[str] | None):
+    """`annotations`に達した時点で絞り込める場合は、ファイルを1回だけ走査する"""
+    path = tmp_path / "coco.json"
+    # categoriesをannotationsの前に置く
+    path.write_text(json.dumps({key: COCO_INSTANCES[key] for key in ["images", "categories", "annotations"]}))
+    open_count = 0
+    original_open_json_for_read = coco_reader.open_json_for_read
+
+    def counting_open_json_for_read(path: Path) -> TextIO:
+        nonlocal open_count
+        open_count += 1
+        return original_open_json_for_read(path)
+
+    monkeypatch.setattr(coco_reader, "open_json_for_read", counting_open_json_for_read)
+    actual = read_coco_instances(path, target_image_file_names=["a.jpg"], target_category_names=target_category_names)
+
+    assert open_count == 1
+    assert [annotation["id"] for annotation in actual["annotations"]] == ([1, 2] if target_category_names is None else [2])
+
+
+def test_read_coco_instances__without_filters(coco_instances_json: Path, monkeypatch: pytest.MonkeyPatch):
+    """絞り込まない場合は、少しずつ読み込まずに`read_json`でまとめてパースする"""
+
+    def fail_open_json_for_read(path: Path) -> TextIO:
+        raise AssertionError(f"少しずつ読み込んではいけません。 :: path='{path}'")
+
+    monkeypatch.setattr(coco_reader, "open_json_for_read", fail_open_json_for_read)
+    annotation_store = CocoAnnotationStore()
+    actual = read_coco_instances(coco_instances_json, annotation_store=annotation_store)
+
+    assert actual["annotations"] is annotation_store
+    assert list(annotation_store) == COCO_INSTANCES["annotations"]
+    assert {key: value for key, value in actual.items() if key != "annotations"} == {key: value for key, value in COCO_INSTANCES.items() if key != "annotations"}
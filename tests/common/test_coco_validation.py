@@ -0,0 +1,147 @@
+from typing import Any
+
+from src.common.annotation_store import CocoAnnotationStore
+from src.common.coco_validation import SEVERITY_ERROR, SEVERITY_WARNING, validate_coco_instances
+from src.common.shard import get_shard_index
+
+
+def create_coco_instances(annotations: list[dict]) -> dict:
+    return {
+        "images": [{"id": 1, "file_name": "a.jpg", "width": 100, "height": 50}, {"id": 2, "file_name": "b.jpg", "width": 10, "height": 10}],
+        "categories": [{"id": 1, "name": "car"}],
+        "annotations": annotations,
+    }
+
+
+def get_issue_kinds(coco_instances: dict) -> list[tuple[str, int | None]]:
+    return sorted((issue.kind, issue.annotation_id) for issue in validate_coco_instances(coco_instances))
+
+
+def test_validate_coco_instances__valid():
+    coco_instances = create_coco_instances(
+        [
+            {"id": 1, "image_id": 1, "category_id": 1, "bbox": [0, 0, 100, 50], "segmentation": [[0, 0, 100, 0, 100, 50]], "iscrowd": 0},
+            {"id": 2, "image_id": 2, "category_id": 1, "bbox": [1.5, 2.5, 3, 4], "segmentation": {"size": [10, 10], "counts": [100]}, "iscrowd": 1},
+        ]
+    )
+    assert validate_coco_instances(coco_instances) == []
+
+
+def test_validate_coco_instances__dangling_and_duplicate_ids():
+    coco_instances = create_coco_instances(
+        [
+            {"id": 1, "image_id": 1, "category_id": 1, "bbox": [0, 0, 1, 1]},
+            {"id": 1, "image_id": 3, "category_id": 1, "bbox": [0, 0, 1, 1]},
+            {"id": 3, "image_id": 1, "category_id": 9, "bbox": [0, 0, 1, 1]},
+        ]
+    )
+    coco_instances["images"].append({"id": 2, "file_name": "c.jpg", "width": 10, "height": 10})
+    issues = validate_coco_instances(coco_instances)
+    assert sorted((issue.kind, issue.annotation_id, issue.image_id) for issue in issues) == [
+        ("dangling_category_id", 3, 1),
+        ("dangling_image_id", 1, 3),
+        ("duplicate_annotation_id", None, None),
+        ("duplicate_image_id", None, None),
+    ]
+    assert all(issue.severity == SEVERITY_ERROR for issue in issues)
+
+
+def test_validate_coco_instances__bbox():
+    coco_instances = create_coco_instances(
+        [
+            {"id": 1, "image_id": 1, "category_id": 1, "bbox": [90, 0, 11, 50]},
+            {"id": 2, "image_id": 2, "category_id": 1, "bbox": [-1, 0, 2, 2]},
+            {"id": 3, "image_id": 2, "category_id": 1, "bbox": [0, 0, -2, 2]},
+            {"id": 4, "image_id": 2, "category_id": 1},
+        ]
+    )
+    assert get_issue_kinds(coco_instances) == [("bbox_out_of_image", 1), ("bbox_out_of_image", 2), ("invalid_bbox", 3)]
+
+
+def test_validate_coco_instances__polygon():
+    coco_instances = create_coco_instances(
+        [
+            # 2個目のポリゴンのy座標（51）が画像の高さ（50）を超えている
+            {"id": 1, "image_id": 1, "category_id": 1, "segmentation": [[0, 0, 1, 0, 1, 1], [0, 0, 60, 51, 60, 0]], "iscrowd": 0},
+            # x座標（60）は画像1の幅の範囲内だが、画像2の幅（10）を超えている
+            {"id": 2, "image_id": 2, "category_id": 1, "segmentation": [[0, 0, 60, 0, 1, 1]], "iscrowd": 0},
+            {"id": 3, "image_id": 1, "category_id": 1, "segmentation": [[0, 0, 1, 0, 1]], "iscrowd": 0},
+            {"id": 4, "image_id": 1, "category_id": 1, "segmentation": [[0, 0, 1, 0]], "iscrowd": 0},
+        ]
+    )
+    issues = validate_coco_instances(coco_instances)
+    assert sorted((issue.kind, issue.annotation_id) for issue in issues) == [
+        ("odd_length_polygon", 3),
+        ("polygon_out_of_image", 1),
+        ("polygon_out_of_image", 2),
+        ("too_few_polygon_points", 4),
+    ]
+    assert {issue.severity for issue in issues if issue.kind == "polygon_out_of_image"} == {SEVERITY_WARNING}
+
+
+def test_validate_coco_instances__rle_size_mismatch():
+    coco_instances = create_coco_instances(
+        [
+            {"id": 1, "image_id": 1, "category_id": 1, "segmentation": {"size": [50, 100], "counts": "abc"}, "iscrowd": 1},
+            # sizeは[height, width]の順
+            {"id": 2, "image_id": 1, "category_id": 1, "segmentation": {"size": [100, 50], "counts": "abc"}, "iscrowd": 1},
+        ]
+    )
+    assert get_issue_kinds(coco_instances) == [("rle_size_mismatch", 2)]
+
+
+def test_validate_coco_instances__empty():
+    assert validate_coco_instances({"images": [], "categories": [], "annotations": []}) == []
+    assert get_issue_kinds({"images": [], "categories": [], "annotations": [{"id": 1, "image_id": 1, "category_id": 1, "bbox": [0, 0, 1, 1]}]}) == [
+        ("dangling_category_id", 1),
+        ("dangling_image_id", 1),
+    ]
+
+
+def test_validate_coco_instances__missing_rle_size():
+    """sizeがないRLEは、例外を発生させずに不整合として報告する"""
+    coco_instances = create_coco_instances([{"id": 1, "image_id": 1, "category_id": 1, "segmentation": {"counts": "abc"}, "iscrowd": 1}])
+    assert get_issue_kinds(coco_instances) == [("missing_rle_size", 1)]
+
+
+def test_validate_coco_instances__annotation_store():
+    """`CocoAnnotationStore`の列に格納したannotationsも、dictのlistと同じように検証する"""
+    annotations = [
+        {"id": 1, "image_id": 1, "category_id": 1, "bbox": [90, 0, 11, 50], "segmentation": [[0, 0, 1, 0, 1, 1], [0, 0, 60, 51, 60, 0]], "area": 1, "iscrowd": 0},
+        {"id": 1, "image_id": 2, "category_id": 9, "bbox": [0, 0, -2, 2], "segmentation": [[0, 0, 1, 0, 1]], "area": 1, "iscrowd": 0},
+        {"id": 3, "image_id": 1, "category_id": 1, "bbox": [0, 0, 1, 1], "segmentation": {"size": [100, 50], "counts": [1, 2]}, "area": 1, "iscrowd": 1},
+        {"id": 4, "image_id": 3, "category_id": 1, "bbox": [0, 0, 1, 1], "segmentation": [[0, 0, 1, 0]], "area": 1, "iscrowd": 0},
+    ]
+    annotation_store = CocoAnnotationStore(annotations)
+    assert annotation_store.raw_annotations == {}
+
+    expected = [
+        ("bbox_out_of_image", 1),
+        ("dangling_category_id", 1),
+        ("dangling_image_id", 4),
+        ("duplicate_annotation_id", None),
+        ("invalid_bbox", 1),
+        ("odd_length_polygon", 1),
+        ("polygon_out_of_image", 1),
+        ("rle_size_mismatch", 3),
+        ("too_few_polygon_points", 4),
+    ]
+    assert get_issue_kinds(create_coco_instances(annotation_store)) == expected  # type: ignore[arg-type]
+    assert get_issue_kinds(create_coco_instances(annotations)) == expected
+
+
+def test_validate_coco_instances__shard():
+    """シャードのimagesとannotationsだけを検証する。存在しないimageを参照しているannotationは、シャード0で検証する"""
+    coco_images: list[dict[str, Any]] = [{"id": i, "file_name": f"{i}.jpg", "width": 10, "height": 10} for i in range(1, 11)]
+    coco_instances = {
+        "images": coco_images,
+        "categories": [{"id": 1, "name": "car"}],
+        # 画像が存在するannotationは、すべてbboxが画像からはみ出ている
+        "annotations": [{"id": i, "image_id": i, "category_id": 1, "bbox": [5, 5, 10, 10]} for i in range(1, 12)],
+    }
+    shard_issues = [validate_coco_instances(coco_instances, num_shards=3, shard_index=shard_index) for shard_index in range(3)]
+
+    assert sorted(issue.annotation_id or 0 for issues in shard_issues for issue in issues if issue.kind == "bbox_out_of_image") == list(range(1, 11))
+    assert [[issue.annotation_id for issue in issues if issue.kind == "dangling_image_id"] for issues in shard_issues] == [[11], [], []]
+    for shard_index, issues in enumerate(shard_issues):
+        assert {issue.image_id for issue in issues if issue.kind == "bbox_out_of_image"} == {image["id"] for image in coco_images if get_shard_index(image["file_name"], 3) == shard_index}
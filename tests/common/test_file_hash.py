@@ -0,0 +1,38 @@
+import hashlib
+import os
+from pathlib import Path
+
+from src.common.file_hash import FileHashCache
+
+
+class TestFileHashCache:
+    def test_get_sha256(self, tmp_path: Path):
+        file = tmp_path / "a.bin"
+        file.write_bytes(b"abc")
+        cache = FileHashCache()
+        assert cache.get_sha256(file) == hashlib.sha256(b"abc").hexdigest()
+
+    def test_persist_cache(self, tmp_path: Path):
+        file = tmp_path / "a.bin"
+        file.write_bytes(b"abc")
+        cache_json = tmp_path / "cache.json"
+        cache = FileHashCache(cache_json)
+        cache.get_sha256(file)
+        cache.save()
+
+        # キャッシュされたハッシュ値が使われることを、キャッシュファイルを書き換えて確認する
+        stat = file.stat()
+        cache_json.write_text(f'{{"{file.resolve()}": {{"size": {stat.st_size}, "mtime_ns": {stat.st_mtime_ns}, "sha256": "cached"}}}}')
+        assert FileHashCache(cache_json).get_sha256(file) == "cached"
+
+    def test_recalculate_modified_file(self, tmp_path: Path):
+        """更新日時が変わったファイルはハッシュ値を再計算する"""
+        file = tmp_path / "a.bin"
+        file.write_bytes(b"abc")
+        cache = FileHashCache()
+        cache.get_sha256(file)
+
+        file.write_bytes(b"xyz")
+        stat = file.stat()
+        os.utime(file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+        assert cache.get_sha256(file) == hashlib.sha256(b"xyz").hexdigest()
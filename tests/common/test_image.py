@@ -0,0 +1,102 @@
+import io
+from pathlib import Path
+
+import numpy
+import pytest
+from PIL import Image
+
+from src.common.image import BinaryImageFormat, list_files_in_dir, read_image_size, read_image_size_from_stream, write_binary_png, write_label_map_png
+from src.common.mask import CroppedMask
+
+
+class TestReadImageSize:
+    def test_png(self, tmp_path: Path):
+        image_file = tmp_path / "a.png"
+        Image.new("RGB", (30, 20)).save(image_file)
+        assert read_image_size(image_file) == (30, 20)
+
+    def test_jpeg(self, tmp_path: Path):
+        image_file = tmp_path / "a.jpg"
+        Image.new("RGB", (30, 20)).save(image_file, format="JPEG")
+        assert read_image_size(image_file) == (30, 20)
+
+    def test_progressive_jpeg(self, tmp_path: Path):
+        image_file = tmp_path / "a.jpg"
+        Image.new("RGB", (31, 17)).save(image_file, format="JPEG", progressive=True)
+        assert read_image_size(image_file) == (31, 17)
+
+    def test_unsupported_format(self, tmp_path: Path):
+        """JPEGでもPNGでもない場合はNoneを返す"""
+        image_file = tmp_path / "a.bmp"
+        Image.new("RGB", (30, 20)).save(image_file, format="BMP")
+        assert read_image_size(image_file) is None
+
+    def test_broken_jpeg(self, tmp_path: Path):
+        """JPEGのセグメント長が壊れている場合はNoneを返す"""
+        image_file = tmp_path / "a.jpg"
+        image_file.write_bytes(b"\xff\xd8\xff\xe0\x00\x00" + b"\x00" * 16)
+        assert read_image_size(image_file) is None
+
+
+def test_list_files_in_dir(tmp_path: Path):
+    (tmp_path / "sub").mkdir()
+    (tmp_path / "a.jpg").write_bytes(b"")
+    (tmp_path / "sub/b.jpg").write_bytes(b"")
+    assert list_files_in_dir(tmp_path) == {"a.jpg", "sub/b.jpg"}
+
+
+class TestWriteBinaryPng:
+    @pytest.mark.parametrize("image_format", list(BinaryImageFormat))
+    def test_write_binary_png(self, image_format: BinaryImageFormat):
+        """塗られている部分は[255,255,255,255]、塗られていない部分は[0,0,0,0]として読み込める"""
+        mask = numpy.random.default_rng(0).random((23, 13)) > 0.5
+        f = io.BytesIO()
+        # 行数が`rows_per_chunk`で割り切れない場合も確認する
+        write_binary_png(mask, f, image_format=image_format, rows_per_chunk=5)
+
+        f.seek(0)
+        assert read_image_size_from_stream(f) == (13, 23)
+        f.seek(0)
+        rgba = numpy.array(Image.open(f).convert("RGBA"))
+        assert (rgba[mask] == 255).all()
+        assert (rgba[~mask] == 0).all()
+
+    @pytest.mark.parametrize("compression_level", [0, 1, 9])
+    def test_fortran_order_uint8_mask(self, compression_level: int):
+        """`pycocotools.mask.decode`の戻り値のような、F-orderのuint8の配列も書き込める"""
+        mask = numpy.asfortranarray(numpy.eye(9, 17, dtype=numpy.uint8))
+        f = io.BytesIO()
+        write_binary_png(mask, f, compression_level=compression_level, image_format=BinaryImageFormat.PALETTE)
+
+        f.seek(0)
+        image = Image.open(f)
+        assert image.mode == "P"
+        assert numpy.array_equal(numpy.array(image.convert("1")), mask.astype(bool))
+
+    @pytest.mark.parametrize("image_format", list(BinaryImageFormat))
+    def test_cropped_mask(self, image_format: BinaryImageFormat):
+        """`CroppedMask`は、画像全体のサイズの配列と同じPNGを書き込む"""
+        mask = numpy.zeros((23, 13), dtype=bool)
+        mask[4:12, 2:7] = numpy.random.default_rng(0).random((8, 5)) > 0.5
+        expected = io.BytesIO()
+        write_binary_png(mask, expected, image_format=image_format, rows_per_chunk=5)
+        actual = io.BytesIO()
+        write_binary_png(CroppedMask.from_array(mask), actual, image_format=image_format, rows_per_chunk=5)
+        assert actual.getvalue() == expected.getvalue()
+
+
+class TestWriteLabelMapPng:
+    @pytest.mark.parametrize("dtype", [numpy.uint8, numpy.uint16])
+    def test_write_label_map_png(self, dtype: type):
+        label_map: numpy.ndarray = numpy.random.default_rng(0).integers(0, numpy.iinfo(dtype).max, size=(23, 13), endpoint=True).astype(dtype)
+        f = io.BytesIO()
+        write_label_map_png(label_map, f, rows_per_chunk=5)
+
+        f.seek(0)
+        image = Image.open(f)
+        assert image.mode == ("L" if dtype == numpy.uint8 else "I;16")
+        assert numpy.array_equal(numpy.array(image), label_map)
+
+    def test_unsupported_dtype(self):
+        with pytest.raises(ValueError):
+            write_label_map_png(numpy.zeros((2, 2), dtype=numpy.int32), io.BytesIO())
@@ -0,0 +1,68 @@
+import gzip
+import json
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+import src.common.json_file
+from src.common.json_file import dumps_json, is_gzip_file, loads_json, open_json_for_write, read_json, write_json
+
+
+@pytest.mark.parametrize("file_name", ["a.json", "a.json.gz"])
+def test_open_json_for_write_and_read_json(tmp_path: Path, file_name: str):
+    """拡張子が`.gz`の場合はgzipで圧縮して書き込み、読み込むときは展開する"""
+    json_file = tmp_path / file_name
+    with open_json_for_write(json_file, compression_level=1) as f:
+        json.dump({"name": "車"}, f, ensure_ascii=False)
+
+    assert is_gzip_file(json_file) == file_name.endswith(".gz")
+    assert read_json(json_file) == {"name": "車"}
+
+
+def test_read_json__detect_gzip_by_content(tmp_path: Path):
+    """拡張子に関わらず、gzipで圧縮されているかはファイルの中身で判定する"""
+    json_file = tmp_path / "a.json"
+    json_file.write_bytes(gzip.compress(b'{"id": 1}'))
+    assert read_json(json_file) == {"id": 1}
+
+
+def test_open_json_for_write__is_gzip(tmp_path: Path):
+    json_file = tmp_path / ".a.json.gz.tmp"
+    with open_json_for_write(json_file, is_gzip=True) as f:
+        f.write("[]")
+    assert gzip.decompress(json_file.read_bytes()) == b"[]"
+
+
+@pytest.fixture(params=["orjson", "json"])
+def json_backend(request: pytest.FixtureRequest, monkeypatch: pytest.MonkeyPatch) -> str:
+    if request.param == "orjson":
+        pytest.importorskip("orjson")
+    monkeypatch.setattr(src.common.json_file, "JSON_BACKEND", request.param)
+    return request.param
+
+
+@pytest.mark.usefixtures("json_backend")
+class TestJsonBackend:
+    def test_dumps_json(self):
+        assert dumps_json({"name": "車", "ids": [1, 2]}) == '{"name":"車","ids":[1,2]}'.encode()
+        assert dumps_json({"name": "車"}, indent=True) == json.dumps({"name": "車"}, indent=2, ensure_ascii=False).encode()
+
+    def test_dumps_json__non_str_key(self):
+        """標準ライブラリのjsonと同じように、intのkeyは文字列に変換する"""
+        assert loads_json(dumps_json({1: "a"})) == {"1": "a"}
+
+    def test_dumps_json__numpy(self):
+        """numpyのスカラーや配列は、Pythonの数値やlistと同じようにシリアライズする"""
+        assert dumps_json({"id": np.int64(1), "area": np.float64(0.5), "bbox": np.array([1, 2])}) == b'{"id":1,"area":0.5,"bbox":[1,2]}'
+
+    def test_loads_json(self):
+        assert loads_json('{"name": "車"}'.encode()) == {"name": "車"}
+        assert loads_json('{"name": "車"}') == {"name": "車"}
+
+    @pytest.mark.parametrize("file_name", ["a.json", "a.json.gz"])
+    def test_write_json_and_read_json(self, tmp_path: Path, file_name: str):
+        json_file = tmp_path / file_name
+        write_json(json_file, {"name": "車"})
+        assert is_gzip_file(json_file) == file_name.endswith(".gz")
+        assert read_json(json_file) == {"name": "車"}
@@ -0,0 +1,84 @@
+import io
+import json
+
+import pytest
+
+import src.common.json_file
+from src.common.json_file import dumps_json
+from src.common.json_stream import StreamingJsonObjectWriter, iter_json_object_members
+
+
+@pytest.mark.parametrize("json_backend", ["orjson", "json"])
+@pytest.mark.parametrize("indent", [False, True])
+def test_streaming_json_object_writer(json_backend: str, *, indent: bool, monkeypatch: pytest.MonkeyPatch):
+    """`dumps_json`と同じ文字列が出力される"""
+    if json_backend == "orjson":
+        pytest.importorskip("orjson")
+    monkeypatch.setattr(src.common.json_file, "JSON_BACKEND", json_backend)
+    # 配列の要素はまとめてシリアライズするので、まとめる個数より多い要素を書き出す
+    monkeypatch.setattr(StreamingJsonObjectWriter, "_ARRAY_BATCH_SIZE", 2)
+    obj = {
+        "images": [{"id": 1, "file_name": "画像.jpg"}],
+        "annotations": [{"id": 1, "bbox": [1, 2, 3, 4]}, {"id": 2, "segmentation": [[1, 2]]}, {"id": 3, "segmentation": {"size": [1, 2], "counts": [0, 2]}}],
+        "categories": [],
+        "info": {"version": "1.0"},
+    }
+
+    f = io.StringIO()
+    with StreamingJsonObjectWriter(f, indent=indent) as writer:
+        writer.write("images", obj["images"])
+        assert writer.write_array("annotations", iter(obj["annotations"])) == 3
+        assert writer.write_array("categories", iter([])) == 0
+        writer.write("info", obj["info"])
+
+    assert f.getvalue() == dumps_json(obj, indent=indent).decode("utf-8")
+    assert json.loads(f.getvalue()) == obj
+
+
+@pytest.mark.parametrize("chunk_size", [1, 5, 2**16])
+def test_iter_json_object_members(chunk_size: int):
+    """指定したキーの配列は要素ごとに返され、それ以外は値がそのまま返される"""
+    obj = {"info": {"version": "1.0"}, "images": [{"id": 1, "file_name": "画像.jpg"}, {"id": 2, "file_name": "b.jpg"}], "annotations": [], "count": 12345, "categories": [1.5, None, [1, [2]]]}
+    text = json.dumps(obj, indent=2, ensure_ascii=False)
+
+    actual = list(iter_json_object_members(io.StringIO(text), stream_keys={"images", "annotations", "categories"}, chunk_size=chunk_size))
+
+    assert actual == [
+        ("info", {"version": "1.0"}),
+        ("images", {"id": 1, "file_name": "画像.jpg"}),
+        ("images", {"id": 2, "file_name": "b.jpg"}),
+        ("count", 12345),
+        ("categories", 1.5),
+        ("categories", None),
+        ("categories", [1, [2]]),
+    ]
+
+
+def test_iter_json_object_members__invalid_json():
+    with pytest.raises(ValueError):
+        list(iter_json_object_members(io.StringIO('{"images": [1, 2'), stream_keys={"images"}))
+    with pytest.raises(ValueError):
+        list(iter_json_object_members(io.StringIO("[]")))
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 2**16])
+def test_iter_json_object_members__skip_keys(chunk_size: int):
+    """`skip_keys`に含まれるキーは、文字列中の括弧やエスケープに関わらず値ごと読み飛ばされる"""
+    obj = {
+        "images": [{"id": 1}],
+        "annotations": [{"id": 1, "segmentation": {"counts": 'a]b}c\\"[{', "size": [2, 3]}}, {"id": 2, "segmentation": [[1.5, 2, 3e10]]}, "x\\\\"],
+        "info": {"description": "]"},
+        "count": 1,
+    }
+    text = json.dumps(obj, indent=2)
+
+    actual = list(iter_json_object_members(io.StringIO(text), stream_keys={"images", "annotations"}, skip_keys={"annotations", "info", "count"}, chunk_size=chunk_size))
+
+    assert actual == [("images", {"id": 1})]
+
+
+def test_iter_json_object_members__skip_keys_invalid_json():
+    with pytest.raises(ValueError):
+        list(iter_json_object_members(io.StringIO('{"annotations": [{"a": "]}'), skip_keys={"annotations"}))
+    with pytest.raises(ValueError):
+        list(iter_json_object_members(io.StringIO('{"annotations": [[1, 2]'), skip_keys={"annotations"}))
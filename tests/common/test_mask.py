@@ -0,0 +1,133 @@
+import io
+
+import numpy as np
+import pycocotools.mask
+import pytest
+from annofabapi.segmentation import write_binary_image
+
+from src.common.mask import CroppedMask, convert_mask_to_polygons, decode_rle_counts_string, read_binary_image_as_cropped_mask, translate_polygon
+from src.convert_af_annotation_to_coco_instances import get_rle_from_boolean_segmentation_array
+
+
+def create_masks() -> dict[str, np.ndarray]:
+    height, width = 40, 30
+    rng = np.random.default_rng(0)
+    small = np.zeros((height, width), dtype=bool)
+    small[5:9, 10:13] = True
+    # 列の下端から次の列の上端まで続く区間を含む
+    wrapped = np.zeros((height, width), dtype=bool)
+    wrapped[20:, 3] = True
+    wrapped[:, 4:6] = True
+    wrapped[:10, 6] = True
+    corners = np.zeros((height, width), dtype=bool)
+    corners[0, 0] = corners[-1, -1] = True
+    return {
+        "small": small,
+        "wrapped": wrapped,
+        "corners": corners,
+        "random": rng.random((height, width)) < 0.2,
+        "empty": np.zeros((height, width), dtype=bool),
+        "full": np.ones((height, width), dtype=bool),
+    }
+
+
+MASKS = create_masks()
+
+
+class TestCroppedMask:
+    @pytest.mark.parametrize("name", MASKS.keys())
+    def test_from_array(self, name: str):
+        mask = MASKS[name]
+        cropped_mask = CroppedMask.from_array(mask)
+        assert np.array_equal(cropped_mask.to_array(), mask)
+        rle = pycocotools.mask.encode(np.asfortranarray(mask.astype(np.uint8)))
+        assert cropped_mask.get_bbox() == pycocotools.mask.toBbox(rle).tolist()
+        assert cropped_mask.get_area() == pycocotools.mask.area(rle)
+        assert cropped_mask.to_uncompressed_rle() == get_rle_from_boolean_segmentation_array(mask)
+
+    @pytest.mark.parametrize("name", MASKS.keys())
+    def test_from_rle__compressed(self, name: str):
+        mask = MASKS[name]
+        rle = pycocotools.mask.encode(np.asfortranarray(mask.astype(np.uint8)))
+        segmentation = {"size": rle["size"], "counts": rle["counts"].decode("ascii")}
+        cropped_mask = CroppedMask.from_rle(segmentation, *mask.shape)
+        assert np.array_equal(cropped_mask.to_array(), mask)
+        assert cropped_mask.array.shape == (cropped_mask.get_bbox()[3], cropped_mask.get_bbox()[2])
+
+    @pytest.mark.parametrize("name", MASKS.keys())
+    def test_from_rle__uncompressed(self, name: str):
+        mask = MASKS[name]
+        cropped_mask = CroppedMask.from_rle(get_rle_from_boolean_segmentation_array(mask), *mask.shape)
+        assert np.array_equal(cropped_mask.to_array(), mask)
+
+    def test_from_rle__short_counts(self):
+        """`counts`の合計が画像のピクセル数より少ない場合、残りは塗られていない部分とみなす"""
+        cropped_mask = CroppedMask.from_rle({"size": [4, 3], "counts": [5, 2]}, 4, 3)
+        assert (cropped_mask.x, cropped_mask.y) == (1, 1)
+        assert cropped_mask.array.tolist() == [[True], [True]]
+
+    def test_get_rows(self):
+        mask = MASKS["small"]
+        cropped_mask = CroppedMask.from_array(mask)
+        assert np.array_equal(cropped_mask.get_rows(0, 7), mask[0:7])
+        assert np.array_equal(cropped_mask.get_rows(32, 64), mask[32:40])
+
+    def test_clip(self):
+        mask = MASKS["wrapped"]
+        clipped_mask = CroppedMask.from_array(mask).clip(image_width=5, image_height=15)
+        assert (clipped_mask.image_width, clipped_mask.image_height) == (5, 15)
+        assert np.array_equal(clipped_mask.to_array(), mask[:15, :5])
+
+    @pytest.mark.parametrize("name", MASKS.keys())
+    @pytest.mark.parametrize(("x", "y"), [(0, 0), (8, 4), (20, 30), (-5, -5)])
+    def test_crop(self, name: str, x: int, y: int):
+        """画像の範囲外を含む領域を切り出しても、画像全体の配列から切り出したものと一致する"""
+        mask = MASKS[name]
+        cropped_mask = CroppedMask.from_array(mask).crop(x, y, width=12, height=16)
+        padded_mask = np.pad(mask, 20)
+        assert (cropped_mask.image_width, cropped_mask.image_height) == (12, 16)
+        assert np.array_equal(cropped_mask.to_array(), padded_mask[y + 20 : y + 36, x + 20 : x + 32])
+
+    def test_read_binary_image_as_cropped_mask(self):
+        mask = MASKS["random"]
+        with io.BytesIO() as f:
+            write_binary_image(mask, f)
+            f.seek(0)
+            cropped_mask = read_binary_image_as_cropped_mask(f)
+        assert (cropped_mask.image_width, cropped_mask.image_height) == (30, 40)
+        assert np.array_equal(cropped_mask.to_array(), mask)
+
+
+def test_decode_rle_counts_string():
+    mask = MASKS["random"]
+    rle = pycocotools.mask.encode(np.asfortranarray(mask.astype(np.uint8)))
+    assert decode_rle_counts_string(rle["counts"]).tolist() == get_rle_from_boolean_segmentation_array(mask)["counts"]
+
+
+def test_translate_polygon():
+    assert translate_polygon([0, 0, 1, 2], 10, 20) == [10, 20, 11, 22]
+
+
+class TestConvertMaskToPolygons:
+    def test_rectangle(self):
+        mask = np.zeros((5, 5), dtype=bool)
+        mask[1:3, 1:4] = True
+        # 座標はピクセルの角（左上が(0,0)）
+        assert convert_mask_to_polygons(mask, simplify_tolerance=0) == [[1, 1, 1, 3, 4, 3, 4, 1]]
+
+    def test_multiple_regions(self):
+        mask = np.zeros((6, 6), dtype=bool)
+        mask[0:2, 0:2] = True
+        mask[4:6, 3:6] = True
+        assert convert_mask_to_polygons(mask, simplify_tolerance=0) == [[3, 4, 3, 6, 6, 6, 6, 4], [0, 0, 0, 2, 2, 2, 2, 0]]
+
+    def test_simplify(self):
+        """単純化すると頂点数が減る"""
+        yy, xx = np.mgrid[:200, :200]
+        mask = (yy - 100) ** 2 + (xx - 100) ** 2 < 80**2
+        polygon = convert_mask_to_polygons(mask, simplify_tolerance=0)[0]
+        simplified_polygon = convert_mask_to_polygons(mask, simplify_tolerance=2)[0]
+        assert len(simplified_polygon) < len(polygon)
+
+    def test_empty_mask(self):
+        assert convert_mask_to_polygons(np.zeros((3, 3), dtype=bool)) == []
@@ -0,0 +1,50 @@
+import pytest
+
+from src.common.sampling import StratifiedReservoirSampler, get_sample_priority
+
+
+def test_get_sample_priority():
+    assert get_sample_priority("task1/input1", 0) == get_sample_priority("task1/input1", 0)
+    assert get_sample_priority("task1/input1", 0) != get_sample_priority("task1/input1", 1)
+
+
+class TestStratifiedReservoirSampler:
+    def test_sample_size_per_stratum(self):
+        sampler = StratifiedReservoirSampler(sample_size=3, seed=0)
+        for i in range(100):
+            sampler.add(f"a{i}", ["a"])
+        sampler.add("b0", ["b"])
+
+        assert sampler.get_sample_counts_by_stratum() == {"a": 3, "b": 1}
+        sampled_keys = sampler.get_sampled_keys()
+        assert len(sampled_keys) == 4
+        assert "b0" in sampled_keys
+
+    def test_independent_of_order(self):
+        """候補を追加する順番によらず、同じキーが選ばれる"""
+        keys = [f"task{i}/input{i}" for i in range(100)]
+        forward = StratifiedReservoirSampler(sample_size=10, seed=1)
+        backward = StratifiedReservoirSampler(sample_size=10, seed=1)
+        for key in keys:
+            forward.add(key, [""])
+        for key in reversed(keys):
+            backward.add(key, [""])
+
+        assert forward.get_sampled_keys() == backward.get_sampled_keys()
+
+        other_seed = StratifiedReservoirSampler(sample_size=10, seed=2)
+        for key in keys:
+            other_seed.add(key, [""])
+        assert other_seed.get_sampled_keys() != forward.get_sampled_keys()
+
+    def test_multiple_strata(self):
+        """複数の層の候補になったキーは、どれか1個の層で選ばれれば選ばれる"""
+        sampler = StratifiedReservoirSampler(sample_size=1, seed=0)
+        sampler.add("both", ["a", "b"])
+        sampler.add("no_stratum", [])
+
+        assert sampler.get_sampled_keys() == {"both"}
+
+    def test_invalid_sample_size(self):
+        with pytest.raises(ValueError):
+            StratifiedReservoirSampler(sample_size=0, seed=0)
@@ -0,0 +1,20 @@
+import pytest
+
+from src.common.shard import get_shard_index, validate_shard
+
+
+def test_get_shard_index():
+    keys = [f"image{i}.jpg" for i in range(100)]
+    shard_indexes = [get_shard_index(key, 4) for key in keys]
+    assert all(0 <= index < 4 for index in shard_indexes)
+    # 実行ごとに同じ値になる
+    assert get_shard_index("image0.jpg", 4) == get_shard_index("image0.jpg", 4)
+    assert len(set(shard_indexes)) == 4
+
+
+def test_validate_shard():
+    validate_shard(4, 3)
+    with pytest.raises(ValueError):
+        validate_shard(4, 4)
+    with pytest.raises(ValueError):
+        validate_shard(0, 0)
@@ -0,0 +1,98 @@
+import numpy as np
+import pytest
+import shapely
+
+from src.common.tile import TileGrid, TilingOptions, clip_polygon_to_tiles, create_tile_images, get_tile_origins
+
+
+@pytest.mark.parametrize(
+    ("length", "tile_size", "overlap", "expected"),
+    [
+        (100, 100, 0, [0]),
+        (80, 100, 10, [0]),
+        (250, 100, 0, [0, 100, 150]),
+        (250, 100, 20, [0, 80, 150]),
+        (300, 100, 0, [0, 100, 200]),
+    ],
+)
+def test_get_tile_origins(length: int, tile_size: int, overlap: int, expected: list[int]):
+    assert get_tile_origins(length, tile_size, overlap) == expected
+
+
+def test_tiling_options__invalid():
+    with pytest.raises(ValueError):
+        TilingOptions(tile_size=0)
+    with pytest.raises(ValueError):
+        TilingOptions(tile_size=10, overlap=10)
+
+
+class TestTileGrid:
+    # 幅250、高さ150の画像を、100x100のタイルに分割する。列の開始位置は[0, 100, 150]、行の開始位置は[0, 50]
+    grid = TileGrid.from_image_size(250, 150, TilingOptions(tile_size=100))
+
+    def test_from_image_size(self):
+        assert len(self.grid) == 6
+        assert self.grid.get_origin(4) == (100, 50)
+
+    def test_find_overlapping_tiles(self):
+        """重なっているタイルは、すべてのタイルと愚直に比較した結果と一致する"""
+        rng = np.random.default_rng(0)
+        x0 = rng.integers(-50, 300, 200)
+        y0 = rng.integers(-50, 200, 200)
+        boxes = np.stack([x0, y0, x0 + rng.integers(0, 120, 200), y0 + rng.integers(0, 120, 200)], axis=1)
+
+        box_indices, tile_indices = self.grid.find_overlapping_tiles(boxes)
+
+        expected = []
+        for box_index, (bx0, by0, bx1, by1) in enumerate(boxes.tolist()):
+            for tile_index in range(len(self.grid)):
+                tx, ty = self.grid.get_origin(tile_index)
+                if max(bx0, tx) < min(bx1, tx + 100) and max(by0, ty) < min(by1, ty + 100):
+                    expected.append((box_index, tile_index))
+        assert list(zip(box_indices.tolist(), tile_indices.tolist(), strict=True)) == expected
+
+    def test_clip_boxes(self):
+        boxes = np.array([[90, 40, 160, 120], [90, 40, 160, 120]])
+        actual = self.grid.clip_boxes(boxes, np.array([0, 5]))
+        assert actual.tolist() == [[90, 40, 100, 100], [0, 0, 10, 70]]
+
+
+def test_create_tile_images():
+    grid = TileGrid.from_image_size(250, 150, TilingOptions(tile_size=100))
+    tile_images = create_tile_images({"id": 3, "file_name": "dir/image.jpg", "width": 250, "height": 150}, grid, TilingOptions(tile_size=100), start_image_id=10)
+
+    assert [tile_image["id"] for tile_image in tile_images] == list(range(10, 16))
+    assert tile_images[4] == {
+        "id": 14,
+        "file_name": "dir/image_100_50.jpg",
+        "width": 100,
+        "height": 100,
+        "tile": {"source_image_id": 3, "source_file_name": "dir/image.jpg", "x": 100, "y": 50},
+    }
+
+
+class TestClipPolygonToTiles:
+    grid = TileGrid.from_image_size(200, 100, TilingOptions(tile_size=100))
+
+    def test_contained(self):
+        """タイルに収まっているポリゴンは、座標を平行移動するだけ"""
+        points = [{"x": 110, "y": 10}, {"x": 150, "y": 10}, {"x": 130, "y": 40}]
+        assert clip_polygon_to_tiles(points, self.grid) == [(1, [[10, 10, 50, 10, 30, 40]], [10.0, 10.0, 40.0, 30.0], 600.0)]
+
+    def test_across_tiles(self):
+        """タイルの境界をまたぐポリゴンは、タイルとの共通部分に切り取る"""
+        points = [{"x": 50, "y": 0}, {"x": 150, "y": 100}, {"x": 50, "y": 100}]
+        actual = clip_polygon_to_tiles(points, self.grid)
+
+        assert [(tile_index, bbox, area) for tile_index, _, bbox, area in actual] == [(0, [50.0, 0.0, 50.0, 100.0], 3750.0), (1, [0.0, 50.0, 50.0, 50.0], 1250.0)]
+        left_polygon = shapely.Polygon(np.array(actual[0][1][0]).reshape(-1, 2))
+        assert left_polygon.equals(shapely.Polygon([(50, 0), (100, 50), (100, 100), (50, 100)]))
+
+    def test_split_into_multiple_parts(self):
+        """共通部分が複数に分かれる場合は、複数のポリゴンになる"""
+        points = [{"x": 50, "y": 10}, {"x": 150, "y": 10}, {"x": 150, "y": 90}, {"x": 50, "y": 90}, {"x": 50, "y": 60}, {"x": 120, "y": 60}, {"x": 120, "y": 40}, {"x": 50, "y": 40}]
+        actual = clip_polygon_to_tiles(points, self.grid)
+
+        assert [tile_index for tile_index, _, _, _ in actual] == [0, 1]
+        assert len(actual[0][1]) == 2
+        assert len(actual[1][1]) == 1
@@ -0,0 +1,54 @@
+import threading
+from pathlib import Path
+
+import pytest
+
+from src.common.write_behind import WriteBehindFileWriter
+
+
+def test_write_behind_file_writer(tmp_path: Path):
+    with WriteBehindFileWriter(max_workers=2) as writer:
+        writer.submit("a", [(tmp_path / "a/1.png", b"png"), (tmp_path / "a.json", b"{}")])
+        writer.submit("b", [(tmp_path / "b.json", b"[]")])
+
+    assert sorted(writer.succeeded_keys) == ["a", "b"]
+    assert writer.failed_keys == []
+    assert (tmp_path / "a/1.png").read_bytes() == b"png"
+    assert (tmp_path / "a.json").read_bytes() == b"{}"
+    assert (tmp_path / "b.json").read_bytes() == b"[]"
+
+
+def test_write_behind_file_writer__error(tmp_path: Path):
+    """書き込みに失敗した場合は、`submit`に渡したkeyを記録して、以降のファイルは書き込まない"""
+    (tmp_path / "file").write_text("")
+    with WriteBehindFileWriter() as writer:
+        writer.submit("a", [(tmp_path / "file/1.png", b"png"), (tmp_path / "a.json", b"{}")])
+        writer.submit("b", [(tmp_path / "b.json", b"[]")])
+
+    assert writer.failed_keys == ["a"]
+    assert writer.succeeded_keys == ["b"]
+    assert not (tmp_path / "a.json").exists()
+
+
+def test_write_behind_file_writer__backpressure(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    """書き込み待ちのデータの合計サイズが上限を超える場合は、`submit`がブロックする"""
+    can_write = threading.Event()
+    original_write_files = WriteBehindFileWriter._write_files
+
+    def blocking_write_files(files: list[tuple[Path, bytes]]) -> None:
+        can_write.wait()
+        original_write_files(files)
+
+    monkeypatch.setattr(WriteBehindFileWriter, "_write_files", staticmethod(blocking_write_files))
+    with WriteBehindFileWriter(max_pending_bytes=10) as writer:
+        # 1件だけで上限を超えていても、ほかに書き込み待ちのデータがなければ受け付ける
+        writer.submit("a", [(tmp_path / "a", b"a" * 20)])
+        submit_thread = threading.Thread(target=writer.submit, args=("b", [(tmp_path / "b", b"b")]))
+        submit_thread.start()
+        submit_thread.join(timeout=0.1)
+        assert submit_thread.is_alive()
+
+        can_write.set()
+        submit_thread.join()
+
+    assert sorted(writer.succeeded_keys) == ["a", "b"]
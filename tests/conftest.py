@@ -0,0 +1,20 @@
+from pathlib import Path
+
+import pytest
+
+from tests.benchmark.microbenchmark import DEFAULT_MICROBENCHMARK_BASELINE_JSON, DEFAULT_MICROBENCHMARK_RESULT_JSON, DEFAULT_MICROBENCHMARK_THRESHOLD
+
+
+def pytest_addoption(parser: pytest.Parser) -> None:
+    group = parser.getgroup("microbenchmark", "マイクロベンチマーク（`-m microbenchmark`）")
+    group.addoption(
+        "--microbenchmark_result_json", type=Path, default=DEFAULT_MICROBENCHMARK_RESULT_JSON, help=f"計測結果の出力先JSONファイルのパス。デフォルトは'{DEFAULT_MICROBENCHMARK_RESULT_JSON}'"
+    )
+    group.addoption("--microbenchmark_baseline_json", type=Path, default=DEFAULT_MICROBENCHMARK_BASELINE_JSON, help="比較対象の計測結果（ベースライン）のJSONファイルのパス")
+    group.addoption(
+        "--microbenchmark_threshold",
+        type=float,
+        default=DEFAULT_MICROBENCHMARK_THRESHOLD,
+        help=f"処理時間がベースラインの何倍を超えたら性能の劣化とみなすか。デフォルトは{DEFAULT_MICROBENCHMARK_THRESHOLD}",
+    )
+    group.addoption("--microbenchmark_update_baseline", action="store_true", help="指定すると、劣化を判定せずに、計測結果でベースラインのJSONファイルを上書きします。")
@@ -1,10 +1,31 @@
-import numpy as np
+import io
+import json
+from collections.abc import Iterator
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, BinaryIO
 
+import numpy as np
+import pycocotools.mask
+import pytest
+from annofabapi.segmentation import write_binary_image
+from PIL import Image
+
+from src import convert_af_annotation_to_coco_instances
+from src.common.mask import CroppedMask
+from src.common.sampling import SampleStratification, SamplingOptions
+from src.common.tile import TilingOptions
 from src.convert_af_annotation_to_coco_instances import (
+    AfAnnotationSource,
     AnnotationConverterFromAnnofabToCoco,
+    CocoSegmentationFormat,
+    FileNamePrefixScheme,
+    LabelMapOverlapOrder,
     clip_bounding_box_to_image,
     clip_polygon_to_image,
+    convert_af_annotation_sources_to_coco_instances_file,
     get_rle_from_boolean_segmentation_array,
+    iter_coco_annotations_from_af_annotation,
 )
 
 
@@ -111,6 +132,23 @@ class TestClipPolygonToImage:
         assert new_points == expected_points
 
 
+class FakeSegmentationParser:
+    """塗りつぶし画像をメモリ上で保持する、`SimpleAnnotationParser`の代わり"""
+
+    def __init__(self, masks: dict[str, np.ndarray]) -> None:
+        self.task_id = "task1"
+        self.input_data_id = "input1"
+        self.outer_files = {}
+        for annotation_id, mask in masks.items():
+            f = io.BytesIO()
+            write_binary_image(mask, f)
+            self.outer_files[annotation_id] = f.getvalue()
+
+    @contextmanager
+    def open_outer_file(self, annotation_id: str) -> Iterator[io.BytesIO]:
+        yield io.BytesIO(self.outer_files[annotation_id])
+
+
 class TestAnnotationConverterFromAnnofabToCoco:
     def test_init(self):
         """コンストラクタのテスト"""
@@ -226,6 +264,520 @@ class TestAnnotationConverterFromAnnofabToCoco:
         # 面積は計算された値と一致すること
         assert coco_annotation["area"] == 1600  # 40 * 40 = 1600
 
+    def test_convert_mask_to_polygon_annotation(self):
+        """塗りつぶしアノテーションのマスクをポリゴンに変換するテスト"""
+        converter = AnnotationConverterFromAnnofabToCoco(
+            coco_categories=[{"id": 1, "name": "label1"}],
+            coco_images=[{"id": 1, "file_name": "image1.jpg", "width": 10, "height": 10}],
+            segmentation_format=CocoSegmentationFormat.POLYGON,
+        )
+        coco_image = converter.images_by_file_name["image1.jpg"]
+        mask = np.zeros((10, 10), dtype=bool)
+        mask[2:6, 3:8] = True
+
+        coco_annotation, iou = converter.convert_mask_to_polygon_annotation(CroppedMask.from_array(mask), coco_image, coco_annotation_id=1, category_id=1)
+
+        assert iou == 1.0
+        assert coco_annotation is not None
+        assert coco_annotation["segmentation"] == [[3, 2, 3, 6, 8, 6, 8, 2]]
+        assert coco_annotation["bbox"] == [3.0, 2.0, 5.0, 4.0]
+        assert coco_annotation["area"] == 20.0
+        assert coco_annotation["iscrowd"] == 0
+
+    def test_convert_mask_to_polygon_annotation__low_iou(self):
+        """ポリゴンで再現できない（穴がある）マスクは、ポリゴンに変換しない"""
+        converter = AnnotationConverterFromAnnofabToCoco(
+            coco_categories=[{"id": 1, "name": "label1"}],
+            coco_images=[{"id": 1, "file_name": "image1.jpg", "width": 10, "height": 10}],
+            segmentation_format=CocoSegmentationFormat.POLYGON,
+        )
+        coco_image = converter.images_by_file_name["image1.jpg"]
+        mask = np.zeros((10, 10), dtype=bool)
+        mask[1:9, 1:9] = True
+        mask[2:8, 2:8] = False
+
+        coco_annotation, iou = converter.convert_mask_to_polygon_annotation(CroppedMask.from_array(mask), coco_image, coco_annotation_id=1, category_id=1)
+
+        assert coco_annotation is None
+        assert iou < 0.9
+
+    def test_convert_af_annotation__segmentation(self):
+        """塗りつぶしアノテーションはまとめて変換されるが、annotation_idはdetailsの順番に割り当てられる"""
+        converter = AnnotationConverterFromAnnofabToCoco(
+            coco_categories=[{"id": 1, "name": "label1"}],
+            coco_images=[{"id": 1, "file_name": "image1.jpg", "width": 6, "height": 4}],
+        )
+        mask1 = np.zeros((4, 6), dtype=bool)
+        mask1[1:3, 2:5] = True
+        mask2 = np.zeros((4, 6), dtype=bool)
+        mask2[0, 0] = True
+        af_parser = FakeSegmentationParser({"seg1": mask1, "seg2": mask2})
+        af_annotation = {
+            "task_id": "task1",
+            "input_data_id": "input1",
+            "details": [
+                {"annotation_id": "seg1", "label": "label1", "data": {"_type": "Segmentation"}},
+                {"annotation_id": "bbox1", "label": "label1", "data": {"_type": "BoundingBox", "left_top": {"x": 0, "y": 0}, "right_bottom": {"x": 2, "y": 2}}},
+                {"annotation_id": "seg2", "label": "label1", "data": {"_type": "Segmentation"}},
+            ],
+        }
+
+        coco_annotations, next_annotation_id = converter.convert_af_annotation(af_annotation, af_parser, converter.images_by_file_name["image1.jpg"], coco_start_annotation_id=10)  # type: ignore[arg-type]
+
+        assert next_annotation_id == 13
+        assert [anno["id"] for anno in coco_annotations] == [10, 11, 12]
+        assert [anno["iscrowd"] for anno in coco_annotations] == [1, 0, 1]
+        assert coco_annotations[0]["bbox"] == [2.0, 1.0, 3.0, 2.0]
+        assert coco_annotations[0]["area"] == 6.0
+        assert coco_annotations[2]["bbox"] == [0.0, 0.0, 1.0, 1.0]
+        for coco_annotation, mask in [(coco_annotations[0], mask1), (coco_annotations[2], mask2)]:
+            rle = pycocotools.mask.frPyObjects(coco_annotation["segmentation"], 4, 6)
+            assert (pycocotools.mask.decode(rle).astype(bool) == mask).all()
+
+    def test_convert_af_annotation_path(self, tmp_path: Path):
+        """dictのlistを返す。`CocoAnnotationStore`で受け取る場合も同じannotationsになる"""
+        create_af_annotation_dir(tmp_path)
+        converter = AnnotationConverterFromAnnofabToCoco(
+            coco_categories=[{"id": 1, "name": "label1"}],
+            coco_images=[{"id": 10, "file_name": "image1.jpg", "width": 10, "height": 10}, {"id": 20, "file_name": "image2.jpg", "width": 10, "height": 10}],
+        )
+
+        actual = converter.convert_af_annotation_path(tmp_path, target_task_phase=None, target_task_status=None)
+        annotation_store = converter.convert_af_annotation_path_to_annotation_store(tmp_path, target_task_phase=None, target_task_status=None)
+
+        assert isinstance(actual, list)
+        assert sorted(anno["id"] for anno in actual) == [1, 2, 3]
+        assert sorted(annotation_store, key=lambda anno: anno["id"]) == sorted(actual, key=lambda anno: anno["id"])
+
+
+class TestCreateLabelMap:
+    coco_categories = [{"id": 1, "name": "small"}, {"id": 2, "name": "large"}]  # noqa: RUF012
+    coco_image = {"id": 1, "file_name": "image1.jpg", "width": 6, "height": 4}  # noqa: RUF012
+
+    def create_af_annotation(self, *, is_small_first: bool) -> tuple[dict, FakeSegmentationParser]:
+        """画像全体を覆うbbox（large）と、その内側の塗りつぶし（small）"""
+        mask = np.zeros((4, 6), dtype=bool)
+        mask[1:3, 2:5] = True
+        small_detail = {"annotation_id": "seg1", "label": "small", "data": {"_type": "Segmentation"}}
+        large_detail = {"annotation_id": "bbox1", "label": "large", "data": {"_type": "BoundingBox", "left_top": {"x": -1, "y": 0}, "right_bottom": {"x": 10, "y": 4}}}
+        details = [small_detail, large_detail] if is_small_first else [large_detail, small_detail]
+        return {"task_id": "task1", "input_data_id": "input1", "details": details}, FakeSegmentationParser({"seg1": mask})
+
+    @pytest.mark.parametrize(
+        ("overlap_order", "is_small_first", "expected_inner_value"),
+        [
+            (LabelMapOverlapOrder.AREA, True, 1),
+            (LabelMapOverlapOrder.AREA, False, 1),
+            (LabelMapOverlapOrder.DETAILS, True, 2),
+            (LabelMapOverlapOrder.DETAILS, False, 1),
+            (LabelMapOverlapOrder.CATEGORY, False, 2),
+        ],
+    )
+    def test_overlap_order(self, overlap_order: LabelMapOverlapOrder, *, is_small_first: bool, expected_inner_value: int):
+        converter = AnnotationConverterFromAnnofabToCoco(coco_categories=self.coco_categories, coco_images=[self.coco_image], label_map_overlap_order=overlap_order)
+        af_annotation, af_parser = self.create_af_annotation(is_small_first=is_small_first)
+
+        label_map = converter.create_label_map(af_annotation, af_parser, self.coco_image)  # type: ignore[arg-type]
+
+        assert label_map.dtype == np.uint8
+        expected = np.full((4, 6), 2, dtype=np.uint8)
+        expected[1:3, 2:5] = expected_inner_value
+        assert (label_map == expected).all()
+
+    def test_polygon_and_uint16(self):
+        """カテゴリのIDが255より大きい場合はuint16になる。ラベルが対象外のアノテーションは塗らない"""
+        converter = AnnotationConverterFromAnnofabToCoco(
+            coco_categories=[{"id": 300, "name": "label1"}, {"id": 1, "name": "label2"}], coco_images=[self.coco_image], target_af_target_labels=["label1"]
+        )
+        af_annotation = {
+            "details": [
+                {"annotation_id": "polygon1", "label": "label1", "data": {"_type": "Points", "points": [{"x": 0, "y": 0}, {"x": 2, "y": 0}, {"x": 2, "y": 2}, {"x": 0, "y": 2}]}},
+                {"annotation_id": "bbox1", "label": "label2", "data": {"_type": "BoundingBox", "left_top": {"x": 0, "y": 0}, "right_bottom": {"x": 6, "y": 4}}},
+            ]
+        }
+
+        label_map = converter.create_label_map(af_annotation, FakeSegmentationParser({}), self.coco_image)  # type: ignore[arg-type]
+
+        assert label_map.dtype == np.uint16
+        expected = np.zeros((4, 6), dtype=np.uint16)
+        expected[0:2, 0:2] = 300
+        assert (label_map == expected).all()
+
+    def test_category_id_0(self):
+        converter = AnnotationConverterFromAnnofabToCoco(coco_categories=[{"id": 0, "name": "label1"}], coco_images=[self.coco_image])
+        with pytest.raises(ValueError):
+            converter.create_label_map({"details": []}, FakeSegmentationParser({}), self.coco_image)  # type: ignore[arg-type]
+
+
+def create_af_annotation_dir(af_annotation_dir: Path) -> None:
+    for task_id, input_data_name, task_phase, boxes in [
+        ("task1", "image1.jpg", "acceptance", [(0, 0, 2, 2), (1, 1, 3, 4)]),
+        ("task2", "image2.jpg", "annotation", [(5, 5, 6, 6)]),
+    ]:
+        details = [
+            {"annotation_id": f"{task_id}-{i}", "label": "label1", "data": {"_type": "BoundingBox", "left_top": {"x": x1, "y": y1}, "right_bottom": {"x": x2, "y": y2}}}
+            for i, (x1, y1, x2, y2) in enumerate(boxes)
+        ]
+        af_annotation = {
+            "task_id": task_id,
+            "task_phase": task_phase,
+            "task_status": "complete",
+            "input_data_id": f"input_{task_id}",
+            "input_data_name": input_data_name,
+            "details": details,
+        }
+        json_file = af_annotation_dir / task_id / f"input_{task_id}.json"
+        json_file.parent.mkdir(parents=True)
+        json_file.write_text(json.dumps(af_annotation))
+
+
+class TestIterCocoAnnotationsFromAfAnnotation:
+    coco_categories = [{"id": 1, "name": "label1"}]  # noqa: RUF012
+
+    def test_coco_images(self, tmp_path: Path):
+        """タスクごとにimageとannotationsを返し、annotationのidは通し番号になる"""
+        create_af_annotation_dir(tmp_path)
+        coco_images = [{"id": 10, "file_name": "image1.jpg", "width": 10, "height": 10}, {"id": 20, "file_name": "image2.jpg", "width": 10, "height": 10}]
+
+        actual = sorted(iter_coco_annotations_from_af_annotation(tmp_path, self.coco_categories, coco_images=coco_images), key=lambda item: item[0]["id"])
+
+        assert [coco_image["id"] for coco_image, _ in actual] == [10, 20]
+        assert [[anno["bbox"] for anno in coco_annotations] for _, coco_annotations in actual] == [[[0, 0, 2, 2], [1, 1, 2, 3]], [[5, 5, 1, 1]]]
+        assert sorted(anno["id"] for _, coco_annotations in actual for anno in coco_annotations) == [1, 2, 3]
+
+    def test_af_input_data_list_and_filter(self, tmp_path: Path):
+        """入力データ全件ファイルからimagesを作成し、CLIと同じフィルタを適用できる"""
+        create_af_annotation_dir(tmp_path)
+        af_input_data_list = [{"input_data_name": name, "system_metadata": {"original_resolution": {"width": 10, "height": 10}}} for name in ["image1.jpg", "image2.jpg"]]
+
+        actual = list(iter_coco_annotations_from_af_annotation(tmp_path, self.coco_categories, af_input_data_list=af_input_data_list, target_task_phase="acceptance"))
+
+        assert len(actual) == 1
+        coco_image, coco_annotations = actual[0]
+        assert coco_image == {"id": 1, "file_name": "image1.jpg", "width": 10, "height": 10}
+        assert [anno["image_id"] for anno in coco_annotations] == [1, 1]
+
+    def test_requires_either_images_or_input_data(self, tmp_path: Path):
+        with pytest.raises(ValueError):
+            next(iter_coco_annotations_from_af_annotation(tmp_path, self.coco_categories))
+
+
+class TestWriteLabelMaps:
+    coco_categories = [{"id": 1, "name": "label1"}]  # noqa: RUF012
+    coco_images = [{"id": 10, "file_name": "image1.jpg", "width": 10, "height": 8}, {"id": 20, "file_name": "sub/image2.jpg", "width": 10, "height": 8}]  # noqa: RUF012
+
+    def assert_label_maps(self, label_map_dir: Path) -> None:
+        label_map1 = np.asarray(Image.open(label_map_dir / "image1.png"))
+        expected = np.zeros((8, 10), dtype=np.uint8)
+        expected[0:2, 0:2] = 1
+        expected[1:4, 1:3] = 1
+        assert (label_map1 == expected).all()
+        # task2はinput_data_nameが"image2.jpg"なので、imagesに存在せず出力されない
+        assert sorted(p.name for p in label_map_dir.iterdir()) == ["image1.png"]
+
+    def test_with_coco_annotations(self, tmp_path: Path):
+        """COCO形式への変換と同じ走査で、ラベルマップを書き出す"""
+        create_af_annotation_dir(tmp_path / "af")
+        converter = AnnotationConverterFromAnnofabToCoco(coco_categories=self.coco_categories, coco_images=self.coco_images)
+
+        actual = list(converter.iter_converted_af_annotation_path(tmp_path / "af", label_map_dir=tmp_path / "label_map"))
+
+        assert len(actual) == 1
+        self.assert_label_maps(tmp_path / "label_map")
+
+    def test_segmentation_is_decoded_once(self, tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+        """COCO形式への変換とラベルマップの作成で、塗りつぶし画像を1回だけデコードする"""
+        mask = np.zeros((8, 10), dtype=bool)
+        mask[2:5, 3:7] = True
+        af_annotation = {"task_id": "task1", "input_data_id": "input1", "input_data_name": "image1.jpg", "details": [{"annotation_id": "seg1", "label": "label1", "data": {"_type": "Segmentation"}}]}
+        (tmp_path / "af/task1/input1").mkdir(parents=True)
+        (tmp_path / "af/task1/input1.json").write_text(json.dumps(af_annotation))
+        with (tmp_path / "af/task1/input1/seg1").open("wb") as f:
+            write_binary_image(mask, f)
+
+        decoded_files = []
+        original_read = convert_af_annotation_to_coco_instances.read_binary_image_as_cropped_mask
+
+        def read_binary_image_as_cropped_mask(fp: BinaryIO) -> CroppedMask:
+            decoded_files.append(fp)
+            return original_read(fp)
+
+        monkeypatch.setattr(convert_af_annotation_to_coco_instances, "read_binary_image_as_cropped_mask", read_binary_image_as_cropped_mask)
+        converter = AnnotationConverterFromAnnofabToCoco(coco_categories=self.coco_categories, coco_images=self.coco_images)
+
+        actual = list(converter.iter_converted_af_annotation_path(tmp_path / "af", label_map_dir=tmp_path / "label_map"))
+
+        assert len(decoded_files) == 1
+        assert actual[0][1][0]["area"] == 12
+        assert (np.asarray(Image.open(tmp_path / "label_map/image1.png")) == mask.astype(np.uint8)).all()
+
+    def test_label_map_failure(self, tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+        """ラベルマップの書き出しに失敗しても、採番済のCOCO形式のannotationsは返す"""
+        create_af_annotation_dir(tmp_path / "af")
+        converter = AnnotationConverterFromAnnofabToCoco(coco_categories=self.coco_categories, coco_images=[*self.coco_images, {"id": 30, "file_name": "image2.jpg", "width": 10, "height": 8}])
+
+        def write_label_map(*_: Any) -> None:
+            raise OSError("disk full")
+
+        monkeypatch.setattr(converter, "write_label_map", write_label_map)
+        actual = list(converter.iter_converted_af_annotation_path(tmp_path / "af", label_map_dir=tmp_path / "label_map"))
+
+        assert sorted(anno["id"] for _, coco_annotations in actual for anno in coco_annotations) == [1, 2, 3]
+
+    def test_label_maps_only(self, tmp_path: Path):
+        create_af_annotation_dir(tmp_path / "af")
+        converter = AnnotationConverterFromAnnofabToCoco(coco_categories=self.coco_categories, coco_images=self.coco_images)
+
+        assert converter.write_label_maps_from_af_annotation_path(tmp_path / "af", tmp_path / "label_map") == 1
+        self.assert_label_maps(tmp_path / "label_map")
+
+
+class TestConvertAfAnnotationSourcesToCocoInstancesFile:
+    coco_categories = [{"id": 1, "name": "label1"}]  # noqa: RUF012
+
+    def create_sources(self, tmp_path: Path) -> list[AfAnnotationSource]:
+        """image1.jpgは両方のプロジェクトに存在する"""
+        create_af_annotation_dir(tmp_path / "site_a")
+        create_af_annotation_dir(tmp_path / "site_b")
+        return [
+            AfAnnotationSource(tmp_path / "site_a", [{"id": 1, "file_name": "image1.jpg", "width": 10, "height": 10}, {"id": 2, "file_name": "image2.jpg", "width": 10, "height": 10}]),
+            AfAnnotationSource(tmp_path / "site_b", [{"id": 1, "file_name": "image1.jpg", "width": 10, "height": 10}, {"id": 2, "file_name": "image3.jpg", "width": 10, "height": 10}]),
+        ]
+
+    @pytest.mark.parametrize("parallelism", [1, 2])
+    def test_collision(self, tmp_path: Path, parallelism: int):
+        """重複した`file_name`にのみ接頭辞が付き、imageとannotationのIDは重複しない"""
+        output_json = tmp_path / "out/coco.json"
+        convert_af_annotation_sources_to_coco_instances_file(self.create_sources(tmp_path), self.coco_categories, output_json, parallelism=parallelism)
+
+        coco_instances = json.loads(output_json.read_text())
+        assert coco_instances["images"] == [
+            {"id": 1, "file_name": "site_a/image1.jpg", "width": 10, "height": 10},
+            {"id": 2, "file_name": "image2.jpg", "width": 10, "height": 10},
+            {"id": 3, "file_name": "site_b/image1.jpg", "width": 10, "height": 10},
+            {"id": 4, "file_name": "image3.jpg", "width": 10, "height": 10},
+        ]
+        assert coco_instances["categories"] == self.coco_categories
+        # sourcesの順番でIDが振られる。image3.jpgはAnnofab形式のアノテーションに存在しないので、site_bのtask2は変換されない
+        annotations = coco_instances["annotations"]
+        assert [anno["id"] for anno in annotations] == [1, 2, 3, 4, 5]
+        assert sorted(anno["image_id"] for anno in annotations) == [1, 1, 2, 3, 3]
+        # 一時ファイルは削除される
+        assert [p.name for p in output_json.parent.iterdir()] == ["coco.json"]
+
+    def test_prefix_scheme(self, tmp_path: Path):
+        sources = self.create_sources(tmp_path)
+
+        convert_af_annotation_sources_to_coco_instances_file(sources, self.coco_categories, tmp_path / "none.json", file_name_prefix_scheme=FileNamePrefixScheme.NONE)
+        # file_nameが同じimageは同じimageとみなされ、annotationsはまとめられる
+        coco_instances = json.loads((tmp_path / "none.json").read_text())
+        assert [image["file_name"] for image in coco_instances["images"]] == ["image1.jpg", "image2.jpg", "image3.jpg"]
+        assert sorted(anno["image_id"] for anno in coco_instances["annotations"]) == [1, 1, 1, 1, 2]
+
+        convert_af_annotation_sources_to_coco_instances_file(
+            sources, self.coco_categories, tmp_path / "all.json", file_name_prefix_scheme=FileNamePrefixScheme.ALL, file_name_prefix_format="{source_index}-"
+        )
+        coco_instances = json.loads((tmp_path / "all.json").read_text())
+        assert [image["file_name"] for image in coco_instances["images"]] == ["0-image1.jpg", "0-image2.jpg", "1-image1.jpg", "1-image3.jpg"]
+
+    def test_main_requires_input_data_per_source(self, tmp_path: Path):
+        """`--coco_instances_json`のimagesを全sourceで共有すると全imageが衝突するので、sourceごとの入力データ全件ファイルを必須にする"""
+        sources = self.create_sources(tmp_path)
+        coco_instances_json = tmp_path / "coco_input.json"
+        coco_instances_json.write_text(json.dumps({"images": sources[0].coco_images, "categories": self.coco_categories}))
+        arguments = ["--af_annotation_zip_or_dir", str(tmp_path / "site_a"), str(tmp_path / "site_b"), "--coco_instances_json", str(coco_instances_json)]
+
+        with pytest.raises(ValueError):
+            convert_af_annotation_to_coco_instances.main([*arguments, "--output_coco_instances_json", str(tmp_path / "shared.json")])
+        assert not (tmp_path / "shared.json").exists()
+
+        af_input_data_jsons = []
+        for source in sources:
+            af_input_data_json = tmp_path / f"{source.name}_input_data.json"
+            af_input_data_json.write_text(
+                json.dumps([{"input_data_name": image["file_name"], "system_metadata": {"original_resolution": {"width": 10, "height": 10}}} for image in source.coco_images])
+            )
+            af_input_data_jsons.append(str(af_input_data_json))
+        convert_af_annotation_to_coco_instances.main([*arguments, "--af_input_data_json", *af_input_data_jsons, "--output_coco_instances_json", str(tmp_path / "out.json")])
+
+        coco_instances = json.loads((tmp_path / "out.json").read_text())
+        assert [image["file_name"] for image in coco_instances["images"]] == ["site_a/image1.jpg", "image2.jpg", "site_b/image1.jpg", "image3.jpg"]
+
+
+def create_sampling_af_annotation_dir(af_annotation_dir: Path) -> list[dict[str, Any]]:
+    """
+    塗りつぶしアノテーションを1個ずつ含むタスクを作成します。carのタスクは10件、busのタスクは2件です。
+
+    Returns:
+        COCO形式のimages
+    """
+    coco_images = []
+    for index in range(12):
+        task_id = f"task{index}"
+        label = "bus" if index < 2 else "car"
+        json_file = af_annotation_dir / task_id / f"input{index}.json"
+        json_file.parent.mkdir(parents=True)
+        af_annotation = {
+            "task_id": task_id,
+            "task_phase": "acceptance" if index % 2 == 0 else "annotation",
+            "task_status": "complete",
+            "input_data_id": f"input{index}",
+            "input_data_name": f"image{index}.jpg",
+            "details": [{"annotation_id": "a1", "label": label, "data": {"_type": "Segmentation", "data_uri": "a1"}}],
+        }
+        json_file.write_text(json.dumps(af_annotation))
+        mask = np.zeros((4, 4), dtype=bool)
+        mask[1:3, 1:3] = True
+        (json_file.parent / f"input{index}").mkdir()
+        write_binary_image(mask, json_file.parent / f"input{index}/a1")
+        coco_images.append({"id": index + 1, "file_name": f"image{index}.jpg", "width": 4, "height": 4})
+    return coco_images
+
+
+class TestSampling:
+    coco_categories = [{"id": 1, "name": "car"}, {"id": 2, "name": "bus"}]  # noqa: RUF012
+
+    def convert(self, tmp_path: Path, sampling: SamplingOptions) -> list[tuple[dict[str, Any], list[dict[str, Any]]]]:
+        coco_images = create_sampling_af_annotation_dir(tmp_path / "af")
+        converter = AnnotationConverterFromAnnofabToCoco(coco_categories=self.coco_categories, coco_images=coco_images)
+        return list(converter.iter_converted_af_annotation_path(tmp_path / "af", sampling=sampling))
+
+    def test_none(self, tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+        """選んだタスクの塗りつぶし画像だけを読み込む"""
+        read_count = 0
+        original_read = convert_af_annotation_to_coco_instances.read_binary_image_as_cropped_mask
+
+        def counting_read(fp: BinaryIO) -> CroppedMask:
+            nonlocal read_count
+            read_count += 1
+            return original_read(fp)
+
+        monkeypatch.setattr(convert_af_annotation_to_coco_instances, "read_binary_image_as_cropped_mask", counting_read)
+        actual = self.convert(tmp_path, SamplingOptions(sample_size=3))
+
+        assert len(actual) == 3
+        assert read_count == 3
+        assert all(coco_annotations[0]["area"] == 4 for _, coco_annotations in actual)
+
+    def test_seed(self, tmp_path: Path):
+        """同じシードなら同じタスクが選ばれる"""
+        first = [coco_image["id"] for coco_image, _ in self.convert(tmp_path / "1", SamplingOptions(sample_size=3, seed=1))]
+        second = [coco_image["id"] for coco_image, _ in self.convert(tmp_path / "2", SamplingOptions(sample_size=3, seed=1))]
+        assert first == second
+
+    def test_category(self, tmp_path: Path):
+        """カテゴリごとに選ぶので、タスクが少ないカテゴリもすべて選ばれる"""
+        actual = self.convert(tmp_path, SamplingOptions(sample_size=3, stratification=SampleStratification.CATEGORY))
+
+        category_ids = sorted(coco_annotation["category_id"] for _, coco_annotations in actual for coco_annotation in coco_annotations)
+        assert category_ids == [1, 1, 1, 2, 2]
+
+    def test_phase(self, tmp_path: Path):
+        actual = self.convert(tmp_path, SamplingOptions(sample_size=2, stratification=SampleStratification.PHASE))
+
+        # image{index}.jpgのindexが偶数ならacceptance、奇数ならannotation
+        assert sorted(coco_image["id"] % 2 for coco_image, _ in actual) == [0, 0, 1, 1]
+
+    def test_main(self, tmp_path: Path):
+        """imagesには選んだタスクのimageだけを出力する"""
+        coco_images = create_sampling_af_annotation_dir(tmp_path / "af")
+        coco_instances_json = tmp_path / "coco_input.json"
+        coco_instances_json.write_text(json.dumps({"images": coco_images, "categories": self.coco_categories}))
+        output_json = tmp_path / "coco.json"
+
+        convert_af_annotation_to_coco_instances.main(
+            [
+                "--af_annotation_zip_or_dir",
+                str(tmp_path / "af"),
+                "--coco_instances_json",
+                str(coco_instances_json),
+                "--output_coco_instances_json",
+                str(output_json),
+                "--sample",
+                "2",
+                "--sample_stratification",
+                "category",
+            ]
+        )
+
+        coco_instances = json.loads(output_json.read_text())
+        assert len(coco_instances["images"]) == 4
+        assert sorted(anno["image_id"] for anno in coco_instances["annotations"]) == sorted(image["id"] for image in coco_instances["images"])
+
+
+class TestTiling:
+    coco_categories = [{"id": 1, "name": "label1"}]  # noqa: RUF012
+    # 幅8、高さ4の画像を、4x4のタイル2個に分割する
+    coco_images = [{"id": 1, "file_name": "image1.jpg", "width": 8, "height": 4}]  # noqa: RUF012
+
+    def test_convert_af_annotation_to_tiles(self):
+        """タイルの境界をまたぐアノテーションは、タイルごとに切り取る"""
+        converter = AnnotationConverterFromAnnofabToCoco(coco_categories=self.coco_categories, coco_images=self.coco_images, tiling=TilingOptions(tile_size=4))
+        mask = np.zeros((4, 8), dtype=bool)
+        mask[1:3, 2:7] = True
+        af_parser = FakeSegmentationParser({"seg1": mask})
+        af_annotation = {
+            "task_id": "task1",
+            "input_data_id": "input1",
+            "details": [
+                {"annotation_id": "seg1", "label": "label1", "data": {"_type": "Segmentation"}},
+                {"annotation_id": "bbox1", "label": "label1", "data": {"_type": "BoundingBox", "left_top": {"x": 3, "y": 0}, "right_bottom": {"x": 10, "y": 2}}},
+                {"annotation_id": "polygon1", "label": "label1", "data": {"_type": "Points", "points": [{"x": 0, "y": 0}, {"x": 2, "y": 0}, {"x": 2, "y": 2}]}},
+            ],
+        }
+
+        actual, next_annotation_id = converter.convert_af_annotation_to_tiles(af_annotation, af_parser, self.coco_images[0], coco_start_annotation_id=1)  # type: ignore[arg-type]
+
+        assert next_annotation_id == 6
+        assert [tile_image["file_name"] for tile_image, _ in actual] == ["image1_0_0.jpg", "image1_4_0.jpg"]
+        left_annotations, right_annotations = (coco_annotations for _, coco_annotations in actual)
+        # タイルごとに、Annofabのアノテーションの順番に並ぶ
+        assert [anno["id"] for anno in left_annotations] == [1, 2, 3]
+        assert [anno["id"] for anno in right_annotations] == [4, 5]
+        assert all(anno["image_id"] == 1 for anno in left_annotations)
+        assert all(anno["image_id"] == 2 for anno in right_annotations)
+
+        assert [anno["bbox"] for anno in left_annotations[:2]] == [[2.0, 1.0, 2.0, 2.0], [3, 0, 1, 2]]
+        assert [anno["bbox"] for anno in right_annotations] == [[0.0, 1.0, 3.0, 2.0], [0, 0, 4, 2]]
+        assert left_annotations[2]["segmentation"] == [[0, 0, 2, 0, 2, 2]]
+        for coco_annotation, tile_mask in [(left_annotations[0], mask[:, :4]), (right_annotations[0], mask[:, 4:])]:
+            rle = pycocotools.mask.frPyObjects(coco_annotation["segmentation"], 4, 4)
+            assert (pycocotools.mask.decode(rle).astype(bool) == tile_mask).all()
+
+    def test_label_map_is_not_supported(self, tmp_path: Path):
+        converter = AnnotationConverterFromAnnofabToCoco(coco_categories=self.coco_categories, coco_images=self.coco_images, tiling=TilingOptions(tile_size=4))
+        with pytest.raises(ValueError):
+            list(converter.iter_converted_af_annotation_path(tmp_path, label_map_dir=tmp_path / "label_map"))
+
+    def test_main(self, tmp_path: Path):
+        """imagesにはタイルを出力する"""
+        coco_images = create_sampling_af_annotation_dir(tmp_path / "af")
+        coco_instances_json = tmp_path / "coco_input.json"
+        coco_instances_json.write_text(json.dumps({"images": coco_images, "categories": [{"id": 1, "name": "car"}, {"id": 2, "name": "bus"}]}))
+        output_json = tmp_path / "coco.json"
+
+        convert_af_annotation_to_coco_instances.main(
+            [
+                "--af_annotation_zip_or_dir",
+                str(tmp_path / "af"),
+                "--coco_instances_json",
+                str(coco_instances_json),
+                "--output_coco_instances_json",
+                str(output_json),
+                "--tile_size",
+                "3",
+                "--tile_overlap",
+                "1",
+            ]
+        )
+
+        coco_instances = json.loads(output_json.read_text())
+        # 4x4の画像を3x3のタイル4個に分割する。塗りつぶしアノテーション（[1:3, 1:3]）はすべてのタイルに含まれる
+        assert len(coco_instances["images"]) == len(coco_images) * 4
+        assert coco_instances["images"][1]["tile"] == {"source_image_id": 1, "source_file_name": "image0.jpg", "x": 1, "y": 0}
+        assert len(coco_instances["annotations"]) == len(coco_instances["images"])
+        assert {anno["area"] for anno in coco_instances["annotations"]} == {4.0}
+
 
 class TestGetRleFromBooleanSegmentationArray:
     def test_get_rle_uncompressed(self):
@@ -255,3 +807,9 @@ class TestGetRleFromBooleanSegmentationArray:
         rle_uncompressed = get_rle_from_boolean_segmentation_array(segmentation_array)
         assert rle_uncompressed["size"] == [2, 3]
         assert rle_uncompressed["counts"][0] == 6  # すべてFalseなので、最初のcountは2x3=6
+
+    def test_starts_with_true(self):
+        """最初のピクセルがTrueの場合、countsは0から始まる"""
+        segmentation_array = np.array([[True, False], [True, True]], dtype=bool)
+        rle = get_rle_from_boolean_segmentation_array(segmentation_array)
+        assert rle["counts"] == [0, 2, 1, 1]
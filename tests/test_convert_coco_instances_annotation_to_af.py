@@ -1,17 +1,21 @@
+import gzip
 import json
 import tempfile
 from pathlib import Path
 from typing import Any
 
 import numpy
+import pycocotools.mask
 import pytest
 
 from src.convert_coco_instances_annotation_to_af import (
     AnnotationConverterFromCocoToAnnofab,
     CocoAnnotationType,
     convert_coco_one_segmentation_to_af_format,
+    create_af_annotation_id,
     create_input_data_id_to_task_id_mapping,
     create_input_data_name_to_input_data_id_mapping,
+    main,
 )
 
 
@@ -106,9 +110,9 @@ class TestAnnotationConverterFromCocoToAnnofab:
         # 初期化後のプロパティを検証
         assert len(converter.coco_images) == 2
         assert converter.target_coco_category_names is None
-        assert len(converter.annotations_by_image_id) == 2
-        assert len(converter.annotations_by_image_id[1]) == 2  # image_id=1に紐づくアノテーション数
-        assert len(converter.annotations_by_image_id[2]) == 1  # image_id=2に紐づくアノテーション数
+        assert len(converter.annotation_store) == 3
+        assert len(converter.annotation_store.get_annotations_by_image_id(1)) == 2  # image_id=1に紐づくアノテーション数
+        assert len(converter.annotation_store.get_annotations_by_image_id(2)) == 1  # image_id=2に紐づくアノテーション数
         assert converter.category_names_by_id[1] == "person"
         assert converter.category_names_by_id[2] == "car"
         assert converter.category_names_by_id[3] == "cat"
@@ -123,6 +127,14 @@ class TestAnnotationConverterFromCocoToAnnofab:
         assert converter.coco_images[0]["file_name"] == "test_image1.jpg"
         assert converter.target_coco_category_names == {"person"}
 
+    def test_init_with_shard(self):
+        """シャードを指定した初期化のテスト"""
+        converters = [AnnotationConverterFromCocoToAnnofab(self.coco_instances, CocoAnnotationType.BBOX, num_shards=2, shard_index=i) for i in range(2)]
+
+        # すべてのimagesが、いずれか1個のシャードに含まれる
+        file_names = [img["file_name"] for converter in converters for img in converter.coco_images]
+        assert sorted(file_names) == ["test_image1.jpg", "test_image2.jpg"]
+
     def test_convert_bbox_annotation_to_af_detail(self):
         """BBoxアノテーション変換のテスト"""
         converter = AnnotationConverterFromCocoToAnnofab(self.coco_instances, CocoAnnotationType.BBOX)
@@ -210,6 +222,143 @@ class TestAnnotationConverterFromCocoToAnnofab:
         assert count == 1
         assert details[0]["label"] == "person"
 
+    def test_convert__write_error(self, tmp_path: Path):
+        """ファイルの書き込みに失敗したimageは、変換に失敗したimageとして返す"""
+        converter = AnnotationConverterFromCocoToAnnofab(self.coco_instances, CocoAnnotationType.BBOX)
+        output_dir = tmp_path / "out"
+        output_dir.mkdir()
+        # タスクのディレクトリと同じ名前のファイルが存在するので、書き込めない
+        (output_dir / "test_image1.jpg").write_text("")
+
+        failed_file_names = converter.convert(output_dir, input_data_id_to_task_id=None, input_data_name_to_input_data_id=None, write_parallelism=2)
+
+        assert failed_file_names == ["test_image1.jpg"]
+        assert (output_dir / "test_image2.jpg/test_image2.jpg.json").exists()
+
+
+def test_main_validation(tmp_path: Path):
+    """検証でエラーが見つかった場合、`--validation fail`では何も出力せず、`--validation report`では変換を続ける。デフォルトでは検証しない"""
+    coco_instances_json = tmp_path / "coco.json"
+    coco_instances_json.write_text(
+        json.dumps(
+            {
+                "images": [{"id": 1, "file_name": "a.jpg", "width": 10, "height": 10}, {"id": 2, "file_name": "b.jpg", "width": 10, "height": 10}],
+                "categories": [{"id": 1, "name": "car"}],
+                "annotations": [
+                    {"id": 1, "image_id": 1, "category_id": 1, "bbox": [0, 0, 1, 1]},
+                    {"id": 2, "image_id": 2, "category_id": 2, "bbox": [0, 0, 1, 1]},
+                ],
+            }
+        )
+    )
+    arguments = ["--coco_instances_json", str(coco_instances_json), "--coco_annotation_type", "bbox"]
+
+    # デフォルトでは検証しない
+    main([*arguments, "--output_dir", str(tmp_path / "default")])
+    assert (tmp_path / "default/a.jpg/a.jpg.json").exists()
+
+    with pytest.raises(ValueError):
+        main([*arguments, "--output_dir", str(tmp_path / "fail"), "--validation", "fail"])
+    assert not (tmp_path / "fail").exists()
+
+    report_json = tmp_path / "report.json"
+    main([*arguments, "--output_dir", str(tmp_path / "report"), "--validation", "report", "--validation_report_json", str(report_json)])
+    assert (tmp_path / "report/a.jpg/a.jpg.json").exists()
+    assert [issue["kind"] for issue in json.loads(report_json.read_text())] == ["dangling_category_id"]
+
+
+def test_main_gzip(tmp_path: Path):
+    """gzipで圧縮されたCOCOデータセットを読み込み、Annofab形式のアノテーションJSONをgzipで圧縮して出力する"""
+    coco_instances = {
+        "images": [{"id": 1, "file_name": "a.jpg", "width": 10, "height": 10}],
+        "categories": [{"id": 1, "name": "car"}],
+        "annotations": [{"id": 1, "image_id": 1, "category_id": 1, "bbox": [0, 0, 1, 1]}],
+    }
+    coco_instances_json = tmp_path / "coco.json.gz"
+    coco_instances_json.write_bytes(gzip.compress(json.dumps(coco_instances).encode()))
+
+    main(["--coco_instances_json", str(coco_instances_json), "--coco_annotation_type", "bbox", "--output_dir", str(tmp_path / "out"), "--gzip_af_annotation_json"])
+
+    af_annotation = json.loads(gzip.decompress((tmp_path / "out/a.jpg/a.jpg.json.gz").read_bytes()))
+    assert [detail["label"] for detail in af_annotation["details"]] == ["car"]
+
+
+@pytest.mark.parametrize("coco_annotation_type", ["bbox", "polygon_segmentation", "rle_segmentation"])
+def test_main_streaming_output_is_unchanged(tmp_path: Path, coco_annotation_type: str):
+    """annotationsを逐次読み込んでも、読み込んだdictをそのまま変換した場合と出力は同じ"""
+    rle = pycocotools.mask.encode(numpy.asfortranarray(numpy.eye(10, dtype=numpy.uint8)))
+    coco_instances = {
+        "images": [{"id": 1, "file_name": "a.jpg", "width": 10, "height": 10}, {"id": 2, "file_name": "b.jpg", "width": 10, "height": 10}],
+        "categories": [{"id": 1, "name": "car"}, {"id": 2, "name": "bike"}],
+        "annotations": [
+            # キーの順番が通常と異なるannotationや、独自のキーを持つannotationを含む
+            {"score": 0.9, "category_id": 1, "image_id": 1, "id": 1, "bbox": [0, 0, 5, 5], "area": 25, "iscrowd": 0, "segmentation": [[0, 0, 5, 0, 5, 5]]},
+            {"id": 2, "image_id": 2, "category_id": 2, "segmentation": {"size": [10, 10], "counts": rle["counts"].decode("ascii")}, "area": 10, "bbox": [0, 0, 10, 10], "iscrowd": 1},
+            {"id": 3, "image_id": 2, "category_id": 1, "segmentation": [[1, 1, 4, 1, 4, 4], [6, 6, 9, 6, 9, 9]], "area": 9, "bbox": [1, 1, 8, 8], "iscrowd": 0, "attributes": {"occluded": True}},
+        ],
+    }
+    coco_instances_json = tmp_path / "coco.json"
+    coco_instances_json.write_text(json.dumps(coco_instances))
+
+    main(["--coco_instances_json", str(coco_instances_json), "--coco_annotation_type", coco_annotation_type, "--output_dir", str(tmp_path / "streaming")])
+    AnnotationConverterFromCocoToAnnofab(json.loads(coco_instances_json.read_text()), CocoAnnotationType(coco_annotation_type)).convert(tmp_path / "expected", None, None)
+
+    expected_files = {path.relative_to(tmp_path / "expected"): path.read_bytes() for path in (tmp_path / "expected").rglob("*") if path.is_file()}
+    actual_files = {path.relative_to(tmp_path / "streaming"): path.read_bytes() for path in (tmp_path / "streaming").rglob("*") if path.is_file()}
+    assert len(expected_files) > 0
+    assert actual_files == expected_files
+
+
+def test_create_af_annotation_id():
+    """同じCOCOのannotationからは同じannotation_idを生成し、種類やポリゴンのインデックスが異なれば異なるannotation_idを生成する"""
+    assert create_af_annotation_id(CocoAnnotationType.BBOX, 1) == create_af_annotation_id(CocoAnnotationType.BBOX, 1)
+    annotation_ids = {
+        create_af_annotation_id(CocoAnnotationType.BBOX, 1),
+        create_af_annotation_id(CocoAnnotationType.BBOX, 2),
+        create_af_annotation_id(CocoAnnotationType.POLYGON_SEGMENTATION, 1, 0),
+        create_af_annotation_id(CocoAnnotationType.POLYGON_SEGMENTATION, 1, 1),
+        create_af_annotation_id(CocoAnnotationType.RLE_SEGMENTATION, 1),
+    }
+    assert len(annotation_ids) == 5
+
+
+def test_main_differential(tmp_path: Path):
+    """前回のマニフェストまたはCOCOデータセットと比較して、変更されたimageのアノテーションのみを出力する"""
+    coco_instances = {
+        "images": [{"id": i, "file_name": f"{name}.jpg", "width": 10, "height": 10} for i, name in enumerate(["a", "b", "c"], start=1)],
+        "categories": [{"id": 1, "name": "car"}],
+        "annotations": [{"id": i, "image_id": i, "category_id": 1, "bbox": [0, 0, 1, 1]} for i in range(1, 4)],
+    }
+    coco_instances_json = tmp_path / "coco.json"
+    coco_instances_json.write_text(json.dumps(coco_instances))
+    arguments = ["--coco_instances_json", str(coco_instances_json), "--coco_annotation_type", "bbox"]
+    manifest_json = tmp_path / "manifest.json"
+    main([*arguments, "--output_dir", str(tmp_path / "full"), "--output_manifest_json", str(manifest_json)])
+    assert sorted(p.name for p in (tmp_path / "full").iterdir()) == ["a.jpg", "b.jpg", "c.jpg"]
+
+    # b.jpgのannotationを変更し、c.jpgのannotationを削除する。annotationsの順番は結果に影響しない
+    previous_coco_instances_json = tmp_path / "previous_coco.json"
+    previous_coco_instances_json.write_text(coco_instances_json.read_text())
+    coco_instances["annotations"] = [{"id": 2, "image_id": 2, "category_id": 1, "bbox": [0, 0, 5, 5]}, {"id": 1, "image_id": 1, "category_id": 1, "bbox": [0, 0, 1, 1]}]
+    coco_instances_json.write_text(json.dumps(coco_instances))
+
+    for option, previous_json, output_dir in [
+        ("--previous_manifest_json", manifest_json, tmp_path / "diff_manifest"),
+        ("--previous_coco_instances_json", previous_coco_instances_json, tmp_path / "diff_coco"),
+    ]:
+        main([*arguments, "--output_dir", str(output_dir), option, str(previous_json), "--output_manifest_json", str(tmp_path / "new_manifest.json")])
+        assert sorted(p.name for p in output_dir.iterdir()) == ["b.jpg", "c.jpg"]
+        b_details = json.loads((output_dir / "b.jpg/b.jpg.json").read_text())["details"]
+        # annotation_idは前回と同じなので、インポートすると上書きされる
+        assert [detail["annotation_id"] for detail in b_details] == [detail["annotation_id"] for detail in json.loads((tmp_path / "full/b.jpg/b.jpg.json").read_text())["details"]]
+        assert b_details[0]["data"]["right_bottom"] == {"x": 5, "y": 5}
+        # アノテーションがすべて削除されたimageは、インポートでアノテーションを削除できるように空のdetailsを出力する
+        assert json.loads((output_dir / "c.jpg/c.jpg.json").read_text()) == {"details": []}
+
+    # 新しいマニフェストと比較すると、変更されたimageは存在しない
+    main([*arguments, "--output_dir", str(tmp_path / "no_change"), "--previous_manifest_json", str(tmp_path / "new_manifest.json")])
+    assert list((tmp_path / "no_change").iterdir()) == []
+
 
 class TestConvertRLESegmentation:
     """RLEセグメンテーションの変換テスト"""
@@ -232,7 +381,7 @@ class TestConvertRLESegmentation:
         coco_image = self.coco_instances["images"][0]  # test_image1.jpg
 
         # 変換実行
-        af_detail, segmentation_bool_array = self.converter.convert_rle_segmentation_annotation_to_af_detail(coco_annotation, coco_image)
+        af_detail, mask = self.converter.convert_rle_segmentation_annotation_to_af_detail(coco_annotation, coco_image)
 
         # 結果検証
         assert af_detail is not None
@@ -242,11 +391,17 @@ class TestConvertRLESegmentation:
         assert af_detail["data"]["_type"] == "Segmentation"
         assert af_detail["data"]["data_uri"] == af_detail["annotation_id"]
 
-        # bool配列の検証
-        assert segmentation_bool_array is not None
-        assert isinstance(segmentation_bool_array, numpy.ndarray)
-        assert segmentation_bool_array.shape == (427, 640)  # 画像サイズと同じ
-        assert segmentation_bool_array.dtype == bool  # bool型であること
+        # マスクの検証。uncompressed RLEの`counts`を列優先で展開したものと一致する
+        # このRLEは`counts`の合計が画像のピクセル数より少ないので、残りは塗られていない部分とみなす
+        assert mask is not None
+        assert (mask.image_height, mask.image_width) == (427, 640)  # 画像サイズと同じ
+        counts = coco_annotation["segmentation"]["counts"]
+        flatten_array = numpy.zeros(427 * 640, dtype=bool)
+        flatten_array[: sum(counts)] = numpy.repeat(numpy.arange(len(counts)) % 2 == 1, counts)
+        expected_array = flatten_array.reshape((640, 427)).T
+        assert numpy.array_equal(mask.to_array(), expected_array)
+        rle = pycocotools.mask.frPyObjects(coco_annotation["segmentation"], coco_image["height"], coco_image["width"])
+        assert mask.get_bbox() == pycocotools.mask.toBbox(rle).tolist()
 
     def test_convert_rle_segmentation_annotation_to_af_detail_not_rle(self):
         """RLEでないアノテーションに対するテスト (iscrowd=0)"""
@@ -298,3 +453,41 @@ class TestConvertRLESegmentation:
         annotation_id = details[0]["annotation_id"]
         segmentation_file = tmp_path / annotation_id
         assert segmentation_file.exists()  # 塗りつぶし画像が生成されていること
+
+
+def test_main_filters(tmp_path: Path):
+    """`--coco_image_file_name`と`--coco_category_name`を指定した場合は、変換対象だけを読み込んで変換する"""
+    coco_instances_json = tmp_path / "coco.json"
+    coco_instances_json.write_text(
+        json.dumps(
+            {
+                "images": [{"id": 1, "file_name": "a.jpg", "width": 10, "height": 10}, {"id": 2, "file_name": "b.jpg", "width": 10, "height": 10}],
+                "annotations": [
+                    {"id": 1, "image_id": 1, "category_id": 1, "bbox": [0, 0, 1, 1]},
+                    {"id": 2, "image_id": 1, "category_id": 2, "bbox": [0, 0, 1, 1]},
+                    # 変換対象でないimageのannotationは読み込まないので、検証でもエラーにならない
+                    {"id": 3, "image_id": 2, "category_id": 3, "bbox": [0, 0, 1, 1]},
+                ],
+                "categories": [{"id": 1, "name": "car"}, {"id": 2, "name": "bus"}],
+            }
+        )
+    )
+
+    main(
+        [
+            "--coco_instances_json",
+            str(coco_instances_json),
+            "--coco_annotation_type",
+            "bbox",
+            "--output_dir",
+            str(tmp_path / "out"),
+            "--coco_image_file_name",
+            "a.jpg",
+            "--coco_category_name",
+            "car",
+        ]
+    )
+
+    af_annotation = json.loads((tmp_path / "out/a.jpg/a.jpg.json").read_text())
+    assert [detail["label"] for detail in af_annotation["details"]] == ["car"]
+    assert not (tmp_path / "out/b.jpg").exists()
@@ -0,0 +1,104 @@
+from pathlib import Path
+
+import pytest
+from PIL import Image
+
+import src.create_af_input_data
+from src.common.file_hash import FileHashCache
+from src.create_af_input_data import (
+    calculate_coco_image_sha256s,
+    check_coco_image_files,
+    create_missing_sha256_metadata_info,
+    create_target_input_data_info,
+    exclude_registered_images,
+    find_duplicated_images,
+    main,
+)
+
+
+def test_create_target_input_data_info():
+    coco_images = [{"id": 1, "file_name": "a.jpg", "width": 10, "height": 20}]
+    actual = create_target_input_data_info(coco_images, Path("images"))
+    assert actual == [{"input_data_id": "a.jpg", "input_data_name": "a.jpg", "input_data_path": "file://images/a.jpg"}]
+
+
+def test_check_coco_image_files(tmp_path: Path):
+    Image.new("RGB", (10, 20)).save(tmp_path / "ok.png")
+    Image.new("RGB", (30, 40)).save(tmp_path / "mismatched.jpg", format="JPEG")
+    coco_images = [
+        {"id": 1, "file_name": "ok.png", "width": 10, "height": 20},
+        {"id": 2, "file_name": "mismatched.jpg", "width": 40, "height": 30},
+        {"id": 3, "file_name": "missing.jpg", "width": 10, "height": 20},
+    ]
+
+    actual = check_coco_image_files(coco_images, tmp_path, parallelism=2)
+
+    assert actual.missing_file_names == ["missing.jpg"]
+    assert actual.unknown_size_file_names == []
+    assert actual.size_mismatched_images == [{"id": 2, "file_name": "mismatched.jpg", "width": 30, "height": 40}]
+    assert actual.corrected_coco_images == [
+        {"id": 1, "file_name": "ok.png", "width": 10, "height": 20},
+        {"id": 2, "file_name": "mismatched.jpg", "width": 30, "height": 40},
+    ]
+    # 元のimagesは変更されない
+    assert coco_images[1]["width"] == 40
+
+
+def test_check_coco_image_files__unreadable(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    """画像ファイルを読み込めない場合は、チェックを中断せずに読み込めなかった画像として返す"""
+    Image.new("RGB", (10, 20)).save(tmp_path / "ok.png")
+    (tmp_path / "unreadable.png").write_bytes(b"")
+    original_read_image_size = src.create_af_input_data.read_image_size
+
+    def read_image_size(image_file: Path) -> tuple[int, int] | None:
+        if image_file.name == "unreadable.png":
+            raise PermissionError(image_file)
+        return original_read_image_size(image_file)
+
+    monkeypatch.setattr(src.create_af_input_data, "read_image_size", read_image_size)
+    coco_images = [{"id": 1, "file_name": "ok.png", "width": 10, "height": 20}, {"id": 2, "file_name": "unreadable.png", "width": 10, "height": 20}]
+
+    actual = check_coco_image_files(coco_images, tmp_path, parallelism=2)
+
+    assert actual.unreadable_file_names == ["unreadable.png"]
+    assert actual.corrected_coco_images == [coco_images[0]]
+
+
+def test_main__output_corrected_coco_images_json_requires_check_image_file(tmp_path: Path):
+    arguments = ["--coco_instances_json", str(tmp_path / "coco.json"), "--image_dir", str(tmp_path), "--af_project_id", "prj1"]
+    with pytest.raises(ValueError):
+        main([*arguments, "--output_corrected_coco_images_json", str(tmp_path / "corrected.json")])
+
+
+def test_find_duplicated_images():
+    sha256_by_file_name = {"a.jpg": "x", "b.jpg": "y", "c.jpg": "x"}
+    assert find_duplicated_images(sha256_by_file_name) == [["a.jpg", "c.jpg"]]
+
+
+def test_exclude_registered_images():
+    coco_images = [
+        {"id": 1, "file_name": "registered.jpg"},
+        {"id": 2, "file_name": "modified.jpg"},
+        {"id": 3, "file_name": "new.jpg"},
+        {"id": 4, "file_name": "no_metadata.jpg"},
+    ]
+    sha256_by_file_name = {"registered.jpg": "a", "modified.jpg": "b", "new.jpg": "c", "no_metadata.jpg": "d"}
+    af_input_data_list = [
+        {"input_data_id": "registered.jpg", "input_data_name": "registered.jpg", "metadata": {"sha256": "a"}},
+        {"input_data_id": "modified.jpg", "input_data_name": "modified.jpg", "metadata": {"sha256": "old"}},
+        {"input_data_id": "no_metadata.jpg", "input_data_name": "no_metadata.jpg", "metadata": {}},
+    ]
+
+    # メタデータにハッシュ値が格納されていない入力データは、登録し直さずにハッシュ値のみ格納する
+    actual = exclude_registered_images(coco_images, sha256_by_file_name, af_input_data_list)
+    assert [img["id"] for img in actual] == [2, 3]
+    assert create_missing_sha256_metadata_info(coco_images, sha256_by_file_name, af_input_data_list) == [{"input_data_id": "no_metadata.jpg", "metadata": {"sha256": "d"}}]
+
+
+def test_calculate_coco_image_sha256s(tmp_path: Path):
+    """画像ファイルが存在しないimageは、ハッシュ値を計算せずに結果から除く"""
+    (tmp_path / "a.jpg").write_bytes(b"a")
+    coco_images = [{"id": 1, "file_name": "a.jpg"}, {"id": 2, "file_name": "missing.jpg"}]
+
+    actual = calculate_coco_image_sha256s(coco_images, tmp_path, FileHashCache())
+    assert list(actual.keys()) == ["a.jpg"]
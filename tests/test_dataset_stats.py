@@ -0,0 +1,95 @@
+import io
+import json
+from pathlib import Path
+
+import numpy as np
+from annofabapi.segmentation import write_binary_image
+
+from src.dataset_stats import calculate_af_annotation_stats, calculate_coco_instances_stats, get_area_histogram_bin
+
+
+def test_get_area_histogram_bin():
+    assert get_area_histogram_bin(0) == 0
+    assert get_area_histogram_bin(0.5) == 0
+    assert get_area_histogram_bin(1) == 1
+    assert get_area_histogram_bin(15) == 2
+    assert get_area_histogram_bin(16) == 4
+    assert get_area_histogram_bin(100 * 100) == 64
+
+
+def test_calculate_coco_instances_stats():
+    coco_instances = json.loads(Path("tests/resources/test_coco_instances.json").read_text())
+    coco_instances["images"].append({"id": 100, "file_name": "no_annotation.jpg", "width": 10, "height": 10})
+
+    stats = calculate_coco_instances_stats(io.StringIO(json.dumps(coco_instances)))
+
+    assert stats["image_count"] == 3
+    assert stats["images_without_annotations_count"] == 1
+    assert stats["annotation_count"] == len(coco_instances["annotations"])
+    assert sum(stats["type_counts"].values()) == stats["annotation_count"]
+    assert sum(stats["area_histogram"].values()) == stats["annotation_count"]
+    assert sum(category_stats["annotation_count"] for category_stats in stats["categories"].values()) == stats["annotation_count"]
+    assert set(stats["categories"].keys()) <= {category["name"] for category in coco_instances["categories"]}
+    assert stats["projected_conversion"]["af_annotation_json_count"] == 2
+
+
+def create_af_annotation_dir(af_annotation_dir: Path) -> None:
+    af_annotation = {
+        "task_id": "task1",
+        "input_data_id": "input1",
+        "details": [
+            {"annotation_id": "a1", "label": "car", "data": {"_type": "BoundingBox", "left_top": {"x": 0, "y": 0}, "right_bottom": {"x": 10, "y": 10}}},
+            {"annotation_id": "a2", "label": "car", "data": {"_type": "Points", "points": [{"x": 0, "y": 0}, {"x": 4, "y": 0}, {"x": 4, "y": 4}, {"x": 0, "y": 4}]}},
+            {"annotation_id": "a3", "label": "person", "data": {"_type": "Classification"}},
+            {"annotation_id": "a4", "label": "road", "data": {"_type": "Segmentation", "data_uri": "input1/a4"}},
+        ],
+    }
+    (af_annotation_dir / "task1/input1").mkdir(parents=True)
+    (af_annotation_dir / "task1/input1.json").write_text(json.dumps(af_annotation))
+    mask = np.zeros((30, 20), dtype=bool)
+    mask[5:10, 2:12] = True
+    with (af_annotation_dir / "task1/input1/a4").open("wb") as f:
+        write_binary_image(mask, f)
+    (af_annotation_dir / "task2").mkdir()
+    (af_annotation_dir / "task2/input2.json").write_text(json.dumps({"task_id": "task2", "input_data_id": "input2", "details": []}))
+
+
+def test_calculate_af_annotation_stats(tmp_path: Path):
+    """塗りつぶし画像はヘッダだけを読み込むので、塗りつぶしアノテーションの面積は数えない"""
+    create_af_annotation_dir(tmp_path)
+
+    stats = calculate_af_annotation_stats(tmp_path)
+
+    assert stats["image_count"] == 2
+    assert stats["images_without_annotations_count"] == 1
+    assert stats["failed_json_count"] == 0
+    assert stats["annotation_count"] == 4
+    assert stats["type_counts"] == {"BoundingBox": 1, "Points": 1, "Classification": 1, "Segmentation": 1}
+    assert stats["categories"]["car"]["area_histogram"] == {"4-8": 1, "8-16": 1}
+    assert stats["categories"]["road"]["area_histogram"] == {}
+    assert stats["projected_conversion"]["coco_annotation_count"] == 3
+    assert stats["projected_conversion"]["segmentation_canvas_pixel_count"] == 30 * 20
+
+
+def test_calculate_af_annotation_stats__count_segmentation_area(tmp_path: Path):
+    create_af_annotation_dir(tmp_path)
+
+    stats = calculate_af_annotation_stats(tmp_path, should_count_segmentation_area=True)
+
+    # 塗りつぶしアノテーションの面積は、塗られているピクセル数（5x10=50）
+    assert stats["categories"]["road"]["area_histogram"] == {"4-8": 1}
+    assert stats["projected_conversion"]["segmentation_canvas_pixel_count"] == 30 * 20
+
+
+def test_calculate_af_annotation_stats__failed_json(tmp_path: Path):
+    """読み込めなかったJSONファイルは統計情報に含めずに数える"""
+    create_af_annotation_dir(tmp_path)
+    # 塗りつぶし画像が存在しない
+    (tmp_path / "task1/input1/a4").unlink()
+
+    stats = calculate_af_annotation_stats(tmp_path)
+
+    assert stats["image_count"] == 1
+    assert stats["failed_json_count"] == 1
+    assert stats["annotation_count"] == 0
+    assert stats["projected_conversion"]["coco_annotation_count"] == 0
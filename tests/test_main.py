@@ -0,0 +1,105 @@
+"""
+起動時間の回帰テスト。`python -X importtime`の出力から、importされたモジュールを確認します。
+"""
+
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+from src.__main__ import SUBCOMMANDS
+
+PROJECT_DIR = Path(__file__).parent.parent
+HEAVY_MODULES = {"numpy", "pycocotools", "shapely", "annofabapi", "jsonargparse", "PIL"}
+
+
+def get_imported_top_level_modules(arguments: list[str], cwd: Path) -> set[str]:
+    """
+    `python -X importtime`でコマンドを実行して、importされたトップレベルのモジュール名を返します。
+    ログファイルが出力されるので、カレントディレクトリは`cwd`にします。
+    """
+    env = {**os.environ, "PYTHONPATH": str(PROJECT_DIR)}
+    result = subprocess.run([sys.executable, "-X", "importtime", *arguments], capture_output=True, text=True, check=True, cwd=cwd, env=env)
+    modules = set()
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        module_name = line.split("|")[-1].strip()
+        if module_name == "package":
+            # ヘッダ行
+            continue
+        modules.add(module_name.split(".")[0])
+    return modules
+
+
+def test_help_does_not_import_subcommand_modules(tmp_path: Path):
+    modules = get_imported_top_level_modules(["-m", "src", "--help"], cwd=tmp_path)
+    assert modules.isdisjoint(HEAVY_MODULES)
+    assert "loguru" not in modules
+
+
+@pytest.mark.parametrize("module_name", [module_name for module_name, _ in SUBCOMMANDS.values()])
+def test_import_subcommand_module(module_name: str, tmp_path: Path):
+    """モジュールをimportしただけでは、重いモジュールはimportされない"""
+    modules = get_imported_top_level_modules(["-c", f"import {module_name}"], cwd=tmp_path)
+    assert modules.isdisjoint(HEAVY_MODULES)
+
+
+def test_convert_coco_bbox_to_af_does_not_import_pycocotools(tmp_path: Path):
+    """bboxの変換では、numpyやpycocotoolsなどはimportされない"""
+    modules = get_imported_top_level_modules(
+        [
+            "-m",
+            "src",
+            "convert_coco_instances_annotation_to_af",
+            "--coco_instances_json",
+            str(PROJECT_DIR / "tests/resources/test_coco_instances.json"),
+            "--coco_annotation_type",
+            "bbox",
+            "--output_dir",
+            str(tmp_path / "out"),
+        ],
+        cwd=tmp_path,
+    )
+    assert modules.isdisjoint(HEAVY_MODULES)
+    assert (tmp_path / "out/test_image1.jpg/test_image1.jpg.json").exists()
+
+
+def test_convert_af_bbox_to_coco_does_not_import_shapely(tmp_path: Path):
+    """矩形のみの変換では、shapelyやpycocotoolsはimportされない"""
+    af_annotation_json = tmp_path / "af_annotation/task1/input1.json"
+    af_annotation_json.parent.mkdir(parents=True)
+    af_annotation_json.write_text(
+        json.dumps(
+            {
+                "task_id": "task1",
+                "task_phase": "acceptance",
+                "task_status": "complete",
+                "input_data_id": "input1",
+                "input_data_name": "test_image1.jpg",
+                "details": [
+                    {"annotation_id": "a1", "label": "car", "data": {"_type": "BoundingBox", "left_top": {"x": 1, "y": 2}, "right_bottom": {"x": 3, "y": 4}}},
+                ],
+            }
+        )
+    )
+    output_json = tmp_path / "coco.json"
+    modules = get_imported_top_level_modules(
+        [
+            "-m",
+            "src",
+            "convert_af_annotation_to_coco_instances",
+            "--af_annotation_zip_or_dir",
+            str(tmp_path / "af_annotation"),
+            "--coco_instances_json",
+            str(PROJECT_DIR / "tests/resources/test_coco_instances.json"),
+            "--output_coco_instances_json",
+            str(output_json),
+        ],
+        cwd=tmp_path,
+    )
+    assert modules.isdisjoint({"shapely", "pycocotools", "PIL"})
+    assert len(json.loads(output_json.read_text())["annotations"]) == 1
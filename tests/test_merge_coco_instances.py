@@ -0,0 +1,86 @@
+import gzip
+import json
+from pathlib import Path
+
+from src.merge_coco_instances import CocoInstancesMerger, merge_coco_instances_files
+
+
+class TestCocoInstancesMerger:
+    def test_merge(self):
+        merger = CocoInstancesMerger()
+        shard1 = {
+            "images": [{"id": 1, "file_name": "a.jpg"}, {"id": 2, "file_name": "b.jpg"}],
+            "categories": [{"id": 1, "name": "car"}],
+            "annotations": [{"id": 1, "image_id": 1, "category_id": 1}],
+        }
+        # imagesは重複している。category_idはshard1と異なる
+        shard2 = {
+            "images": [{"id": 1, "file_name": "a.jpg"}, {"id": 2, "file_name": "b.jpg"}],
+            "categories": [{"id": 5, "name": "car"}],
+            "annotations": [{"id": 1, "image_id": 2, "category_id": 5}, {"id": 2, "image_id": 1, "category_id": 5}],
+        }
+
+        annotations = [*merger.merge(shard1), *merger.merge(shard2)]
+
+        assert annotations == [
+            {"id": 1, "image_id": 1, "category_id": 1},
+            {"id": 2, "image_id": 2, "category_id": 1},
+            {"id": 3, "image_id": 1, "category_id": 1},
+        ]
+        assert list(merger.images_by_file_name.values()) == shard1["images"]
+        assert list(merger.categories_by_name.values()) == [{"id": 1, "name": "car"}]
+
+    def test_merge_conflicted_image_id(self):
+        """別のimageが同じIDを使っている場合は、新しいIDが割り当てられる"""
+        merger = CocoInstancesMerger()
+        shard1 = {"images": [{"id": 1, "file_name": "a.jpg"}], "categories": [{"id": 1, "name": "car"}], "annotations": []}
+        shard2 = {"images": [{"id": 1, "file_name": "b.jpg"}], "categories": [{"id": 1, "name": "car"}], "annotations": [{"id": 1, "image_id": 1, "category_id": 1}]}
+
+        annotations = [*merger.merge(shard1), *merger.merge(shard2)]
+
+        assert annotations == [{"id": 1, "image_id": 2, "category_id": 1}]
+        assert merger.images_by_file_name["b.jpg"] == {"id": 2, "file_name": "b.jpg"}
+
+    def test_merge_images_and_categories_before_merge(self):
+        """先にimagesとcategoriesをマージしても、mergeで割り当てられるIDは変わらない"""
+        merger = CocoInstancesMerger()
+        shard1 = {"images": [{"id": 1, "file_name": "a.jpg"}], "categories": [{"id": 1, "name": "car"}], "annotations": [{"id": 1, "image_id": 1, "category_id": 1}]}
+        shard2 = {"images": [{"id": 1, "file_name": "b.jpg"}], "categories": [{"id": 1, "name": "car"}], "annotations": [{"id": 1, "image_id": 1, "category_id": 1}]}
+
+        assert merger.merge_images_and_categories(shard1) == ({1: 1}, {1: 1})
+        assert merger.merge_images_and_categories(shard2) == ({1: 2}, {1: 1})
+        annotations = [*merger.merge(shard1), *merger.merge(shard2)]
+
+        assert annotations == [{"id": 1, "image_id": 1, "category_id": 1}, {"id": 2, "image_id": 2, "category_id": 1}]
+
+
+def test_merge_coco_instances_files(tmp_path: Path):
+    categories = [{"id": 1, "name": "car"}]
+    images = [{"id": 1, "file_name": "a.jpg"}]
+    input_jsons = []
+    for index in range(3):
+        input_json = tmp_path / f"shard{index}.json"
+        input_json.write_text(json.dumps({"images": images, "annotations": [{"id": 1, "image_id": 1, "category_id": 1, "bbox": [index, 0, 1, 1]}], "categories": categories}))
+        input_jsons.append(input_json)
+
+    output_json = tmp_path / "out/merged.json"
+    merge_coco_instances_files(input_jsons, output_json)
+
+    actual = json.loads(output_json.read_text())
+    assert list(actual.keys()) == ["images", "annotations", "categories"]
+    assert actual["images"] == images
+    assert actual["categories"] == categories
+    assert [anno["id"] for anno in actual["annotations"]] == [1, 2, 3]
+    assert [anno["bbox"][0] for anno in actual["annotations"]] == [0, 1, 2]
+
+
+def test_merge_coco_instances_files__gzip(tmp_path: Path):
+    """gzipで圧縮された入力ファイルを読み込み、拡張子が`.gz`の出力ファイルはgzipで圧縮する"""
+    coco_instances = {"images": [{"id": 1, "file_name": "a.jpg"}], "annotations": [{"id": 1, "image_id": 1, "category_id": 1, "bbox": [0, 0, 1, 1]}], "categories": [{"id": 1, "name": "car"}]}
+    input_json = tmp_path / "input.json.gz"
+    input_json.write_bytes(gzip.compress(json.dumps(coco_instances).encode()))
+
+    output_json = tmp_path / "merged.json.gz"
+    merge_coco_instances_files([input_json], output_json, gzip_compression_level=1)
+
+    assert json.loads(gzip.decompress(output_json.read_bytes())) == coco_instances
@@ -0,0 +1,63 @@
+import pytest
+
+import src.verify_coco_instances_roundtrip
+from src.convert_coco_instances_annotation_to_af import CocoAnnotationType
+from src.verify_coco_instances_roundtrip import compare_roundtrip_annotations, verify_roundtrip
+
+
+def create_coco_instances() -> dict:
+    images = [{"id": i, "file_name": f"image{i}.jpg", "width": 20, "height": 10} for i in range(1, 4)]
+    annotations = [
+        # 座標が整数なので、往復変換しても一致する
+        {"id": 1, "image_id": 1, "category_id": 1, "bbox": [2, 2, 4, 4], "segmentation": [[2, 2, 6, 2, 6, 6, 2, 6]], "area": 16, "iscrowd": 0},
+        # マルチポリゴン
+        {"id": 2, "image_id": 2, "category_id": 2, "bbox": [0, 0, 10, 6], "segmentation": [[0, 0, 4, 0, 4, 4, 0, 4], [6, 2, 10, 2, 10, 6, 6, 6]], "area": 32, "iscrowd": 0},
+        # RLE（2x2の矩形）
+        {"id": 3, "image_id": 3, "category_id": 1, "bbox": [1.0, 1.0, 2.0, 2.0], "segmentation": {"size": [10, 20], "counts": [11, 2, 8, 2, 177]}, "area": 4, "iscrowd": 1},
+        # 小さい物体の小数の座標は、整数に丸められるのでIoUが下がる
+        {"id": 4, "image_id": 3, "category_id": 2, "bbox": [10.4, 5.4, 1.2, 1.2], "segmentation": [[10.4, 5.4, 11.6, 5.4, 11.6, 6.6, 10.4, 6.6]], "area": 1.44, "iscrowd": 0},
+    ]
+    categories = [{"id": 1, "name": "person"}, {"id": 2, "name": "car"}]
+    return {"images": images, "annotations": annotations, "categories": categories}
+
+
+@pytest.mark.parametrize("parallelism", [1, 2])
+def test_verify_roundtrip__polygon_segmentation(parallelism: int, monkeypatch: pytest.MonkeyPatch):
+    # 複数のプロセスで検証されるように、1個のimageごとに分割する
+    monkeypatch.setattr(src.verify_coco_instances_roundtrip, "IMAGE_CHUNK_SIZE", 1)
+    # 投入できるチャンク数（2個）よりチャンクが多くても、すべてのチャンクを検証する
+    monkeypatch.setattr(src.verify_coco_instances_roundtrip, "MAX_PENDING_CHUNKS_PER_PROCESS", 1)
+    result = verify_roundtrip(create_coco_instances(), CocoAnnotationType.POLYGON_SEGMENTATION, min_iou=0.95, parallelism=parallelism)
+
+    assert result.image_count == 3
+    assert result.annotation_count == 3
+    assert [(mismatch.annotation_id, mismatch.reason) for mismatch in result.mismatches] == [(4, "low_iou")]
+    assert result.mismatches[0].mask_iou is not None
+
+
+def test_verify_roundtrip__rle_segmentation():
+    result = verify_roundtrip(create_coco_instances(), CocoAnnotationType.RLE_SEGMENTATION, min_iou=0.99, parallelism=1)
+    assert result.annotation_count == 1
+    assert result.mismatches == []
+
+
+def test_verify_roundtrip__bbox():
+    result = verify_roundtrip(create_coco_instances(), CocoAnnotationType.BBOX, min_iou=0.95, parallelism=1)
+    assert result.annotation_count == 4
+    assert [mismatch.annotation_id for mismatch in result.mismatches] == [4]
+    assert result.mismatches[0].mask_iou is None
+
+
+def test_compare_roundtrip_annotations():
+    coco_image = {"id": 1, "file_name": "image1.jpg", "width": 20, "height": 10}
+    original_annotations = [
+        {"id": 1, "category_id": 1, "bbox": [0, 0, 2, 2]},
+        {"id": 2, "category_id": 1, "bbox": [0, 0, 2, 2]},
+        {"id": 3, "category_id": 1, "bbox": [0, 0, 2, 2]},
+    ]
+    roundtrip_annotations_by_original_id = {
+        1: [{"category_id": 1, "bbox": [0, 0, 2, 2]}],
+        2: [{"category_id": 2, "bbox": [0, 0, 2, 2]}],
+    }
+    mismatches = compare_roundtrip_annotations(coco_image, original_annotations, roundtrip_annotations_by_original_id, should_compare_mask=False, min_iou=0.99)
+    assert [(mismatch.annotation_id, mismatch.reason) for mismatch in mismatches] == [(2, "category_mismatch"), (3, "missing")]
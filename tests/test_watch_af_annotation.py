@@ -0,0 +1,154 @@
+import json
+import os
+import zipfile
+from pathlib import Path
+from typing import Any
+
+from src.convert_af_annotation_to_coco_instances import AnnotationConverterFromAnnofabToCoco
+from src.watch_af_annotation import AfAnnotationWatcher
+
+COCO_CATEGORIES = [{"id": 1, "name": "car"}]
+COCO_IMAGES = [{"id": 1, "file_name": "image1.jpg", "width": 10, "height": 10}, {"id": 2, "file_name": "image2.jpg", "width": 10, "height": 10}]
+
+
+def create_af_annotation(task_id: str, input_data_name: str, box_count: int, task_phase: str = "acceptance") -> dict[str, Any]:
+    details = [{"annotation_id": f"{task_id}-{i}", "label": "car", "data": {"_type": "BoundingBox", "left_top": {"x": i, "y": i}, "right_bottom": {"x": i + 1, "y": i + 1}}} for i in range(box_count)]
+    return {
+        "task_id": task_id,
+        "task_phase": task_phase,
+        "task_status": "complete",
+        "input_data_id": f"input_{task_id}",
+        "input_data_name": input_data_name,
+        "details": details,
+    }
+
+
+def write_task_json(drop_dir: Path, af_annotation: dict[str, Any], mtime: int) -> Path:
+    json_file = drop_dir / af_annotation["task_id"] / f"{af_annotation['input_data_id']}.json"
+    json_file.parent.mkdir(parents=True, exist_ok=True)
+    json_file.write_text(json.dumps(af_annotation))
+    # 更新日時の精度に依存しないように、明示的に設定する
+    os.utime(json_file, ns=(mtime, mtime))
+    return json_file
+
+
+def create_watcher(tmp_path: Path, **kwargs: Any) -> AfAnnotationWatcher:  # noqa: ANN401
+    converter = AnnotationConverterFromAnnofabToCoco(coco_categories=COCO_CATEGORIES, coco_images=COCO_IMAGES)
+    (tmp_path / "drop").mkdir(exist_ok=True)
+    return AfAnnotationWatcher(converter, COCO_CATEGORIES, COCO_IMAGES, tmp_path / "drop", tmp_path / "out/coco.json", status_json=tmp_path / "out/status.json", **kwargs)
+
+
+def read_annotations(watcher: AfAnnotationWatcher) -> list[tuple[int, int]]:
+    coco_instances = json.loads(watcher.output_coco_instances_json.read_text())
+    assert coco_instances["images"] == COCO_IMAGES
+    return [(anno["id"], anno["image_id"]) for anno in coco_instances["annotations"]]
+
+
+class TestAfAnnotationWatcher:
+    def test_poll_converts_only_changed_tasks(self, tmp_path: Path):
+        watcher = create_watcher(tmp_path)
+        drop_dir = watcher.drop_dir
+        write_task_json(drop_dir, create_af_annotation("task2", "image2.jpg", 1), mtime=1)
+        task1_json = write_task_json(drop_dir, create_af_annotation("task1", "image1.jpg", 2), mtime=1)
+
+        assert watcher.poll()
+        # idはtask_idの順に振られる
+        assert read_annotations(watcher) == [(1, 1), (2, 1), (3, 2)]
+        assert watcher.status.last_converted_task_count == 2
+
+        # 変更がなければ出力しない
+        assert not watcher.poll()
+
+        write_task_json(drop_dir, create_af_annotation("task1", "image1.jpg", 3), mtime=2)
+        assert watcher.poll()
+        assert read_annotations(watcher) == [(1, 1), (2, 1), (3, 1), (4, 2)]
+        assert watcher.status.last_converted_task_count == 1
+
+        task1_json.unlink()
+        assert watcher.poll()
+        assert read_annotations(watcher) == [(1, 2)]
+
+        status = json.loads((tmp_path / "out/status.json").read_text())
+        assert status["poll_count"] == 4
+        assert status["publish_count"] == 3
+        assert status["task_count"] == 1
+        assert status["annotation_count"] == 1
+        assert status["converted_task_count"] == 3
+        assert status["lag_seconds"] is None
+        # 一時ファイルは残らない
+        assert sorted(p.name for p in (tmp_path / "out").iterdir()) == ["coco.json", "status.json"]
+
+    def test_poll_zip(self, tmp_path: Path):
+        """ZIPファイルが更新された場合は、ZIPファイル内の変更されたタスクのみ変換する"""
+        watcher = create_watcher(tmp_path, target_task_phase="acceptance")
+        zip_path = watcher.drop_dir / "annotation.zip"
+
+        def write_zip(af_annotations: list[dict[str, Any]]) -> None:
+            with zipfile.ZipFile(zip_path, "w") as zip_file:
+                for af_annotation in af_annotations:
+                    zip_file.writestr(f"{af_annotation['task_id']}/{af_annotation['input_data_id']}.json", json.dumps(af_annotation))
+
+        write_zip([create_af_annotation("task1", "image1.jpg", 1), create_af_annotation("task2", "image2.jpg", 1)])
+        assert watcher.poll()
+        assert read_annotations(watcher) == [(1, 1), (2, 2)]
+
+        # task2は変換対象外のフェーズになったので除かれる。task1は変更されていないので変換しない
+        write_zip([create_af_annotation("task1", "image1.jpg", 1), create_af_annotation("task2", "image2.jpg", 2, task_phase="annotation")])
+        os.utime(zip_path, ns=(10**18, 10**18))
+        assert watcher.poll()
+        assert read_annotations(watcher) == [(1, 1)]
+        assert watcher.status.last_converted_task_count == 0
+
+    def test_poll_broken_zip(self, tmp_path: Path):
+        """書き込み途中のZIPファイルは、次回の確認時に再度読み込む"""
+        watcher = create_watcher(tmp_path)
+        zip_path = watcher.drop_dir / "annotation.zip"
+        zip_path.write_bytes(b"PK")
+
+        # 読み込めたファイルがないので出力しない
+        assert not watcher.poll()
+        assert not watcher.output_coco_instances_json.exists()
+        assert watcher.status.publish_count == 0
+
+        with zipfile.ZipFile(zip_path, "w") as zip_file:
+            af_annotation = create_af_annotation("task1", "image1.jpg", 1)
+            zip_file.writestr("task1/input_task1.json", json.dumps(af_annotation))
+        assert watcher.poll()
+        assert read_annotations(watcher) == [(1, 1)]
+
+    def test_poll_removed_source_falls_back_to_remaining_source(self, tmp_path: Path):
+        """新しいファイルが削除された場合は、同じタスクを含む残りのファイルのタスクを出力する"""
+        watcher = create_watcher(tmp_path)
+        old_zip = watcher.drop_dir / "old.zip"
+        new_zip = watcher.drop_dir / "new.zip"
+        for zip_path, box_count, mtime in [(old_zip, 1, 1), (new_zip, 2, 2)]:
+            with zipfile.ZipFile(zip_path, "w") as zip_file:
+                af_annotation = create_af_annotation("task1", "image1.jpg", box_count)
+                zip_file.writestr("task1/input_task1.json", json.dumps(af_annotation))
+            os.utime(zip_path, ns=(mtime, mtime))
+
+        assert watcher.poll()
+        assert read_annotations(watcher) == [(1, 1), (2, 1)]
+
+        new_zip.unlink()
+        assert watcher.poll()
+        assert read_annotations(watcher) == [(1, 1)]
+
+        old_zip.unlink()
+        assert watcher.poll()
+        assert read_annotations(watcher) == []
+
+    def test_poll_filtered_task_in_older_source(self, tmp_path: Path):
+        """古いファイルで変換対象外のタスクは、新しいファイルのタスクを出力結果から除かない"""
+        watcher = create_watcher(tmp_path, target_task_phase="acceptance")
+        new_json = write_task_json(watcher.drop_dir / "new", create_af_annotation("task1", "image1.jpg", 2), mtime=2)
+        assert watcher.poll()
+
+        write_task_json(watcher.drop_dir / "old", create_af_annotation("task1", "image1.jpg", 1, task_phase="annotation"), mtime=1)
+        assert watcher.poll()
+        assert read_annotations(watcher) == [(1, 1), (2, 1)]
+
+        # 新しいファイルが削除されても、古いファイルのタスクは変換対象外なので出力しない
+        new_json.unlink()
+        assert watcher.poll()
+        assert read_annotations(watcher) == []